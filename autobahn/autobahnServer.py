@@ -1,12 +1,11 @@
 import json
 import logging
 import sys
-from threading import Lock, Thread
-import urllib2
 import time
 from autobahn.twisted.websocket import WebSocketServerProtocol, WebSocketServerFactory, listenWS
-from twisted.web.client import Agent
-from twisted.internet import reactor
+from twisted.web.client import Agent, HTTPConnectionPool, readBody
+from twisted.web.http_headers import Headers
+from twisted.internet import defer, reactor
 from twisted.python import log
 from twisted.web.server import Site
 from twisted.web.static import File
@@ -17,26 +16,94 @@ POLL_INTERVAL = 5
 MAX_POLL_INTERVAL = 30
 POLL_INTERVAL_STEP = 5
 MAX_ERRORS = 5
-updateLock = Lock()
+# Number of URLs fetched at the same time
+MAX_FETCHES = 10
+# Time to wait after pushed data, so that a burst of events causes one fetch
+PUSH_DELAY = 1
 
 #Server Messages
 KRT_JSON_DATA = "krtJSONData"
+KRT_JSON_DIFF = "krtJSONDiff"
 KRT_URL_DROPPED = "krtURLDropped"
 KRT_REGISTER_URL = "krtRegisterURL"
 KRT_PUSH_DATA = "krtPushData"
 
-agent = Agent(reactor)
+agent = Agent(reactor, connectTimeout=MAX_POLL_INTERVAL, pool=HTTPConnectionPool(reactor))
 
 
-def dict_compare(d1, d2):
-    d1_keys = set(d1.keys())
-    d2_keys = set(d2.keys())
-    intersect_keys = d1_keys.intersection(d2_keys)
-    added = d1_keys - d2_keys
-    removed = d2_keys - d1_keys
-    modified = {o : (d1[o], d2[o]) for o in intersect_keys if d1[o] != d2[o]}
-    same = set(o for o in intersect_keys if d1[o] == d2[o])
-    return added, removed, modified, same
+class NotModified(Exception):
+    pass
+
+
+def json_diff(old, new, path=()):
+    """
+    Returns the changes turning old into new, as a list of [path, value] to
+    set and [path] to delete, where path is the list of keys leading to the
+    value. Only dictionaries are compared key by key.
+    """
+    if not isinstance(old, dict) or not isinstance(new, dict):
+        if old != new:
+            return [[list(path), new]]
+        return []
+
+    changes = []
+    for key, value in new.iteritems():
+        if key not in old:
+            changes.append([list(path) + [key], value])
+        else:
+            changes.extend(json_diff(old[key], value, path + (key,)))
+    for key in old:
+        if key not in new:
+            changes.append([list(path) + [key]])
+    return changes
+
+
+def fetch_json(url, etag=None):
+    """
+    Fetches the JSON at url, returns a Deferred fired with the data and
+    its ETag, or failing with NotModified if it still has the given ETag.
+    """
+    headers = Headers({"User-Agent": ["autobahnServer"]})
+    if etag is not None:
+        headers.addRawHeader("If-None-Match", etag)
+    # the URLs registered by the clients are decoded from JSON, the agent
+    # only takes bytes
+    if isinstance(url, unicode):
+        url = url.encode("utf-8")
+    d = agent.request("GET", url, headers)
+    timeout = reactor.callLater(MAX_POLL_INTERVAL, d.cancel)
+
+    def gotResponse(response):
+        if response.code == 304:
+            response.deliverBody(_Discard())
+            raise NotModified()
+        if response.code != 200:
+            response.deliverBody(_Discard())
+            raise IOError("HTTP {0}".format(response.code))
+        etags = response.headers.getRawHeaders("ETag")
+        d = readBody(response)
+        d.addCallback(lambda body: (json.loads(body), etags[0] if etags else None))
+        return d
+    d.addCallback(gotResponse)
+
+    def done(result):
+        if timeout.active():
+            timeout.cancel()
+        return result
+    d.addBoth(done)
+    return d
+
+
+class _Discard(object):
+    """A protocol for the body of the responses we don't read"""
+    def makeConnection(self, transport):
+        pass
+
+    def dataReceived(self, data):
+        pass
+
+    def connectionLost(self, reason):
+        pass
 
 
 class CachedURL():
@@ -46,6 +113,7 @@ class CachedURL():
     def __init__(self, url):
         self.url = url
         self.cachedJSON = None
+        self.etag = None
         self.clients = []
         self.lastChecked = 0
         self.errorCount = 0
@@ -55,21 +123,27 @@ class CachedURL():
         self.waitForPush = False
         self.pushFilters = {}
         self.newData = False
-
-    def pollNeeded(self):
-        past_interval = (time.time() - self.lastChecked) > self.currentPollInterval
+        # The pending call to check the URL
+        self.nextCheck = None
+
+    def nextPollDelay(self):
+        """
+        Returns when the URL should be fetched next, or None if it should
+        wait for pushed data
+        """
+        if self.waitForPush and not self.newData:
+            return None
+        delay = self.lastChecked + self.currentPollInterval - time.time()
         if self.waitForPush:
-            if self.newData:
-                return past_interval
-            return False
-
-        return past_interval
+            delay = max(delay, PUSH_DELAY)
+        return max(delay, 0)
 
     def pollSuccess(self):
         self.lastChecked = time.time()
         self.locked = False
         self.errorCount = 0
-        self.newData = False
+        # newData is not reset here: it was cleared when the fetch started,
+        # and data pushed during the fetch needs another one
 
         if self.currentPollInterval > self.pollInterval:
             self.currentPollInterval -= POLL_INTERVAL_STEP
@@ -109,6 +183,9 @@ class BroadcastServerFactory(WebSocketServerFactory):
     """
     Checks given JSON URLs by clients and broadcasts back to them
     if the JSON has changed
+
+    The URLs waiting for push are only fetched when data matching their
+    filters is pushed by a master, the others are polled.
     """
 
     def __init__(self, url, debug=False, debugCodePaths=False):
@@ -116,11 +193,10 @@ class BroadcastServerFactory(WebSocketServerFactory):
         self.urlCacheDict = {}
         self.clients = []
         self.clients_urls = {}
-        self.tick()
-
-    def tick(self):
-        self.checkURLs()
-        reactor.callLater(0.1, self.tick)
+        # Clients that asked for the changes of the JSON instead of the
+        # whole JSON
+        self.diffClients = set()
+        self.fetches = defer.DeferredSemaphore(MAX_FETCHES)
 
     def sendClientCommand(self, clients, command, data):
         msg = {"cmd": command, "data": data}
@@ -129,66 +205,77 @@ class BroadcastServerFactory(WebSocketServerFactory):
         for client in clients:
             client.sendMessage(msg)
 
-    def jsonChanged(self, json, cachedJSON):
-        if cachedJSON is None:
-            return True
-        else:
-            if isinstance(cachedJSON, dict):
-                added, removed, modified, same = dict_compare(json, cachedJSON)
-                if len(added) > 0 or len(removed) > 0 or len(modified) > 0:
-                    return True
-            else:
-                return cachedJSON != json
-
-        return False
-
-    def checkURLs(self):
-        for urlCache in self.urlCacheDict.values():
-            #Thread each of these
-            try:
-                if urlCache.locked is False and urlCache.pollNeeded():
-                    urlCache.locked = True
-
-                    p = Thread(target=self.checkURL, args=(urlCache, ))
-                    p.start()
-            except Exception as e:
-                logging.error("{0}".format(e))
+    def scheduleCheck(self, urlCache):
+        delay = urlCache.nextPollDelay()
+        if urlCache.locked or delay is None:
+            # checked again once the current check is done or data is pushed
+            return
+        if urlCache.nextCheck is not None and urlCache.nextCheck.active():
+            if urlCache.nextCheck.getTime() <= time.time() + delay:
+                return
+            urlCache.nextCheck.cancel()
+        urlCache.nextCheck = reactor.callLater(delay, self.checkURL, urlCache)
+
+    def removeURL(self, url):
+        urlCache = self.urlCacheDict.pop(url)
+        if urlCache.nextCheck is not None and urlCache.nextCheck.active():
+            urlCache.nextCheck.cancel()
 
     def checkURL(self, urlCache):
+        urlCache.nextCheck = None
         url = urlCache.url
-        cachedURL = self.urlCacheDict[url]
-        if cachedURL.errorCount > MAX_ERRORS:
+        if self.urlCacheDict.get(url) is not urlCache:
+            return
+        if urlCache.errorCount > MAX_ERRORS:
             logging.info("Removing cached URL as it has too many errors {0}".format(url))
-            self.sendClientCommand(cachedURL.clients, KRT_URL_DROPPED, url)
-            updateLock.acquire()
-            del self.urlCacheDict[url]
-            updateLock.release()
+            self.sendClientCommand(urlCache.clients, KRT_URL_DROPPED, url)
+            self.removeURL(url)
             return
-        if urlCache.pollNeeded():
-            try:
-                #logging.info("Polling: {0}".format(url))
-                response = urllib2.urlopen(url, timeout=MAX_POLL_INTERVAL)
-                updateLock.acquire()
-                cachedURL.pollSuccess()
-                jsonObj = json.load(response)
-                if self.jsonChanged(jsonObj, cachedURL.cachedJSON):
-                    cachedURL.cachedJSON = jsonObj
-                    clients = cachedURL.clients
-                    logging.info("JSON at {1} Changed, informing {0} client(s)".format(len(clients), url))
-                    data = {"url": url, "data": jsonObj}
-                    self.sendClientCommand(clients, KRT_JSON_DATA, data)
-
-                #Reset error count to reduce cutting of many users
-                #in busy times
-                cachedURL.errorCount = 0
-            except Exception as e:
-                logging.error("{0}: {1}".format(e, url))
-                cachedURL.pollFailure()
-            finally:
-                cachedURL.locked = False
-
-                if updateLock.locked():
-                    updateLock.release()
+
+        urlCache.locked = True
+        urlCache.newData = False
+        d = self.fetches.run(fetch_json, url, urlCache.etag)
+
+        def success(result):
+            jsonObj, etag = result
+            urlCache.pollSuccess()
+            urlCache.etag = etag
+            self.jsonFetched(urlCache, jsonObj)
+
+        def failure(f):
+            if f.check(NotModified):
+                urlCache.pollSuccess()
+                return
+            logging.error("{0}: {1}".format(f.getErrorMessage(), url))
+            urlCache.pollFailure()
+            # try again, even if we are waiting for push
+            urlCache.newData = True
+
+        def done(_):
+            urlCache.locked = False
+            if self.urlCacheDict.get(url) is urlCache:
+                self.scheduleCheck(urlCache)
+        d.addCallbacks(success, failure)
+        d.addErrback(lambda f: logging.error("{0}: {1}".format(f.getErrorMessage(), url)))
+        d.addBoth(done)
+
+    def jsonFetched(self, urlCache, jsonObj):
+        url = urlCache.url
+        if urlCache.cachedJSON is None:
+            changes = None
+        else:
+            changes = json_diff(urlCache.cachedJSON, jsonObj)
+            if not changes:
+                return
+        urlCache.cachedJSON = jsonObj
+
+        clients = urlCache.clients
+        logging.info("JSON at {1} Changed, informing {0} client(s)".format(len(clients), url))
+        diffClients = [c for c in clients if c in self.diffClients]
+        if changes is not None and diffClients:
+            self.sendClientCommand(diffClients, KRT_JSON_DIFF, {"url": url, "changes": changes})
+            clients = [c for c in clients if c not in self.diffClients]
+        self.sendClientCommand(clients, KRT_JSON_DATA, {"url": url, "data": jsonObj})
 
     def register(self, client):
         if not client in self.clients:
@@ -196,6 +283,7 @@ class BroadcastServerFactory(WebSocketServerFactory):
             self.clients.append(client)
 
     def unregister(self, client):
+        self.diffClients.discard(client)
         if client in self.clients:
             logging.info("unregistered client " + client.peerstr)
             self.clients.remove(client)
@@ -206,7 +294,7 @@ class BroadcastServerFactory(WebSocketServerFactory):
                     urlCache.clients.remove(client)
 
                 if len(urlCache.clients) == 0:
-                    del self.urlCacheDict[url]
+                    self.removeURL(url)
                     logging.info("Removed stale cached URL {0}".format(url))
 
 
@@ -222,10 +310,19 @@ class BroadcastServerFactory(WebSocketServerFactory):
                     logging.info("Created new url {0} for {1}".format(url, client.peer))
                     self.urlCacheDict[url] = CachedURL(url)
                     self.urlCacheDict[url].clients = [client, ]
+                    # fetch the JSON the changes are compared to
+                    self.urlCacheDict[url].newData = True
                 else:
                     logging.info("Added {1} to url {0}".format(url, client.peer))
                     self.urlCacheDict[url].clients.append(client)
 
+                if not isinstance(data["data"], basestring) and data["data"].get("acceptDiffs") in (True, "true"):
+                    self.diffClients.add(client)
+                    # the changes are relative to the JSON this server has
+                    cachedJSON = self.urlCacheDict[url].cachedJSON
+                    if cachedJSON is not None:
+                        self.sendClientCommand([client], KRT_JSON_DATA, {"url": url, "data": cachedJSON})
+
                 if not isinstance(data["data"], basestring) and "waitForPush" in data["data"] \
                         and data["data"]["waitForPush"] == "true":
                     self.urlCacheDict[url].waitForPush = True
@@ -236,6 +333,8 @@ class BroadcastServerFactory(WebSocketServerFactory):
                         else:
                             self.urlCacheDict[url].pushFilters = filters
                     logging.info("URL {0} is waiting for push data with these filters {1}".format(url, self.urlCacheDict[url].pushFilters))
+
+                self.scheduleCheck(self.urlCacheDict[url])
             elif data["cmd"] == KRT_PUSH_DATA:
                 self.update_push_urls(data)
 
@@ -297,6 +396,7 @@ class BroadcastServerFactory(WebSocketServerFactory):
                 if "server" in data and data["server"] in url:
                     if matches_filter(obj, events):
                         obj.newData = True
+                        self.scheduleCheck(obj)
 
 def createDeamon():
     import os, sys
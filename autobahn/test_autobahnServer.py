@@ -0,0 +1,102 @@
+import json
+from twisted.internet import defer, task
+from twisted.python import failure
+from twisted.trial import unittest
+from twisted.web.client import ResponseDone
+from twisted.web.http_headers import Headers
+
+import autobahnServer
+
+
+class FakeResponse(object):
+
+    def __init__(self, code, body="", etag=None):
+        self.code = code
+        self.phrase = "OK"
+        self.body = body
+        self.headers = Headers({"ETag": [etag]} if etag else {})
+
+    def deliverBody(self, protocol):
+        protocol.dataReceived(self.body)
+        protocol.connectionLost(failure.Failure(ResponseDone()))
+
+
+class FakeAgent(object):
+
+    def __init__(self):
+        self.requests = []
+        self.responses = []
+
+    def request(self, method, uri, headers=None, bodyProducer=None):
+        # as twisted.web.client.Agent does
+        if not isinstance(uri, bytes):
+            raise TypeError("uri must be bytes, not unicode")
+        self.requests.append((method, uri, headers.getRawHeaders("If-None-Match")))
+        return defer.succeed(self.responses.pop(0))
+
+
+class FakeClient(object):
+
+    peer = peerstr = "tcp:127.0.0.1:1234"
+
+    def __init__(self):
+        self.messages = []
+
+    def sendMessage(self, msg):
+        self.messages.append(json.loads(msg))
+
+
+class TestBroadcastServerFactory(unittest.TestCase):
+
+    url = u"http://localhost:8001/json/builders/b1"
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.agent = FakeAgent()
+        self.patch(autobahnServer, "reactor", self.clock)
+        self.patch(autobahnServer, "agent", self.agent)
+        self.factory = autobahnServer.BroadcastServerFactory("ws://localhost:%d" % autobahnServer.PORT)
+        self.client = FakeClient()
+        self.factory.register(self.client)
+
+    def registerURL(self, **data):
+        data["url"] = self.url
+        self.factory.clientMessage(json.dumps({"cmd": autobahnServer.KRT_REGISTER_URL, "data": data}),
+                                   self.client)
+
+    def test_registeredURLIsFetched(self):
+        self.agent.responses.append(FakeResponse(200, json.dumps({"state": "idle"}), etag='"1"'))
+        self.registerURL()
+        self.clock.advance(0)
+
+        self.assertEqual(self.agent.requests, [("GET", self.url.encode("utf-8"), None)])
+        self.assertEqual(self.client.messages,
+                         [{"cmd": autobahnServer.KRT_JSON_DATA,
+                           "data": {"url": self.url, "data": {"state": "idle"}}}])
+        urlCache = self.factory.urlCacheDict[self.url]
+        self.assertEqual((urlCache.etag, urlCache.errorCount), ('"1"', 0))
+
+    def test_changesAreSentToDiffClients(self):
+        self.agent.responses += [FakeResponse(200, json.dumps({"state": "idle"}), etag='"1"'),
+                                 FakeResponse(304),
+                                 FakeResponse(200, json.dumps({"state": "building"}), etag='"2"')]
+        self.registerURL(acceptDiffs=True)
+        self.clock.advance(0)
+        self.clock.advance(autobahnServer.POLL_INTERVAL)
+        self.clock.advance(autobahnServer.POLL_INTERVAL)
+
+        self.assertEqual([r[2] for r in self.agent.requests], [None, ['"1"'], ['"1"']])
+        self.assertEqual(self.client.messages[1:],
+                         [{"cmd": autobahnServer.KRT_JSON_DIFF,
+                           "data": {"url": self.url, "changes": [[["state"], "building"]]}}])
+
+    def test_failingURLIsDropped(self):
+        self.agent.responses += [FakeResponse(500)] * (autobahnServer.MAX_ERRORS + 1)
+        self.registerURL()
+        for _ in range(autobahnServer.MAX_ERRORS + 2):
+            self.clock.advance(autobahnServer.MAX_POLL_INTERVAL)
+
+        self.assertEqual(len(self.agent.requests), autobahnServer.MAX_ERRORS + 1)
+        self.assertEqual(self.client.messages,
+                         [{"cmd": autobahnServer.KRT_URL_DROPPED, "data": self.url}])
+        self.assertEqual(self.factory.urlCacheDict, {})
@@ -29,14 +29,20 @@ class GitPoller(base.PollingChangeSource, StateMixin):
     
     compare_attrs = ["repourl", "branches", "workdir",
                      "pollInterval", "gitbin", "usetimestamps",
-                     "category", "project"]
+                     "category", "project", "maxProcesses"]
+
+    # number of commits whose details are read by a single git log
+    commitsBatchSize = 100
+
+    # the fields of each commit in the output of _get_commits
+    _commitFormat = r'--format=%x1e%H%x1f%ct%x1f%aN <%aE>%x1f%s%n%b%x1f'
 
     def __init__(self, repourl, branches=None, branch=None,
                  workdir=None, pollInterval=10*60, 
                  gitbin='git', usetimestamps=True,
                  category=None, project=None,
                  pollinterval=-2, fetch_refspec=None,
-                 encoding='utf-8'):
+                 encoding='utf-8', maxProcesses=4):
 
         # for backward compatibility; the parameter used to be spelled with 'i'
         if pollinterval != -2:
@@ -64,6 +70,10 @@ class GitPoller(base.PollingChangeSource, StateMixin):
         self.project = project
         self.changeCount = 0
         self.lastRev = {}
+        # the branches are polled concurrently, running at most maxProcesses
+        # git commands at once
+        self.maxProcesses = maxProcesses
+        self.processes = defer.DeferredSemaphore(maxProcesses)
 
         if fetch_refspec is not None:
             config.error("GitPoller: fetch_refspec is no longer supported. "
@@ -109,63 +119,52 @@ class GitPoller(base.PollingChangeSource, StateMixin):
                 [self.repourl] + refspecs, path=self.workdir)
 
         revs = {}
-        for branch in self.branches:
-            try:
-                revs[branch] = rev = yield self._dovccmd('rev-parse',
-                        [self._localBranch(branch)], path=self.workdir)
-                yield self._process_changes(rev, branch)
-            except:
-                log.err(_why="trying to poll branch %s of %s"
-                                % (branch, self.repourl))
+        def pollBranch(branch):
+            d = self._dovccmd('rev-parse',
+                    [self._localBranch(branch)], path=self.workdir)
+            def process(rev):
+                revs[branch] = rev
+                return self._process_changes(rev, branch)
+            d.addCallback(process)
+            d.addErrback(log.err, "trying to poll branch %s of %s"
+                                  % (branch, self.repourl))
+            return d
+        yield defer.gatherResults([pollBranch(branch) for branch in self.branches])
 
         self.lastRev.update(revs)
         yield self.setState('lastRev', self.lastRev)
 
-    def _get_commit_comments(self, rev):
-        args = ['--no-walk', r'--format=%s%n%b', rev, '--']
-        d = self._dovccmd('log',  args, path=self.workdir)
-        def process(git_output):
-            git_output = git_output.decode(self.encoding)
-            if len(git_output) == 0:
-                raise EnvironmentError('could not get commit comment for rev')
-            return git_output
-        d.addCallback(process)
-        return d
-
-    def _get_commit_timestamp(self, rev):
-        # unix timestamp
-        args = ['--no-walk', r'--format=%ct', rev, '--']
-        d = self._dovccmd('log', args, path=self.workdir)
-        def process(git_output):
-            if self.usetimestamps:
-                try:
-                    stamp = float(git_output)
-                except Exception, e:
-                        log.msg('gitpoller: caught exception converting output \'%s\' to timestamp' % git_output)
-                        raise e
-                return stamp
-            else:
-                return None
-        d.addCallback(process)
-        return d
-
-    def _get_commit_files(self, rev):
-        args = ['--name-only', '--no-walk', r'--format=%n', rev, '--']
-        d = self._dovccmd('log', args, path=self.workdir)
-        def process(git_output):
-            fileList = git_output.split()
-            return fileList
-        d.addCallback(process)
-        return d
-            
-    def _get_commit_author(self, rev):
-        args = ['--no-walk', r'--format=%aN <%aE>', rev, '--']
+    def _get_commits(self, revs):
+        """
+        Get the timestamp, author, files and comments of each of the revs, in
+        order, with a single git log.
+        """
+        args = ['--no-walk=unsorted', '--name-only', self._commitFormat] + revs + ['--']
         d = self._dovccmd('log', args, path=self.workdir)
         def process(git_output):
-            git_output = git_output.decode(self.encoding)
-            if len(git_output) == 0:
-                raise EnvironmentError('could not get commit author for rev')
-            return git_output
+            commits = {}
+            for record in git_output.split('\x1e')[1:]:
+                fields = record.split('\x1f')
+                if len(fields) != 5:
+                    raise EnvironmentError('could not parse the git log output for rev %s'
+                                           % fields[0])
+                rev, timestamp, author, comments, files = fields
+                if self.usetimestamps:
+                    try:
+                        timestamp = float(timestamp)
+                    except Exception:
+                        log.msg('gitpoller: caught exception converting output \'%s\' to timestamp' % timestamp)
+                        raise
+                else:
+                    timestamp = None
+                commits[rev] = (timestamp, author.decode(self.encoding),
+                                [f for f in files.splitlines() if f],
+                                comments.strip().decode(self.encoding))
+            missing = [rev for rev in revs if rev not in commits]
+            if missing:
+                raise EnvironmentError('could not get commit details for revs %s'
+                                       % ', '.join(missing))
+            return [commits[rev] for rev in revs]
         d.addCallback(process)
         return d
 
@@ -175,7 +174,7 @@ class GitPoller(base.PollingChangeSource, StateMixin):
         Read changes since last change.
 
         - Read list of commit hashes.
-        - Extract details from each commit.
+        - Extract details from the commits, commitsBatchSize at a time.
         - Add changes to database.
         """
 
@@ -198,36 +197,27 @@ class GitPoller(base.PollingChangeSource, StateMixin):
         log.msg('gitpoller: processing %d changes: %s from "%s"'
                 % (self.changeCount, revList, self.repourl) )
 
-        for rev in revList:
-            dl = defer.DeferredList([
-                self._get_commit_timestamp(rev),
-                self._get_commit_author(rev),
-                self._get_commit_files(rev),
-                self._get_commit_comments(rev),
-            ], consumeErrors=True)
-
-            results = yield dl
-
-            # check for failures
-            failures = [ r[1] for r in results if not r[0] ]
-            if failures:
-                # just fail on the first error; they're probably all related!
-                raise failures[0]
-
-            timestamp, author, files, comments = [ r[1] for r in results ]
-            yield self.master.addChange(
-                   author=author,
-                   revision=rev,
-                   files=files,
-                   comments=comments,
-                   when_timestamp=epoch2datetime(timestamp),
-                   branch=branch,
-                   category=self.category,
-                   project=self.project,
-                   repository=self.repourl,
-                   src='git')
+        for i in range(0, len(revList), self.commitsBatchSize):
+            batch = revList[i:i + self.commitsBatchSize]
+            commits = yield self._get_commits(batch)
+
+            for rev, (timestamp, author, files, comments) in zip(batch, commits):
+                yield self.master.addChange(
+                       author=author,
+                       revision=rev,
+                       files=files,
+                       comments=comments,
+                       when_timestamp=epoch2datetime(timestamp),
+                       branch=branch,
+                       category=self.category,
+                       project=self.project,
+                       repository=self.repourl,
+                       src='git')
 
     def _dovccmd(self, command, args, path=None):
+        return self.processes.run(self._runGit, command, args, path=path)
+
+    def _runGit(self, command, args, path=None):
         d = utils.getProcessOutputAndValue(self.gitbin,
                 [command] + args, path=path, env=os.environ)
         def _convert_nonzero_to_failure(res):
@@ -69,11 +69,14 @@ class MasterConfig(object):
         self.changeHorizon = None
         self.cleanUpPeriod = None
         self.buildRequestsDays = None
+        self.buildStartBatchSize = 1
         self.eventHorizon = 50
         self.logHorizon = None
         self.buildHorizon = None
         self.logCompressionLimit = 4*1024
         self.logCompressionMethod = 'bz2'
+        self.buildStatusStorage = 'pickle'
+        self.buildLoaderThreads = 4
         self.logMaxTailSize = None
         self.logMaxSize = None
         self.properties = properties.Properties()
@@ -89,7 +92,6 @@ class MasterConfig(object):
         self.gzip = True
         self.requireLogin = True
         self.autobahn_push = "false"
-        self.lastBuildCacheDays = 30
         self.slave_debug_url = None
         # This URL will only be used if no slaveManagerUrl is present in master.cfg
         self.slaveManagerUrl = None
@@ -108,6 +110,8 @@ class MasterConfig(object):
         self.caches = dict(
             Builds=15,
             Changes=10,
+            BuildRequests=6000,
+            BuildSummaries=500,
         )
         self.schedulers = {}
         self.builders = []
@@ -130,7 +134,8 @@ class MasterConfig(object):
         "status", "title", "titleURL", "user_managers", "validation", "realTimeServer",
         "analytics_code", "gzip", "autobahn_push", "lastBuildCacheDays",
         "requireLogin", "globalFactory", "slave_debug_url", "slaveManagerUrl",
-        "cleanUpPeriod", "buildRequestsDays"
+        "cleanUpPeriod", "buildRequestsDays", "buildStartBatchSize",
+        "buildStatusStorage", "buildLoaderThreads",
     ])
 
     @classmethod
@@ -277,19 +282,34 @@ class MasterConfig(object):
         copy_int_param('cleanUpPeriod')
         copy_int_param('changeHorizon')
         copy_int_param('buildRequestsDays')
+        copy_int_param('buildStartBatchSize')
         copy_int_param('eventHorizon')
         copy_int_param('logHorizon')
         copy_int_param('buildHorizon')
-        copy_int_param('lastBuildCacheDays')
+
+        if 'lastBuildCacheDays' in config_dict:
+            # the latest builds are kept in the last_builds table, which does
+            # not expire
+            log.msg("c['lastBuildCacheDays'] is no longer used and can be removed")
 
         copy_int_param('logCompressionLimit')
 
         if 'logCompressionMethod' in config_dict:
             logCompressionMethod = config_dict.get('logCompressionMethod')
-            if logCompressionMethod not in ('bz2', 'gz'):
-                error("c['logCompressionMethod'] must be 'bz2' or 'gz'")
+            if logCompressionMethod not in ('bz2', 'gz', 'blockgz'):
+                error("c['logCompressionMethod'] must be 'bz2', 'gz' or 'blockgz'")
             self.logCompressionMethod = logCompressionMethod
 
+        if 'buildStatusStorage' in config_dict:
+            buildStatusStorage = config_dict.get('buildStatusStorage')
+            if buildStatusStorage not in ('pickle', 'sqlite'):
+                error("c['buildStatusStorage'] must be 'pickle' or 'sqlite'")
+            self.buildStatusStorage = buildStatusStorage
+
+        copy_int_param('buildLoaderThreads')
+        if self.buildLoaderThreads < 1:
+            error("c['buildLoaderThreads'] must be at least 1")
+
         copy_int_param('logMaxSize')
         copy_int_param('logMaxTailSize')
 
@@ -20,8 +20,7 @@ from sqlalchemy import func
 from datetime import datetime, timedelta
 from twisted.internet import reactor, defer
 from twisted.python import log
-from buildbot.db import base
-from buildbot.util import json
+from buildbot.db import base, events
 from buildbot.util import epoch2datetime, datetime2epoch
 from buildbot.status.results import RESUME, CANCELED
 from twisted.python.failure import Failure
@@ -314,8 +313,8 @@ class BuildRequestsConnectorComponent(base.DBConnectorComponent):
 
     @with_master_objectid
     def getBuildRequestsInQueue(self, queue, buildername=None, sourcestamps=None,
-                                mergebrids=None, startbrid=None,
-                                order=True, _master_objectid=None):
+                                mergebrids=None, startbrid=None, brids=None,
+                                order=True, limit=None, after=None, _master_objectid=None):
         """
         Finds the buildrequests that are in queue waiting to be process
         it will return empty list if there are no pending request.
@@ -326,43 +325,38 @@ class BuildRequestsConnectorComponent(base.DBConnectorComponent):
         @param sourcestamps: filter the results by sourcestamps
         @param mergebrids: fetch buildrequest that has been merged with brids
         @param startbrid: filter pending builds that belong to same build chain
+        @param brids: filter the results by buildrequest ids
         @param order: order the resutls by higher priority and oldest submitted time
         this can be skipped when applying filters to check request that can be merged.
+        @param limit: maximum number of requests to return, used to page through the queue
+        @param after: the last build request dictionary of the previous page, the results
+        start with the next request in queue order
 
         @returns: a build request dictionary or empty list
         """
         def thd(conn):
             reqs_tbl = self.db.model.buildrequests
             claims_tbl = self.db.model.buildrequest_claims
-            buildset_properties_tbl = self.db.model.buildset_properties
             sourcestamps_tbl = self.db.model.sourcestamps
             sourcestampsets_tbl = self.db.model.sourcestampsets
             buildsets_tbl = self.db.model.buildsets
 
             pending = sa.select([reqs_tbl.c.id, reqs_tbl.c.buildername, reqs_tbl.c.priority,
                                  reqs_tbl.c.submitted_at, reqs_tbl.c.results,
-                                 reqs_tbl.c.buildsetid,
-                                 buildset_properties_tbl.c.property_value,
+                                 reqs_tbl.c.buildsetid, reqs_tbl.c.selected_slave,
                                  reqs_tbl.c.slavepool, reqs_tbl.c.startbrid],
-                                from_obj=reqs_tbl.outerjoin(claims_tbl, (reqs_tbl.c.id == claims_tbl.c.brid))
-                                .outerjoin(buildset_properties_tbl,
-                                           (buildset_properties_tbl.c.buildsetid == reqs_tbl.c.buildsetid)
-                                           & (buildset_properties_tbl.c.property_name == 'selected_slave')),
+                                from_obj=reqs_tbl.outerjoin(claims_tbl, (reqs_tbl.c.id == claims_tbl.c.brid)),
                                 whereclause=((claims_tbl.c.claimed_at == None) &
                                              (reqs_tbl.c.complete == 0)))
 
             resumebuilds = sa.select([reqs_tbl.c.id,
                                       reqs_tbl.c.buildername, reqs_tbl.c.priority,
                                       reqs_tbl.c.submitted_at, reqs_tbl.c.results,
-                                      reqs_tbl.c.buildsetid,
-                                      buildset_properties_tbl.c.property_value,
+                                      reqs_tbl.c.buildsetid, reqs_tbl.c.selected_slave,
                                       reqs_tbl.c.slavepool, reqs_tbl.c.startbrid],
                                      from_obj=reqs_tbl.join(claims_tbl,
                                                             (reqs_tbl.c.id == claims_tbl.c.brid)
-                                                            & (claims_tbl.c.objectid == _master_objectid))
-                                     .outerjoin(buildset_properties_tbl,
-                                                (buildset_properties_tbl.c.buildsetid == reqs_tbl.c.buildsetid)
-                                                & (buildset_properties_tbl.c.property_name == 'selected_slave'))) \
+                                                            & (claims_tbl.c.objectid == _master_objectid))) \
                 .where(reqs_tbl.c.complete == 0) \
                 .where(reqs_tbl.c.results == RESUME)
 
@@ -394,18 +388,33 @@ class BuildRequestsConnectorComponent(base.DBConnectorComponent):
             if startbrid:
                 buildersqueue = buildersqueue.where(reqs_tbl.c.startbrid == startbrid)
 
-            if order:
-                buildersqueue = buildersqueue.order_by(sa.desc(reqs_tbl.c.priority), sa.asc(reqs_tbl.c.submitted_at))
+            if brids:
+                buildersqueue = buildersqueue.where(reqs_tbl.c.id.in_(brids))
+
+            if after:
+                # keyset pagination, the page starts after the last request of
+                # the previous page in (priority desc, submitted_at, id) order
+                after_submitted_at = datetime2epoch(after['submitted_at'])
+                buildersqueue = buildersqueue.where(
+                    (reqs_tbl.c.priority < after['priority'])
+                    | ((reqs_tbl.c.priority == after['priority'])
+                       & (reqs_tbl.c.submitted_at > after_submitted_at))
+                    | ((reqs_tbl.c.priority == after['priority'])
+                       & (reqs_tbl.c.submitted_at == after_submitted_at)
+                       & (reqs_tbl.c.id > after['brid'])))
+
+            if order or limit or after:
+                buildersqueue = buildersqueue.order_by(sa.desc(reqs_tbl.c.priority), sa.asc(reqs_tbl.c.submitted_at),
+                                                       sa.asc(reqs_tbl.c.id))
+
+            if limit:
+                buildersqueue = buildersqueue.limit(limit)
 
-            # TODO: for performance we may need to limit the result
             res = conn.execute(buildersqueue)
 
             rows = res.fetchall()
             rv = []
 
-            def getSelectedSlave(row):
-                return json.loads(row.property_value)[0] if row.property_value and len(row.property_value) > 0 else None
-
             for row in rows:
                 if row:
                     rv.append(dict(brid=row.id,
@@ -414,7 +423,7 @@ class BuildRequestsConnectorComponent(base.DBConnectorComponent):
                                    submitted_at=mkdt(row.submitted_at),
                                    results=row.results,
                                    buildsetid=row.buildsetid,
-                                   selected_slave=getSelectedSlave(row),
+                                   selected_slave=row.selected_slave,
                                    slavepool=row.slavepool,
                                    startbrid=row.startbrid))
 
@@ -423,6 +432,45 @@ class BuildRequestsConnectorComponent(base.DBConnectorComponent):
 
         return self.db.pool.do(thd)
 
+    def getBuildRequestsSourceStamps(self, brids):
+        """
+        Fetch the sourcestamps of a list of buildrequests, they are used to find
+        the requests that can be merged without querying the database for each one.
+
+        @param brids: list of buildrequest ids
+        @returns: dictionary of brid to a list of dictionaries with keys sourcestampsetid,
+        codebase, branch and revision, via Deferred
+        """
+        def thd(conn):
+            reqs_tbl = self.db.model.buildrequests
+            buildsets_tbl = self.db.model.buildsets
+            sourcestamps_tbl = self.db.model.sourcestamps
+
+            rv = dict((brid, []) for brid in brids)
+            # we'll need to batch the brids into groups of 100, so that the
+            # parameter lists supported by the DBAPI aren't exhausted
+            iterator = iter(brids)
+            batch = list(itertools.islice(iterator, 100))
+            while batch:
+                q = sa.select([reqs_tbl.c.id, sourcestamps_tbl.c.sourcestampsetid,
+                               sourcestamps_tbl.c.codebase, sourcestamps_tbl.c.branch,
+                               sourcestamps_tbl.c.revision],
+                              from_obj=reqs_tbl.join(buildsets_tbl,
+                                                     (reqs_tbl.c.buildsetid == buildsets_tbl.c.id))
+                              .join(sourcestamps_tbl,
+                                    (buildsets_tbl.c.sourcestampsetid == sourcestamps_tbl.c.sourcestampsetid)),
+                              whereclause=(reqs_tbl.c.id.in_(batch)))
+                res = conn.execute(q)
+                for row in res.fetchall():
+                    rv[row.id].append(dict(sourcestampsetid=row.sourcestampsetid, codebase=row.codebase,
+                                           branch=row.branch, revision=row.revision))
+                res.close()
+                batch = list(itertools.islice(iterator, 100))
+
+            return rv
+
+        return self.db.pool.do(thd)
+
     def selectBuildSetsExactlyMatchesSourcestamps(self,
                                                   sourcestamps,
                                                   sourcestamps_tbl,
@@ -696,25 +744,7 @@ class BuildRequestsConnectorComponent(base.DBConnectorComponent):
                 claimed_at = self.getClaimedAtValue(_reactor)
                 if queue == Queue.unclaimed:
                     self.insertBuildRequestClaimsTable(conn, _master_objectid, brids, claimed_at)
-                # we'll need to batch the brids into groups of 100, so that the
-                # parameter lists supported by the DBAPI aren't
-                iterator = iter(brids[1:])
-                batch = list(itertools.islice(iterator, 100))
-                while len(batch) > 0:
-
-                    stmt = buildrequests_tbl.update() \
-                        .where(sa.or_(buildrequests_tbl.c.id.in_(batch), buildrequests_tbl.c.mergebrid.in_(batch))) \
-                        .values(mergebrid=brids[0])
-
-                    if artifactbrid is not None:
-                        stmt_br = sa.select([buildrequests_tbl.c.artifactbrid]) \
-                            .where(buildrequests_tbl.c.id == brids[0])
-                        res = conn.execute(stmt_br)
-                        row = res.fetchone()
-                        stmt = stmt.values(artifactbrid=row.artifactbrid if row and row.artifactbrid else artifactbrid)
-
-                    conn.execute(stmt)
-                    batch = list(itertools.islice(iterator, 100))
+                self.executeMergePendingBuildRequests(conn, brids, artifactbrid)
 
             except:
                 transaction.rollback()
@@ -723,6 +753,28 @@ class BuildRequestsConnectorComponent(base.DBConnectorComponent):
 
         return self.db.pool.do(thd)
 
+    def executeMergePendingBuildRequests(self, conn, brids, artifactbrid=None):
+        buildrequests_tbl = self.db.model.buildrequests
+        # we'll need to batch the brids into groups of 100, so that the
+        # parameter lists supported by the DBAPI aren't
+        iterator = iter(brids[1:])
+        batch = list(itertools.islice(iterator, 100))
+        while len(batch) > 0:
+
+            stmt = buildrequests_tbl.update() \
+                .where(sa.or_(buildrequests_tbl.c.id.in_(batch), buildrequests_tbl.c.mergebrid.in_(batch))) \
+                .values(mergebrid=brids[0])
+
+            if artifactbrid is not None:
+                stmt_br = sa.select([buildrequests_tbl.c.artifactbrid]) \
+                    .where(buildrequests_tbl.c.id == brids[0])
+                res = conn.execute(stmt_br)
+                row = res.fetchone()
+                stmt = stmt.values(artifactbrid=row.artifactbrid if row and row.artifactbrid else artifactbrid)
+
+            conn.execute(stmt)
+            batch = list(itertools.islice(iterator, 100))
+
     def getBuildRequestTriggered(self, triggeredbybrid, buildername):
         def thd(conn):
             buildrequests_tbl = self.db.model.buildrequests
@@ -841,6 +893,27 @@ class BuildRequestsConnectorComponent(base.DBConnectorComponent):
         conn.execute(q, [dict(brid=id, objectid=_master_objectid,
                               claimed_at=claimed_at)
                          for id in brids])
+        self.thdAddRequestEvents(conn, events.BUILDREQUEST_CLAIMED, brids)
+
+    def thdAddRequestEvents(self, conn, event, brids):
+        # writes an event with the buildset and builder of each of the
+        # requests, for the other masters to act on
+        if not self.db.events.enabled or not brids:
+            return
+        reqs_tbl = self.db.model.buildrequests
+        iterator = iter(brids)
+        while 1:
+            batch = list(itertools.islice(iterator, 100))
+            if not batch:
+                break
+            res = conn.execute(sa.select([reqs_tbl.c.id, reqs_tbl.c.buildsetid, reqs_tbl.c.buildername],
+                                         whereclause=reqs_tbl.c.id.in_(batch)))
+            rows = res.fetchall()
+            res.close()
+            self.db.events.thdAddEvents(conn, [dict(event=event, objectid=row.id,
+                                                    buildsetid=row.buildsetid,
+                                                    buildername=row.buildername)
+                                               for row in rows])
 
     def getClaimedAtValue(self, _reactor, claimed_at=None):
         if claimed_at is not None:
@@ -870,6 +943,43 @@ class BuildRequestsConnectorComponent(base.DBConnectorComponent):
                 transaction.rollback()
                 raise AlreadyClaimedError
 
+            self.thdAddRequestEvents(conn, events.BUILDREQUEST_CLAIMED, brids)
+            transaction.commit()
+
+        return self.db.pool.do(thd)
+
+    @with_master_objectid
+    def claimBuildRequestGroups(self, brids_groups, claimed_at=None, _reactor=reactor,
+                                _master_objectid=None):
+        """
+        Claims several groups of build requests in a single transaction, the
+        first brid of each group is the request that will be built and the
+        rest are merged with it (see L{mergePendingBuildRequests}).
+
+        @param brids_groups: list of lists of brids
+        @raises AlreadyClaimedError: if any of the requests was already claimed,
+        in that case none of the requests are claimed
+        """
+        claimed_at = self.getClaimedAtValue(_reactor, claimed_at)
+
+        def thd(conn):
+            transaction = conn.begin()
+
+            try:
+                self.insertBuildRequestClaimsTable(conn, _master_objectid,
+                                                   [brid for brids in brids_groups for brid in brids],
+                                                   claimed_at)
+            except (sa.exc.IntegrityError, sa.exc.ProgrammingError):
+                transaction.rollback()
+                raise AlreadyClaimedError
+
+            try:
+                for brids in brids_groups:
+                    self.executeMergePendingBuildRequests(conn, brids)
+            except:
+                transaction.rollback()
+                raise
+
             transaction.commit()
 
         return self.db.pool.do(thd)
@@ -944,6 +1054,8 @@ class BuildRequestsConnectorComponent(base.DBConnectorComponent):
                         q = q.values(results=results)
 
                     conn.execute(q)
+
+                    self.thdAddRequestEvents(conn, events.BUILDREQUEST_UNCLAIMED, batch)
                 except:
                     transaction.rollback()
                     raise
@@ -1110,6 +1222,8 @@ class BuildRequestsConnectorComponent(base.DBConnectorComponent):
                             "but only completed %d" % (len(batch), res.rowcount))
                     transaction.rollback()
                     raise NotClaimedError
+
+                self.thdAddRequestEvents(conn, events.BUILDREQUEST_COMPLETED, batch)
             transaction.commit()
 
         return self.db.pool.do(thd)
@@ -1123,9 +1237,21 @@ class BuildRequestsConnectorComponent(base.DBConnectorComponent):
             # select any expired requests, and delete each one individually
             expired_brids = sa.select([reqs_tbl.c.id],
                                       whereclause=(reqs_tbl.c.complete != 1))
-            res = conn.execute(claims_tbl.delete(
-                (claims_tbl.c.claimed_at < old_epoch) &
-                claims_tbl.c.brid.in_(expired_brids)))
+            expired = ((claims_tbl.c.claimed_at < old_epoch) &
+                       claims_tbl.c.brid.in_(expired_brids))
+
+            if not self.db.events.enabled:
+                res = conn.execute(claims_tbl.delete(expired))
+                return res.rowcount
+
+            # the other masters are told which requests are claimable again
+            transaction = conn.begin()
+            res = conn.execute(sa.select([claims_tbl.c.brid], whereclause=expired))
+            brids = [row.brid for row in res.fetchall()]
+            res.close()
+            res = conn.execute(claims_tbl.delete(expired))
+            self.thdAddRequestEvents(conn, events.BUILDREQUEST_UNCLAIMED, brids)
+            transaction.commit()
             return res.rowcount
 
         d = self.db.pool.do(thd)
@@ -1138,74 +1264,98 @@ class BuildRequestsConnectorComponent(base.DBConnectorComponent):
         d.addCallback(log_nonzero_count)
         return d
 
-    def pruneBuildRequests(self, buildRequestsDays):
+    def pruneBuildRequests(self, buildRequestsDays, limit=100):
+        """
+        Delete the complete buildsets submitted more than buildRequestsDays days
+        ago, together with their buildrequests, claims, builds, properties and the
+        sourcestampsets no other buildset uses.  Incomplete buildsets are kept,
+        however old, as their requests may still be pending or running.
+
+        Only up to limit buildsets are deleted, in a single transaction, so the
+        tables are not locked for long; call it again until it returns 0 to prune
+        all of them.
+
+        @param buildRequestsDays: number of days the buildrequests are kept
+        @param limit: maximum number of buildsets to delete
+        @returns: number of buildsets deleted, via Deferred
+        """
         if not buildRequestsDays:
-            return defer.succeed(None)
+            return defer.succeed(0)
 
         def thd(conn):
-            if self.db.pool.engine.dialect.name != 'mysql':
-                # sqlite doesnt have integrity constraints, we should check if this approach works on postgre
-                log.msg("pruneBuildRequests is not yet supported for %s" % self.db.pool.engine.dialect.name)
-                return
-
-            try:
-                buildrequests_tbl = self.db.model.buildrequests
-                buildsets_tbl = self.db.model.buildsets
-                sourcestampsets_tbl = self.db.model.sourcestampsets
-
-                prune_period = datetime.now().date() - timedelta(buildRequestsDays)
-                prune_period_epoch = datetime2epoch(datetime(prune_period.year, prune_period.month, prune_period.day))
+            buildrequests_tbl = self.db.model.buildrequests
+            claims_tbl = self.db.model.buildrequest_claims
+            builds_tbl = self.db.model.builds
+            buildsets_tbl = self.db.model.buildsets
+            buildset_properties_tbl = self.db.model.buildset_properties
+            sourcestampsets_tbl = self.db.model.sourcestampsets
+            sourcestamps_tbl = self.db.model.sourcestamps
+            sourcestamp_changes_tbl = self.db.model.sourcestamp_changes
+            patches_tbl = self.db.model.patches
 
-                transaction = conn.begin()
+            prune_period = datetime.now().date() - timedelta(buildRequestsDays)
+            prune_period_epoch = datetime2epoch(datetime(prune_period.year, prune_period.month, prune_period.day))
 
-                stmt_brids = sa.select([buildrequests_tbl.c.id])\
-                    .where(buildrequests_tbl.c.submitted_at <= prune_period_epoch).limit(100000)
+            transaction = conn.begin()
+            try:
+                res = conn.execute(sa.select([buildsets_tbl.c.id, buildsets_tbl.c.sourcestampsetid])
+                                   .where((buildsets_tbl.c.submitted_at <= prune_period_epoch)
+                                          & (buildsets_tbl.c.complete == 1))
+                                   .order_by(buildsets_tbl.c.submitted_at, buildsets_tbl.c.id)
+                                   .limit(limit))
+                rows = res.fetchall()
+                if not rows:
+                    transaction.commit()
+                    return 0
 
-                res = conn.execute(stmt_brids)
+                bsids = [r.id for r in rows]
+                res = conn.execute(sa.select([buildrequests_tbl.c.id])
+                                   .where(buildrequests_tbl.c.buildsetid.in_(bsids)))
                 brids = [r.id for r in res]
 
-                if not brids:
-                    return
-
-                log.msg("Prune %d buildrequests" % len(brids))
-
-                iterator = iter(brids)
-                batch = list(itertools.islice(iterator, 100))
-
-                while len(batch) > 0:
-                    stmt_bsids = sa.select(
-                            [buildsets_tbl.c.id],
-                            from_obj=buildsets_tbl.join(
-                                    buildrequests_tbl, buildsets_tbl.c.id == buildrequests_tbl.c.buildsetid))\
-                        .where(buildrequests_tbl.c.id.in_(batch))\
-                        .group_by(buildsets_tbl.c.id)
-
-                    res = conn.execute(stmt_bsids)
-                    bsids = [r.id for r in res]
-
-                    stmt_ssids = sa.select(
-                            [sourcestampsets_tbl.c.id],
-                            from_obj=sourcestampsets_tbl.join(
-                                    buildsets_tbl,
-                                    buildsets_tbl.c.sourcestampsetid == sourcestampsets_tbl.c.id))\
-                        .where(buildrequests_tbl.c.id.in_(bsids))\
-                        .group_by(sourcestampsets_tbl.c.id)
-
-                    res = conn.execute(stmt_ssids)
-                    ssids = [r.id for r in res]
-
-                    # Cascade delete to related tables
-                    conn.execute(sourcestampsets_tbl.delete((sourcestampsets_tbl.c.id.in_(ssids))))
-                    conn.execute(buildsets_tbl.delete((buildsets_tbl.c.id.in_(bsids))))
-                    conn.execute(buildrequests_tbl.delete((buildrequests_tbl.c.id.in_(batch))))
-                    batch = list(itertools.islice(iterator, 100))
+                if brids:
+                    # requests that are kept lose their reference to the pruned ones
+                    for column in (buildrequests_tbl.c.artifactbrid, buildrequests_tbl.c.triggeredbybrid,
+                                   buildrequests_tbl.c.mergebrid, buildrequests_tbl.c.startbrid):
+                        conn.execute(buildrequests_tbl.update()
+                                     .where(column.in_(brids))
+                                     .where(~buildrequests_tbl.c.buildsetid.in_(bsids))
+                                     .values({column.name: None}))
+
+                    conn.execute(claims_tbl.delete(claims_tbl.c.brid.in_(brids)))
+                    conn.execute(builds_tbl.delete(builds_tbl.c.brid.in_(brids)))
+                    conn.execute(buildrequests_tbl.delete(buildrequests_tbl.c.id.in_(brids)))
+
+                conn.execute(buildset_properties_tbl.delete(buildset_properties_tbl.c.buildsetid.in_(bsids)))
+                conn.execute(buildsets_tbl.delete(buildsets_tbl.c.id.in_(bsids)))
+
+                # triggered buildsets share the sourcestampset of their parent
+                ssids = set(r.sourcestampsetid for r in rows)
+                res = conn.execute(sa.select([buildsets_tbl.c.sourcestampsetid])
+                                   .where(buildsets_tbl.c.sourcestampsetid.in_(ssids)))
+                ssids -= set(r.sourcestampsetid for r in res)
+
+                if ssids:
+                    res = conn.execute(sa.select([sourcestamps_tbl.c.id, sourcestamps_tbl.c.patchid])
+                                       .where(sourcestamps_tbl.c.sourcestampsetid.in_(ssids)))
+                    ssrows = res.fetchall()
+                    sourcestampids = [r.id for r in ssrows]
+                    patchids = [r.patchid for r in ssrows if r.patchid is not None]
+
+                    if sourcestampids:
+                        conn.execute(sourcestamp_changes_tbl.delete(
+                            sourcestamp_changes_tbl.c.sourcestampid.in_(sourcestampids)))
+                        conn.execute(sourcestamps_tbl.delete(sourcestamps_tbl.c.id.in_(sourcestampids)))
+                    if patchids:
+                        conn.execute(patches_tbl.delete(patches_tbl.c.id.in_(patchids)))
+                    conn.execute(sourcestampsets_tbl.delete(sourcestampsets_tbl.c.id.in_(ssids)))
 
-            except Exception:
+            except:
                 transaction.rollback()
-                log.msg(Failure(), "Could not pruneBuildRequests")
-                return
+                raise
 
             transaction.commit()
+            return len(bsids)
 
         return self.db.pool.do(thd)
 
@@ -1228,4 +1378,5 @@ class BuildRequestsConnectorComponent(base.DBConnectorComponent):
                       complete=bool(row.complete), results=row.results,
                       submitted_at=submitted_at, complete_at=complete_at,
                       artifactbrid=row.artifactbrid, triggeredbybrid=row.triggeredbybrid,
-                      mergebrid=row.mergebrid, startbrid=row.startbrid, slavepool=row.slavepool)
+                      mergebrid=row.mergebrid, startbrid=row.startbrid, slavepool=row.slavepool,
+                      selected_slave=row.selected_slave)
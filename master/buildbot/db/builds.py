@@ -13,6 +13,7 @@
 #
 # Copyright Buildbot Team Members
 
+import hashlib
 from twisted.internet import reactor
 from buildbot.db import base
 from buildbot.util import epoch2datetime
@@ -242,6 +243,103 @@ class BuildsConnectorComponent(base.DBConnectorComponent):
 
         return self.db.pool.do(thd)
 
+    def getLastBuildNumbersByResults(self, buildername, sourcestamps=None):
+        """
+        Get the number of the latest finished build of C{buildername} for
+        each results, on the branches given by C{sourcestamps} (as for
+        L{getLastBuildsNumbers}).
+
+        @returns: dictionary mapping results to build number, via Deferred
+        """
+        def thd(conn):
+            buildrequests_tbl = self.db.model.buildrequests
+            buildsets_tbl = self.db.model.buildsets
+            sourcestampsets_tbl = self.db.model.sourcestampsets
+            sourcestamps_tbl = self.db.model.sourcestamps
+            builds_tbl = self.db.model.builds
+
+            resumeBuilds = [9, -1]
+
+            q = sa.select(columns=[buildrequests_tbl.c.results,
+                                   sa.func.max(builds_tbl.c.number).label("number")],
+                          from_obj=buildrequests_tbl.join(builds_tbl,
+                                                          (buildrequests_tbl.c.id == builds_tbl.c.brid)
+                                                          & (builds_tbl.c.finish_time != None)))\
+                .where(buildrequests_tbl.c.mergebrid == None)\
+                .where(~buildrequests_tbl.c.results.in_(resumeBuilds))\
+                .where(buildrequests_tbl.c.buildername == buildername)\
+                .where(buildrequests_tbl.c.complete == 1)\
+                .group_by(buildrequests_tbl.c.results)
+
+            q = maybeFilterBuildRequestsBySourceStamps(query=q,
+                                                       sourcestamps=sourcestamps,
+                                                       buildrequests_tbl=buildrequests_tbl,
+                                                       buildsets_tbl=buildsets_tbl,
+                                                       sourcestamps_tbl=sourcestamps_tbl,
+                                                       sourcestampsets_tbl=sourcestampsets_tbl)
+
+            res = conn.execute(q)
+            numbers = dict((row.results, row.number) for row in res.fetchall())
+            res.close()
+            return numbers
+
+        return self.db.pool.do(thd)
+
+    def _lastBuildKeyHash(self, buildername, codebases_key):
+        key = u'%s\0%s' % (buildername, codebases_key)
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def updateLastBuild(self, buildername, codebases_key, results, number, finish_time=None):
+        """
+        Record build C{number} as the latest build of C{buildername} with
+        C{results} on the branches given by C{codebases_key}, unless a later
+        build is already recorded.
+        """
+        def thd(conn):
+            tbl = self.db.model.last_builds
+            key_hash = self._lastBuildKeyHash(buildername, codebases_key)
+
+            def update():
+                q = tbl.update(whereclause=((tbl.c.key_hash == key_hash)
+                                            & (tbl.c.results == results)
+                                            & (tbl.c.number < number)))
+                res = conn.execute(q, number=number, finish_time=finish_time)
+                return res.rowcount
+
+            if update():
+                return
+
+            # either there is no row yet, or it has a later build; another
+            # master inserting the row first is the same as the latter
+            try:
+                conn.execute(tbl.insert(), buildername=buildername,
+                             codebases_key=codebases_key, key_hash=key_hash,
+                             results=results, number=number, finish_time=finish_time)
+            except (sa.exc.IntegrityError, sa.exc.ProgrammingError):
+                update()
+        return self.db.pool.do(thd)
+
+    def getLastBuildNumber(self, buildername, codebases_key, results=None):
+        """
+        Get the number of the latest build of C{buildername} on the branches
+        given by C{codebases_key}, with one of C{results} if given, as recorded
+        by L{updateLastBuild}.
+
+        @returns: build number or None, via Deferred
+        """
+        def thd(conn):
+            tbl = self.db.model.last_builds
+            key_hash = self._lastBuildKeyHash(buildername, codebases_key)
+            q = sa.select([tbl.c.number], whereclause=(tbl.c.key_hash == key_hash))
+            if results:
+                q = q.where(tbl.c.results.in_(results))
+            q = q.order_by(sa.desc(tbl.c.number)).limit(1)
+            res = conn.execute(q)
+            number = res.scalar()
+            res.close()
+            return number
+        return self.db.pool.do(thd)
+
     def _bdictFromRow(self, row):
         def mkdt(epoch):
             if epoch:
@@ -20,7 +20,7 @@ Support for buildsets in the database
 import sqlalchemy as sa
 from twisted.internet import reactor
 from buildbot.util import json
-from buildbot.db import base
+from buildbot.db import base, events
 from buildbot.util import epoch2datetime, datetime2epoch
 from buildbot.process.buildrequest import Priority
 
@@ -34,6 +34,7 @@ class BuildsetsConnectorComponent(base.DBConnectorComponent):
                     builderNames=None, external_idstring=None,  _reactor=reactor):
         def thd(conn):
             priority = Priority.Default
+            selected_slave = None
             buildsets_tbl = self.db.model.buildsets
             submitted_at = _reactor.seconds()
 
@@ -59,6 +60,9 @@ class BuildsetsConnectorComponent(base.DBConnectorComponent):
                     priority = priority_property if priority_property \
                                                     and int(priority_property) > 0 else Priority.Default
 
+                if 'selected_slave' in properties:
+                    selected_slave = properties.get('selected_slave')[0]
+
                 inserts = [
                     dict(buildsetid=bsid, property_name=k,
                          property_value=json.dumps([v,s]))
@@ -93,10 +97,17 @@ class BuildsetsConnectorComponent(base.DBConnectorComponent):
                         claimed_at=0, claimed_by_name=None,
                         claimed_by_incarnation=None, complete=0, results=-1,
                         submitted_at=submitted_at, complete_at=None,
-                        triggeredbybrid=triggeredbybrid, startbrid=startbrid))
+                        triggeredbybrid=triggeredbybrid, startbrid=startbrid,
+                        selected_slave=selected_slave))
 
                 brids[buildername] = res.inserted_primary_key[0]
 
+            self.db.events.thdAddEvents(conn,
+                [dict(event=events.BUILDSET_ADDED, objectid=bsid)] +
+                [dict(event=events.BUILDREQUEST_ADDED, objectid=brid, buildsetid=bsid,
+                      buildername=buildername)
+                 for buildername, brid in brids.iteritems()])
+
             transaction.commit()
 
             return (bsid, brids)
@@ -20,7 +20,7 @@ Support for changes in the database
 from buildbot.util import json
 import sqlalchemy as sa
 from twisted.internet import defer, reactor
-from buildbot.db import base
+from buildbot.db import base, events
 from buildbot.util import epoch2datetime, datetime2epoch
 from twisted.python import log
 from twisted.python.failure import Failure
@@ -106,6 +106,9 @@ class ChangesConnectorComponent(base.DBConnectorComponent):
                 ins = self.db.model.change_users.insert()
                 conn.execute(ins, dict(changeid=changeid, uid=uid))
 
+            self.db.events.thdAddEvents(conn, [dict(event=events.CHANGE_ADDED,
+                                                    objectid=changeid)])
+
             transaction.commit()
 
             return changeid
@@ -140,25 +143,38 @@ class ChangesConnectorComponent(base.DBConnectorComponent):
         d = self.db.pool.do(thd)
         return d
 
+    def getChangesSince(self, changeid, limit=None):
+        """
+        Get the changes with an id greater than C{changeid}, by increasing id,
+        at most C{limit} of them.  The changes are fetched with their files and
+        properties in a fixed number of queries, and are not cached.
+
+        @returns: list of chdicts, via Deferred
+        """
+        def thd(conn):
+            changes_tbl = self.db.model.changes
+            q = changes_tbl.select(whereclause=(changes_tbl.c.changeid > changeid),
+                    order_by=[changes_tbl.c.changeid],
+                    limit=limit)
+            rp = conn.execute(q)
+            rows = rp.fetchall()
+            rp.close()
+            return self._chdicts_from_change_rows_thd(conn, rows)
+        d = self.db.pool.do(thd)
+        return d
+
     def getRecentChanges(self, count):
         def thd(conn):
-            # get the changeids from the 'changes' table
+            # get the last rows from the 'changes' table
             changes_tbl = self.db.model.changes
-            q = sa.select([changes_tbl.c.changeid],
+            q = changes_tbl.select(
                     order_by=[sa.desc(changes_tbl.c.changeid)],
                     limit=count)
             rp = conn.execute(q)
-            changeids = [ row.changeid for row in rp ]
+            rows = rp.fetchall()
             rp.close()
-            return list(reversed(changeids))
+            return self._chdicts_from_change_rows_thd(conn, list(reversed(rows)))
         d = self.db.pool.do(thd)
-
-        # then turn those into changes, using the cache
-        def get_changes(changeids):
-            return defer.gatherResults([ self.getChange(changeid)
-                                         for changeid in changeids ],
-                                       consumeErrors=True)
-        d.addCallback(get_changes)
         return d
 
     def getLatestChangeid(self):
@@ -224,30 +240,17 @@ class ChangesConnectorComponent(base.DBConnectorComponent):
     def _chdict_from_change_row_thd(self, conn, ch_row):
         # This method must be run in a db.pool thread, and returns a chdict
         # given a row from the 'changes' table
+        return self._chdicts_from_change_rows_thd(conn, [ch_row])[0]
+
+    def _chdicts_from_change_rows_thd(self, conn, ch_rows):
+        # This method must be run in a db.pool thread, and returns the chdicts
+        # of the rows from the 'changes' table, fetching the files and
+        # properties of up to 100 changes at a time
         change_files_tbl = self.db.model.change_files
         change_properties_tbl = self.db.model.change_properties
 
-        chdict = ChDict(
-                changeid=ch_row.changeid,
-                author=ch_row.author,
-                files=[], # see below
-                comments=ch_row.comments,
-                is_dir=ch_row.is_dir,
-                revision=ch_row.revision,
-                when_timestamp=epoch2datetime(ch_row.when_timestamp),
-                branch=ch_row.branch,
-                category=ch_row.category,
-                revlink=ch_row.revlink,
-                properties={}, # see below
-                repository=ch_row.repository,
-                codebase=ch_row.codebase,
-                project=ch_row.project)
-
-        query = change_files_tbl.select(
-                whereclause=(change_files_tbl.c.changeid == ch_row.changeid))
-        rows = conn.execute(query)
-        for r in rows:
-            chdict['files'].append(r.filename)
+        chdicts = [ self._chdict_from_row(ch_row) for ch_row in ch_rows ]
+        by_changeid = dict((chdict['changeid'], chdict) for chdict in chdicts)
 
         # and properties must be given without a source, so strip that, but
         # be flexible in case users have used a development version where the
@@ -261,14 +264,41 @@ class ChangesConnectorComponent(base.DBConnectorComponent):
                 v,s = vs, "Change"
             return v, s
 
-        query = change_properties_tbl.select(
-                whereclause=(change_properties_tbl.c.changeid == ch_row.changeid))
-        rows = conn.execute(query)
-        for r in rows:
-            try:
-                v, s = split_vs(json.loads(r.property_value))
-                chdict['properties'][r.property_name] = (v,s)
-            except ValueError:
-                pass
-
-        return chdict
+        changeids = by_changeid.keys()
+        while changeids:
+            batch, changeids = changeids[:100], changeids[100:]
+
+            query = change_files_tbl.select(
+                    whereclause=(change_files_tbl.c.changeid.in_(batch)))
+            rows = conn.execute(query)
+            for r in rows:
+                by_changeid[r.changeid]['files'].append(r.filename)
+
+            query = change_properties_tbl.select(
+                    whereclause=(change_properties_tbl.c.changeid.in_(batch)))
+            rows = conn.execute(query)
+            for r in rows:
+                try:
+                    v, s = split_vs(json.loads(r.property_value))
+                    by_changeid[r.changeid]['properties'][r.property_name] = (v,s)
+                except ValueError:
+                    pass
+
+        return chdicts
+
+    def _chdict_from_row(self, ch_row):
+        return ChDict(
+                changeid=ch_row.changeid,
+                author=ch_row.author,
+                files=[], # see _chdicts_from_change_rows_thd
+                comments=ch_row.comments,
+                is_dir=ch_row.is_dir,
+                revision=ch_row.revision,
+                when_timestamp=epoch2datetime(ch_row.when_timestamp),
+                branch=ch_row.branch,
+                category=ch_row.category,
+                revlink=ch_row.revlink,
+                properties={}, # see _chdicts_from_change_rows_thd
+                repository=ch_row.repository,
+                codebase=ch_row.codebase,
+                project=ch_row.project)
@@ -14,13 +14,15 @@
 # Copyright Buildbot Team Members
 
 import textwrap
-from twisted.internet import defer
+from twisted.internet import defer, reactor
 from twisted.python import log
 from twisted.application import internet, service
-from buildbot import config
+from buildbot import config, util
+from buildbot.process import metrics
 from buildbot.db import enginestrategy
 from buildbot.db import pool, model, changes, schedulers, sourcestamps, sourcestampsets
 from buildbot.db import state, buildsets, buildrequests, builds, users, mastersconfig
+from buildbot.db import events
 
 class DatabaseNotReadyError(Exception):
     pass
@@ -36,6 +38,56 @@ upgrade_message = textwrap.dedent("""\
     want to make a backup of your buildmaster before doing so.
     """).strip()
 
+class BuildRequestsPruner(internet.TimerService):
+    """
+    Deletes the old buildrequests in small batches, each batch is committed so
+    the tables are only locked for a short time. The pruning stops after
+    C{TIME_BUDGET} seconds and continues on the next tick.
+    """
+
+    # seconds between ticks
+    INTERVAL = 60
+    # seconds spent pruning on each tick
+    TIME_BUDGET = 5
+    # number of buildsets deleted per batch
+    BATCH_SIZE = 100
+
+    _reactor = reactor
+
+    def __init__(self, db):
+        internet.TimerService.__init__(self, self.INTERVAL, self.prune)
+        self.db = db
+        self.pruning = False
+
+    @defer.inlineCallbacks
+    def prune(self):
+        buildRequestsDays = self.db.master.config.buildRequestsDays
+        if not self.db.configured_url or not buildRequestsDays or self.pruning:
+            return
+
+        self.pruning = True
+        started = util.now(self._reactor)
+        total = 0
+        try:
+            while True:
+                pruned = yield self.db.buildrequests.pruneBuildRequests(buildRequestsDays,
+                                                                        limit=self.BATCH_SIZE)
+                total += pruned
+                metrics.MetricCountEvent.log("BuildRequestsPruner.pruned", pruned)
+                if not pruned or util.now(self._reactor) - started >= self.TIME_BUDGET:
+                    break
+        except Exception:
+            log.err(None, "while pruning buildrequests")
+        finally:
+            self.pruning = False
+
+        elapsed = util.now(self._reactor) - started
+        metrics.MetricTimeEvent.log("BuildRequestsPruner.prune", elapsed)
+        if total:
+            rate = total / elapsed if elapsed > 0 else total
+            metrics.MetricCountEvent.log("BuildRequestsPruner.rows_per_second", int(rate), absolute=True)
+            log.msg("pruned %d old buildsets and their buildrequests in %.2f seconds" % (total, elapsed))
+
 class DBConnector(config.ReconfigurableServiceMixin, service.MultiService):
     # The connection between Buildbot and its backend database.  This is
     # generally accessible as master.db, but is also used during upgrades.
@@ -61,6 +113,7 @@ class DBConnector(config.ReconfigurableServiceMixin, service.MultiService):
         self._engine = None # set up in reconfigService
         self.pool = None # set up in reconfigService
         self.cleanup_timer = None
+        self.pruner = None
         self.model = model.Model(self)
         self.changes = changes.ChangesConnectorComponent(self)
         self.schedulers = schedulers.SchedulersConnectorComponent(self)
@@ -72,18 +125,21 @@ class DBConnector(config.ReconfigurableServiceMixin, service.MultiService):
         self.builds = builds.BuildsConnectorComponent(self)
         self.users = users.UsersConnectorComponent(self)
         self.mastersconfig = mastersconfig.MastersConfigConnectorComponent(self)
+        self.events = events.EventsConnectorComponent(self)
 
     def setUpCleanUp(self):
         cleanUpPeriod = self.master.config.cleanUpPeriod
 
         if cleanUpPeriod and cleanUpPeriod > 0:
-            pruneBuildRequests = self.pool.engine.dialect.name == 'mysql'
             self.cleanup_timer = internet.TimerService(
                     cleanUpPeriod,
-                    self._doCleanup, pruneBuildRequests)
+                    self._doCleanup)
 
             self.cleanup_timer.setServiceParent(self)
 
+            self.pruner = BuildRequestsPruner(self)
+            self.pruner.setServiceParent(self)
+
     def setup(self, check_version=True, verbose=True):
         db_url = self.configured_url = self.master.config.db['db_url']
 
@@ -118,7 +174,7 @@ class DBConnector(config.ReconfigurableServiceMixin, service.MultiService):
                                                             new_config)
 
     @defer.inlineCallbacks
-    def _doCleanup(self, pruneBuildRequests):
+    def _doCleanup(self):
         """
         Perform any periodic database cleanup tasks.
 
@@ -129,6 +185,3 @@ class DBConnector(config.ReconfigurableServiceMixin, service.MultiService):
 
         log.msg("Running db clean up jobs")
         yield self.changes.pruneChanges(self.master.config.changeHorizon)
-
-        if pruneBuildRequests:
-            yield self.buildrequests.pruneBuildRequests(self.master.config.buildRequestsDays)
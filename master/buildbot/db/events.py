@@ -0,0 +1,149 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Unity Technologies
+
+import sqlalchemy as sa
+from twisted.internet import reactor
+from buildbot.db import base
+
+# the events written to the master_events table
+CHANGE_ADDED = 'change_added'
+BUILDSET_ADDED = 'buildset_added'
+BUILDREQUEST_ADDED = 'buildrequest_added'
+BUILDREQUEST_CLAIMED = 'buildrequest_claimed'
+BUILDREQUEST_UNCLAIMED = 'buildrequest_unclaimed'
+BUILDREQUEST_COMPLETED = 'buildrequest_completed'
+BUILDREQUEST_CANCELLED = 'buildrequest_cancelled'
+
+
+class MasterEventDict(dict):
+    pass
+
+
+class EventsConnectorComponent(base.DBConnectorComponent):
+    """
+    The master_events table is a log of what the masters sharing the database
+    did, that each master reads from the last event it has seen instead of
+    polling the changes and buildrequests tables.
+
+    Events are only written once the master enables them, which it does when
+    it polls the database; the other components add theirs with thdAddEvents,
+    in the transaction making the change they describe.
+    """
+
+    def __init__(self, connector):
+        base.DBConnectorComponent.__init__(self, connector)
+        self.enabled = False
+        self.masterid = None
+
+    def enable(self, masterid):
+        self.enabled = True
+        self.masterid = masterid
+
+    def disable(self):
+        self.enabled = False
+
+    def thdAddEvents(self, conn, events, _reactor=reactor):
+        """
+        Writes events, given as dictionaries with the keys C{event},
+        C{objectid} and, optionally, C{buildsetid} and C{buildername}, using the
+        connection of the current thread; does nothing unless the events are
+        enabled.
+        """
+        if not self.enabled or not events:
+            return
+        tbl = self.db.model.master_events
+        created_at = _reactor.seconds()
+        conn.execute(tbl.insert(), [dict(event=ev['event'],
+                                         objectid=ev['objectid'],
+                                         buildsetid=ev.get('buildsetid'),
+                                         buildername=ev.get('buildername'),
+                                         masterid=self.masterid,
+                                         created_at=created_at)
+                                    for ev in events])
+
+    def addEvents(self, events, _reactor=reactor):
+        def thd(conn):
+            self.thdAddEvents(conn, events, _reactor=_reactor)
+        return self.db.pool.do(thd)
+
+    def getEventsSince(self, eventid, limit=500, missing=()):
+        """
+        Get at most C{limit} events with an id greater than C{eventid}, or in
+        C{missing}, by increasing id.
+
+        The ids are allocated when the events are written, but the events only
+        appear once their transaction commits, so a reader can see an event
+        before one with a smaller id; it passes the ids it skipped as
+        C{missing} to get them later.
+
+        @returns: list of event dictionaries, via Deferred
+        """
+        def thd(conn):
+            tbl = self.db.model.master_events
+            whereclause = (tbl.c.id > eventid)
+            if missing:
+                whereclause = whereclause | tbl.c.id.in_(list(missing))
+            q = sa.select([tbl], whereclause=whereclause) \
+                .order_by(tbl.c.id).limit(limit)
+            res = conn.execute(q)
+            rows = res.fetchall()
+            res.close()
+            return [self._eventdictFromRow(row) for row in rows]
+        return self.db.pool.do(thd)
+
+    def getLatestEventId(self):
+        """
+        @returns: the id of the last event, or 0 if there are none, via
+        Deferred
+        """
+        def thd(conn):
+            tbl = self.db.model.master_events
+            res = conn.execute(sa.select([sa.func.max(tbl.c.id)]))
+            latest = res.scalar()
+            res.close()
+            return latest or 0
+        return self.db.pool.do(thd)
+
+    def getFirstEventId(self, event, objectid):
+        """
+        @returns: the id of the first C{event} event about an object with an
+        id greater than C{objectid}, or None, via Deferred
+        """
+        def thd(conn):
+            tbl = self.db.model.master_events
+            res = conn.execute(sa.select([sa.func.min(tbl.c.id)],
+                                         whereclause=((tbl.c.event == event)
+                                                      & (tbl.c.objectid > objectid))))
+            first = res.scalar()
+            res.close()
+            return first
+        return self.db.pool.do(thd)
+
+    def pruneEvents(self, age, _reactor=reactor):
+        """
+        Delete the events older than C{age} seconds.
+
+        @returns: the number of deleted events, via Deferred
+        """
+        def thd(conn):
+            tbl = self.db.model.master_events
+            res = conn.execute(tbl.delete(tbl.c.created_at < _reactor.seconds() - age))
+            return res.rowcount
+        return self.db.pool.do(thd)
+
+    def _eventdictFromRow(self, row):
+        return MasterEventDict(eventid=row.id, event=row.event, objectid=row.objectid,
+                               buildsetid=row.buildsetid, buildername=row.buildername,
+                               masterid=row.masterid, created_at=row.created_at)
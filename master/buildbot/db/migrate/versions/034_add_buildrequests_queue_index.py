@@ -0,0 +1,29 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Unity Technologies
+
+import sqlalchemy as sa
+
+def upgrade(migrate_engine):
+
+    metadata = sa.MetaData()
+    metadata.bind = migrate_engine
+
+    # covers the filters and the order used to page through the queue of
+    # pending build requests
+    buildrequests_tbl = sa.Table('buildrequests', metadata, autoload=True)
+    idx = sa.Index('buildrequests_queue',
+                   buildrequests_tbl.c.complete, buildrequests_tbl.c.mergebrid,
+                   buildrequests_tbl.c.priority, buildrequests_tbl.c.submitted_at)
+    idx.create()
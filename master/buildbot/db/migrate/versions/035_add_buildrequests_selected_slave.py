@@ -0,0 +1,47 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Unity Technologies
+
+import sqlalchemy as sa
+from buildbot.util import json
+
+def upgrade(migrate_engine):
+
+    metadata = sa.MetaData()
+    metadata.bind = migrate_engine
+
+    buildrequests_tbl = sa.Table('buildrequests', metadata, autoload=True)
+    buildset_properties_tbl = sa.Table('buildset_properties', metadata, autoload=True)
+
+    selected_slave = sa.Column('selected_slave', sa.String(255), nullable=True)
+    selected_slave.create(buildrequests_tbl)
+
+    idx = sa.Index('buildrequests_selected_slave', buildrequests_tbl.c.selected_slave)
+    idx.create()
+
+    # copy the selected_slave property of the pending buildsets
+    # so the queue no longer needs to join buildset_properties
+    q = sa.select([buildset_properties_tbl.c.buildsetid, buildset_properties_tbl.c.property_value],
+                  whereclause=((buildset_properties_tbl.c.property_name == 'selected_slave')
+                               & buildset_properties_tbl.c.buildsetid.in_(
+                                   sa.select([buildrequests_tbl.c.buildsetid],
+                                             whereclause=(buildrequests_tbl.c.complete == 0)))))
+
+    for row in migrate_engine.execute(q).fetchall():
+        if not row.property_value:
+            continue
+        slavename = json.loads(row.property_value)[0]
+        migrate_engine.execute(buildrequests_tbl.update()
+                               .where(buildrequests_tbl.c.buildsetid == row.buildsetid)
+                               .values(selected_slave=slavename))
@@ -0,0 +1,34 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Unity Technologies
+
+import sqlalchemy as sa
+
+def upgrade(migrate_engine):
+
+    metadata = sa.MetaData()
+    metadata.bind = migrate_engine
+
+    master_events = sa.Table("master_events", metadata,
+                             sa.Column('id', sa.Integer, primary_key=True),
+                             sa.Column('event', sa.String(64), nullable=False),
+                             sa.Column('objectid', sa.Integer, nullable=False),
+                             sa.Column('buildsetid', sa.Integer),
+                             sa.Column('buildername', sa.String(256)),
+                             sa.Column('masterid', sa.Integer),
+                             sa.Column('created_at', sa.Integer, nullable=False))
+    master_events.create()
+
+    idx = sa.Index('master_events_created_at', master_events.c.created_at)
+    idx.create()
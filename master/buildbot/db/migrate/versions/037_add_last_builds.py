@@ -0,0 +1,37 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Unity Technologies
+
+import sqlalchemy as sa
+
+def upgrade(migrate_engine):
+
+    metadata = sa.MetaData()
+    metadata.bind = migrate_engine
+
+    # the table starts empty: the builder statuses fill it as the builds
+    # finish, and when they find a latest build it does not have yet
+    last_builds = sa.Table("last_builds", metadata,
+                           sa.Column('id', sa.Integer, primary_key=True),
+                           sa.Column('buildername', sa.String(256), nullable=False),
+                           sa.Column('codebases_key', sa.Text, nullable=False),
+                           sa.Column('key_hash', sa.String(40), nullable=False),
+                           sa.Column('results', sa.Integer, nullable=False),
+                           sa.Column('number', sa.Integer, nullable=False),
+                           sa.Column('finish_time', sa.Integer))
+    last_builds.create()
+
+    idx = sa.Index('last_builds_key', last_builds.c.key_hash, last_builds.c.results,
+                   unique=True)
+    idx.create()
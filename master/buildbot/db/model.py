@@ -77,7 +77,9 @@ class Model(base.DBConnectorComponent):
         sa.Column('triggeredbybrid', sa.Integer, sa.ForeignKey('buildrequests.id'), nullable=True),
         sa.Column('mergebrid', sa.Integer, sa.ForeignKey('buildrequests.id'), nullable=True),
         sa.Column('startbrid', sa.Integer, sa.ForeignKey('buildrequests.id'), nullable=True),
-        sa.Column('slavepool', sa.Text, nullable=True)
+        sa.Column('slavepool', sa.Text, nullable=True),
+        # copy of the buildset 'selected_slave' property, used by the queue
+        sa.Column('selected_slave', sa.String(255), nullable=True)
     )
 
     # Each row in this table represents a claimed build request, where the
@@ -338,6 +340,54 @@ class Model(base.DBConnectorComponent):
         sa.Column('objectid', sa.Integer, sa.ForeignKey('objects.id'), index=True,  unique=True, nullable=False),
     )
 
+    # master_events
+
+    # This table is a log of the changes, buildsets and buildrequests added,
+    # claimed, completed or cancelled by the masters, which the other masters
+    # read instead of polling those tables
+    master_events = sa.Table("master_events", metadata,
+        # increasing id, the masters remember the last one they have read
+        sa.Column('id', sa.Integer, primary_key=True),
+
+        # the kind of event, see buildbot.db.events
+        sa.Column('event', sa.String(64), nullable=False),
+
+        # the changeid, bsid or brid the event is about
+        sa.Column('objectid', sa.Integer, nullable=False),
+
+        # the buildset and builder of a buildrequest event
+        sa.Column('buildsetid', sa.Integer),
+        sa.Column('buildername', sa.String(256)),
+
+        # objectid of the master that wrote the event
+        sa.Column('masterid', sa.Integer),
+
+        # time the event was written, used to prune the table
+        sa.Column('created_at', sa.Integer, nullable=False),
+    )
+
+    # last_builds
+
+    # This table holds the number of the latest finished build of each
+    # builder, by codebases and results; it is updated when the builds finish
+    # so that the latest build is read without searching the builds
+    last_builds = sa.Table("last_builds", metadata,
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('buildername', sa.String(256), nullable=False),
+
+        # the branches of the build, as given by the builder status'
+        # getCodebasesCacheKey, e.g. 'katana-buildbot=katana;'
+        sa.Column('codebases_key', sa.Text, nullable=False),
+
+        # sha1 of the buildername and codebases_key, which are too long to be
+        # indexed on every database
+        sa.Column('key_hash', sa.String(40), nullable=False),
+
+        sa.Column('results', sa.Integer, nullable=False),
+        sa.Column('number', sa.Integer, nullable=False),
+        sa.Column('finish_time', sa.Integer),
+    )
+
     #users
 
     # This table identifies individual users, and contains buildbot-specific
@@ -425,9 +475,15 @@ class Model(base.DBConnectorComponent):
     sa.Index('buildrequests_triggeredbybrid', buildrequests.c.triggeredbybrid, unique=False)
     sa.Index('buildrequests_mergebrid', buildrequests.c.mergebrid, unique=False)
     sa.Index('buildrequests_startbrid', buildrequests.c.startbrid, unique=False)
+    sa.Index('buildrequests_queue', buildrequests.c.complete, buildrequests.c.mergebrid,
+             buildrequests.c.priority, buildrequests.c.submitted_at)
+    sa.Index('buildrequests_selected_slave', buildrequests.c.selected_slave, unique=False)
     sa.Index('builds_slavename', builds.c.slavename, unique=False)
     sa.Index('user_properties_uid', user_props.c.uid, unique=False)
     sa.Index('user_props_attrs', user_props.c.prop_type, user_props.c.prop_data)
+    sa.Index('master_events_created_at', master_events.c.created_at)
+    sa.Index('last_builds_key', last_builds.c.key_hash, last_builds.c.results,
+             unique=True)
 
     # MySQl creates indexes for foreign keys, and these appear in the
     # reflection.  This is a list of (table, index) names that should be
@@ -1071,6 +1071,9 @@ class ILogFile(Interface):
         pass
     def addHeader(data):
         pass
+    def addEntries(entries):
+        """Add several chunks of data at once, as a list of (channel, data),
+        in order."""
     def finish():
         """The process that is feeding the log file has finished, and no
         further data will be added. This closes the logfile."""
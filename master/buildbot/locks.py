@@ -14,6 +14,8 @@
 # Copyright Buildbot Team Members
 
 
+from collections import OrderedDict
+
 from twisted.python import log
 from twisted.internet import defer
 from buildbot import util
@@ -33,15 +35,28 @@ class BaseLock:
     We maintain the wait queue in FIFO order, and ensure that counting waiters
     in the queue behind exclusive waiters cannot acquire the lock. This ensures
     that exclusive waiters are not starved.
+
+    The numbers of exclusive and counting owners, and of exclusive waiters,
+    are kept up to date as the lock is claimed and released, and the wait
+    queue is indexed by owner, so that no operation walks more of the queue
+    than the lock has free slots.
     """
     description = "<BaseLock>"
 
+    # For testing
+    _reactor = None
+
     def __init__(self, name, maxCount=1):
         self.name = name          # Name of the lock
-        self.waiting = []         # Current queue, tuples (waiter, LockAccess,
-                                  #                        deferred)
+        self.waiting = OrderedDict() # Current queue, waiter -> (LockAccess,
+                                     #             deferred, time it queued)
         self.owners = []          # Current owners, tuples (owner, LockAccess)
         self.maxCount = maxCount  # maximal number of counting owners
+        self.metricName = name    # Name of the lock in the metrics
+
+        self._numExclusive = 0
+        self._numCounting = 0
+        self._numExclusiveWaiting = 0
 
         # subscriptions to this lock being released
         self.release_subs = subscription.SubscriptionPoint("%r releases"
@@ -55,13 +70,7 @@ class BaseLock:
 
             @return: Tuple (number exclusive owners, number counting owners)
         """
-        num_excl, num_counting = 0, 0
-        for owner in self.owners:
-            if owner[1].mode == 'exclusive':
-                num_excl = num_excl + 1
-            else: # mode == 'counting'
-                num_counting = num_counting + 1
-
+        num_excl, num_counting = self._numExclusive, self._numCounting
         assert (num_excl == 1 and num_counting == 0) \
                 or (num_excl == 0 and num_counting <= self.maxCount)
         return num_excl, num_counting
@@ -72,23 +81,28 @@ class BaseLock:
         debuglog("%s isAvailable(%s, %s): self.owners=%r"
                                       % (self, requester, access, self.owners))
         num_excl, num_counting = self._getOwnersCount()
-
-        # Find all waiters ahead of the requester in the wait queue
-        for idx, waiter in enumerate(self.waiting):
-            if waiter[0] == requester:
-                w_index = idx
-                break
-        else:
-            w_index = len(self.waiting) 
-        ahead = self.waiting[:w_index]
-
-        if access.mode == 'counting':
-            # Wants counting access
-            return num_excl == 0 and num_counting + len(ahead) < self.maxCount \
-                    and all([w[1].mode == 'counting' for w in ahead])
-        else:
-            # Wants exclusive access
-            return num_excl == 0 and num_counting == 0 and len(ahead) == 0
+        if num_excl > 0:
+            return False
+
+        if access.mode == 'exclusive':
+            # Wants exclusive access, and there must be nobody ahead
+            if num_counting > 0:
+                return False
+            return not self.waiting or iter(self.waiting).next() == requester
+
+        # Wants counting access: all the waiters ahead of the requester in the
+        # wait queue must want counting access, and fit in the free slots
+        # with it
+        free = self.maxCount - num_counting
+        if requester not in self.waiting:
+            return self._numExclusiveWaiting == 0 and len(self.waiting) < free
+        for ahead, (w_owner, w) in enumerate(self.waiting.iteritems()):
+            if ahead >= free:
+                return False
+            if w_owner == requester:
+                return True
+            if w[0].mode == 'exclusive':
+                return False
 
     def claim(self, owner, access):
         """ Claim the lock (lock must be available) """
@@ -98,8 +112,14 @@ class BaseLock:
 
         assert isinstance(access, LockAccess)
         assert access.mode in ['counting', 'exclusive']
-        self.waiting = [w for w in self.waiting if w[0] != owner]
+        waiter = self._removeWaiter(owner)
+        if waiter is not None:
+            self._logWaitTime(util.now(self._reactor) - waiter[2])
         self.owners.append((owner, access))
+        if access.mode == 'exclusive':
+            self._numExclusive += 1
+        else:
+            self._numCounting += 1
         debuglog(" %s is claimed '%s'" % (self, access.mode))
 
     def subscribeToReleases(self, callback):
@@ -117,11 +137,16 @@ class BaseLock:
             debuglog("%s already released" % self)
             return
         self.owners.remove(entry)
+        if access.mode == 'exclusive':
+            self._numExclusive -= 1
+        else:
+            self._numCounting -= 1
         # who can we wake up?
         # After an exclusive access, we may need to wake up several waiting.
         # Break out of the loop when the first waiting client should not be awakened.
         num_excl, num_counting = self._getOwnersCount()
-        for i, (w_owner, w_access, d) in enumerate(self.waiting):
+        woken = []
+        for w_owner, (w_access, d, queued_at) in self.waiting.iteritems():
             if w_access.mode == 'counting':
                 if num_excl > 0 or num_counting == self.maxCount:
                     break
@@ -134,11 +159,14 @@ class BaseLock:
                 else:
                     num_excl = num_excl + 1
 
-            # If the waiter has a deferred, wake it up and clear the deferred
-            # from the wait queue entry to indicate that it has been woken.
             if d:
-                self.waiting[i] = (w_owner, w_access, None)
-                eventually(d.callback, self)
+                woken.append((w_owner, w_access, d, queued_at))
+
+        # If the waiter has a deferred, wake it up and clear the deferred
+        # from the wait queue entry to indicate that it has been woken.
+        for w_owner, w_access, d, queued_at in woken:
+            self.waiting[w_owner] = (w_access, None, queued_at)
+            eventually(d.callback, self)
 
         # notify any listeners
         self.release_subs.deliver()
@@ -156,19 +184,46 @@ class BaseLock:
             return defer.succeed(self)
         d = defer.Deferred()
 
-        # Are we already in the wait queue?
-        w = [i for i, w in enumerate(self.waiting) if w[0] == owner]
-        if w:
-            self.waiting[w[0]] = (owner, access, d)
+        # If we are already in the wait queue, we keep our place
+        waiter = self.waiting.get(owner)
+        if waiter is not None:
+            if waiter[0].mode == 'exclusive':
+                self._numExclusiveWaiting -= 1
+            queued_at = waiter[2]
         else:
-            self.waiting.append((owner, access, d))
+            queued_at = util.now(self._reactor)
+        if access.mode == 'exclusive':
+            self._numExclusiveWaiting += 1
+        self.waiting[owner] = (access, d, queued_at)
+        if waiter is None:
+            self._logQueueLength()
         return d
 
     def stopWaitingUntilAvailable(self, owner, access, d):
         debuglog("%s stopWaitingUntilAvailable(%s)" % (self, owner))
         assert isinstance(access, LockAccess)
-        assert (owner, access, d) in self.waiting
-        self.waiting = [w for w in self.waiting if w[0] != owner]
+        assert self.waiting.get(owner, (None, None))[:2] == (access, d)
+        self._removeWaiter(owner)
+
+    def _removeWaiter(self, owner):
+        waiter = self.waiting.pop(owner, None)
+        if waiter is not None:
+            if waiter[0].mode == 'exclusive':
+                self._numExclusiveWaiting -= 1
+            self._logQueueLength()
+        return waiter
+
+    # buildbot.process.metrics imports buildbot.config, which imports this
+    # module, hence the imports below
+
+    def _logQueueLength(self):
+        from buildbot.process import metrics
+        metrics.MetricCountEvent.log("Lock(%s).waiting" % self.metricName,
+                                     len(self.waiting), absolute=True)
+
+    def _logWaitTime(self, elapsed):
+        from buildbot.process import metrics
+        metrics.MetricTimeEvent.log("Lock(%s).wait" % self.metricName, elapsed)
 
     def isOwner(self, owner, access):
         return (owner, access) in self.owners
@@ -204,6 +259,7 @@ class RealSlaveLock:
             desc = "<SlaveLock(%s, %s)[%s] %d>" % (self.name, maxCount,
                                                    slavename, id(lock))
             lock.description = desc
+            lock.metricName = "%s[%s]" % (self.name, slavename)
             self.locks[slavename] = lock
         return self.locks[slavename]
 
@@ -31,7 +31,7 @@ from buildbot.changes import changes
 from buildbot.changes.manager import ChangeManager
 from buildbot import interfaces
 from buildbot.process.builder import BuilderControl
-from buildbot.db import connector
+from buildbot.db import connector, events
 from buildbot.schedulers.manager import SchedulerManager
 from buildbot.process.botmaster import BotMaster
 from buildbot.process import debug
@@ -66,6 +66,22 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
     # database poll operation.
     WARNING_UNCLAIMED_COUNT = 10000
 
+    # when polling, the master reads the events the masters write to the
+    # master_events table, at most EVENT_BATCH_SIZE at a time.  An event id it
+    # skipped is looked for until it is EVENT_GAP_TIMEOUT seconds old, as the
+    # event may be written by a transaction that is not committed yet.
+    EVENT_BATCH_SIZE = 500
+    EVENT_GAP_TIMEOUT = 60
+
+    # events older than EVENT_MAX_AGE seconds are deleted every
+    # EVENT_PRUNE_INTERVAL seconds; a master that starts polling catches up
+    # with the tables, so it does not need older events
+    EVENT_MAX_AGE = 24*60*60
+    EVENT_PRUNE_INTERVAL = 60*60
+
+    # number of new changes fetched at once when polling
+    CHANGES_BATCH_SIZE = 100
+
     def __init__(self, basedir, configFileName="master.cfg", umask=None):
         service.MultiService.__init__(self)
         self.setName("buildmaster")
@@ -109,6 +125,8 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
                 subscription.SubscriptionPoint("buildset_additions")
         self._complete_buildset_subs = \
                 subscription.SubscriptionPoint("buildset_completion")
+        self._master_event_subs = \
+                subscription.SubscriptionPoint("master_events")
 
         # local cache for this master's object ID
         self._object_id = None
@@ -334,8 +352,11 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
         if self.configured_poll_interval != new_config.db['db_poll_interval']:
             self.configured_poll_interval = new_config.db['db_poll_interval']
 
-        # resume the db poller
+        # resume the db poller, the masters tell each other what they do
+        # through the master_events table
         if self.configured_poll_interval:
+            _master_objectid = yield self.getObjectId()
+            self.db.events.enable(_master_objectid)
             self.db_loop = task.LoopingCall(self.pollDatabase)
             self.db_loop.start(self.configured_poll_interval, now=False)
 
@@ -647,6 +668,12 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
         self._cancelled_buildrequest_subs.deliver(
                 dict(bsid=bsid, brid=brid, buildername=buildername))
 
+        # and let the other masters know
+        if self.db.events.enabled:
+            d = self.db.events.addEvents([dict(event=events.BUILDREQUEST_CANCELLED,
+                                               objectid=brid, buildsetid=bsid,
+                                               buildername=buildername)])
+            d.addErrback(log.err, "while adding a cancelled build request event")
 
     def subscribeToBuildRequests(self, callback):
         """
@@ -668,15 +695,67 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
         """
         return self._cancelled_buildrequest_subs.subscribe(callback)
 
+    def subscribeToMasterEvents(self, callback):
+        """
+        Request that C{callback} be invoked with each event read from the
+        master_events table when polling the database, as a dictionary with
+        keys C{eventid}, C{event} (one of the constants in
+        L{buildbot.db.events}), C{objectid} (the changeid, bsid or brid the
+        event is about), C{buildsetid}, C{buildername}, C{masterid} and
+        C{created_at}.  This includes the events written by this master.
+        """
+        return self._master_event_subs.subscribe(callback)
 
     ## database polling
 
-    def pollDatabase(self):
+    _last_event_id = None
+    _last_event_prune = 0
+    @defer.inlineCallbacks
+    def pollDatabase(self, _reactor=reactor):
+        # This is used in a LoopingCall, so returning a Deferred means that we
+        # won't run two polling operations simultaneously.  The first poll
+        # catches up with the tables, the next ones only read the events added
+        # since.  Each particular poll method handles errors itself, although
+        # catastrophic errors are handled here
+        if self._last_event_id is None:
+            # events written while the tables are polled may be read twice,
+            # but none is lost
+            try:
+                last_event_id = yield self.db.events.getLatestEventId()
+            except Exception:
+                log.err(None, "while getting the latest master event")
+                return
+            yield self.pollDatabaseTables()
+            if self._changes_gap:
+                # the changes after the one not committed yet are delivered
+                # from their events, which are read again from the first
+                try:
+                    first_event_id = yield self.db.events.getFirstEventId(
+                        events.CHANGE_ADDED, self._last_processed_change)
+                except Exception:
+                    log.err(None, "while getting the master events of the new changes")
+                    return
+                if first_event_id is not None:
+                    last_event_id = min(last_event_id, first_event_id - 1)
+            self._last_event_id = last_event_id
+            self._missing_event_ids = {}
+            self._changes_polled_to = self._last_processed_change or 0
+        else:
+            yield defer.gatherResults([
+                self.pollDatabaseEvents(_reactor=_reactor).addErrback(log.err,
+                    "while polling master events"),
+                self.unclaimExpiredRequests().addErrback(log.err,
+                    "while unclaiming expired build requests"),
+            ])
+
+        if _reactor.seconds() - self._last_event_prune >= self.EVENT_PRUNE_INTERVAL:
+            self._last_event_prune = _reactor.seconds()
+            yield self.db.events.pruneEvents(self.EVENT_MAX_AGE).addErrback(log.err,
+                "while pruning master events")
+
+    def pollDatabaseTables(self):
         # poll each of the tables that can indicate new, actionable stuff for
-        # this buildmaster to do.  This is used in a TimerService, so returning
-        # a Deferred means that we won't run two polling operations
-        # simultaneously.  Each particular poll method handles errors itself,
-        # although catastrophic errors are handled here
+        # this buildmaster to do
         d = defer.gatherResults([
             self.pollDatabaseChanges().addErrback(log.err,
                 "while polling changes"),
@@ -686,7 +765,94 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
         ])
         return d
 
+    _missing_event_ids = None
+    _changes_polled_to = 0
+    @defer.inlineCallbacks
+    def pollDatabaseEvents(self, _reactor=reactor):
+        # reads the events the masters wrote since the last poll, and the ones
+        # skipped then, and acts on them
+        timer = metrics.Timer("BuildMaster.pollDatabaseEvents()")
+        timer.start()
+
+        if self._missing_event_ids is None:
+            self._missing_event_ids = {}
+        missing = self._missing_event_ids
+        last_processed_change = self._last_processed_change
+        count = 0
+
+        while True:
+            evdicts = yield self.db.events.getEventsSince(self._last_event_id,
+                                                         limit=self.EVENT_BATCH_SIZE,
+                                                         missing=missing.keys())
+
+            # fetch the added changes together
+            changeids = [evdict['objectid'] for evdict in evdicts
+                         if evdict['event'] == events.CHANGE_ADDED
+                         and evdict['objectid'] > self._changes_polled_to]
+            chdicts = {}
+            if changeids:
+                first, last = min(changeids), max(changeids)
+                for chdict in (yield self.db.changes.getChangesSince(first - 1,
+                                                                     limit=last - first + 1)):
+                    chdicts[chdict['changeid']] = chdict
+
+            for evdict in evdicts:
+                eventid = evdict['eventid']
+                if eventid > self._last_event_id:
+                    if eventid - self._last_event_id - 1 <= self.EVENT_BATCH_SIZE:
+                        for skipped in xrange(self._last_event_id + 1, eventid):
+                            missing[skipped] = _reactor.seconds()
+                    else:
+                        log.msg("skipped master events %d to %d" % (self._last_event_id + 1, eventid - 1))
+                    self._last_event_id = eventid
+                elif missing.pop(eventid, None) is None:
+                    continue
+
+                yield self._handleMasterEvent(evdict, chdicts)
+                count += 1
+
+            if len(evdicts) < self.EVENT_BATCH_SIZE:
+                break
+
+        for eventid, skipped_at in missing.items():
+            if _reactor.seconds() - skipped_at >= self.EVENT_GAP_TIMEOUT:
+                del missing[eventid]
+
+        if self._last_processed_change != last_processed_change:
+            yield self._setState('last_processed_change',
+                                 self._last_processed_change)
+
+        metrics.MetricCountEvent.log("BuildMaster.master_events", count)
+        timer.stop()
+
+    @defer.inlineCallbacks
+    def _handleMasterEvent(self, evdict, chdicts):
+        event = evdict['event']
+        if event == events.CHANGE_ADDED:
+            changeid = evdict['objectid']
+            # changes up to _changes_polled_to were delivered by the first poll
+            if changeid > self._changes_polled_to:
+                chdict = chdicts.get(changeid)
+                if chdict:
+                    change = yield changes.Change.fromChdict(self, chdict)
+                    self._change_subs.deliver(change)
+                self._last_processed_change = max(self._last_processed_change, changeid)
+
+        elif event in (events.BUILDREQUEST_ADDED, events.BUILDREQUEST_UNCLAIMED):
+            self.buildRequestAdded(evdict['buildsetid'], evdict['objectid'],
+                                   evdict['buildername'])
+
+        elif event == events.BUILDREQUEST_CANCELLED:
+            # the cancels of this master were delivered when they happened
+            if evdict['masterid'] != self.db.events.masterid:
+                self._cancelled_buildrequest_subs.deliver(
+                    dict(bsid=evdict['buildsetid'], brid=evdict['objectid'],
+                         buildername=evdict['buildername']))
+
+        self._master_event_subs.deliver(evdict)
+
     _last_processed_change = None
+    _changes_gap = False
     @defer.inlineCallbacks
     def pollDatabaseChanges(self):
         # Older versions of Buildbot had each scheduler polling the database
@@ -723,21 +889,30 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
             timer.stop()
             return
 
-        while True:
-            changeid = self._last_processed_change + 1
-            chdict = yield self.db.changes.getChange(changeid)
+        self._changes_gap = gap = False
+        while not gap:
+            chdicts = yield self.db.changes.getChangesSince(
+                self._last_processed_change, limit=self.CHANGES_BATCH_SIZE)
 
-            # if there's no such change, we've reached the end and can
-            # stop polling
-            if not chdict:
-                break
+            for chdict in chdicts:
+                # stop at the first missing changeid, which is usually a
+                # transaction that is not committed yet; it is read on the
+                # next poll
+                if chdict['changeid'] != self._last_processed_change + 1:
+                    self._changes_gap = gap = True
+                    break
 
-            change = yield changes.Change.fromChdict(self, chdict)
+                change = yield changes.Change.fromChdict(self, chdict)
 
-            self._change_subs.deliver(change)
+                self._change_subs.deliver(change)
 
-            self._last_processed_change = changeid
-            need_setState = True
+                self._last_processed_change = chdict['changeid']
+                need_setState = True
+
+            # if there are no more changes, we've reached the end and can
+            # stop polling
+            if len(chdicts) < self.CHANGES_BATCH_SIZE:
+                break
 
         # write back the updated state, if it's changed
         if need_setState:
@@ -745,15 +920,9 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
                             self._last_processed_change)
         timer.stop()
 
-    _last_unclaimed_brids_set = None
     _last_claim_cleanup = 0
     @defer.inlineCallbacks
-    def pollDatabaseBuildRequests(self):
-        # deal with cleaning up unclaimed requests, and (if necessary)
-        # requests from a previous instance of this master
-        timer = metrics.Timer("BuildMaster.pollDatabaseBuildRequests()")
-        timer.start()
-
+    def unclaimExpiredRequests(self):
         # cleanup unclaimed builds
         since_last_cleanup = reactor.seconds() - self._last_claim_cleanup 
         if since_last_cleanup < self.RECLAIM_BUILD_INTERVAL:
@@ -763,6 +932,16 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
 
             self._last_claim_cleanup = reactor.seconds()
 
+    _last_unclaimed_brids_set = None
+    @defer.inlineCallbacks
+    def pollDatabaseBuildRequests(self):
+        # deal with cleaning up unclaimed requests, and (if necessary)
+        # requests from a previous instance of this master
+        timer = metrics.Timer("BuildMaster.pollDatabaseBuildRequests()")
+        timer.start()
+
+        yield self.unclaimExpiredRequests()
+
         # _last_unclaimed_brids_set tracks the state of unclaimed build
         # requests; whenever it sees a build request which was not claimed on
         # the last poll, it notifies the subscribers.  It only tracks that
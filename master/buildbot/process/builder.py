@@ -620,6 +620,9 @@ class Builder(config.ReconfigurableServiceMixin,
     def _resubmit_buildreqs(self, out=None, requests=None):
         brids = [br.id for br in requests]
         yield self.master.db.buildrequests.unclaimBuildRequests(brids, results=BEGINNING)
+        # the requests are back in the queue, let the distributor know
+        for br in requests:
+            self.master.buildRequestAdded(br.bsid, br.id, self.name)
         defer.returnValue(out)
 
     def setExpectations(self, progress):
@@ -77,12 +77,15 @@ class BuildRequest(object):
     @ivar id: build request ID
 
     @ivar bsid: ID of the parent buildset
+
+    @ivar selectedSlave: name of the slave the request has to run on, or None
     """
 
     source = None
     sources = None
     submittedAt = None
     brdict = None
+    selectedSlave = None
     checkMerges = True
     retries = 0
 
@@ -104,8 +107,12 @@ class BuildRequest(object):
         def updateRequest(br):
             if 'results' in brdict and brdict['results'] != br.results:
                 br.results = brdict['results']
+            if 'priority' in brdict and brdict['priority'] != br.priority:
+                br.priority = brdict['priority']
             if 'slavepool' in brdict and brdict['slavepool'] != br.slavepool:
                 br.slavepool = brdict['slavepool']
+            if brdict.get('selected_slave') and brdict['selected_slave'] != br.selectedSlave:
+                br.selectedSlave = brdict['selected_slave']
             return br
 
         cache = master.caches.get_cache("BuildRequests", cls._make_br)
@@ -144,6 +151,10 @@ class BuildRequest(object):
 
         buildrequest.properties = properties.Properties.fromDict(buildset_properties)
 
+        # requests submitted before the column existed only have the property
+        buildrequest.selectedSlave = brdict.get('selected_slave') \
+            or buildrequest.properties.getProperty("selected_slave")
+
         # fetch the sourcestamp dictionary
         sslist = yield  master.db.sourcestamps.getSourceStamps(buildset['sourcestampsetid'])
         assert len(sslist) > 0, "Empty sourcestampset: db schema enforces set to exist but cannot enforce a non empty set"
@@ -24,10 +24,12 @@ from buildbot.process import metrics
 from buildbot.process.buildrequest import BuildRequest
 from buildbot.status.results import RESUME, BEGINNING
 from buildbot.db.buildrequests import AlreadyClaimedError, UnsupportedQueueError, Queue
+from buildbot.db import events
 from buildbot.process.builder import Slavepool
 from buildbot import util
-from buildbot.util import lru
 
+import heapq
+import itertools
 import random
 
 def timerLogFinished(msg, timer):
@@ -43,6 +45,156 @@ def timerLogStart(msg, function_name):
     log.msg(msg + " started at %s" % util.epoch2datetime(timer.started))
     return timer
 
+class BuildRequestQueue(object):
+    """
+    Build request dictionaries in the order the distributor should process
+    them: higher priority first, then oldest submitted time.
+
+    The requests are indexed by builder, each builder keeps its requests
+    in a heap so a walk of the queue is a merge of the builders' requests and
+    builders that cannot start builds can be left out of the walk.
+    Requests that are part of a chain (they have a startbrid) are kept
+    apart, those are always visited.
+
+    Removing a request only drops it from the index, the stale entries are
+    skipped by the walks and discarded once there are more of them than
+    requests in the queue.
+
+    Requests that carry their sourcestamps are also indexed by builder and
+    sourcestamps, to find the requests that can be merged together.
+    """
+
+    def __init__(self, brdicts=None):
+        self._brdicts = {}
+        self._builders = {}
+        self._chained = []
+        self._stale = 0
+        self._mergeCandidates = {}
+        self._mergeKeys = {}
+        for brdict in brdicts or []:
+            self.add(brdict)
+
+    @staticmethod
+    def _sortKey(brdict):
+        return -brdict['priority'], brdict['submitted_at'], brdict['brid']
+
+    @staticmethod
+    def _mergeKey(buildername, sourcestamps):
+        # requests are merged when the sourcestamps match exactly
+        return buildername, frozenset((ss['codebase'], ss['branch'], ss['revision']) for ss in sourcestamps)
+
+    def __len__(self):
+        return len(self._brdicts)
+
+    def __contains__(self, brid):
+        return brid in self._brdicts
+
+    def get(self, brid):
+        return self._brdicts.get(brid)
+
+    def add(self, brdict):
+        self.remove(brdict['brid'])
+        self._brdicts[brdict['brid']] = brdict
+        entries = self._chained if brdict.get('startbrid') is not None \
+            else self._builders.setdefault(brdict['buildername'], [])
+        heapq.heappush(entries, (self._sortKey(brdict), brdict))
+        if brdict.get('sourcestamps'):
+            key = self._mergeKey(brdict['buildername'], brdict['sourcestamps'])
+            self._mergeCandidates.setdefault(key, {})[brdict['brid']] = brdict
+            self._mergeKeys[brdict['brid']] = key
+
+    def remove(self, brid):
+        brdict = self._brdicts.pop(brid, None)
+        if brdict is not None:
+            self._stale += 1
+            if self._stale > len(self._brdicts):
+                self._compact()
+        key = self._mergeKeys.pop(brid, None)
+        if key is not None:
+            candidates = self._mergeCandidates[key]
+            del candidates[brid]
+            if not candidates:
+                del self._mergeCandidates[key]
+        return brdict
+
+    def getMergeCandidates(self, buildername, sourcestamps, startbrid=None):
+        """
+        Finds the requests of a builder with the same sourcestamps, requests
+        sharing the sourcestampset of the given sourcestamps are not included.
+
+        @param buildername: name of the builder
+        @param sourcestamps: list of dictionaries with keys sourcestampsetid,
+        codebase, branch and revision
+        @param startbrid: only include requests that belong to this build chain
+        @returns: list of build request dictionaries in queue order
+        """
+        candidates = self._mergeCandidates.get(self._mergeKey(buildername, sourcestamps), {})
+        sourcestampsetids = set(ss['sourcestampsetid'] for ss in sourcestamps)
+        brdicts = [brdict for brdict in candidates.itervalues()
+                   if (startbrid is None or brdict['startbrid'] == startbrid)
+                   and brdict['sourcestamps'][0]['sourcestampsetid'] not in sourcestampsetids]
+        brdicts.sort(key=self._sortKey)
+        return brdicts
+
+    def _isValid(self, entry):
+        brdict = entry[1]
+        return self._brdicts.get(brdict['brid']) is brdict
+
+    def _compact(self):
+        # the heaps are replaced rather than changed, the walks in progress
+        # go on with the old ones
+        self._chained = filter(self._isValid, self._chained)
+        heapq.heapify(self._chained)
+        for buildername, entries in self._builders.items():
+            entries = filter(self._isValid, entries)
+            if entries:
+                heapq.heapify(entries)
+                self._builders[buildername] = entries
+            else:
+                del self._builders[buildername]
+        self._stale = 0
+
+    def _walkEntries(self, entries, skipBuilder=None, buildername=None):
+        # visits the heap in order without changing it, by keeping the
+        # entries whose parents were visited in a second heap; a request
+        # added meanwhile moves the entries, the walk then starts again
+        # from the root and skips the entries it already went past
+        last = None
+        while True:
+            size = len(entries)
+            frontier = [(entries[0], 0)] if entries else []
+            while frontier:
+                if skipBuilder and skipBuilder(buildername):
+                    return
+                entry, i = heapq.heappop(frontier)
+                for child in (2*i + 1, 2*i + 2):
+                    if child < size:
+                        heapq.heappush(frontier, (entries[child], child))
+                if last is not None and entry[0] <= last:
+                    continue
+                if self._isValid(entry):
+                    last = entry[0]
+                    yield entry
+                    if len(entries) != size:
+                        break
+            else:
+                return
+
+    def walk(self, skipBuilder=None):
+        """
+        Iterates the requests in the queue, the requests are not removed.
+
+        @param skipBuilder: callable that receives a builder name and returns
+        True if the remaining requests of the builder should not be visited,
+        it is checked before visiting each request.
+        """
+        iterables = [self._walkEntries(self._chained)]
+        iterables += [self._walkEntries(entries, skipBuilder, buildername)
+                      for buildername, entries in self._builders.iteritems()]
+        for _, brdict in heapq.merge(*iterables):
+            yield brdict
+
+
 class BuildChooserBase(object):
     #
     # WARNING: This API is experimental and in active development. 
@@ -117,6 +269,14 @@ class BuildChooserBase(object):
             self.unclaimedBrdicts = brdicts
         defer.returnValue(self.unclaimedBrdicts)
 
+    @defer.inlineCallbacks
+    def claimBuildRequestGroups(self, breqsGroups):
+        brids_groups = [[br.id for br in breqs] for breqs in breqsGroups]
+        yield self.master.db.buildrequests.claimBuildRequestGroups(brids_groups)
+        for brids in brids_groups:
+            if len(brids) > 1:
+                log.msg("merge pending buildrequest %s with %s " % (brids[0], brids[1:]))
+
     @defer.inlineCallbacks
     def claimBuildRequests(self, breqs):
         brids = [br.id for br in breqs]
@@ -360,6 +520,12 @@ class BasicBuildChooser(BuildChooserBase):
 
 class KatanaBuildChooser(BasicBuildChooser):
 
+    # how often (in seconds) the queues are fully reloaded from the db, in
+    # between the queues are updated incrementally from the master's events
+    RECONCILE_QUEUE_INTERVAL = 60
+    # number of build requests fetched per query when loading the queues
+    QUEUE_PAGE_SIZE = 500
+
     def __init__(self, builders, master):
         # By default katana  merges Requests
         self.bldr = None
@@ -367,10 +533,93 @@ class KatanaBuildChooser(BasicBuildChooser):
         self.initializeBreqCache()
         self.builders = builders
         self.initializeBuildRequestQueue()
+        self.releaseReservations()
 
     def initializeBuildRequestQueue(self):
-        self.unclaimedBrdicts = None
-        self.resumeBrdicts = None
+        # forces a full reload of the queues the next time they are used
+        self.buildRequestQueues = {Queue.unclaimed: None, Queue.resume: None}
+        self.reconciledAt = {Queue.unclaimed: None, Queue.resume: None}
+        self.addedBrids = {Queue.unclaimed: set(), Queue.resume: set()}
+        self.parkedBrdicts = []
+        # builder name -> {slavepool: time} of the slavepools found with no idle slaves
+        self.unavailableSlavepools = {}
+        # (builder name, startbrid) -> (brdict or None, time) of the finished
+        # requests found in each build chain
+        self.finishedBuildRequests = {}
+
+    def buildRequestAdded(self, brid):
+        # the request will be fetched the next time the queue is used,
+        # it may be a new request or a request waiting to be resumed
+        for queue in self.addedBrids:
+            self.addedBrids[queue].add(brid)
+
+    def buildRequestRemoved(self, brid):
+        # the request was claimed, merged, completed or cancelled
+        self.breqCache.remove(brid)
+        for queue in self.addedBrids:
+            self.addedBrids[queue].discard(brid)
+        for buildrequestQueue in self.buildRequestQueues.itervalues():
+            if buildrequestQueue is not None:
+                buildrequestQueue.remove(brid)
+
+    def restoreParkedBuildRequests(self):
+        # requests that failed too many times are given another chance
+        # once the queue has been processed
+        for queue, brdict in self.parkedBrdicts:
+            buildrequestQueue = self.buildRequestQueues[queue]
+            if buildrequestQueue is not None and brdict['brid'] not in buildrequestQueue:
+                buildrequestQueue.add(brdict)
+        self.parkedBrdicts = []
+
+    def slavepoolIsUnavailable(self, buildername, slavepool):
+        markedAt = self.unavailableSlavepools.get(buildername, {}).get(slavepool)
+        return markedAt is not None and util.now() - markedAt < self.RECONCILE_QUEUE_INTERVAL
+
+    def slavepoolUnavailable(self, bldr, slavepool):
+        """
+        Remember that the slavepool of the builder has no idle slaves, so its
+        requests are skipped without being fetched.
+
+        This stands in for an index of the idle slaves of each builder: the
+        mark is dropped by L{slavesAvailabilityChanged}, which every
+        L{maybeStartBuildsOn} call reaches.  The slaves freed by attaching,
+        finishing a build, releasing a lock or being unpaused all go through
+        L{BotMaster.maybeStartBuildsForSlave}, which calls it for the builders
+        of the slave.  A slave freed any other way (e.g. a
+        L{BuildSlave.canStartBuild} override that changes its mind without
+        calling L{BotMaster.maybeStartBuildsForSlave}) is ignored for up to
+        RECONCILE_QUEUE_INTERVAL seconds, when the mark expires.
+        """
+        # without startSlavenames both slavepools use the same slaves
+        slavepools = [slavepool] if bldr.config.startSlavenames \
+            else [Slavepool.startSlavenames, Slavepool.slavenames]
+        markedAt = util.now()
+        for pool in slavepools:
+            self.unavailableSlavepools.setdefault(bldr.name, {})[pool] = markedAt
+
+    def slavesAvailabilityChanged(self, buildernames):
+        # slaves attached, finished a build or released a lock, the builders
+        # need to be checked again
+        for buildername in buildernames:
+            self.unavailableSlavepools.pop(buildername, None)
+        # a build may have finished, chains without a finished request are checked again
+        for key, (finished_br, _) in self.finishedBuildRequests.items():
+            if key[0] in buildernames and finished_br is None:
+                del self.finishedBuildRequests[key]
+
+    def reserveBuildRequests(self, breqs, slavebuilder=None):
+        # while builds are started in batch the slaves and requests already
+        # selected are not picked up again until the reservations are released
+        if slavebuilder is not None:
+            self.reservedSlaves.add(slavebuilder.slave)
+        self.reservedBrids.update(br.id for br in breqs)
+
+    def releaseReservations(self):
+        self.reservedSlaves = set()
+        self.reservedBrids = set()
+
+    def slaveIsReserved(self, slavebuilder):
+        return slavebuilder is not None and slavebuilder.slave in self.reservedSlaves
 
     def setupNextBuildRequest(self, bldr, breq):
         self.bldr = bldr
@@ -388,8 +637,23 @@ class KatanaBuildChooser(BasicBuildChooser):
         self.nextBreq = breq
 
     def initializeBreqCache(self):
-        self.breqCache = lru.AsyncLRUCache(BuildRequest.fromBrdict, 6000)
-        self.breqCache.fn_uses_key = False
+        # the BuildRequest objects are kept across activity loops, the size of
+        # the cache is configured with c['caches']['BuildRequests']
+        self.breqCache = self.master.caches.get_cache("BuildRequests", BuildRequest._make_br)
+        self.mergeCheckedBreqs = []
+
+    def resetMergeChecks(self):
+        # requests checked in this activity loop can be merged with the
+        # builds started since then, they are checked again in the next loop
+        for breq in self.mergeCheckedBreqs:
+            breq.checkMerges = True
+        self.mergeCheckedBreqs = []
+
+    def reportBreqCacheMetrics(self):
+        metrics.MetricCountEvent.log("KatanaBuildChooser.breqCache.hits", self.breqCache.hits, absolute=True)
+        metrics.MetricCountEvent.log("KatanaBuildChooser.breqCache.refhits", self.breqCache.refhits, absolute=True)
+        metrics.MetricCountEvent.log("KatanaBuildChooser.breqCache.misses", self.breqCache.misses, absolute=True)
+        metrics.MetricCountEvent.log("KatanaBuildChooser.breqCache.size", len(self.breqCache.keys()), absolute=True)
 
     def cleanupNextBuildRequest(self):
         self.bldr = None
@@ -410,11 +674,7 @@ class KatanaBuildChooser(BasicBuildChooser):
         # reset the checkMerges in case the breq still in the master cache
         breq.checkMerges = True
         breq.retries = 0
-        if self.unclaimedBrdicts and breq.brdict and breq.brdict in self.unclaimedBrdicts:
-            self.unclaimedBrdicts.remove(breq.brdict)
-        if self.resumeBrdicts and breq.brdict and breq.brdict in self.resumeBrdicts:
-            self.resumeBrdicts.remove(breq.brdict)
-        self.breqCache.remove(breq.id)
+        self.buildRequestRemoved(breq.id)
 
     def removeBuildRequests(self, breqs):
         # Remove a BuildrRequest object (and its brdict)
@@ -429,6 +689,10 @@ class KatanaBuildChooser(BasicBuildChooser):
         if self.nextBreq.retries > 4:
             msg = "Katana failed to process buildrequest.id %s after %d retries, " \
                   "Katana will retry after the queue is proccessed " % (self.nextBreq.id, self.nextBreq.retries)
+            for queue, buildrequestQueue in self.buildRequestQueues.iteritems():
+                brdict = buildrequestQueue.get(self.nextBreq.id) if buildrequestQueue is not None else None
+                if brdict is not None:
+                    self.parkedBrdicts.append((queue, brdict))
             self.removeBuildRequest(self.nextBreq)
         log.msg(msg)
 
@@ -438,25 +702,65 @@ class KatanaBuildChooser(BasicBuildChooser):
         # for API like 'nextBuild', which operate on BuildRequest objects.
         timer = timerLogStart("_getBuildRequestForBrdict starting",
                               function_name="KatanaBuildChooser._getBuildRequestForBrdict")
-        breq = yield self.breqCache.get(brdict['brid'], master=self.master, brdict=brdict)
+        breq = yield BuildRequest.fromBrdict(self.master, brdict)
         breq.brdict = brdict
         timerLogFinished(msg="_getBuildRequestForBrdict finished", timer=timer)
         defer.returnValue(breq)
 
+    def _queueNeedsReconciliation(self, queue):
+        return self.buildRequestQueues[queue] is None or \
+               util.now() - self.reconciledAt[queue] >= self.RECONCILE_QUEUE_INTERVAL
+
+    @defer.inlineCallbacks
+    def _loadBuildRequestsQueue(self, queue):
+        # page through the queue so a big backlog doesn't
+        # turn into a single huge query
+        buildrequestQueue = BuildRequestQueue()
+        brdicts = yield self.master.db.buildrequests.getBuildRequestsInQueue(queue=queue,
+                                                                             limit=self.QUEUE_PAGE_SIZE)
+        while brdicts:
+            yield self._addBuildRequestsToQueue(buildrequestQueue, brdicts)
+
+            if len(brdicts) < self.QUEUE_PAGE_SIZE:
+                break
+
+            brdicts = yield self.master.db.buildrequests.getBuildRequestsInQueue(queue=queue,
+                                                                                 limit=self.QUEUE_PAGE_SIZE,
+                                                                                 after=brdicts[-1])
+        defer.returnValue(buildrequestQueue)
+
     @defer.inlineCallbacks
     def _getBuildRequestsQueue(self, queue):
-        if queue == Queue.unclaimed:
-            if self.unclaimedBrdicts is None:
-                self.unclaimedBrdicts = yield self.master.db.buildrequests\
-                    .getBuildRequestsInQueue(queue=queue)
-            defer.returnValue(self.unclaimedBrdicts)
-            return
+        if queue not in self.buildRequestQueues:
+            raise UnsupportedQueueError
+
+        if self._queueNeedsReconciliation(queue):
+            self.addedBrids[queue] = set()
+            self.reconciledAt[queue] = util.now()
+            self.buildRequestQueues[queue] = yield self._loadBuildRequestsQueue(queue)
+
+        elif self.addedBrids[queue]:
+            brids, self.addedBrids[queue] = list(self.addedBrids[queue]), set()
+            # we'll need to batch the brids into groups of 100, so that the
+            # parameter lists supported by the DBAPI aren't exhausted
+            iterator = iter(brids)
+            batch = list(itertools.islice(iterator, 100))
+            while batch:
+                brdicts = yield self.master.db.buildrequests.getBuildRequestsInQueue(queue=queue,
+                                                                                     brids=batch,
+                                                                                     order=False)
+                yield self._addBuildRequestsToQueue(self.buildRequestQueues[queue], brdicts)
+                batch = list(itertools.islice(iterator, 100))
+
+        defer.returnValue(self.buildRequestQueues[queue])
 
-        if queue == Queue.resume:
-            if self.resumeBrdicts is None:
-                self.resumeBrdicts = yield self.master.db.buildrequests\
-                    .getBuildRequestsInQueue(queue=queue)
-            defer.returnValue(self.resumeBrdicts)
+    @defer.inlineCallbacks
+    def _addBuildRequestsToQueue(self, buildrequestQueue, brdicts):
+        # the sourcestamps index the requests by merge compatibility
+        sourcestamps = yield self.master.db.buildrequests.getBuildRequestsSourceStamps([br['brid'] for br in brdicts])
+        for brdict in brdicts:
+            brdict['sourcestamps'] = sourcestamps.get(brdict['brid'], [])
+            buildrequestQueue.add(brdict)
 
     # Katana's gets the next priority builder from the DB instead of keeping a local list
     @defer.inlineCallbacks
@@ -472,15 +776,34 @@ class KatanaBuildChooser(BasicBuildChooser):
         it will select only builds pending to be resume
         @returns: a build request dictionary or None via Deferred
         """
-        unavailableBuilderNames = []
-        builderSlavepool = {}
-
-        # TODO: For performance reasons we may need to limit the searches but  we need to load test it first
         buildrequestQueue = yield self._getBuildRequestsQueue(queue)
 
         log.msg("getNextPriorityBuilder found %d buildrequests in the '%s' Queue" % (len(buildrequestQueue), queue))
 
-        for br in buildrequestQueue:
+        builderSlavepool = {}
+
+        def getSlavepool(br):
+            if queue == Queue.unclaimed:
+                return Slavepool.startSlavenames
+            elif queue == Queue.resume and br['slavepool']:
+                return br['slavepool']
+            return Slavepool.slavenames
+
+        def skipBuilder(buildername):
+            # a builder with no idle slaves is left out of the walk,
+            # unless its requests could be merged with a running build
+            bldr = self.builders.get(buildername)
+            if not bldr or bldr.building:
+                return False
+            slavepools = [Slavepool.startSlavenames] if queue == Queue.unclaimed \
+                else [Slavepool.startSlavenames, Slavepool.slavenames]
+            return all(self.slavepoolIsUnavailable(buildername, slavepool) for slavepool in slavepools)
+
+        # requests stay in the queue until they are claimed, merged or cancelled
+        for br in buildrequestQueue.walk(skipBuilder=skipBuilder):
+            if br['brid'] in self.reservedBrids:
+                continue
+
             buildername = br['buildername']
 
             bldr = self.builders.get(buildername)
@@ -493,7 +816,9 @@ class KatanaBuildChooser(BasicBuildChooser):
                 log.msg("BuildRequest %d uses builder %s with no configuration" % (br['brid'], buildername))
                 continue
 
-            if buildername in unavailableBuilderNames and not bldr.building and br['startbrid'] is None:
+            slavepool = getSlavepool(br)
+
+            if self.slavepoolIsUnavailable(buildername, slavepool) and not bldr.building and br['startbrid'] is None:
                 continue
 
             breq = yield self._getBuildRequestForBrdict(br)
@@ -502,26 +827,21 @@ class KatanaBuildChooser(BasicBuildChooser):
             if breq.checkMerges and (yield self.mergeCompatibleBuildRequests(breq, queue)):
                 continue
 
-            def getSlavepool():
-                if queue == Queue.unclaimed:
-                    return Slavepool.startSlavenames
-                elif queue == Queue.resume and br['slavepool']:
-                    return br['slavepool']
-                return Slavepool.slavenames
-
-            slavepool = getSlavepool()
-
-            if buildername not in builderSlavepool:
-                builderSlavepool[buildername] = bldr.getAvailableSlavesToProcessBuildRequests(slavepool=slavepool)
+            if (buildername, slavepool) not in builderSlavepool:
+                availableSlaves = bldr.getAvailableSlavesToProcessBuildRequests(slavepool=slavepool)
+                if not availableSlaves:
+                    self.slavepoolUnavailable(bldr, slavepool)
+                # slaves reserved for the builds being started in batch are not available
+                builderSlavepool[(buildername, slavepool)] = [sb for sb in availableSlaves
+                                                              if not self.slaveIsReserved(sb)]
 
-            if not builderSlavepool[buildername]:
-                unavailableBuilderNames.append(buildername)
+            if not builderSlavepool[(buildername, slavepool)]:
                 log.msg("No idle slaves found in '%s' list to process buildrequest.id %d for builder %s"
                         % (slavepool, br['brid'], buildername))
 
                 continue
 
-            self.slavepool = builderSlavepool[buildername]
+            self.slavepool = builderSlavepool[(buildername, slavepool)]
 
             buildRequestShouldUseSelectedSlave = "selected_slave" in br and br["selected_slave"] \
                                                  and br['results'] == BEGINNING and bldr.shouldUseSelectedSlave()
@@ -531,7 +851,8 @@ class KatanaBuildChooser(BasicBuildChooser):
                                                          and br['slavepool'] != Slavepool.startSlavenames
 
             if buildRequestShouldUseSelectedSlave or resumingBuildRequestShouldUseSelectedSlave:
-                if bldr.slaveIsAvailable(slavename=br["selected_slave"]):
+                if bldr.slaveIsAvailable(slavename=br["selected_slave"]) \
+                        and not self.slaveIsReserved(bldr.getSlaveBuilder(br["selected_slave"])):
                     defer.returnValue(breq)
                     return
 
@@ -553,7 +874,7 @@ class KatanaBuildChooser(BasicBuildChooser):
         """
         if self.buildRequestHasSelectedSlave(breq):
             for sb in self.bldr.slaves:
-                if sb.slave.slave_status.getName() == breq.properties.getProperty("selected_slave"):
+                if sb.slave.slave_status.getName() == breq.selectedSlave:
                     return sb
         return None
 
@@ -562,7 +883,7 @@ class KatanaBuildChooser(BasicBuildChooser):
         Does the build request have a specified slave?
         """
 
-        return breq.properties.hasProperty("selected_slave")
+        return breq.selectedSlave is not None
 
     @defer.inlineCallbacks
     def buildHasSelectedSlave(self, breq):
@@ -591,8 +912,7 @@ class KatanaBuildChooser(BasicBuildChooser):
         brids = [breq.id for breq in breqs]
         brdicts = yield self.master.db.buildrequests.getBuildRequestsInQueue(queue=queue,
                                                                              buildername=self.bldr.name,
-                                                                             mergebrids=brids,
-                                                                             order=False)
+                                                                             mergebrids=brids)
         merged_breqs = yield defer.gatherResults([self._getBuildRequestForBrdict(brdict)
                                                   for brdict in brdicts])
         defer.returnValue(breqs + merged_breqs)
@@ -601,16 +921,23 @@ class KatanaBuildChooser(BasicBuildChooser):
     def mergeRequests(self, breq, queue, startbrid=None):
         mergedRequests = [breq]
 
-        sourcestamps = []
-        for ss in breq.sources.itervalues():
-            sourcestamps.append({'b_codebase': ss.codebase, 'b_revision': ss.revision,
-                                 'b_branch': ss.branch, 'b_sourcestampsetid': ss.sourcestampsetid})
+        buildrequestQueue = self.buildRequestQueues.get(queue)
+        if buildrequestQueue is not None:
+            sourcestamps = [dict(sourcestampsetid=ss.sourcestampsetid, codebase=ss.codebase,
+                                 branch=ss.branch, revision=ss.revision)
+                            for ss in breq.sources.itervalues()]
+            brdicts = buildrequestQueue.getMergeCandidates(self.bldr.name, sourcestamps, startbrid=startbrid)
+        else:
+            sourcestamps = []
+            for ss in breq.sources.itervalues():
+                sourcestamps.append({'b_codebase': ss.codebase, 'b_revision': ss.revision,
+                                     'b_branch': ss.branch, 'b_sourcestampsetid': ss.sourcestampsetid})
 
-        brdicts = yield self.master.db.buildrequests.getBuildRequestsInQueue(queue=queue,
-                                                                             buildername=self.bldr.name,
-                                                                             sourcestamps=sourcestamps,
-                                                                             startbrid=startbrid,
-                                                                             order=False)
+            brdicts = yield self.master.db.buildrequests.getBuildRequestsInQueue(queue=queue,
+                                                                                 buildername=self.bldr.name,
+                                                                                 sourcestamps=sourcestamps,
+                                                                                 startbrid=startbrid,
+                                                                                 order=False)
 
         for brdict in brdicts:
             req = yield self._getBuildRequestForBrdict(brdict)
@@ -620,6 +947,22 @@ class KatanaBuildChooser(BasicBuildChooser):
 
         defer.returnValue(mergedRequests)
 
+    @defer.inlineCallbacks
+    def findCompatibleFinishedBuildRequest(self, startbrid):
+        # a request that finished stays finished, requests of chains that
+        # have none are checked again when the builder finishes a build
+        key = (self.bldr.name, startbrid)
+        finished_br, checkedAt = self.finishedBuildRequests.get(key, (None, None))
+        if checkedAt is None or util.now() - checkedAt >= self.RECONCILE_QUEUE_INTERVAL:
+            finished_br = yield self.master.db.buildrequests.findCompatibleFinishedBuildRequest(self.bldr.name,
+                                                                                                startbrid)
+            self.finishedBuildRequests[key] = (finished_br, util.now())
+        defer.returnValue(finished_br)
+
+    def canMergeWithBuildingRequests(self, breq):
+        return any(not b.finished and self.mergeRequestsFn(self.bldr, b.requests[0], breq)
+                   for b in self.bldr.building)
+
     @defer.inlineCallbacks
     def chooseNextBuildToResume(self):
         slave, breq = yield self.popNextBuildToResume()
@@ -739,10 +1082,11 @@ class KatanaBuildChooser(BasicBuildChooser):
 
         def mergeCheckFinished():
             breq.checkMerges = False
+            self.mergeCheckedBreqs.append(breq)
             timerLogFinished(msg="mergeCompatibleBuildRequests finished", timer=timer)
 
         # 2. try merge this build with a compatible running build
-        if breq and self.bldr.building:
+        if breq and self.bldr.building and self.canMergeWithBuildingRequests(breq):
             breqs = yield self.mergeRequests(breq, queue=queue)
             totalBreqs = yield self.fetchPreviouslyMergedBuildRequests(breqs, queue=queue)
             brids = [br.id for br in totalBreqs]
@@ -764,8 +1108,7 @@ class KatanaBuildChooser(BasicBuildChooser):
         # 3. try merge with compatible finished build in the same chain
         if breq and breq.buildChainID and breq.buildChainID != breq.id:
             #check if can be merged with finished build
-            finished_br = yield self.master.db.buildrequests\
-                .findCompatibleFinishedBuildRequest(self.bldr.name, breq.buildChainID)
+            finished_br = yield self.findCompatibleFinishedBuildRequest(breq.buildChainID)
 
             finishedBreq = yield self._getBuildRequestForBrdict(finished_br) if finished_br else None
 
@@ -1092,9 +1435,34 @@ class KatanaBuildRequestDistributor(service.Service):
         self.check_new_builds = True
         self.check_resume_builds = True
         self.katanaBuildChooser = self.createBuildChooser(builders=self.botmaster.builders, master=self.master)
+        self.buildrequest_sub = None
+        self.cancelled_buildrequest_sub = None
+        self.master_event_sub = None
+
+    def startService(self):
+        service.Service.startService(self)
+        # keep the chooser's queues up to date in between reconciliations
+        self.buildrequest_sub = \
+            self.master.subscribeToBuildRequests(self._buildRequestAdded)
+        self.cancelled_buildrequest_sub = \
+            self.master.subscribeToCancelledBuildRequests(self._buildRequestRemoved)
+        self.master_event_sub = \
+            self.master.subscribeToMasterEvents(self._masterEvent)
 
     @defer.inlineCallbacks
     def stopService(self):
+        if self.buildrequest_sub:
+            self.buildrequest_sub.unsubscribe()
+            self.buildrequest_sub = None
+
+        if self.cancelled_buildrequest_sub:
+            self.cancelled_buildrequest_sub.unsubscribe()
+            self.cancelled_buildrequest_sub = None
+
+        if self.master_event_sub:
+            self.master_event_sub.unsubscribe()
+            self.master_event_sub = None
+
         # Lots of stuff happens asynchronously here, so we need to let it all
         # quiesce.  First, let the parent stopService succeed between
         # activities; then the loop will stop calling itself, since
@@ -1116,6 +1484,8 @@ class KatanaBuildRequestDistributor(service.Service):
         @param new_builders: names of new builders that should be given the
         opportunity to check for new requests.
         """
+        self.katanaBuildChooser.slavesAvailabilityChanged(new_builders)
+
         if not self.running or not self.master.config.builders:
             return
 
@@ -1141,7 +1511,22 @@ class KatanaBuildRequestDistributor(service.Service):
     def _checkBuildRequests(self):
         self.check_new_builds = True
         self.check_resume_builds = True
-        self.katanaBuildChooser.initializeBuildRequestQueue()
+
+    def _buildRequestAdded(self, notif):
+        self.katanaBuildChooser.buildRequestAdded(notif['brid'])
+        self._checkBuildRequests()
+
+    def _buildRequestRemoved(self, notif):
+        self.katanaBuildChooser.buildRequestRemoved(notif['brid'])
+
+    def _masterEvent(self, evdict):
+        # the requests claimed by other masters leave the unclaimed queue, the
+        # claims of this master are handled when they are made, and its
+        # resumed requests are claimed again
+        if evdict['event'] == events.BUILDREQUEST_COMPLETED \
+                or (evdict['event'] == events.BUILDREQUEST_CLAIMED
+                    and evdict['masterid'] != self.master.db.events.masterid):
+            self.katanaBuildChooser.buildRequestRemoved(evdict['objectid'])
 
     @defer.inlineCallbacks
     def _selectNextBuildRequest(self, queue, asyncFunc):
@@ -1189,9 +1574,13 @@ class KatanaBuildRequestDistributor(service.Service):
 
             # continue checking new builds if we have pending builders
             if self.check_new_builds:
-                nextBuilder = yield self._selectNextBuildRequest(queue=Queue.unclaimed,
-                                                                 asyncFunc=self._maybeStartBuildsOnBuilder)
-                self.check_new_builds = nextBuilder is not None
+                batchSize = self.master.config.buildStartBatchSize
+                if batchSize > 1:
+                    self.check_new_builds = yield self._maybeStartBuildsOnBuilders(batchSize)
+                else:
+                    nextBuilder = yield self._selectNextBuildRequest(queue=Queue.unclaimed,
+                                                                     asyncFunc=self._maybeStartBuildsOnBuilder)
+                    self.check_new_builds = nextBuilder is not None
 
             # continue checking resume builds if we have pending builders to resume
             if  self.check_resume_builds:
@@ -1202,7 +1591,9 @@ class KatanaBuildRequestDistributor(service.Service):
             self.activity_lock.release()
 
         timerLogFinished(msg="KatanaBuildRequestDistributor._procesBuildRequestsActivityLoop finished", timer=timer)
-        self.katanaBuildChooser.initializeBreqCache()
+        self.katanaBuildChooser.restoreParkedBuildRequests()
+        self.katanaBuildChooser.resetMergeChecks()
+        self.katanaBuildChooser.reportBreqCacheMetrics()
         self._quiet()
 
     def logResumeOrStartBuildStatus(self, msg, slave, breqs):
@@ -1265,6 +1656,100 @@ class KatanaBuildRequestDistributor(service.Service):
         self.logResumeOrStartBuildStatus(msg, slave, breqs)
         defer.returnValue(buildStarted)
 
+    @defer.inlineCallbacks
+    def _selectBuildsToStart(self, batchSize):
+        # pick up to batchSize (slave, breqs, bldr) builds, each one on a different slave
+        chooser = self.katanaBuildChooser
+        builds = []
+        selected = False
+        while len(builds) < batchSize:
+            breq = yield chooser.getNextPriorityBuilder(queue=Queue.unclaimed)
+            if breq is None:
+                break
+            selected = True
+
+            slave, breqs = yield chooser.chooseNextBuild()
+            if not slave or not breqs:
+                chooser.retryBuildRequest()
+                chooser.reserveBuildRequests([breq])
+                continue
+
+            # requests already merged with another build of this batch
+            breqs = breqs[:1] + [br for br in breqs[1:] if br.id not in chooser.reservedBrids]
+            chooser.reserveBuildRequests(breqs, slavebuilder=slave)
+            builds.append((slave, breqs, chooser.bldr))
+
+        defer.returnValue((selected, builds))
+
+    @defer.inlineCallbacks
+    def _claimBuildsToStart(self, builds):
+        chooser = self.katanaBuildChooser
+        try:
+            yield chooser.claimBuildRequestGroups([breqs for _, breqs, _ in builds])
+            defer.returnValue(builds)
+            return
+        except AlreadyClaimedError:
+            log.msg("KatanaBuildRequestDistributor could not claim %d builds at once, claiming them one by one"
+                    % len(builds))
+
+        claimed = []
+        for slave, breqs, bldr in builds:
+            try:
+                yield chooser.claimBuildRequests(breqs)
+                claimed.append((slave, breqs, bldr))
+            except AlreadyClaimedError:
+                # claimed by another master, or merged while selecting the builds
+                chooser.removeBuildRequests(breqs)
+        defer.returnValue(claimed)
+
+    @defer.inlineCallbacks
+    def _startBuild(self, slave, breqs, bldr):
+        try:
+            buildStarted = yield bldr.maybeStartBuild(slave, breqs)
+        except Exception:
+            log.err(Failure(), "while starting build for builder '%s'" % bldr.name)
+            buildStarted = False
+
+        msg = "_maybeStartNewBuildsOnBuilders is starting build"
+
+        if not buildStarted:
+            yield self.master.db.buildrequests.unclaimBuildRequests([br.id for br in breqs])
+            self.botmaster.maybeStartBuildsForBuilder(bldr.name)
+            msg = "_maybeStartNewBuildsOnBuilders could not start build"
+        else:
+            self.katanaBuildChooser.removeBuildRequests(breqs)
+
+        self.logResumeOrStartBuildStatus(msg, slave, breqs)
+        defer.returnValue(buildStarted)
+
+    @defer.inlineCallbacks
+    def _maybeStartBuildsOnBuilders(self, batchSize):
+        """
+        Selects up to batchSize unclaimed build requests, each one on a different
+        slave, claims all of them in a single transaction and starts the builds
+        concurrently.
+
+        @returns: True if any build request was selected, via Deferred
+        """
+        timer = timerLogStart(msg="_maybeStartBuildsOnBuilders starting",
+                              function_name="KatanaBuildRequestDistributor._maybeStartBuildsOnBuilders()")
+        selected = False
+        try:
+            selected, builds = yield self._selectBuildsToStart(batchSize)
+            if builds:
+                builds = yield self._claimBuildsToStart(builds)
+                yield defer.gatherResults([self._startBuild(slave, breqs, bldr) for slave, breqs, bldr in builds],
+                                          consumeErrors=True)
+        except Exception:
+            self.katanaBuildChooser.initializeBuildRequestQueue()
+            log.err(Failure(), "from _maybeStartBuildsOnBuilders")
+        finally:
+            self.katanaBuildChooser.releaseReservations()
+            self.katanaBuildChooser.cleanupNextBuildRequest()
+
+        timerLogFinished(msg="_maybeStartBuildsOnBuilders finished", timer=timer)
+        defer.returnValue(selected)
+
     def createBuildChooser(self, builders, master):
         # just instantiate the build chooser requested
         return self.BuildChooser(builders, master)
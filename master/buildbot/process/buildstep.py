@@ -26,6 +26,7 @@ from twisted.python.reflect import accumulateClassList
 
 from buildbot import interfaces, util, config
 from buildbot.status import progress
+from buildbot.status.logfile import STDOUT, STDERR, HEADER
 from buildbot.status.results import SUCCESS, WARNINGS, FAILURE, SKIPPED, \
      EXCEPTION, RETRY, INTERRUPTED, worst_status
 from buildbot.process import metrics, properties
@@ -235,6 +236,26 @@ class RemoteCommand(pb.Referenceable):
         else:
             log.msg("%s.addToLog: no such log %s" % (self, logname))
 
+    def addSegments(self, segments):
+        # the stdio segments are added to the stdio log in a single call
+        entries = []
+        for logname, data in segments:
+            if logname == 'stdout':
+                entries.append((STDOUT, data))
+            elif logname == 'stderr':
+                entries.append((STDERR, data))
+            elif logname == 'header':
+                entries.append((HEADER, data))
+            else:
+                # ('log', logname)
+                self.addToLog(logname[1], data)
+        if self.collectStdout:
+            self.stdout += "".join([d for c, d in entries if c == STDOUT])
+        if self.collectStderr:
+            self.stderr += "".join([d for c, d in entries if c == STDERR])
+        if entries and 'stdio' in self.logs:
+            self.logs['stdio'].addEntries(entries)
+
     @metrics.countMethod('RemoteCommand.remoteUpdate()')
     def remoteUpdate(self, update):
         if self.debug:
@@ -253,6 +274,10 @@ class RemoteCommand(pb.Referenceable):
             # 'log': (logname, data)
             logname, data = update['log']
             self.addToLog(logname, data)
+        if update.has_key('segments'):
+            # 'segments': [(logname, data), ...], in output order, where
+            # logname is 'stdout', 'stderr', 'header' or ('log', logname)
+            self.addSegments(update['segments'])
         if update.has_key('rc'):
             rc = self.rc = update['rc']
             log.msg("%s rc=%s" % (self, rc))
@@ -262,7 +287,7 @@ class RemoteCommand(pb.Referenceable):
 
         # TODO: these should be handled at the RemoteCommand level
         for k in update:
-            if k not in ('stdout', 'stderr', 'header', 'rc'):
+            if k not in ('stdout', 'stderr', 'header', 'rc', 'segments'):
                 if k not in self.updates:
                     self.updates[k] = []
                 self.updates[k].append(update[k])
@@ -405,6 +430,10 @@ class RemoteShellCommand(RemoteCommand):
                 self.step.slaveVersionIsOlderThan("shell", "2.16")):
             m = "slave does not support the 'user' parameter"
             raise BuildSlaveTooOldError(m)
+        if (self.remote_command == "shell" and
+                not self.step.slaveVersionIsOlderThan("shell", "2.17")):
+            # the output comes in ordered segments, see addSegments
+            self.args['log_segments'] = True
         what = "command '%s' in dir '%s'" % (self.args['command'],
                                              self.args['workdir'])
         log.msg(what)
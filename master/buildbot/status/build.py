@@ -15,10 +15,9 @@
 
 from __future__ import with_statement
 
-import os, shutil, re
-from cPickle import dump
+import re
 from zope.interface import implements
-from twisted.python import log, runtime, components
+from twisted.python import log, components
 from twisted.persisted import styles
 from twisted.internet import reactor, defer, threads
 from buildbot import interfaces, util, sourcestamp
@@ -32,7 +31,106 @@ TriggerType = "<class 'buildbot.steps.trigger.Trigger'>"
 AcquireBuildLocksType = "<class 'buildbot.steps.artifact.AcquireBuildLocks'>"
 
 
-class BuildStatus(styles.Versioned, properties.PropertiesMixin):
+class BuildDictMixin:
+    """Builds the base JSON dictionary of a build, shared by L{BuildStatus}
+    and L{BuildSummary}."""
+
+    def currentStepDict(self, dict):
+        if self.getCurrentStep():
+            dict['currentStep'] = self.getCurrentStep().asDict()
+
+            step_type = self.getCurrentStep().getStepType()
+            if step_type == str(AcquireBuildLocksType) or step_type == str(TriggerType):
+                dict['isWaiting'] = True
+        else:
+            dict['currentStep'] = None
+
+        return dict
+
+    def asBaseDict(self, request=None, include_current_step=False, include_artifacts=False, include_failure_url=False):
+        from buildbot.status.web.base import getCodebasesArg
+
+        result = {}
+        sourcestamps = self.getSourceStamps()
+        status = self.master.status
+        args = getCodebasesArg(request, sourcestamps=sourcestamps)
+
+        # Constant
+        result['builderName'] = self.builder.name
+        result['builderFriendlyName'] = self.builder.getFriendlyName()
+        result['number'] = self.getNumber()
+        result['reason'] = self.getReason()
+        result['submittedTime'] = self.submitted
+        result['owners'] = self.owners
+        result['brids'] = self.brids
+        result['buildChainID'] = self.buildChainID
+        result['blame'] = self.getResponsibleUsers()
+        result['url'] = status.getURLForBuild(self.builder.getName(), self.getNumber())
+        result['url']['path'] += args
+        result['builder_url'] = status.getURLForThing(self.builder) + args
+        result['builder_tags'] = self.builder.tags
+
+        if self.resume:
+            result['resume'] = self.resume
+
+        if self.resumeSlavepool:
+            result['resumeSlavepool'] = self.resumeSlavepool
+
+        if include_failure_url:
+            result['failure_url'] = self.get_failure_of_interest()
+            if result['failure_url'] is not None:
+                result['failure_url'] += args
+
+        if include_artifacts:
+            result['artifacts'] = self.get_artifacts()
+
+        # Transient
+        result['times'] = self.getTimes()
+        result['text'] = self.getText()
+        result['results'] = self.getResults()
+        result['slave'] = self.getSlavename()
+        slave = status.getSlave(self.getSlavename())
+        if slave is not None:
+            result['slave_friendly_name'] = slave.getFriendlyName()
+            result['slave_url'] = status.getURLForThing(slave)
+        result['eta'] = self.getETA()
+
+        #Lazy importing here to avoid python import errors
+        from buildbot.status.web.base import css_classes
+        result['results_text'] = css_classes.get(result['results'], "")
+
+        if include_current_step:
+            result = self.currentStepDict(result)
+
+        # Constant
+        project = None
+        for p, obj in status.getProjects().iteritems():
+            if p == self.builder.project:
+                project = obj
+                break
+
+        def getCodebaseObj(repo):
+            for c in project.codebases:
+                if c.values()[0]['repository'] == repo:
+                    return c.values()[0]
+
+        stamp_array = []
+        for ss in sourcestamps:
+            d = ss.asDict(status)
+            c = getCodebaseObj(d['repository'])
+            if c is not None and c.has_key("display_repository"):
+                d['display_repository'] = c['display_repository']
+            else:
+                d['display_repository'] = d['repository']
+
+            stamp_array.append(d)
+
+        result['sourceStamps'] = stamp_array
+
+        return result
+
+
+class BuildStatus(styles.Versioned, properties.PropertiesMixin, BuildDictMixin):
     implements(interfaces.IBuildStatus, interfaces.IStatusEvent)
 
     persistenceVersion = 4
@@ -89,6 +187,16 @@ class BuildStatus(styles.Versioned, properties.PropertiesMixin):
     def __repr__(self):
         return "<%s #%s>" % (self.__class__.__name__, self.number)
 
+    def __getattr__(self, name):
+        # a build read from a build store may load its steps on first use
+        if name == 'steps' and '_loadSteps' in self.__dict__:
+            steps = self.__dict__.pop('_loadSteps')()
+            for step in steps:
+                step.checkLogfiles()
+            self.steps = steps
+            return steps
+        raise AttributeError(name)
+
     # IBuildStatus
 
     def getBuilder(self):
@@ -457,6 +565,8 @@ class BuildStatus(styles.Versioned, properties.PropertiesMixin):
         return filename
 
     def __getstate__(self):
+        # make sure the steps not loaded yet are saved too
+        self.getSteps()
         d = styles.Versioned.__getstate__(self)
         # for now, a serialized Build is always "finished". We will never
         # save unfinished builds.
@@ -480,6 +590,8 @@ class BuildStatus(styles.Versioned, properties.PropertiesMixin):
     def setProcessObjects(self, builder, master):
         self.builder = builder
         self.master = master
+        if '_loadSteps' in self.__dict__:
+            return
         for step in self.steps:
             step.setProcessObjects(self, master)
     def upgradeToVersion1(self):
@@ -517,6 +629,8 @@ class BuildStatus(styles.Versioned, properties.PropertiesMixin):
     def checkLogfiles(self):
         # check that all logfiles exist, and remove references to any that
         # have been deleted (e.g., by purge())
+        if '_loadSteps' in self.__dict__:
+            return
         for s in self.steps:
             s.checkLogfiles()
 
@@ -546,40 +660,14 @@ class BuildStatus(styles.Versioned, properties.PropertiesMixin):
         yield threads.deferToThread(self.saveYourself)
 
     def saveYourself(self):
-        filename = os.path.join(self.builder.basedir, "%d" % self.number)
-        if os.path.isdir(filename):
-            # leftover from 0.5.0, which stored builds in directories
-            shutil.rmtree(filename, ignore_errors=True)
-        tmpfilename = filename + ".tmp"
-
         try:
-            with open(tmpfilename, "wb") as f:
-                dump(self, f, -1)
-            if runtime.platformType  == 'win32':
-                # windows cannot rename a file on top of an existing one, so
-                # fall back to delete-first. There are ways this can fail and
-                # lose the builder's history, so we avoid using it in the
-                # general (non-windows) case
-                if os.path.exists(filename):
-                    os.unlink(filename)
-
-            os.rename(tmpfilename, filename)
+            self.builder.getBuildStore().saveBuild(self)
         except:
             log.msg("unable to save build %s-#%d" % (self.builder.name,
                                                      self.number))
             log.err()
-
-    def currentStepDict(self, dict):
-        if self.getCurrentStep():
-            dict['currentStep'] = self.getCurrentStep().asDict()
-
-            step_type = self.getCurrentStep().getStepType()
-            if step_type == str(AcquireBuildLocksType) or step_type == str(TriggerType):
-                dict['isWaiting'] = True
-        else:
-            dict['currentStep'] = None
-
-        return dict
+            return
+        self.builder.buildSaved(self)
 
     def get_failure_of_interest(self):
         if self.foi_url is not None:
@@ -629,87 +717,8 @@ class BuildStatus(styles.Versioned, properties.PropertiesMixin):
                 self.artifacts = artifacts
             return self.artifacts
 
-    def asBaseDict(self, request=None, include_current_step=False, include_artifacts=False, include_failure_url=False):
-        from buildbot.status.web.base import getCodebasesArg
-
-        result = {}
-        sourcestamps = self.getSourceStamps()
-        status = self.master.status
-        args = getCodebasesArg(request, sourcestamps=sourcestamps)
-
-        # Constant
-        result['builderName'] = self.builder.name
-        result['builderFriendlyName'] = self.builder.getFriendlyName()
-        result['number'] = self.getNumber()
-        result['reason'] = self.getReason()
-        result['submittedTime'] = self.submitted
-        result['owners'] = self.owners
-        result['brids'] = self.brids
-        result['buildChainID'] = self.buildChainID
-        result['blame'] = self.getResponsibleUsers()
-        result['url'] = status.getURLForThing(self)
-        result['url']['path'] += args
-        result['builder_url'] = status.getURLForThing(self.builder) + args
-        result['builder_tags'] = self.builder.tags
-
-        if self.resume:
-            result['resume'] = self.resume
-
-        if self.resumeSlavepool:
-            result['resumeSlavepool'] = self.resumeSlavepool
-
-        if include_failure_url:
-            result['failure_url'] = self.get_failure_of_interest()
-            if result['failure_url'] is not None:
-                result['failure_url'] += args
-
-        if include_artifacts:
-            result['artifacts'] = self.get_artifacts()
-
-        # Transient
-        result['times'] = self.getTimes()
-        result['text'] = self.getText()
-        result['results'] = self.getResults()
-        result['slave'] = self.getSlavename()
-        slave = status.getSlave(self.getSlavename())
-        if slave is not None:
-            result['slave_friendly_name'] = slave.getFriendlyName()
-            result['slave_url'] = status.getURLForThing(slave)
-        result['eta'] = self.getETA()
-
-        #Lazy importing here to avoid python import errors
-        from buildbot.status.web.base import css_classes
-        result['results_text'] = css_classes.get(result['results'], "")
-
-        if include_current_step:
-            result = self.currentStepDict(result)
-
-        # Constant
-        project = None
-        for p, obj in status.getProjects().iteritems():
-            if p == self.builder.project:
-                project = obj
-                break
-
-        def getCodebaseObj(repo):
-            for c in project.codebases:
-                if c.values()[0]['repository'] == repo:
-                    return c.values()[0]
-
-        stamp_array = []
-        for ss in sourcestamps:
-            d = ss.asDict(status)
-            c = getCodebaseObj(d['repository'])
-            if c is not None and c.has_key("display_repository"):
-                d['display_repository'] = c['display_repository']
-            else:
-                d['display_repository'] = d['repository']
-
-            stamp_array.append(d)
-
-        result['sourceStamps'] = stamp_array
-
-        return result
+    def getSummary(self):
+        return BuildSummary(self)
 
     def asDict(self, request=None, include_artifacts=False, include_failure_url=False, include_steps=True,
                include_properties=True):
@@ -735,5 +744,116 @@ class BuildStatus(styles.Versioned, properties.PropertiesMixin):
 
         return result
 
+class BuildSummary(BuildDictMixin):
+    """The part of a finished build needed by asBaseDict, without its steps,
+    logs and properties. It is saved next to the build when it finishes so
+    that build listings do not have to load the whole build."""
+
+    sources = None
+    reason = None
+    blamelist = []
+    resume = []
+    resumeSlavepool = None
+    started = None
+    finished = None
+    submitted = None
+    owners = None
+    buildChainID = None
+    brids = []
+    text = []
+    results = None
+    slavename = "???"
+    foi_url = None
+    artifacts = None
+    # (step name, log name) of the logs of the build, None in the summaries
+    # saved before they were kept
+    logs = None
+
+    def __init__(self, build):
+        self.builder = build.builder
+        self.master = build.master
+        self.number = build.number
+        for attr in ('sources', 'reason', 'blamelist', 'resume', 'resumeSlavepool', 'started',
+                     'finished', 'submitted', 'owners', 'buildChainID', 'brids', 'results',
+                     'slavename'):
+            setattr(self, attr, getattr(build, attr))
+        self.text = build.getText()
+        self.foi_url = build.get_failure_of_interest()
+        self.artifacts = build.get_artifacts()
+        self.logs = [(l.getStep().getName(), l.getName()) for l in build.getLogs()]
+
+    def __repr__(self):
+        return "<%s #%s>" % (self.__class__.__name__, self.number)
+
+    def __getstate__(self):
+        d = self.__dict__.copy()
+        for k in ['builder', 'master']:
+            if k in d: del d[k]
+        return d
+
+    def setProcessObjects(self, builder, master):
+        self.builder = builder
+        self.master = master
+
+    def getBuilder(self):
+        return self.builder
+
+    def getNumber(self):
+        return self.number
+
+    def getSourceStamps(self):
+        return list(self.sources or [])
+
+    def getReason(self):
+        return self.reason
+
+    def getResponsibleUsers(self):
+        return self.blamelist
+
+    def getTimes(self):
+        return (self.started, self.finished)
+
+    def isFinished(self):
+        return (self.finished is not None)
+
+    def getETA(self):
+        return None
+
+    def getCurrentStep(self):
+        return None
+
+    def getText(self):
+        return self.text
+
+    def getResults(self):
+        return self.results
+
+    def getSlavename(self):
+        return self.slavename
+
+    def get_failure_of_interest(self):
+        return self.foi_url
+
+    def get_artifacts(self):
+        return self.artifacts
+
+    def asDict(self, request=None, include_artifacts=False, include_failure_url=False):
+        """The dictionary L{BuildStatus.asDict} gives without the steps and
+        properties."""
+        from buildbot.status.web.base import getCodebasesArg
+        result = self.asBaseDict(request, include_artifacts=include_artifacts,
+                                 include_failure_url=include_failure_url)
+
+        args = getCodebasesArg(request)
+        status = self.master.status
+        result['logs'] = [[logname,
+                           status.getURLForLog(self.builder.getProject(), self.builder.getName(),
+                                               self.number, stepname, logname) + args]
+                          for stepname, logname in self.logs or []]
+        result['isWaiting'] = False
+        result['currentStep'] = None
+        return result
+
+
 components.registerAdapter(lambda build_status : build_status.properties,
         BuildStatus, interfaces.IProperties)
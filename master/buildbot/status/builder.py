@@ -17,10 +17,9 @@ from __future__ import with_statement
 
 
 import os, re, itertools
-from cPickle import load, dump
-import datetime
+from cPickle import dump
 from buildbot.interfaces import IStatusReceiver
-from twisted.internet import defer, threads
+from twisted.internet import defer, reactor, threads
 
 from zope.interface import implements
 from twisted.python import log, runtime
@@ -29,6 +28,8 @@ from buildbot import interfaces, util
 from buildbot.util.lru import LRUCache
 from buildbot.status.event import Event
 from buildbot.status.build import BuildStatus
+from buildbot.status.buildstore import PickleBuildStore
+from buildbot.status.buildloader import BuildLoader, INTERACTIVE
 from buildbot.status.buildrequest import BuildRequestStatus
 
 # user modules expect these symbols to be present here
@@ -100,6 +101,8 @@ class BuilderStatus(styles.Versioned):
     basedir = None # filled in by our parent
     unavailable_build_numbers = set()
     status = None
+    buildStore = None # filled in by our parent
+    buildLoader = None # filled in by our parent
 
     def __init__(self, buildername, category, master, friendly_name=None, description=None, project=None):
         self.name = buildername
@@ -121,13 +124,14 @@ class BuilderStatus(styles.Versioned):
         self.nextBuild = None
         self.watchers = []
         self.buildCache = LRUCache(self.cacheMiss)
+        self.summaryCache = LRUCache(self.summaryCacheMiss)
         self.reason = None
         self.unavailable_build_numbers = set()
-        self.latestBuildCache = {}
         self.pendingBuildsCache = None
         self.tags = []
-        self.loadingBuilds = {}
         self.cancelBuilds = {}
+        # codebases key -> results filters without a recorded build
+        self.latestBuildMisses = {}
 
 
     # persistence
@@ -136,9 +140,6 @@ class BuilderStatus(styles.Versioned):
         self.status = status
         self.pendingBuildsCache = PendingBuildsCache(self)
 
-        if not hasattr(self, 'latestBuildCache'):
-            self.latestBuildCache = {}
-
     def deleteKey(self, key, d):
         if d.has_key(key):
             del d[key]
@@ -151,6 +152,7 @@ class BuilderStatus(styles.Versioned):
         d = styles.Versioned.__getstate__(self)
         d['watchers'] = []
         del d['buildCache']
+        self.deleteKey('summaryCache', d)
         for b in self.currentBuilds:
             b.saveYourself()
             # TODO: push a 'hey, build was interrupted' event
@@ -161,12 +163,14 @@ class BuilderStatus(styles.Versioned):
         self.deleteKey('status', d)
         self.deleteKey('nextBuildNumber', d)
         del d['master']
-        self.deleteKey('loadingBuilds', d)
+        self.deleteKey('buildLoader', d)
+        self.deleteKey('buildStore', d)
 
         if 'pendingBuildsCache' in d:
             del d['pendingBuildsCache']
 
         self.deleteKey('latestBuildCache', d)
+        self.deleteKey('latestBuildMisses', d)
         return d
 
     def __setstate__(self, d):
@@ -174,12 +178,13 @@ class BuilderStatus(styles.Versioned):
         # upgradeToVersion1 and such will be called after this finishes.
         styles.Versioned.__setstate__(self, d)
         self.buildCache = LRUCache(self.cacheMiss)
+        self.summaryCache = LRUCache(self.summaryCacheMiss)
         self.currentBuilds = []
         self.watchers = []
         self.slavenames = []
         self.startSlavenames = []
-        self.loadingBuilds = {}
         self.cancelBuilds = {}
+        self.latestBuildMisses = {}
         # self.basedir must be filled in by our parent
         # self.status must be filled in by our parent
         # self.master must be filled in by our parent
@@ -210,6 +215,10 @@ class BuilderStatus(styles.Versioned):
             if r is not None and len(r.groups()) > 0:
                 existing_builds.append(int(r.groups()[0]))
 
+        last = self.getBuildStore().lastBuildNumber()
+        if last is not None:
+            existing_builds.append(last)
+
         if len(existing_builds):
             self.nextBuildNumber = max(existing_builds) + 1
         else:
@@ -243,35 +252,43 @@ class BuilderStatus(styles.Versioned):
 
     def setCacheSize(self, caches):
         self.buildCache.set_max_size(caches['Builds'])
+        if caches and 'BuildSummaries' in caches:
+            self.summaryCache.set_max_size(caches['BuildSummaries'])
         if caches and 'BuilderBuildRequestStatus' in caches:
             self.pendingBuildsCache.buildRequestStatusCache.set_max_size(caches['BuilderBuildRequestStatus'])
 
+    def setBuildStore(self, store):
+        self.buildStore = store
+
+    def getBuildStore(self):
+        if self.buildStore is None:
+            self.buildStore = PickleBuildStore(self.basedir)
+        return self.buildStore
+
     def makeBuildFilename(self, number):
         return os.path.join(self.basedir, "%d" % number)
 
     def getBuildByNumber(self, number):
         return self.buildCache.get(number)
 
-    def loadBuildFromFile(self, number):
+    def loadBuildFromFile(self, number, withSteps=True):
         if number in self.unavailable_build_numbers:
             return None
 
-        filename = self.makeBuildFilename(number)
         try:
-            if not os.path.exists(filename):
+            log.msg("Loading builder %s's build %d from disk" % (self.name, number))
+            try:
+                build = self.getBuildStore().loadBuild(number, withSteps=withSteps)
+            except ImportError as err:
+                log.msg("ImportError loading builder %s's build %d from disk" % (self.name, number))
+                log.msg(str(err))
+                return None
+
+            if build is None:
                 if number < self.nextBuildNumber:
                     self.unavailable_build_numbers.add(number)
                 return None
 
-            log.msg("Loading builder %s's build %d from on-disk pickle" % (self.name, number))
-            with open(filename, "rb") as f:
-                try:
-                    build = load(f)
-                except ImportError as err:
-                    log.msg("ImportError loading builder %s's build %d from disk pickle" % (self.name, number))
-                    log.msg(str(err))
-                    return None
-
             build.setProcessObjects(self, self.master)
 
             # (bug #1068) if we need to upgrade, we probably need to rewrite
@@ -290,8 +307,6 @@ class BuilderStatus(styles.Versioned):
             return build
         except IOError:
             raise IndexError("no such build %d" % number)
-        except EOFError:
-            raise IndexError("corrupted build pickle %d" % number)
 
     def cacheMiss(self, number, **kwargs):
         # If kwargs['val'] exists, this is a new value being added to
@@ -307,6 +322,49 @@ class BuilderStatus(styles.Versioned):
         # then fall back to loading it from disk
         return self.loadBuildFromFile(number)
 
+    def getBuildSummary(self, number):
+        if number < 0:
+            number = self.nextBuildNumber + number
+        if number < 0 or number >= self.nextBuildNumber:
+            return None
+
+        try:
+            return self.summaryCache.get(number)
+        except IndexError:
+            return None
+
+    def summaryCacheMiss(self, number, **kwargs):
+        if 'val' in kwargs:
+            return kwargs['val']
+
+        # a build which is already loaded does not need to be read again
+        build = self.buildCache.cache.get(number)
+        if build is not None:
+            if build.isFinished():
+                return build.getSummary()
+            return None
+
+        summary = self.getBuildStore().loadSummary(number)
+        if summary is not None and summary.logs is not None:
+            summary.setProcessObjects(self, self.master)
+            styles.doUpgrade()
+            return summary
+
+        # builds saved before summaries existed, or before they kept the logs,
+        # get one the first time they are listed; the build is not cached, its
+        # steps are only read for the names of the logs
+        build = self.loadBuildFromFile(number, withSteps=False)
+        if build is None or not build.isFinished():
+            return None
+        summary = build.getSummary()
+        self.getBuildStore().saveSummary(summary)
+        return summary
+
+    def buildSaved(self, build):
+        # keep the cached summary in line with the saved build
+        if build.isFinished() and build.number in self.summaryCache.cache:
+            self.summaryCache.put(build.number, build.getSummary())
+
     def prune(self, events_only=False):
         # begin by pruning our own events
         eventHorizon = self.master.config.eventHorizon
@@ -334,29 +392,22 @@ class BuilderStatus(styles.Versioned):
         if earliest_build == 0:
             return
 
-        # skim the directory and delete anything that shouldn't be there anymore
-        build_re = re.compile(r"^([0-9]+)$")
-        build_log_re = re.compile(r"^([0-9]+)-.*$")
         # if the directory doesn't exist, bail out here
         if not os.path.exists(self.basedir):
             return
 
-        for filename in os.listdir(self.basedir):
-            num = None
-            mo = build_re.match(filename)
-            is_logfile = False
-            if mo:
-                num = int(mo.group(1))
-            else:
-                mo = build_log_re.match(filename)
-                if mo:
-                    num = int(mo.group(1))
-                    is_logfile = True
+        self.getBuildStore().pruneBuilds(earliest_build, keep=self.buildCache.cache)
 
-            if num is None: continue
+        # skim the directory and delete the logs that shouldn't be there anymore
+        build_log_re = re.compile(r"^([0-9]+)-.*$")
+        for filename in os.listdir(self.basedir):
+            mo = build_log_re.match(filename)
+            if not mo:
+                continue
+            num = int(mo.group(1))
             if num in self.buildCache.cache: continue
 
-            if (is_logfile and num < earliest_log) or num < earliest_build:
+            if num < earliest_log:
                 pathname = os.path.join(self.basedir, filename)
                 log.msg("pruning '%s'" % pathname)
                 try: os.unlink(pathname)
@@ -497,15 +548,18 @@ class BuilderStatus(styles.Versioned):
         return set([ ss.branch
             for ss in build.getSourceStamps() ])
 
-    @defer.inlineCallbacks
-    def generateBuildNumbers(self, codebases={}, branches=[], results=None, num_builds=1):
+    def _sourceStampsFilter(self, codebases, branches):
         sourcestamps = [{'b_branch': b} for b in branches if b is not None] if branches else []
-        #TODO: support filter by RETRY result
-        results_filter = [r for r in results if r is not None and r != RETRY] if results else []
-
         if codebases and not branches:
             for key, value in codebases.iteritems():
                 sourcestamps.append({'b_codebase': key, 'b_branch': value})
+        return sourcestamps
+
+    @defer.inlineCallbacks
+    def generateBuildNumbers(self, codebases={}, branches=[], results=None, num_builds=1):
+        sourcestamps = self._sourceStampsFilter(codebases, branches)
+        #TODO: support filter by RETRY result
+        results_filter = [r for r in results if r is not None and r != RETRY] if results else []
 
         # Handles the condition where the last build status couldn't be saved into pickles,
         # in that case we need to search more builds and use the previous one 
@@ -521,69 +575,76 @@ class BuilderStatus(styles.Versioned):
         defer.returnValue(lastBuildsNumbers)
         return
 
-    def getLatestBuildCache(self, key):
-        cache = self.latestBuildCache[key]
-        max_cache = datetime.timedelta(days=self.master.config.lastBuildCacheDays)
-        if datetime.datetime.now() - cache["date"] > max_cache:
-            del self.latestBuildCache[key]
-        elif cache["build"] is not None:
-            return self.getBuild(self.latestBuildCache[key]["build"])
-        return None
+    def getLatestBuildNumber(self, key, results=None):
+        """Returns the number of the latest build on the branches given by
+        key recorded by saveLatestBuild, or None, via Deferred."""
+        return self.master.db.builds.getLastBuildNumber(self.name, key, results=results)
 
     @defer.inlineCallbacks
-    def getLatestBuildCacheAsync(self, key):
-        cache = self.latestBuildCache[key]
-        max_cache = datetime.timedelta(days=self.master.config.lastBuildCacheDays)
-        if datetime.datetime.now() - cache["date"] > max_cache:
-            del self.latestBuildCache[key]
-        elif cache["build"] is not None:
-            build = yield self.deferToThread(self.latestBuildCache[key]["build"])
-            defer.returnValue(build)
-            return
-        defer.returnValue(None)
-
-    def shouldUseLatestBuildCache(self, useCache, num_builds, key):
-        return key and useCache and num_builds == 1 and key in self.latestBuildCache
-
-    def buildLoaded(self, build, buildnumber):
-        if build and not self.loadingBuilds[buildnumber]['build']:
-            self.loadingBuilds[buildnumber]['build'] = build
-
-    def getLoadedBuildFromThread(self, buildnumber):
-        build = self.loadingBuilds[buildnumber]['build']
-
-        self.loadingBuilds[buildnumber]['access'] -= 1
-        if not self.loadingBuilds[buildnumber]['access']:
-            del self.loadingBuilds[buildnumber]
-
-        return build
-
-    def loadBuildFromThread(self, buildnumber):
-        if buildnumber not in self.loadingBuilds:
-            d = threads.deferToThread(self.getBuild, buildnumber)
-            d.addCallback(self.buildLoaded, buildnumber=buildnumber)
-            self.loadingBuilds[buildnumber] = {'defer': d, 'access': 1, 'build': None}
-            return
+    def findLatestBuildNumber(self, key, codebases, branches, results=None):
+        """Like getLatestBuildNumber, but when no build is recorded, the
+        latest build of each results is searched and recorded first.
+
+        The builds finished before the last_builds table was added are only
+        recorded this way. Recording them all keeps the later lookups for any
+        results right, where recording only the build found for the results
+        asked for would hide the later builds with other results.
+
+        When there is still no build, None is remembered for the key and
+        results until saveLatestBuild records a build on the key."""
+        resultsKey = tuple(sorted(results)) if results else None
+        if resultsKey in self.latestBuildMisses.get(key, ()):
+            defer.returnValue(None)
+
+        number = yield self.getLatestBuildNumber(key, results)
+        if number is not None:
+            defer.returnValue(number)
+
+        numbers = yield self.master.db.builds.getLastBuildNumbersByResults(
+            self.name, self._sourceStampsFilter(codebases, branches))
+        for res, number in numbers.iteritems():
+            yield self.master.db.builds.updateLastBuild(self.name, key, res, number)
+        number = None
+        if numbers:
+            number = yield self.getLatestBuildNumber(key, results)
+        if number is None:
+            self.latestBuildMisses.setdefault(key, set()).add(resultsKey)
+        defer.returnValue(number)
+
+    def setBuildLoader(self, loader):
+        self.buildLoader = loader
+
+    def getBuildLoader(self):
+        if self.buildLoader is None:
+            # outside of a master, share the reactor's thread pool
+            self.buildLoader = BuildLoader(pool=reactor.getThreadPool())
+        return self.buildLoader
+
+    def deferToThread(self, buildnumber, priority=INTERACTIVE, batch=False):
+        if buildnumber in self.buildCache.cache:
+            return defer.succeed(self.getBuildByNumber(number=buildnumber))
 
-        if self.loadingBuilds[buildnumber]['defer']:
-            self.loadingBuilds[buildnumber]['access'] += 1
+        return self.getBuildLoader().load(('build', self.name, buildnumber),
+                                          lambda: self.getBuild(buildnumber),
+                                          priority=priority,
+                                          batch=('build', self.name) if batch else None)
 
-    @defer.inlineCallbacks
-    def deferToThread(self, buildnumber):
-        if buildnumber in self.buildCache.cache:
-            defer.returnValue(self.getBuildByNumber(number=buildnumber))
-            return
+    def deferSummaryToThread(self, buildnumber, priority=INTERACTIVE, batch=False):
+        if buildnumber in self.summaryCache.cache:
+            return defer.succeed(self.getBuildSummary(buildnumber))
 
-        self.loadBuildFromThread(buildnumber=buildnumber)
-        yield self.loadingBuilds[buildnumber]['defer']
-        build = self.getLoadedBuildFromThread(buildnumber)
-        defer.returnValue(build)
+        return self.getBuildLoader().load(('summary', self.name, buildnumber),
+                                          lambda: self.getBuildSummary(buildnumber),
+                                          priority=priority,
+                                          batch=('summary', self.name) if batch else None)
 
     @defer.inlineCallbacks
-    def getFinishedBuildsByNumbers(self, buildnumbers=[], results=None):
+    def getFinishedBuildsByNumbers(self, buildnumbers=[], results=None, priority=INTERACTIVE):
         finishedBuilds = []
-        for bn in buildnumbers:
-            build = yield self.deferToThread(bn)
+        # queue all the loads at once so they can be batched
+        loads = [self.deferToThread(bn, priority, batch=True) for bn in buildnumbers]
+        for d in loads:
+            build = yield d
 
             if build:
                 if results is not None and build.getResults() not in results:
@@ -594,6 +655,22 @@ class BuilderStatus(styles.Versioned):
         defer.returnValue(finishedBuilds)
 
 
+    @defer.inlineCallbacks
+    def getFinishedBuildSummariesByNumbers(self, buildnumbers=[], results=None, priority=INTERACTIVE):
+        finishedSummaries = []
+        # queue all the loads at once so they can be batched
+        loads = [self.deferSummaryToThread(bn, priority, batch=True) for bn in buildnumbers]
+        for d in loads:
+            summary = yield d
+
+            if summary:
+                if results is not None and summary.getResults() not in results:
+                    continue
+
+                finishedSummaries.append(summary)
+
+        defer.returnValue(finishedSummaries)
+
     @defer.inlineCallbacks
     def generateFinishedBuildsAsync(self, branches=[], codebases={},
                                num_builds=None,
@@ -605,14 +682,18 @@ class BuilderStatus(styles.Versioned):
         branches = set(branches)
 
         key = self.getCodebasesCacheKey(codebases)
-
-        if self.shouldUseLatestBuildCache(useCache, num_builds, key):
-            build = yield self.getLatestBuildCacheAsync(key)
-
+        useLatestBuild = key and useCache and num_builds == 1
+
+        if useLatestBuild:
+            number = yield self.findLatestBuildNumber(key, codebases, branches, results)
+            if number is None:
+                # the latest builds of the key are all recorded
+                defer.returnValue([])
+                return
+            build = yield self.deferToThread(number)
             if build:
-                finishedBuilds.append(build)
-            defer.returnValue(finishedBuilds)
-            return
+                defer.returnValue([build])
+                return
 
         buildNumbers = yield self.generateBuildNumbers(codebases, branches, results, num_builds)
 
@@ -631,13 +712,54 @@ class BuilderStatus(styles.Versioned):
             if num_builds == 1:
                 break
 
-        if key and useCache and num_builds == 1:
-            self.saveLatestBuild(build, key)
-
         defer.returnValue(finishedBuilds)
         return
 
 
+    @defer.inlineCallbacks
+    def generateFinishedBuildSummariesAsync(self, branches=[], codebases={},
+                                            num_builds=None,
+                                            results=None,
+                                            useCache=False):
+        """Just like L{generateFinishedBuildsAsync}, but returns the
+        L{BuildSummary} of the builds, without loading their steps."""
+        summary = None
+        finishedSummaries = []
+        branches = set(branches)
+
+        key = self.getCodebasesCacheKey(codebases)
+        useLatestBuild = key and useCache and num_builds == 1
+
+        if useLatestBuild:
+            number = yield self.findLatestBuildNumber(key, codebases, branches, results)
+            if number is None:
+                # the latest builds of the key are all recorded
+                defer.returnValue([])
+                return
+            summary = yield self.deferSummaryToThread(number)
+            if summary:
+                defer.returnValue([summary])
+                return
+
+        buildNumbers = yield self.generateBuildNumbers(codebases, branches, results, num_builds)
+
+        for bn in buildNumbers:
+            summary = yield self.deferSummaryToThread(bn)
+
+            if summary is None:
+                continue
+
+            if results is not None:
+                if summary.getResults() not in results:
+                    continue
+
+            finishedSummaries.append(summary)
+
+            if num_builds == 1:
+                break
+
+        defer.returnValue(finishedSummaries)
+
     def generateFinishedBuilds(self, branches=[], codebases={},
                                num_builds=None,
                                max_buildnum=None,
@@ -646,14 +768,8 @@ class BuilderStatus(styles.Versioned):
                                max_search=2000,
                                filter_fn=None,
                                useCache=False):
-
-        key = self.getCodebasesCacheKey(codebases)
-        if self.shouldUseLatestBuildCache(useCache, num_builds, key):
-            build = self.getLatestBuildCache(key)
-            if build:
-                yield build
-            # Warning: if there is a problem saving the build in the cache the build wont be loaded
-            return
+        # useCache is only honoured by generateFinishedBuildsAsync, since the
+        # latest builds are read from the database
 
         got = 0
         branches = set(branches)
@@ -690,13 +806,6 @@ class BuilderStatus(styles.Versioned):
                     continue
             got += 1
             yield build
-            if num_builds and num_builds == 1 and useCache:
-                    #Save our latest builds to the cache
-                    self.saveLatestBuild(build, key)
-                    return
-
-        if useCache and num_builds == 1:
-            self.saveLatestBuild(build=None, key=key)
 
     def buildCanceled(self, _, buildnumber):
         self.cancelBuilds[buildnumber]['access'] -= 1
@@ -891,6 +1000,7 @@ class BuilderStatus(styles.Versioned):
         assert s in self.currentBuilds
         s.saveYourself()
         self.currentBuilds.remove(s)
+        self.summaryCache.get(s.number, val=s.getSummary())
 
         name = self.getName()
         results = s.getResults()
@@ -901,7 +1011,7 @@ class BuilderStatus(styles.Versioned):
                 log.msg("Exception caught notifying %r of buildFinished event" % w)
                 log.err()
 
-        self.saveLatestBuild(s)
+        yield self.saveLatestBuild(s)
         yield threads.deferToThread(self.prune) # conserve disk
 
     def getCodebasesCacheKey(self, codebases={}):
@@ -915,43 +1025,33 @@ class BuilderStatus(styles.Versioned):
 
         return codebase_key
 
-    def updateLatestBuildCache(self, cache, k):
-        def nonEmptyCacheUpdateToEmptyBuild():
-            return self.latestBuildCache and k in self.latestBuildCache and 'build' in self.latestBuildCache[k] and \
-                self.latestBuildCache[k]["build"] and cache["build"] is None
-
-        def keyHasMultipleCodebasesAndEmptyBuild():
-            codebases = [key for key in k.split(';') if key]
-            return not cache["build"] and len(codebases) > 1
+    def saveLatestBuild(self, build):
+        """Records the finished build (or build summary) as the latest build
+        on its branches, in the last_builds table. Returns a Deferred, which
+        does not fail."""
+        results = build.getResults()
+        if results is None or results == RESUME:
+            return defer.succeed(None)
 
-        if nonEmptyCacheUpdateToEmptyBuild():
-            return
+        # the key is computed as when the latest build is looked up
+        codebases = {}
+        for ss in build.getSourceStamps():
+            if ss.codebase and ss.branch:
+                codebases[ss.codebase] = ss.branch
 
-        if keyHasMultipleCodebasesAndEmptyBuild():
-            return
-
-        self.latestBuildCache[k] = cache
-
-    def saveLatestBuild(self, build, key=None):
-        if build and build.getResults() == RESUME:
-            return
-
-        cache = {"build": None, "date": datetime.datetime.now()}
-
-        if build is not None:
-            cache["build"] = build.number
-
-            # Save the latest build using the build's codebases
-            ss = build.getSourceStamps()
-            codebases = {}
-            for s in ss:
-                if s.codebase and s.branch:
-                    codebases[s.codebase] = s.branch
+        key = self.getCodebasesCacheKey(codebases)
+        if not key:
+            return defer.succeed(None)
 
-            # We save it in the same way as we access it
-            key = self.getCodebasesCacheKey(codebases)
+        finish_time = build.getTimes()[1]
+        d = self.master.db.builds.updateLastBuild(self.name, key, results, build.number,
+                                                  finish_time=int(finish_time) if finish_time else None)
 
-        self.updateLatestBuildCache(cache, key)
+        def forgetMisses(_):
+            self.latestBuildMisses.pop(key, None)
+        d.addCallback(forgetMisses)
+        d.addErrback(log.err, "while recording the latest build of %s" % self.name)
+        return d
 
     def asDict(self, codebases={}, request=None, base_build_dict=False, include_build_steps=True,
                include_build_props=True):
@@ -0,0 +1,170 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Unity Technologies
+
+import time
+from collections import deque
+
+from twisted.internet import defer, reactor
+from twisted.python import failure, threadpool
+from buildbot import util
+from buildbot.process import metrics
+
+INTERACTIVE = 0
+BACKGROUND = 10
+
+
+class _Load(object):
+
+    def __init__(self, key, fn, priority, queued):
+        self.key = key
+        self.fn = fn
+        self.priority = priority
+        self.queued = queued
+        self.waiters = []
+
+
+class BuildLoader(object):
+    """Runs the loads of builds and build summaries from disk in a bounded
+    number of threads.
+
+    Loads are identified by a key, a load requested while the same key is
+    queued or running shares its result. Queued loads run by priority,
+    INTERACTIVE loads (web requests) before BACKGROUND ones, and in request
+    order within a priority. Up to batchSize consecutive loads of the same
+    batch are run by a single thread call.
+
+    The loader uses its own thread pool of size threads, unless a thread
+    pool is given."""
+
+    def __init__(self, size=4, batchSize=10, pool=None, _reactor=reactor):
+        self.size = size
+        self.batchSize = batchSize
+        self._reactor = _reactor
+        self._ownPool = pool is None
+        if pool is None:
+            pool = threadpool.ThreadPool(minthreads=0, maxthreads=size, name='BuildLoader')
+        self.pool = pool
+        self._stop_evt = None
+        # priority -> deque of (batch, _Load)
+        self._queues = {}
+        # key -> _Load, for queued and running loads
+        self._loads = {}
+        self._queued = 0
+        self._running = 0
+
+    def setSize(self, size):
+        if size == self.size:
+            return
+        self.size = size
+        if self._ownPool:
+            self.pool.adjustPoolsize(maxthreads=size)
+        self._dispatch()
+
+    def _start(self):
+        if self._ownPool and not self.pool.started:
+            self.pool.start()
+            self._stop_evt = self._reactor.addSystemEventTrigger('during', 'shutdown', self._stop)
+
+    def _stop(self):
+        self._stop_evt = None
+        self.pool.stop()
+
+    def stop(self):
+        """Stops the thread pool; this is only necessary from tests, as the
+        pool stops itself when the reactor stops."""
+        if self._stop_evt:
+            self._reactor.removeSystemEventTrigger(self._stop_evt)
+            self._stop()
+
+    def load(self, key, fn, priority=INTERACTIVE, batch=None):
+        """Returns a Deferred fired with the result of calling fn in a thread,
+        or with the result of the load of the same key already in progress.
+        Consecutive loads with the same batch may run in the same thread
+        call."""
+        d = defer.Deferred()
+        load = self._loads.get(key)
+        if load is None:
+            load = _Load(key, fn, priority, util.now(self._reactor))
+            self._loads[key] = load
+            self._enqueue(batch, load)
+        elif load.priority is not None and priority < load.priority:
+            self._requeue(load, priority)
+        load.waiters.append(d)
+        self._dispatch()
+        return d
+
+    def _enqueue(self, batch, load):
+        self._queues.setdefault(load.priority, deque()).append((batch, load))
+        self._queued += 1
+        metrics.MetricCountEvent.log('BuildLoader.queued', self._queued, absolute=True)
+
+    def _requeue(self, load, priority):
+        queue = self._queues[load.priority]
+        for entry in queue:
+            if entry[1] is load:
+                queue.remove(entry)
+                break
+        self._queued -= 1
+        load.priority = priority
+        # a load moved to another priority is not batched anymore
+        self._enqueue(None, load)
+
+    def _dispatch(self):
+        while self._running < self.size and self._queued:
+            queue = self._queues[min(p for p, q in self._queues.iteritems() if q)]
+            batch, load = queue.popleft()
+            loads = [load]
+            while batch is not None and queue and queue[0][0] == batch and len(loads) < self.batchSize:
+                loads.append(queue.popleft()[1])
+
+            self._queued -= len(loads)
+            metrics.MetricCountEvent.log('BuildLoader.queued', self._queued, absolute=True)
+            self._running += 1
+
+            started = util.now(self._reactor)
+            for l in loads:
+                # running loads can not change priority anymore
+                l.priority = None
+                metrics.MetricTimeEvent.log('BuildLoader.wait', started - l.queued)
+
+            self._start()
+            self.pool.callInThreadWithCallback(
+                lambda success, results, loads=loads:
+                    self._reactor.callFromThread(self._loaded, loads, results),
+                self._runLoads, loads)
+
+    def _runLoads(self, loads):
+        results = []
+        for load in loads:
+            start = time.time()
+            try:
+                result = load.fn()
+            except:
+                result = failure.Failure()
+            results.append((result, time.time() - start))
+        return results
+
+    def _loaded(self, loads, results):
+        self._running -= 1
+        for load, (result, elapsed) in zip(loads, results):
+            del self._loads[load.key]
+            metrics.MetricTimeEvent.log('BuildLoader.load', elapsed)
+            for d in load.waiters:
+                if isinstance(result, failure.Failure):
+                    d.errback(result)
+                else:
+                    d.callback(result)
+        self._dispatch()
+
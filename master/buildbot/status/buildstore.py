@@ -0,0 +1,335 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Unity Technologies
+
+from __future__ import with_statement
+
+import os, re, shutil, sqlite3, threading, zlib
+from cStringIO import StringIO
+from cPickle import Pickler, Unpickler, load, dump, dumps, loads
+from twisted.python import log, runtime
+from twisted.persisted import styles
+
+
+class PickleBuildStore(object):
+    """Stores each finished build in its own pickle file, named after the
+    build number, in the builder basedir."""
+
+    build_re = re.compile(r"^([0-9]+)$")
+
+    def __init__(self, basedir):
+        self.basedir = basedir
+
+    def makeBuildFilename(self, number):
+        return os.path.join(self.basedir, "%d" % number)
+
+    def hasBuild(self, number):
+        return os.path.isfile(self.makeBuildFilename(number))
+
+    def buildNumbers(self):
+        if not os.path.isdir(self.basedir):
+            return []
+        numbers = []
+        for filename in os.listdir(self.basedir):
+            mo = self.build_re.match(filename)
+            if mo:
+                numbers.append(int(mo.group(1)))
+        numbers.sort()
+        return numbers
+
+    def lastBuildNumber(self):
+        numbers = self.buildNumbers()
+        if numbers:
+            return numbers[-1]
+        return None
+
+    def makeSummaryFilename(self, number):
+        return os.path.join(self.basedir, "%d.summary" % number)
+
+    def saveBuild(self, build):
+        filename = self.makeBuildFilename(build.number)
+        if os.path.isdir(filename):
+            # leftover from 0.5.0, which stored builds in directories
+            shutil.rmtree(filename, ignore_errors=True)
+        self._dump(build, filename)
+        if build.isFinished():
+            self.saveSummary(build.getSummary())
+
+    def saveSummary(self, summary):
+        self._dump(summary, self.makeSummaryFilename(summary.number))
+
+    def _dump(self, obj, filename):
+        tmpfilename = filename + ".tmp"
+
+        with open(tmpfilename, "wb") as f:
+            dump(obj, f, -1)
+        if runtime.platformType  == 'win32':
+            # windows cannot rename a file on top of an existing one, so
+            # fall back to delete-first. There are ways this can fail and
+            # lose the builder's history, so we avoid using it in the
+            # general (non-windows) case
+            if os.path.exists(filename):
+                os.unlink(filename)
+
+        os.rename(tmpfilename, filename)
+
+    def loadBuild(self, number, withSteps=True):
+        """Returns the unpickled build, or None if it is not stored. Raises
+        IndexError if the pickle is corrupted. The pickle always holds the
+        steps, withSteps is ignored."""
+        filename = self.makeBuildFilename(number)
+        try:
+            with open(filename, "rb") as f:
+                return load(f)
+        except IOError:
+            if not os.path.exists(filename):
+                return None
+            raise IndexError("no such build %d" % number)
+        except EOFError:
+            raise IndexError("corrupted build pickle %d" % number)
+
+    def loadSummary(self, number):
+        """Returns the summary of the build, or None if it was not saved."""
+        try:
+            with open(self.makeSummaryFilename(number), "rb") as f:
+                return load(f)
+        except (IOError, EOFError):
+            return None
+
+    def removeBuild(self, number):
+        for filename in (self.makeBuildFilename(number), self.makeSummaryFilename(number)):
+            try:
+                os.unlink(filename)
+            except OSError:
+                pass
+
+    def pruneBuilds(self, earliest_build, keep=()):
+        for number in self.buildNumbers():
+            if number < earliest_build and number not in keep:
+                log.msg("pruning '%s'" % self.makeBuildFilename(number))
+                self.removeBuild(number)
+
+    def close(self):
+        pass
+
+
+class SQLiteBuildStore(object):
+    """Stores the finished builds of a builder in a single SQLite file.
+
+    Each row holds the summary columns of a build, the pickled build without
+    its steps, the pickled steps and the pickled BuildSummary, all
+    compressed. The steps (and the metadata of their logs) can be left out
+    when a build is loaded, they are then unpickled when first used.
+
+    Builds still stored as pickle files are read from them until migrate()
+    moves them to the database."""
+
+    filename = "builds.sqlite"
+
+    def __init__(self, basedir):
+        self.basedir = basedir
+        self.path = os.path.join(basedir, self.filename)
+        self.pickles = PickleBuildStore(basedir)
+        # builds are saved from the reactor and loaded from threads
+        self._lock = threading.RLock()
+        self._conn = None
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("""CREATE TABLE IF NOT EXISTS builds (
+                number INTEGER PRIMARY KEY,
+                results INTEGER,
+                started REAL,
+                finished REAL,
+                slavename TEXT,
+                body BLOB NOT NULL,
+                steps BLOB NOT NULL,
+                summary BLOB)""")
+            columns = [r[1] for r in self._conn.execute("PRAGMA table_info(builds)")]
+            if 'summary' not in columns:
+                self._conn.execute("ALTER TABLE builds ADD COLUMN summary BLOB")
+            self._conn.commit()
+        return self._conn
+
+    def _execute(self, sql, args=(), commit=False):
+        with self._lock:
+            conn = self._connection()
+            rows = conn.execute(sql, args).fetchall()
+            if commit:
+                conn.commit()
+            return rows
+
+    def hasBuild(self, number):
+        rows = self._execute("SELECT 1 FROM builds WHERE number = ?", (number,))
+        return bool(rows) or self.pickles.hasBuild(number)
+
+    def buildNumbers(self):
+        numbers = set(r[0] for r in self._execute("SELECT number FROM builds"))
+        numbers.update(self.pickles.buildNumbers())
+        return sorted(numbers)
+
+    def lastBuildNumber(self):
+        last = self._execute("SELECT MAX(number) FROM builds")[0][0]
+        lastPickle = self.pickles.lastBuildNumber()
+        if last is None or (lastPickle is not None and lastPickle > last):
+            return lastPickle
+        return last
+
+    insertColumns = "number, results, started, finished, slavename, body, steps, summary"
+
+    def saveBuild(self, build):
+        self._execute("INSERT OR REPLACE INTO builds (%s) VALUES (?, ?, ?, ?, ?, ?, ?, ?)" % self.insertColumns,
+                      self._buildRow(build), commit=True)
+
+    def _buildRow(self, build):
+        steps = build.getSteps()
+        body = StringIO()
+        pickler = Pickler(body, -1)
+        # the steps are stored in their own column
+        pickler.persistent_id = lambda obj: "steps" if obj is steps else None
+        pickler.dump(build)
+        started, finished = build.getTimes()
+        summary = None
+        if build.isFinished():
+            summary = self._compress(build.getSummary())
+        return (build.number, build.getResults(), started, finished, build.getSlavename(),
+                buffer(zlib.compress(body.getvalue(), 1)),
+                self._compress(steps), summary)
+
+    def _compress(self, obj):
+        return buffer(zlib.compress(dumps(obj, -1), 1))
+
+    def loadBuild(self, number, withSteps=False):
+        """Returns the build, or None if it is not stored. Unless withSteps is
+        set, the steps are left out and loaded when first used, which is then
+        done by the thread using them."""
+        query = "SELECT body, steps FROM builds WHERE number = ?" if withSteps \
+            else "SELECT body, NULL FROM builds WHERE number = ?"
+        rows = self._execute(query, (number,))
+        if not rows:
+            build = self.pickles.loadBuild(number)
+            if build is not None:
+                return build
+            # the pickle may have been migrated since the first query
+            rows = self._execute(query, (number,))
+            if not rows:
+                return None
+
+        body, steps = rows[0]
+        unpickler = Unpickler(StringIO(zlib.decompress(str(body))))
+        if withSteps:
+            # the steps are upgraded (and written back) along with the build
+            unpickler.persistent_load = lambda pid: loads(zlib.decompress(str(steps)))
+            return unpickler.load()
+
+        unpickler.persistent_load = lambda pid: []
+        build = unpickler.load()
+        del build.steps
+        build._loadSteps = lambda: self.loadSteps(build)
+        return build
+
+    def loadSteps(self, build):
+        rows = self._execute("SELECT steps FROM builds WHERE number = ?", (build.number,))
+        if not rows:
+            raise IndexError("no such build %d" % build.number)
+        steps = loads(zlib.decompress(str(rows[0][0])))
+        for step in steps:
+            step.setProcessObjects(build, build.master)
+        versioneds = styles.versionedsToUpgrade
+        styles.doUpgrade()
+        if True in [hasattr(o, 'wasUpgraded') for o in versioneds.values()]:
+            log.msg("re-writing upgraded build steps")
+            self._execute("UPDATE builds SET steps = ? WHERE number = ?",
+                          (self._compress(steps), build.number), commit=True)
+        return steps
+
+    def saveSummary(self, summary):
+        with self._lock:
+            conn = self._connection()
+            cursor = conn.execute("UPDATE builds SET summary = ? WHERE number = ?",
+                                  (self._compress(summary), summary.number))
+            conn.commit()
+            if cursor.rowcount:
+                return
+        # the build is still stored as a pickle
+        self.pickles.saveSummary(summary)
+
+    def loadSummary(self, number):
+        """Returns the summary of the build, or None if it was not saved."""
+        rows = self._execute("SELECT summary FROM builds WHERE number = ?", (number,))
+        if not rows:
+            return self.pickles.loadSummary(number)
+        if rows[0][0] is None:
+            return None
+        return loads(zlib.decompress(str(rows[0][0])))
+
+    def removeBuild(self, number):
+        self._execute("DELETE FROM builds WHERE number = ?", (number,), commit=True)
+        self.pickles.removeBuild(number)
+
+    def pruneBuilds(self, earliest_build, keep=()):
+        keep = list(keep)
+        self._execute("DELETE FROM builds WHERE number < ? AND number NOT IN (%s)" %
+                      ",".join("?" * len(keep)), [earliest_build] + keep, commit=True)
+        self.pickles.pruneBuilds(earliest_build, keep)
+
+    def migrate(self, builder, batchSize=100):
+        """Moves the builds stored as pickle files to the database, removing
+        each pickle once its build is committed. Returns the number of
+        migrated builds."""
+        numbers = self.pickles.buildNumbers()
+        if not numbers:
+            return 0
+
+        log.msg("migrating %d build pickles of builder %s to %s" % (len(numbers), builder.name, self.path))
+        migrated = 0
+        for i in range(0, len(numbers), batchSize):
+            rows = []
+            for number in numbers[i:i + batchSize]:
+                try:
+                    build = self.pickles.loadBuild(number)
+                except (IndexError, ImportError):
+                    log.msg("unable to migrate build %s-#%d" % (builder.name, number))
+                    log.err()
+                    continue
+                if build is None:
+                    continue
+                build.setProcessObjects(builder, builder.master)
+                styles.doUpgrade()
+                rows.append(self._buildRow(build))
+
+            with self._lock:
+                conn = self._connection()
+                conn.executemany("INSERT OR IGNORE INTO builds (%s) VALUES (?, ?, ?, ?, ?, ?, ?, ?)" %
+                                 self.insertColumns, rows)
+                conn.commit()
+            for row in rows:
+                self.pickles.removeBuild(row[0])
+            migrated += len(rows)
+
+        log.msg("migrated %d build pickles of builder %s" % (migrated, builder.name))
+        return migrated
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def makeBuildStore(storage, basedir):
+    if storage == 'sqlite':
+        return SQLiteBuildStore(basedir)
+    return PickleBuildStore(basedir)
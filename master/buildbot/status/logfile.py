@@ -14,6 +14,8 @@
 # Copyright Buildbot Team Members
 
 import os
+import struct
+from bisect import bisect_left
 from cStringIO import StringIO
 from bz2 import BZ2File
 from gzip import GzipFile
@@ -21,7 +23,7 @@ from gzip import GzipFile
 from zope.interface import implements
 from twisted.python import log, runtime
 from twisted.internet import defer, threads, reactor
-from buildbot.util import netstrings
+from buildbot.util import blockgz, netstrings
 from buildbot.util.eventual import eventually
 from buildbot import interfaces
 from twisted.persisted import styles
@@ -204,6 +206,22 @@ class LogFile:
     BUFFERSIZE = 2048
     filename = None # relative to the Builder's basedir
     openfile = None
+    # STDOUT and STDERR newlines written to the file, and whether the last
+    # line written is unterminated
+    lineCount = 0
+    midLine = False
+    # logs written before the line index have neither index nor line count
+    indexed = False
+    indexfile = None
+    # (line counts, file offsets) of the indexed chunks, see _indexChunk
+    _index = None
+    INDEX_INTERVAL = 64*1024
+    INDEX_RECORD = struct.Struct(">QQ")
+    # the 'blockgz' compression of the log while it is written, see
+    # _queueBlocks
+    _blockWriter = None
+    _compressing = None
+    _blocksQueued = 0
 
     def __init__(self, parent, name, logfilename):
         """
@@ -231,6 +249,10 @@ class LogFile:
         if not os.path.exists(dirname):
             os.makedirs(dirname)
         self.openfile = open(fn, "w+")
+        if os.path.exists(self.getIndexFilename()):
+            os.unlink(self.getIndexFilename())
+        self.indexed = True
+        self._index = ([], [])
         self.runEntries = []
         self.watchers = []
         self.finishedWatchers = []
@@ -254,6 +276,14 @@ class LogFile:
         """
         return os.path.join(self.step.build.builder.basedir, self.filename)
 
+    def getIndexFilename(self):
+        """
+        Get the filename of the line index of this log file.
+
+        @returns: filename
+        """
+        return self.getFilename() + ".index"
+
     def hasContents(self):
         """
         Return true if this logfile's contents are available.  For a newly
@@ -324,6 +354,11 @@ class LogFile:
             return BZ2File(self.getFilename() + ".bz2", "r")
         except IOError:
             pass
+        try:
+            return blockgz.BlockGzipFile(self.getFilename() + ".gz",
+                                         self.getFilename() + ".gz.blocks")
+        except IOError:
+            pass
         try:
             return GzipFile(self.getFilename() + ".gz", "r")
         except IOError:
@@ -350,13 +385,15 @@ class LogFile:
         # data, you must insure that nothing will be added to the log during
         # yield() calls.
 
+        return self._getChunksFrom(0, channels, onlyText)
+
+    def _getChunksFrom(self, offset, channels, onlyText):
+        # offset must be the start of a chunk in the file
         f = self.getFile()
         if not self.finished:
-            offset = 0
             f.seek(0, 2)
-            remaining = f.tell()
+            remaining = f.tell() - offset
         else:
-            offset = 0
             remaining = None
 
         leftover = None
@@ -405,6 +442,104 @@ class LogFile:
             else:
                 yield leftover
 
+    def getTextLines(self, first=0, last=None):
+        """Return the STDOUT and STDERR lines numbered from first up to, but
+        excluding, last (or up to the end of the log), counting from 0 in the
+        text returned by getText. Reading starts from the closest indexed
+        chunk before the first line, instead of the start of the file."""
+        if last is not None and last <= first:
+            return []
+        offset, line = self._findLine(first)
+        lines = []
+        current = []
+        for text in self._getChunksFrom(offset, [STDOUT, STDERR], True):
+            pieces = text.split("\n")
+            for piece in pieces[:-1]:
+                if line >= first:
+                    current.append(piece)
+                    lines.append("".join(current) + "\n")
+                current = []
+                line += 1
+                if last is not None and line >= last:
+                    return lines
+            if line >= first and pieces[-1]:
+                current.append(pieces[-1])
+        if current:
+            lines.append("".join(current))
+        return lines
+
+    def getTailLines(self, count):
+        """Return the last count STDOUT and STDERR lines."""
+        return self.getTextLines(max(0, self.getLineCount() - count))
+
+    def getLineCount(self):
+        """Return the number of STDOUT and STDERR lines, including a last
+        line without newline."""
+        if self.indexed:
+            count, midLine = self.lineCount, self.midLine
+            if self.runEntries and self.runEntries[0][0] in (STDOUT, STDERR):
+                count, midLine = _countLines([c[1] for c in self.runEntries], count, midLine)
+        else:
+            count, midLine = _countLines(self.getChunks([STDOUT, STDERR], onlyText=True), 0, False)
+        if midLine:
+            count += 1
+        return count
+
+    def getTextLinesAsync(self, first=0, last=None):
+        return self._read(self.getTextLines, first, last)
+
+    def getTailLinesAsync(self, count):
+        return self._read(self.getTailLines, count)
+
+    def getLineCountAsync(self):
+        return self._read(self.getLineCount)
+
+    def _read(self, fn, *args):
+        # finished logs are not written anymore, so they can be read from a
+        # thread; unfinished ones are read from the reactor
+        if self.finished:
+            return threads.deferToThread(fn, *args)
+        return defer.maybeDeferred(fn, *args)
+
+    def _findLine(self, line):
+        # returns the file offset of the last indexed chunk starting before
+        # the given line, and the number of the line that chunk is part of
+        if line <= 0 or not self.indexed:
+            return 0, 0
+        lines, offsets = self._getIndex()
+        i = bisect_left(lines, line)
+        if i == 0:
+            return 0, 0
+        return offsets[i - 1], lines[i - 1]
+
+    def _getIndex(self):
+        if self._index is None:
+            lines, offsets = [], []
+            try:
+                with open(self.getIndexFilename(), "rb") as f:
+                    data = f.read()
+            except IOError:
+                data = ""
+            size = self.INDEX_RECORD.size
+            for i in range(0, len(data) - size + 1, size):
+                offset, count = self.INDEX_RECORD.unpack_from(data, i)
+                offsets.append(offset)
+                lines.append(count)
+            self._index = (lines, offsets)
+        return self._index
+
+    def _indexChunk(self, offset):
+        # remember where chunks start, every INDEX_INTERVAL bytes, along
+        # with the number of lines before them
+        lines, offsets = self._getIndex()
+        if offset - (offsets[-1] if offsets else 0) < self.INDEX_INTERVAL:
+            return
+        lines.append(self.lineCount)
+        offsets.append(offset)
+        if self.indexfile is None:
+            self.indexfile = open(self.getIndexFilename(), "ab")
+        self.indexfile.write(self.INDEX_RECORD.pack(offset, self.lineCount))
+
     def readlines(self):
         """Return an iterator that produces newline-terminated lines,
         excluding header chunks."""
@@ -445,12 +580,18 @@ class LogFile:
         offset = 0
         while offset < len(text):
             size = min(len(text)-offset, self.chunkSize)
+            if self.indexed:
+                self._indexChunk(f.tell())
             f.write("%d:%d" % (1 + size, channel))
             f.write(text[offset:offset+size])
             f.write(",")
+            if channel in (STDOUT, STDERR):
+                self.lineCount, self.midLine = _countLines([text[offset:offset+size]],
+                                                           self.lineCount, self.midLine)
             offset += size
         self.runEntries = []
         self.runLength = 0
+        self._compressWhileRunning(f)
 
     def addEntry(self, channel, text, _no_watchers=False):
         """
@@ -554,6 +695,25 @@ class LogFile:
         """
         self.addEntry(HEADER, text)
 
+    def addEntries(self, entries):
+        """
+        Add several entries to the logfile at once. Consecutive entries of the
+        same channel are added as a single one.
+
+        @param entries: list of (channel, text), in order
+        """
+        i = 0
+        while i < len(entries):
+            channel = entries[i][0]
+            j = i + 1
+            while j < len(entries) and entries[j][0] == channel:
+                j += 1
+            if j == i + 1:
+                self.addEntry(channel, entries[i][1])
+            else:
+                self.addEntry(channel, "".join([e[1] for e in entries[i:j]]))
+            i = j
+
     def finish(self):
         """
         Finish the logfile, flushing any buffers and preventing any further
@@ -577,6 +737,9 @@ class LogFile:
             # filehandle will be released and automatically closed.
             self.openfile.flush()
             self.openfile = None
+        if self.indexfile:
+            self.indexfile.close()
+            self.indexfile = None
         self.finished = True
         watchers = self.finishedWatchers
         self.finishedWatchers = []
@@ -585,15 +748,59 @@ class LogFile:
         self.watchers = []
 
 
+    def _compressWhileRunning(self, f):
+        # with 'blockgz', the blocks of logs that are already bigger than the
+        # compression limit are compressed as soon as they are complete
+        config = self.master.config
+        if config.logCompressionMethod != "blockgz" or config.logCompressionLimit is False:
+            return
+        end = f.tell()
+        if end <= config.logCompressionLimit or end - self._blocksQueued < blockgz.BLOCK_SIZE:
+            return
+        # the blocks are read from the file by the compression thread
+        f.flush()
+        self._queueBlocks(end)
+
+    def _queueBlocks(self, end, final=False):
+        # compress the complete blocks of the log file up to end, and the
+        # remaining data too if final, in a thread. The compressions are
+        # chained so that the blocks are written in order.
+        if self._compressing is None:
+            self._compressing = defer.succeed(None)
+        self._blocksQueued = end
+        self._compressing.addCallback(
+            lambda _: threads.deferToThread(self._writeBlocks, end, final))
+        return self._compressing
+
+    def _writeBlocks(self, end, final):
+        if self._blockWriter is None:
+            self._blockWriter = blockgz.BlockGzipWriter(
+                self.getFilename() + ".gz.tmp", self.getFilename() + ".gz.blocks.tmp")
+        writer = self._blockWriter
+        with open(self.getFilename(), "rb") as f:
+            f.seek(writer.offset)
+            while writer.offset < end:
+                size = min(blockgz.BLOCK_SIZE, end - writer.offset)
+                if size < blockgz.BLOCK_SIZE and not final:
+                    break
+                data = f.read(size)
+                if not data:
+                    break
+                writer.writeBlock(data)
+        if final:
+            self._blockWriter = None
+            writer.close()
+
     def compressLog(self):
         logCompressionMethod = self.master.config.logCompressionMethod
         # bail out if there's no compression support
         if logCompressionMethod == "bz2":
             compressed = self.getFilename() + ".bz2.tmp"
-        elif logCompressionMethod == "gz":
+        elif logCompressionMethod in ("gz", "blockgz"):
             compressed = self.getFilename() + ".gz.tmp"
         else:
             return defer.succeed(None)
+        compressedIndex = self.getFilename() + ".gz.blocks.tmp"
 
         def _compressLog():
             infile = self.getFile()
@@ -608,7 +815,12 @@ class LogFile:
                 if len(buf) < bufsize:
                     break
             cf.close()
-        d = threads.deferToThread(_compressLog)
+        if logCompressionMethod == "blockgz":
+            # only the blocks that were not compressed while the log was
+            # written remain
+            d = self._queueBlocks(os.path.getsize(self.getFilename()), final=True)
+        else:
+            d = threads.deferToThread(_compressLog)
 
         def _renameCompressedLog(rv):
             if logCompressionMethod == "bz2":
@@ -624,13 +836,23 @@ class LogFile:
                     os.unlink(filename)
             if not os.path.exists(filename):
                 os.rename(compressed, filename)
+                if logCompressionMethod == "blockgz":
+                    # readers use the file as a plain gzip file until its
+                    # index is in place
+                    if runtime.platformType  == 'win32' and os.path.exists(filename + '.blocks'):
+                        os.unlink(filename + '.blocks')
+                    os.rename(compressedIndex, filename + '.blocks')
             _tryremove(self.getFilename(), 1, 5)
         d.addCallback(_renameCompressedLog)
 
         def _cleanupFailedCompress(failure):
             log.msg("failed to compress %s" % self.getFilename())
-            if os.path.exists(compressed):
-                _tryremove(compressed, 1, 5)
+            if self._blockWriter is not None:
+                self._blockWriter.abort()
+                self._blockWriter = None
+            for tmp in (compressed, compressedIndex):
+                if os.path.exists(tmp):
+                    _tryremove(tmp, 1, 5)
             failure.trap() # reraise the failure
         d.addErrback(_cleanupFailedCompress)
         return d
@@ -649,6 +871,11 @@ class LogFile:
         d['entries'] = []  # let 0.6.4 tolerate the saved log. TODO: really?
         self.deleteKey('finished', d)
         self.deleteKey('openfile', d)
+        self.deleteKey('indexfile', d)
+        self.deleteKey('_index', d)
+        self.deleteKey('_blockWriter', d)
+        self.deleteKey('_compressing', d)
+        self.deleteKey('_blocksQueued', d)
 
     def __getstate__(self):
         d = self.__dict__.copy()
@@ -705,6 +932,14 @@ class HTMLLogFile(styles.Versioned, LogFile):
         self.wasUpgraded = True
 
 
+def _countLines(texts, count, midLine):
+    for text in texts:
+        if text:
+            count += text.count("\n")
+            midLine = not text.endswith("\n")
+    return count, midLine
+
+
 def _tryremove(filename, timeout, retries):
     """Try to remove a file, and if failed, try again in timeout.
     Increases the timeout by a factor of 4, and only keeps trying for
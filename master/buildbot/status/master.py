@@ -19,7 +19,7 @@ import os, urllib
 from cPickle import load
 from twisted.python import log
 from twisted.persisted import styles
-from twisted.internet import defer
+from twisted.internet import defer, threads
 from twisted.application import service
 from zope.interface import implements
 from buildbot import config, interfaces, util
@@ -27,7 +27,7 @@ from buildbot.status.web.base import getCodebasesArg, _revlinkcfg
 from buildbot.util import bbcollections
 from buildbot.util.eventual import eventually
 from buildbot.changes import changes
-from buildbot.status import buildset, builder, buildrequest
+from buildbot.status import buildset, builder, buildrequest, buildstore, buildloader
 from buildbot.status.results import RETRY
 from datetime import datetime, timedelta
 
@@ -52,6 +52,8 @@ class Status(config.ReconfigurableServiceMixin, service.MultiService):
         self._change_sub = None
         self.rev_url_func = None
         self.total_builds_lastday = {}
+        # sized from the configuration in reconfigService
+        self.buildLoader = buildloader.BuildLoader()
 
     # service management
 
@@ -95,6 +97,8 @@ class Status(config.ReconfigurableServiceMixin, service.MultiService):
             sr.master = self.master
             sr.setServiceParent(self)
 
+        self.buildLoader.setSize(new_config.buildLoaderThreads)
+
         # reconfig any newly-added change sources, as well as existing
         yield config.ReconfigurableServiceMixin.reconfigService(self,
                                                             new_config)
@@ -257,12 +261,19 @@ class Status(config.ReconfigurableServiceMixin, service.MultiService):
                     break
             else:
                 return None
-            return prefix + "projects/%s/builders/%s/builds/%d/steps/%s/logs/%s" % (
-                urllib.quote(proj, safe=''),
-                urllib.quote(bldr.getName(), safe=''),
-                build.getNumber(),
-                urllib.quote(step.getName(), safe=''),
-                urllib.quote(loog.getName(), safe=''))
+            return self.getURLForLog(proj, bldr.getName(), build.getNumber(),
+                                     step.getName(), loog.getName())
+
+    def getURLForLog(self, project, builder_name, build_number, step_name, log_name):
+        prefix = self.getBuildbotURL()
+        if not prefix:
+            return None
+        return prefix + "projects/%s/builders/%s/builds/%d/steps/%s/logs/%s" % (
+            urllib.quote(project, safe=''),
+            urllib.quote(builder_name, safe=''),
+            build_number,
+            urllib.quote(step_name, safe=''),
+            urllib.quote(log_name, safe=''))
 
     def getChangeSources(self):
         return list(self.master.change_svc)
@@ -359,7 +370,8 @@ class Status(config.ReconfigurableServiceMixin, service.MultiService):
         defer.returnValue(self.total_builds_lastday[lastday])
 
     @defer.inlineCallbacks
-    def generateFinishedBuildsAsync(self, num_builds=15, results=None, slavename=None):
+    def generateFinishedBuildsAsync(self, num_builds=15, results=None, slavename=None, summaries=False,
+                                    priority=buildloader.INTERACTIVE):
         #TODO: support filter by RETRY result
         results_filter = [r for r in results if r is not None and r != RETRY] if results else []
         lastBuilds = yield self.master.db.builds.getLastsBuildsNumbersBySlave(slavename, results_filter, num_builds)
@@ -372,8 +384,14 @@ class Status(config.ReconfigurableServiceMixin, service.MultiService):
         all_builds = []
         for bn in builder_names:
             b = self.getBuilder(bn)
-            finished_builds = yield b.getFinishedBuildsByNumbers(buildnumbers=lastBuilds[bn],
-                                                                 results=results)
+            if summaries:
+                finished_builds = yield b.getFinishedBuildSummariesByNumbers(buildnumbers=lastBuilds[bn],
+                                                                             results=results,
+                                                                             priority=priority)
+            else:
+                finished_builds = yield b.getFinishedBuildsByNumbers(buildnumbers=lastBuilds[bn],
+                                                                     results=results,
+                                                                     priority=priority)
             all_builds.extend(finished_builds)
 
         sorted_builds = sorted(all_builds, key=lambda build: build.finished, reverse=True)
@@ -499,7 +517,15 @@ class Status(config.ReconfigurableServiceMixin, service.MultiService):
 
         if not os.path.isdir(builder_status.basedir):
             os.makedirs(builder_status.basedir)
+        store = buildstore.makeBuildStore(self.master.config.buildStatusStorage,
+                                          builder_status.basedir)
+        builder_status.setBuildStore(store)
+        builder_status.setBuildLoader(self.buildLoader)
         builder_status.determineNextBuildNumber()
+        if isinstance(store, buildstore.SQLiteBuildStore):
+            # the builds are read from their pickles until they are migrated
+            d = threads.deferToThread(store.migrate, builder_status)
+            d.addErrback(log.err, "while migrating the builds of %s" % name)
 
         builder_status.setBigState("offline")
 
@@ -0,0 +1,108 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Unity Technologies
+
+"""Publish side of the NATS protocol
+
+."""
+
+from collections import deque
+import json
+
+from twisted.internet import defer, protocol
+from twisted.protocols import basic
+from twisted.python import log
+
+
+class NatsProtocol(basic.LineReceiver):
+    """Publishes messages to a NATS server without waiting for each of them.
+
+    Messages are written as soon as they are published. flush() sends a PING
+    and the PONG of the server acknowledges everything written before it, so
+    several batches can be in flight at the same time."""
+
+    delimiter = '\r\n'
+
+    def __init__(self):
+        self.serverInfo = {}
+        # Bytes written and not acknowledged yet by a PONG.
+        self.inflightBytes = 0
+        # Bytes written since the last PING.
+        self._unflushedBytes = 0
+        # (bytes, Deferred) for each PING waiting for its PONG.
+        self._pings = deque()
+
+    def connectionMade(self):
+        options = dict(verbose=False, pedantic=False, name=self.factory.name)
+        self.sendLine('CONNECT %s' % json.dumps(options, separators=(',', ':'), sort_keys=True))
+        self.factory.clientConnected(self)
+
+    def connectionLost(self, reason):
+        pings, self._pings = self._pings, deque()
+        self.inflightBytes = self._unflushedBytes = 0
+        self.factory.clientDisconnected(self)
+        # Fail the newest first so the items queued back keep their order.
+        for _, d in reversed(pings):
+            d.errback(reason)
+
+    def lineReceived(self, line):
+        op, _, args = line.partition(' ')
+        op = op.upper()
+        if op == 'PING':
+            self.sendLine('PONG')
+        elif op == 'PONG':
+            if self._pings:
+                nbytes, d = self._pings.popleft()
+                self.inflightBytes -= nbytes
+                d.callback(None)
+        elif op == 'INFO':
+            self.serverInfo = json.loads(args)
+        elif op == '-ERR':
+            log.msg("NATS server error: %s" % args)
+
+    def publish(self, subject, payload):
+        data = 'PUB %s %d\r\n%s\r\n' % (subject, len(payload), payload)
+        self.transport.write(data)
+        self.inflightBytes += len(data)
+        self._unflushedBytes += len(data)
+
+    def flush(self):
+        """Returns a Deferred fired once the server has processed all the
+        messages published so far, or errbacked if the connection is lost."""
+        d = defer.Deferred()
+        self._pings.append((self._unflushedBytes, d))
+        self._unflushedBytes = 0
+        self.sendLine('PING')
+        return d
+
+
+class NatsClientFactory(protocol.ReconnectingClientFactory):
+    """Keeps a connection to a NATS server, reconnecting with an exponential
+    backoff up to maxDelay seconds."""
+
+    protocol = NatsProtocol
+    maxDelay = 60
+
+    def __init__(self, name='katana'):
+        self.name = name
+        # Connected NatsProtocol instance, or None.
+        self.client = None
+
+    def clientConnected(self, client):
+        self.resetDelay()
+        self.client = client
+
+    def clientDisconnected(self, client):
+        if self.client is client:
+            self.client = None
@@ -18,6 +18,7 @@ from __future__ import with_statement
 
 from collections import deque
 import os
+import struct
 import cPickle as pickle
 
 from zope.interface import implements, Interface
@@ -247,6 +248,250 @@ class DiskQueue(object):
             self.lastItemId = files[-1]
 
 
+class _Segment(object):
+    """An append-only file of length prefixed records."""
+
+    header = struct.Struct('>I')
+
+    def __init__(self, path, seq):
+        self.path = path
+        self.seq = seq
+        # Offset of each record in the file.
+        self.offsets = []
+        # Number of records already popped.
+        self.consumed = 0
+        # End of the last complete record.
+        self.size = 0
+        self._reader = None
+        self._writer = None
+
+    def load(self):
+        """Indexes the records of the file, dropping a truncated last record."""
+        with open(self.path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            fileSize = f.tell()
+            pos = 0
+            while pos + self.header.size <= fileSize:
+                f.seek(pos)
+                length, = self.header.unpack(f.read(self.header.size))
+                end = pos + self.header.size + length
+                if end > fileSize:
+                    break
+                self.offsets.append(pos)
+                pos = end
+        self.size = pos
+        if self.size < fileSize:
+            with open(self.path, 'r+b') as f:
+                f.truncate(self.size)
+
+    def nbItems(self):
+        return len(self.offsets) - self.consumed
+
+    def append(self, records):
+        if self._writer is None:
+            self._writer = open(self.path, 'ab')
+        buf = []
+        for data in records:
+            self.offsets.append(self.size)
+            buf.append(self.header.pack(len(data)))
+            buf.append(data)
+            self.size += self.header.size + len(data)
+        self._writer.write(''.join(buf))
+        self._writer.flush()
+
+    def read(self, index):
+        if self._reader is None:
+            self._reader = open(self.path, 'rb')
+        self._reader.seek(self.offsets[index])
+        length, = self.header.unpack(self._reader.read(self.header.size))
+        return self._reader.read(length)
+
+    def close(self):
+        for f in (self._reader, self._writer):
+            if f is not None:
+                f.close()
+        self._reader = self._writer = None
+
+    def remove(self):
+        self.close()
+        os.remove(self.path)
+
+
+class SegmentDiskQueue(object):
+    """Keeps a list of abstract items in append-only segment files.
+
+    Unlike DiskQueue, which writes a file per item, the items are appended to
+    a segment file until it holds segmentItems items, then a new segment is
+    started. Each segment keeps the offsets of its items in memory so an item
+    is popped with a single read, and a segment file is deleted once all its
+    items are popped. The number of items popped from each segment is saved
+    in a small state file after each popChunk().
+
+    Pushed items are written by batches of flushItems, so up to flushItems
+    items can be lost if the master dies before save() is called. Items popped
+    since the last saved state are read again after a crash."""
+    implements(IQueue)
+
+    SUFFIX = '.segment'
+    STATE_FILE = 'consumed'
+
+    def __init__(self, path, maxItems=None, pickleFn=pickle.dumps,
+                 unpickleFn=pickle.loads, segmentItems=1000, flushItems=100):
+        """
+        @path: directory to save the segments.
+        @maxItems: maximum number of items to keep on disk, flush the
+        older ones.
+        @pickleFn: function used to pack the items to disk.
+        @unpickleFn: function used to unpack items from disk.
+        @segmentItems: number of items written to a segment before starting
+        a new one.
+        @flushItems: number of pushed items buffered before writing them.
+        """
+        self.path = path
+        self._maxItems = maxItems
+        if self._maxItems is None:
+            self._maxItems = 100000
+        if not os.path.isdir(self.path):
+            os.mkdir(self.path)
+        self.pickleFn = pickleFn
+        self.unpickleFn = unpickleFn
+        self.segmentItems = segmentItems
+        self.flushItems = flushItems
+
+        self._segments = deque()
+        # Pushed items not written yet to the last segment.
+        self._pending = []
+        self._nbItems = 0
+        self._lastSeq = 0
+        self._loadFromDisk()
+
+    def pushItem(self, item):
+        ret = None
+        if self._nbItems == self._maxItems:
+            ret = self._popItem()
+        tail = self._segments[-1] if self._segments else None
+        if tail is None or len(tail.offsets) + len(self._pending) >= self.segmentItems:
+            self._flush()
+            self._segments.append(self._newSegment(self._lastSeq + 1))
+        self._pending.append(self.pickleFn(item))
+        self._nbItems += 1
+        if len(self._pending) >= self.flushItems:
+            self._flush()
+        return ret
+
+    def insertBackChunk(self, chunk):
+        ret = None
+        excess = self._nbItems + len(chunk) - self._maxItems
+        if excess > 0:
+            ret = chunk[0:excess]
+            chunk = chunk[excess:]
+        if chunk:
+            # Segments are append-only, the items go in a new first segment.
+            if self._segments:
+                seq = self._segments[0].seq - 1
+            else:
+                seq = self._lastSeq + 1
+            segment = self._newSegment(seq)
+            segment.append([self.pickleFn(i) for i in chunk])
+            self._segments.appendleft(segment)
+            self._nbItems += len(chunk)
+            self._saveState()
+        return ret
+
+    def popChunk(self, nbItems=None):
+        if nbItems is None:
+            nbItems = self._maxItems
+        ret = []
+        while self._nbItems and len(ret) < nbItems:
+            ret.append(self._popItem())
+        if ret:
+            self._saveState()
+        return ret
+
+    def save(self):
+        self._flush()
+        self._saveState()
+
+    def items(self):
+        """Reads all the items, slow."""
+        self._flush()
+        ret = []
+        for segment in self._segments:
+            for index in range(segment.consumed, len(segment.offsets)):
+                ret.append(self.unpickleFn(segment.read(index)))
+        return ret
+
+    def nbItems(self):
+        return self._nbItems
+
+    def maxItems(self):
+        return self._maxItems
+
+    #### Protected functions
+
+    def _newSegment(self, seq):
+        self._lastSeq = max(self._lastSeq, seq)
+        return _Segment(os.path.join(self.path, '%d%s' % (seq, self.SUFFIX)), seq)
+
+    def _flush(self):
+        if self._pending:
+            self._segments[-1].append(self._pending)
+            self._pending = []
+
+    def _popItem(self):
+        segment = self._segments[0]
+        if not segment.nbItems():
+            # Only the last segment can be waiting for its items to be written.
+            self._flush()
+        item = self.unpickleFn(segment.read(segment.consumed))
+        segment.consumed += 1
+        self._nbItems -= 1
+        if not segment.nbItems() and not (segment is self._segments[-1] and self._pending):
+            self._segments.popleft()
+            segment.remove()
+            self._saveState()
+        return item
+
+    def _saveState(self):
+        path = os.path.join(self.path, self.STATE_FILE)
+        lines = ['%d %d\n' % (s.seq, s.consumed) for s in self._segments if s.consumed]
+        if lines:
+            WriteFile(path + '.tmp', ''.join(lines))
+            os.rename(path + '.tmp', path)
+        elif os.path.exists(path):
+            os.remove(path)
+
+    def _loadFromDisk(self):
+        """Indexes the segments left on disk."""
+        consumed = {}
+        path = os.path.join(self.path, self.STATE_FILE)
+        if os.path.isfile(path):
+            for line in ReadFile(path).splitlines():
+                seq, count = line.split()
+                consumed[int(seq)] = int(count)
+        # A state entry of a deleted segment must not apply to a new one.
+        if consumed:
+            self._lastSeq = max(consumed)
+
+        seqs = []
+        for name in os.listdir(self.path):
+            if name.endswith(self.SUFFIX):
+                try:
+                    seqs.append(int(name[:-len(self.SUFFIX)]))
+                except ValueError:
+                    pass
+        for seq in sorted(seqs):
+            segment = self._newSegment(seq)
+            segment.load()
+            segment.consumed = min(consumed.get(seq, 0), len(segment.offsets))
+            if segment.nbItems():
+                self._segments.append(segment)
+                self._nbItems += segment.nbItems()
+            else:
+                segment.remove()
+        self._saveState()
+
+
 class PersistentQueue(object):
     """Keeps a list of abstract items and serializes it to the disk.
 
@@ -257,18 +502,23 @@ class PersistentQueue(object):
     """
     implements(IQueue)
 
-    def __init__(self, primaryQueue=None, secondaryQueue=None, path=None):
+    def __init__(self, primaryQueue=None, secondaryQueue=None, path=None,
+                 segmented=False):
         """
         @primaryQueue: memory queue to use before buffering to disk.
         @secondaryQueue: disk queue to use as permanent buffer.
         @path: path is a shortcut when using default DiskQueue settings.
+        @segmented: use a SegmentDiskQueue instead of a DiskQueue with path.
         """
         self.primaryQueue = primaryQueue
         if self.primaryQueue is None:
             self.primaryQueue = MemoryQueue()
         self.secondaryQueue = secondaryQueue
         if self.secondaryQueue is None:
-            self.secondaryQueue = DiskQueue(path)
+            if segmented:
+                self.secondaryQueue = SegmentDiskQueue(path)
+            else:
+                self.secondaryQueue = DiskQueue(path)
         # Preload data from the secondary queue only if we know we won't start
         # using the secondary queue right away.
         if self.secondaryQueue.nbItems() < self.primaryQueue.maxItems():
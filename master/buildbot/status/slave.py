@@ -17,6 +17,7 @@ import time
 from zope.interface import implements
 from buildbot import interfaces
 from buildbot.status.results import WARNINGS, EXCEPTION, FAILURE, SUCCESS, RESUME, CANCELED, NOT_REBUILT
+from buildbot.status.buildloader import BACKGROUND
 from buildbot.util.eventual import eventually
 from twisted.internet import defer
 
@@ -143,7 +144,8 @@ class SlaveStatus:
     @defer.inlineCallbacks
     def getRecentBuilds(self, num_builds=15):
         status = self.master.status
-        builds = yield status.generateFinishedBuildsAsync(num_builds=num_builds, slavename=self.name)
+        builds = yield status.generateFinishedBuildsAsync(num_builds=num_builds, slavename=self.name,
+                                                          summaries=True, priority=BACKGROUND)
         defer.returnValue(builds)
 
     @defer.inlineCallbacks
@@ -18,20 +18,26 @@
 
 ."""
 
-from buildbot import config
-import pynats
 import json
+import urlparse
+
+from twisted.internet import defer, reactor
+from twisted.python import log
 
+from buildbot import config
+from buildbot.status.natsprotocol import NatsClientFactory
 from buildbot.status.status_queue import QueuedStatusPush
 
 
 class NatsStatusPush(QueuedStatusPush):
     """Event streamer to a Nats server."""
 
-    def __init__(self, serverUrl, subject="katana", **kwargs):
+    def __init__(self, serverUrl, subject="katana", maxInflightBytes=2 ** 22, batchEvents=False, **kwargs):
         """
         @serverUrl: The Nats server to be used to push events notifications to.
         @subject: The subject to use when publishing data
+        @maxInflightBytes: stop publishing while this many bytes are not acknowledged by the server.
+        @batchEvents: publish a json list of the events of each subject instead of one message per event.
         """
         if not serverUrl:
             raise config.ConfigErrors(['NatsStatusPush requires a serverUrl'])
@@ -39,22 +45,67 @@ class NatsStatusPush(QueuedStatusPush):
         # Parameters.
         self.serverUrl = serverUrl
         self.subject = subject
-        self.client = None
+        self.maxInflightBytes = maxInflightBytes
+        self.batchEvents = batchEvents
+
+        url = urlparse.urlparse(serverUrl)
+        self.host = url.hostname or 'localhost'
+        self.port = url.port or 4222
+        self.factory = NatsClientFactory()
+        self.connector = None
 
         # Use the unbounded method.
         QueuedStatusPush.__init__(self, **kwargs)
 
+    def startService(self):
+        self.connector = reactor.connectTCP(self.host, self.port, self.factory)
+        QueuedStatusPush.startService(self)
+
+    @defer.inlineCallbacks
+    def stopService(self):
+        yield QueuedStatusPush.stopService(self)
+        # the last events are still written before the connection is closed
+        self.factory.stopTrying()
+        if self.connector:
+            self.connector.disconnect()
+            self.connector = None
+
+    def formatMessages(self, items):
+        """Returns the (subject, payload) of the messages to publish."""
+        def subject(item):
+            return '%s.%s' % (self.subject, item.get('event', 'unknown'))
+
+        if not self.batchEvents:
+            return [(subject(item), json.dumps(item, separators=(',', ':'))) for item in items]
+
+        subjects = []
+        events = {}
+        for item in items:
+            s = subject(item)
+            if s not in events:
+                subjects.append(s)
+                events[s] = []
+            events[s].append(item)
+        return [(s, json.dumps(events[s], separators=(',', ':'))) for s in subjects]
+
     def pushData(self, _, items):
-        try:
-            if self.client is None:
-                self.client = pynats.Connection(self.serverUrl, verbose=True)
-                self.client.connect()
-
-            for item in items:
-                json_str = json.dumps(item, separators=(',', ':'))
-                self.client.publish('%s.%s' % (self.subject, item.get('event', 'unknown')), json_str)
-
-            return True, None
-        except pynats.connection.SocketError as e:
-            self.client = None
-            return False, e
+        client = self.factory.client
+        if client is None:
+            return False, 'not connected'
+        if client.inflightBytes >= self.maxInflightBytes:
+            return False, '%d bytes not acknowledged yet' % client.inflightBytes
+
+        for subject, payload in self.formatMessages(items):
+            client.publish(subject, payload)
+        d = client.flush()
+        d.addErrback(self._publishFailed, items)
+        return True, None
+
+    def _publishFailed(self, reason, items):
+        """The connection was lost before the server acknowledged the items."""
+        log.msg('Lost %d events sent to %s: %s' % (len(items), self.serverUrl, reason.getErrorMessage()))
+        self.queue.insertBackChunk(items)
+        if self.stopped:
+            self.queue.save()
+        self.lastPushWasSuccessful = False
+        self.queueNextServerPush()
@@ -19,7 +19,7 @@
 ."""
 
 from buildbot.status.status_push import StatusPush
-from buildbot.status.persistent_queue import DiskQueue, MemoryQueue, PersistentQueue
+from buildbot.status.persistent_queue import DiskQueue, MemoryQueue, PersistentQueue, SegmentDiskQueue
 
 from twisted.python import log
 import json
@@ -28,7 +28,7 @@ import json
 class QueuedStatusPush(StatusPush):
 
     def __init__(self, debug=None, maxMemoryItems=None, maxDiskItems=None, chunkSize=200, maxPushSize=2 ** 20,
-                 **kwargs):
+                 segmentedDiskQueue=False, **kwargs):
         """
         @serverUrl: The Nats server to be used to push events notifications to.
         @subject: The subject to use when publishing data
@@ -37,6 +37,7 @@ class QueuedStatusPush(StatusPush):
         @debug: Save the json with nice formatting.
         @chunkSize: maximum number of items to send in each at each PUSH.
         @maxPushSize: limits the size of encoded data for AE, the default is 1MB.
+        @segmentedDiskQueue: buffer to append-only segment files instead of a file per item.
         """
         # Parameters.
         self.debug = debug
@@ -47,9 +48,13 @@ class QueuedStatusPush(StatusPush):
         if maxDiskItems != 0:
             # The queue directory is determined by the server url.
             path = 'queue_%s' % (self.eventName())
+            if segmentedDiskQueue:
+                diskQueue = SegmentDiskQueue(path, maxItems=maxDiskItems)
+            else:
+                diskQueue = DiskQueue(path, maxItems=maxDiskItems)
             queue = PersistentQueue(
                         primaryQueue=MemoryQueue(maxItems=maxMemoryItems),
-                        secondaryQueue=DiskQueue(path, maxItems=maxDiskItems))
+                        secondaryQueue=diskQueue)
         else:
             path = None
             queue = MemoryQueue(maxItems=maxMemoryItems)
@@ -42,6 +42,7 @@ from buildbot.status.web.buildstatus import BuildStatusStatusResource
 from buildbot.status.web.slaves import BuildSlavesResource
 from buildbot.status.web.loginkatana import LoginKatanaResource, LogoutKatanaResource
 from buildbot.status.web.status_json import JsonStatusResource
+from buildbot.status.web.jsoncache import JsonResponseCache
 from buildbot.status.web.about import AboutBuildbot
 from buildbot.status.web.projects import ProjectsResource
 from buildbot.status.web.authz import Authz
@@ -374,6 +375,10 @@ class WebStatus(service.MultiService):
         # keep track of cached connections so we can break them when we shut
         # down. See ticket #102 for more details.
         self.channels = weakref.WeakKeyDictionary()
+
+        # the json responses shared by the clients, until the builds or
+        # build requests they describe change
+        self.jsonCache = JsonResponseCache()
         
         # do we want to allow change_hook
         self.change_hook_dialects = {}
@@ -562,8 +567,13 @@ class WebStatus(service.MultiService):
     def registerChannel(self, channel):
         self.channels[channel] = 1 # weakrefs
 
+    def startService(self):
+        service.MultiService.startService(self)
+        self.jsonCache.startWatching(self.getStatus())
+
     @defer.inlineCallbacks
     def stopService(self):
+        self.jsonCache.stopWatching()
         for channel in self.channels:
             try:
                 channel.transport.loseConnection()
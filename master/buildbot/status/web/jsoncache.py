@@ -0,0 +1,223 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Unity Technologies
+
+from collections import OrderedDict
+
+from zope.interface import implements
+from twisted.internet import reactor
+from twisted.internet.interfaces import IConsumer
+from buildbot import util
+from buildbot.db import events
+from buildbot.process import metrics
+from buildbot.status.base import StatusReceiverBase
+
+
+class CachedResponse(object):
+
+    def __init__(self, body, etag, builderNames, expires):
+        self.body = body
+        self.etag = etag
+        self.builderNames = builderNames
+        self.expires = expires
+
+
+class ResponseRecorder(object):
+    """Writes to a request, keeping what is written for the cache."""
+
+    implements(IConsumer)
+
+    def __init__(self, request):
+        self.request = request
+        self.written = []
+        # whether the connection was lost before the response was complete
+        self.lost = False
+        request.notifyFinish().addErrback(self._connectionLost)
+
+    def _connectionLost(self, _):
+        self.lost = True
+
+    def registerProducer(self, producer, streaming):
+        self.request.registerProducer(producer, streaming)
+
+    def unregisterProducer(self):
+        self.request.unregisterProducer()
+
+    def write(self, data):
+        self.written.append(data)
+        self.request.write(data)
+
+    def getvalue(self):
+        return "".join(self.written)
+
+
+class JsonResponseCache(StatusReceiverBase):
+    """The serialized json responses of the resources describing builders,
+    by request path and arguments.
+
+    A response is dropped when a build of one of the builders it describes
+    starts or finishes, when a build request is submitted or cancelled for
+    one of them, or when their state changes, and at the latest after the
+    lifetime given when it is stored. The build requests claimed, unclaimed
+    or completed by any master are read from the master events. While a
+    build runs, the responses of its builder are also dropped when a step
+    starts or finishes and every updateInterval seconds, for its ETA.
+    """
+
+    # arguments that do not change the response, like jQuery's cache buster
+    ignoredArgs = ('_',)
+
+    updateInterval = 10
+
+    requestEvents = (events.BUILDREQUEST_ADDED, events.BUILDREQUEST_CLAIMED,
+                     events.BUILDREQUEST_UNCLAIMED, events.BUILDREQUEST_COMPLETED,
+                     events.BUILDREQUEST_CANCELLED)
+
+    def __init__(self, maxSize=200, _reactor=reactor):
+        self.maxSize = maxSize
+        self._reactor = _reactor
+        self.responses = OrderedDict()
+        # builder name -> keys of the responses describing it
+        self.byBuilder = {}
+        # builder name -> invalidation counter when it was last invalidated
+        self.invalidated = {}
+        self.counter = 0
+        # the etags are unique to this cache, so that a response cached by a
+        # previous instance is not taken for a current one
+        self.etagPrefix = "%x" % int(util.now(_reactor) * 1000)
+        self.builders = {}
+        self.status = None
+        self.eventSubscription = None
+
+    def makeKey(self, request):
+        args = tuple(sorted((name, tuple(values)) for name, values in request.args.iteritems()
+                            if values and name not in self.ignoredArgs))
+        return (request.path, args)
+
+    def get(self, key):
+        response = self.responses.pop(key, None)
+        if response is not None and response.expires <= util.now(self._reactor):
+            self._forget(key, response)
+            response = None
+        if response is None:
+            metrics.MetricCountEvent.log('JsonResponseCache.misses', 1)
+            return None
+        # most recently used last
+        self.responses[key] = response
+        metrics.MetricCountEvent.log('JsonResponseCache.hits', 1)
+        return response
+
+    def begin(self):
+        """Returns the token to give to put for a response computed from
+        now on."""
+        self.counter += 1
+        return self.counter
+
+    def makeETag(self, token):
+        return '"%s-%x"' % (self.etagPrefix, token)
+
+    def put(self, key, token, body, etag, builderNames, lifetime):
+        """Stores the response, unless one of its builders was invalidated
+        since begin returned token."""
+        for name in builderNames:
+            if self.invalidated.get(name, 0) > token:
+                return
+        old = self.responses.pop(key, None)
+        if old is not None:
+            self._forget(key, old)
+        self.responses[key] = CachedResponse(body, etag, builderNames,
+                                             util.now(self._reactor) + lifetime)
+        for name in builderNames:
+            self.byBuilder.setdefault(name, set()).add(key)
+        while len(self.responses) > self.maxSize:
+            key, response = self.responses.popitem(last=False)
+            self._forget(key, response)
+
+    def _forget(self, key, response):
+        for name in response.builderNames:
+            keys = self.byBuilder.get(name)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.byBuilder[name]
+
+    def invalidate(self, builderName):
+        self.counter += 1
+        self.invalidated[builderName] = self.counter
+        for key in self.byBuilder.pop(builderName, ()):
+            response = self.responses.pop(key, None)
+            if response is not None:
+                self._forget(key, response)
+
+    def clear(self):
+        self.responses.clear()
+        self.byBuilder.clear()
+
+    # status events
+
+    def startWatching(self, status):
+        self.status = status
+        status.subscribe(self)
+        self.eventSubscription = status.master.subscribeToMasterEvents(self.masterEvent)
+
+    def stopWatching(self):
+        if self.eventSubscription is not None:
+            self.eventSubscription.unsubscribe()
+            self.eventSubscription = None
+        if self.status is not None:
+            self.status.unsubscribe(self)
+            self.status = None
+        for builder_status in self.builders.values():
+            builder_status.unsubscribe(self)
+        self.builders = {}
+        self.clear()
+
+    def builderAdded(self, builderName, builder, friendly_name=None):
+        self.builders[builderName] = builder
+        self.invalidate(builderName)
+        return self
+
+    def builderRemoved(self, builderName):
+        self.builders.pop(builderName, None)
+        self.invalidate(builderName)
+
+    def builderChangedState(self, builderName, state):
+        self.invalidate(builderName)
+
+    def requestSubmitted(self, request):
+        self.invalidate(request.getBuilderName())
+
+    def requestCancelled(self, builder, request):
+        self.invalidate(request.getBuilderName())
+
+    def buildStarted(self, builderName, build):
+        self.invalidate(builderName)
+        # the responses include the current step and ETA of the build
+        return self, self.updateInterval
+
+    def buildETAUpdate(self, build, ETA):
+        self.invalidate(build.getBuilder().getName())
+
+    def stepStarted(self, build, step):
+        self.invalidate(build.getBuilder().getName())
+
+    def stepFinished(self, build, step, results):
+        self.invalidate(build.getBuilder().getName())
+
+    def buildFinished(self, builderName, build, results):
+        self.invalidate(builderName)
+
+    def masterEvent(self, evdict):
+        if evdict['event'] in self.requestEvents and evdict['buildername']:
+            self.invalidate(evdict['buildername'])
@@ -0,0 +1,217 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Unity Technologies
+
+import json
+from types import GeneratorType
+
+from zope.interface import implements
+from twisted.internet import defer, reactor, task
+from twisted.internet.interfaces import IPushProducer
+
+
+class _Child(object):
+
+    def __init__(self, value, prefix, depth):
+        self.value = value
+        self.prefix = prefix
+        self.depth = depth
+
+
+class _Result(object):
+
+    def __init__(self, value):
+        self.value = value
+
+
+class JsonStreamEncoder(object):
+    """Encodes data as JSON into a consumer, such as a twisted.web request, as
+    it is produced.
+
+    Besides the types handled by json.dumps, the data may contain Deferreds
+    and callables returning data (or a Deferred), which are waited for (or
+    called) when the encoder reaches them, and generators, which are encoded
+    as lists. The output is written in pieces of about bufferSize bytes, and
+    the encoder stops while the consumer is paused.
+
+    With filterOut, the empty values are left out as FilterOut does, and
+    without compact, the output is indented and sorted as by
+    json.dumps(data, sort_keys=True, indent=2)."""
+
+    implements(IPushProducer)
+
+    bufferSize = 64*1024
+
+    def __init__(self, consumer, filterOut=False, compact=True, _reactor=reactor):
+        self.consumer = consumer
+        self.filterOut = filterOut
+        self.compact = compact
+        self._reactor = _reactor
+        self._buffer = []
+        self._buffered = 0
+        self._flushed = False
+        self._paused = None
+        self.stopped = False
+
+    def pauseProducing(self):
+        if self._paused is None:
+            self._paused = defer.Deferred()
+
+    def resumeProducing(self):
+        d, self._paused = self._paused, None
+        if d is not None:
+            d.callback(None)
+
+    def stopProducing(self):
+        self.stopped = True
+        self.resumeProducing()
+
+    def encode(self, data, prefix="", suffix=""):
+        """Writes prefix, the encoded data and suffix to the consumer. Returns
+        a Deferred fired once everything is written, or once the consumer
+        stopped the encoder."""
+        self.consumer.registerProducer(self, True)
+        d = self._run(self._value(data, prefix, 0))
+
+        def done(result):
+            if self.stopped:
+                return
+            if result is not True:
+                # the whole data was filtered out
+                self._write(prefix + result)
+            self._write(suffix)
+            self._flush()
+        d.addCallback(done)
+
+        def unregister(result):
+            self.consumer.unregisterProducer()
+            return result
+        d.addBoth(unregister)
+        return d
+
+    @defer.inlineCallbacks
+    def _run(self, gen):
+        # runs the generators encoding each value, as a stack, so that a
+        # nested value does not need its own Deferred
+        stack = [gen]
+        result = None
+        while stack:
+            if self.stopped:
+                return
+            item = stack[-1].send(result)
+            result = None
+            if isinstance(item, _Result):
+                stack.pop()
+                result = item.value
+            elif isinstance(item, _Child):
+                stack.append(self._value(item.value, item.prefix, item.depth))
+            else:
+                result = yield item
+
+            if self._flushed:
+                # let the reactor send what was written
+                self._flushed = False
+                yield task.deferLater(self._reactor, 0, lambda: None)
+            while self._paused is not None:
+                yield self._paused
+        defer.returnValue(result)
+
+    def _value(self, value, prefix, depth):
+        # writes prefix and the encoding of value, and results in True, or,
+        # when the value is filtered out, writes nothing and results in the
+        # encoding of the filtered value
+        while callable(value) or isinstance(value, defer.Deferred):
+            if isinstance(value, defer.Deferred):
+                value = yield value
+            else:
+                value = value()
+
+        if isinstance(value, dict):
+            items = value.iteritems() if self.compact else sorted(value.iteritems())
+            opened = False
+            for key, item in items:
+                if opened:
+                    p = self._separator(depth + 1)
+                else:
+                    p = prefix + "{" + self._indent(depth + 1)
+                written = yield _Child(item, p + self._key(key), depth + 1)
+                opened = opened or written is True
+            if opened:
+                self._write(self._indent(depth) + "}")
+            elif self.filterOut:
+                yield _Result("{}")
+            else:
+                self._write(prefix + "{}")
+
+        elif isinstance(value, (list, tuple, GeneratorType)):
+            # filtered out items are kept, unless they all are
+            pending = []
+            opened = False
+            for item in value:
+                if opened:
+                    p = self._separator(depth + 1)
+                else:
+                    p = prefix + "[" + self._indent(depth + 1) + \
+                        "".join(e + self._separator(depth + 1) for e in pending)
+                written = yield _Child(item, p, depth + 1)
+                if written is True:
+                    opened = True
+                elif opened:
+                    self._write(self._separator(depth + 1) + written)
+                else:
+                    pending.append(written)
+            if opened:
+                self._write(self._indent(depth) + "]")
+            elif self.filterOut:
+                yield _Result("null")
+            else:
+                self._write(prefix + "[]")
+
+        else:
+            encoded = json.dumps(value)
+            if self.filterOut and value in ('', False, None):
+                yield _Result(encoded)
+            self._write(prefix + encoded)
+
+        yield _Result(True)
+
+    def _key(self, key):
+        if not isinstance(key, basestring):
+            # as json.dumps, which turns keys like 1 or None into "1" or "null"
+            key = json.dumps(key)
+        return json.dumps(key) + (":" if self.compact else ": ")
+
+    def _indent(self, depth):
+        if self.compact:
+            return ""
+        return "\n" + "  " * depth
+
+    def _separator(self, depth):
+        if self.compact:
+            return ","
+        return ", " + self._indent(depth)
+
+    def _write(self, data):
+        self._buffer.append(data)
+        self._buffered += len(data)
+        if self._buffered >= self.bufferSize:
+            self._flush()
+
+    def _flush(self):
+        if self._buffer:
+            data = "".join(self._buffer)
+            self._buffer = []
+            self._buffered = 0
+            self._flushed = True
+            self.consumer.write(data)
@@ -64,6 +64,9 @@ class TextLog(Resource, ContextMixin):
     newWindow = False
     subscribed = False
     iFrame = False
+    lineRange = None
+    tailLines = False
+    defaultTailLines = 1000
 
     def __init__(self, original):
         Resource.__init__(self)
@@ -88,6 +91,12 @@ class TextLog(Resource, ContextMixin):
         if path == "iframe":
             self.iFrame = True
             return self
+        if path == "lines":
+            self.lineRange = True
+            return self
+        if path == "tail":
+            self.tailLines = True
+            return self
         return Resource.getChild(self, path, req)
 
     def content(self, entries):
@@ -131,6 +140,10 @@ class TextLog(Resource, ContextMixin):
         else:
             req.setHeader("Cache-Control", "no-cache")
 
+        # Only a slice of the log's lines is requested
+        if self.lineRange or self.tailLines:
+            return self._renderLines(req)
+
         # If plaintext is requested just return the content of the logfile
         if self.asDownload:
             with_headers = "_with_headers" if self.withHeaders else ""
@@ -186,8 +199,29 @@ class TextLog(Resource, ContextMixin):
         return ""
 
 
+    def _renderLines(self, req):
+        try:
+            if self.tailLines:
+                count = int(req.args.get("lines", [self.defaultTailLines])[0])
+                d = self.original.getTailLinesAsync(count)
+            else:
+                first = int(req.args.get("first", [0])[0])
+                last = req.args.get("last", [None])[0]
+                if last is not None:
+                    last = int(last)
+                d = self.original.getTextLinesAsync(first, last)
+        except ValueError:
+            req.setResponseCode(400)
+            return "invalid line numbers"
+
+        def write(lines):
+            req.write("".join(lines))
+            req.finish()
+        d.addCallbacks(write, req.processingFailed)
+        return server.NOT_DONE_YET
+
     def _setContentType(self, req):
-        if self.asDownload or self.newWindow:
+        if self.asDownload or self.newWindow or self.lineRange or self.tailLines:
             req.setHeader("content-type", "text/plain; charset=utf-8")
         else:
             req.setHeader("content-type", "text/html; charset=utf-8")
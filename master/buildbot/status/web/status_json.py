@@ -21,12 +21,13 @@ import re
 from twisted.python import log
 
 from twisted.internet import defer
-from twisted.web import html, resource, server
+from twisted.web import html, http, resource, server
 
 from buildbot.status.buildrequest import BuildRequestStatus
+from buildbot.status.web.jsoncache import ResponseRecorder
+from buildbot.status.web.jsonstream import JsonStreamEncoder
 from buildbot.status.web.base import HtmlResource, path_to_root, map_branches, getCodebasesArg, \
     getRequestCharset, getResultsArg, getCodebases, path_to_comparison
-import json
 import time
 
 
@@ -93,6 +94,9 @@ EXAMPLES = """\
       build. Using <4 will give the last 4 builds.
   - /json/builders/<A_BUILDER>/builds/-1/source_stamp/changes
     - Build changes
+  - /json/builders/<A_BUILDER>/builds/<A_BUILD>/steps/<A_STEP>/logs/<A_LOG>?tail=100
+    - The last 100 lines of a log of a build step, or the lines numbered from
+      first to last with ?first=200&last=300
   - /json/builders/<A_BUILDER>/builds?select=-1&select=-2
     - Builds without properties or steps
   - /json/builders/<A_BUILDER>/builds?props=0&steps=0
@@ -169,6 +173,8 @@ class JsonResource(resource.Resource):
 
     contentType = "application/json"
     cache_seconds = 60
+    # how long a response is kept in the response cache, cache_seconds if None
+    cache_lifetime = None
     help = None
     pageTitle = None
     level = 0
@@ -208,44 +214,76 @@ class JsonResource(resource.Resource):
 
     def render_GET(self, request):
         """Renders a HTTP GET at the http request level."""
-        d = defer.maybeDeferred(lambda: self.content(request))
-
-        def handle(data):
-            if isinstance(data, unicode):
-                data = data.encode("utf-8")
-            request.setHeader("Access-Control-Allow-Origin", "*")
-            if RequestArgToBool(request, 'as_text', False):
-                request.setHeader("content-type", 'text/plain')
-            else:
-                request.setHeader("content-type", self.contentType)
-                # Make sure we get fresh pages.
-            if self.cache_seconds:
-                now = datetime.datetime.utcnow()
-                expires = now + datetime.timedelta(seconds=self.cache_seconds)
-                request.setHeader("Expires",
-                                  expires.strftime("%a, %d %b %Y %H:%M:%S GMT"))
-                request.setHeader("Pragma", "no-cache")
-            return data
-
-        d.addCallback(handle)
+        request.setHeader("Access-Control-Allow-Origin", "*")
+        if RequestArgToBool(request, 'as_text', False):
+            request.setHeader("content-type", 'text/plain')
+        else:
+            request.setHeader("content-type", self.contentType)
+            # Make sure we get fresh pages.
+        if self.cache_seconds:
+            now = datetime.datetime.utcnow()
+            expires = now + datetime.timedelta(seconds=self.cache_seconds)
+            request.setHeader("Expires",
+                              expires.strftime("%a, %d %b %Y %H:%M:%S GMT"))
+            request.setHeader("Pragma", "no-cache")
+
+        builderNames = self.cacheBuilders(request)
+        cache = None
+        if builderNames is not None and self.cache_seconds:
+            cache = getattr(request.site.buildbot_service, 'jsonCache', None)
+
+        if cache is not None:
+            key = cache.makeKey(request)
+            cached = cache.get(key)
+            if cached is not None:
+                if request.setETag(cached.etag) == http.CACHED:
+                    return ''
+                return cached.body
+
+            token = cache.begin()
+            etag = cache.makeETag(token)
+            request.setETag(etag)
+            recorder = ResponseRecorder(request)
+            d = defer.maybeDeferred(lambda: self.content(request, recorder))
+
+            def store(_):
+                if not recorder.lost:
+                    cache.put(key, token, recorder.getvalue(), etag,
+                              builderNames, self.cache_lifetime or self.cache_seconds)
+            d.addCallback(store)
+        else:
+            d = defer.maybeDeferred(lambda: self.content(request))
 
-        def ok(data):
+        def ok(_):
             try:
-                request.write(data)
                 request.finish()
             except RuntimeError:
                 log.msg("Connection from {0} lost".format(request.client.host))
 
         def fail(f):
-            request.processingFailed(f)
-            return None # processingFailed will log this for us
+            if not request.startedWriting:
+                request.processingFailed(f)
+                return None # processingFailed will log this for us
+            # too late for an error page, don't let the client take the
+            # truncated json for a complete one
+            log.err(f, "while writing json for %s" % request.uri)
+            request.transport.loseConnection()
 
         d.addCallbacks(ok, fail)
         return server.NOT_DONE_YET
 
+    def cacheBuilders(self, request):
+        """Returns the names of the builders the json describes, if it only
+        changes when their builds start or finish or when build requests are
+        submitted for them, so that it can be kept in the response cache.
+
+        By default, returns None, the json is not cached."""
+        return None
+
     @defer.inlineCallbacks
-    def content(self, request):
-        """Renders the json dictionaries."""
+    def content(self, request, consumer=None):
+        """Writes the json dictionaries to the request, or to consumer if
+        given, as they are produced."""
         # Supported flags.
         select = request.args.get('select')
         as_text = RequestArgToBool(request, 'as_text', False)
@@ -291,20 +329,20 @@ class JsonResource(resource.Resource):
                 request.prepath = prepath
                 request.postpath = postpath
         else:
-            data = yield defer.maybeDeferred(lambda: self.asDict(request))
+            data = yield defer.maybeDeferred(lambda: self.asLazyDict(request))
 
-        if filter_out:
-            data = FilterOut(data)
-        if compact:
-            data = json.dumps(data, separators=(',', ':'))
-        else:
-            data = json.dumps(data, sort_keys=True, indent=2)
+        prefix = suffix = ''
         if callback:
             # Only accept things that look like identifiers for now
             callback = callback[0]
             if re.match(r'^[a-zA-Z$_][a-zA-Z$0-9._]*$', callback):
-                data = '%s(%s);' % (callback, data)
-        defer.returnValue(data)
+                prefix, suffix = '%s(' % callback, ');'
+
+        if consumer is None:
+            consumer = request
+        encoder = JsonStreamEncoder(consumer, filterOut=filter_out, compact=compact)
+        request.notifyFinish().addErrback(lambda _: encoder.stopProducing())
+        yield encoder.encode(data, prefix, suffix)
 
     @defer.inlineCallbacks
     def asDict(self, request):
@@ -323,6 +361,23 @@ class JsonResource(resource.Resource):
         else:
             raise NotImplementedError()
 
+    def asLazyDict(self, request):
+        """Generates the json dictionary like asDict, except that it may hold
+        Deferreds, or callables returning the data, which are only waited for
+        (or called) when the json is written.
+
+        By default, returns asDict, or the lazily rendered childs."""
+        # the childs are rendered lazily for the resources that render them
+        # with the default asDict
+        if self.children and self.asDict.im_func is JsonResource.asDict.im_func:
+            data = {}
+            for name in self.children:
+                child = self.getChildWithDefault(name, request)
+                if isinstance(child, JsonResource):
+                    data[name] = lambda child=child: child.asLazyDict(request)
+            return data
+        return self.asDict(request)
+
 
 def ToHtml(text):
     """Convert a string in a wiki-style format into HTML."""
@@ -420,11 +475,17 @@ class BuilderPendingBuildsJsonResource(JsonResource):
     help = """Describe pending builds for a builder.
 """
     pageTitle = 'Builder'
+    # the requests claimed by other masters leave the queue through the
+    # master events, which may be disabled
+    cache_lifetime = 5
 
     def __init__(self, status, builder_status):
         JsonResource.__init__(self, status)
         self.builder_status = builder_status
 
+    def cacheBuilders(self, request):
+        return [self.builder_status.getName()]
+
     def asDict(self, request):
         # buildbot.status.builder.BuilderStatus
         d = self.builder_status.getPendingBuildRequestStatusesDicts(codebases=getCodebases(request=request))
@@ -570,6 +631,9 @@ class AllBuildsJsonResource(JsonResource):
 class PastBuildsJsonResource(JsonResource):
     help = """Previous x number of builds that were run on a builder."""
     pageTitle = 'Builds'
+    # the builds finished by other masters are only seen through the master
+    # events of their requests, which may be disabled
+    cache_lifetime = 5
 
     def __init__(self, status, number, builder_status=None, slave_status=None):
         JsonResource.__init__(self, status)
@@ -577,6 +641,11 @@ class PastBuildsJsonResource(JsonResource):
         self.number = number
         self.slave_status = slave_status
 
+    def cacheBuilders(self, request):
+        if self.builder_status is not None:
+            return [self.builder_status.getName()]
+        return None
+
     @defer.inlineCallbacks
     def asDict(self, request, params=None):
         include_steps = True
@@ -600,6 +669,15 @@ class PastBuildsJsonResource(JsonResource):
             encoding = getRequestCharset(request)
             branches = [b.decode(encoding) for b in request.args.get("branch", []) if b]
 
+            if not include_steps and not include_props:
+                # the summaries have everything else, without loading the steps
+                summaries = yield self.builder_status.generateFinishedBuildSummariesAsync(
+                    branches=map_branches(branches), codebases=codebases, results=results,
+                    num_builds=self.number)
+                defer.returnValue([s.asDict(request, include_artifacts=True, include_failure_url=True)
+                                   for s in summaries])
+                return
+
             builds = yield self.builder_status.generateFinishedBuildsAsync(branches=map_branches(branches),
                                                                            codebases=codebases,
                                                                            results=results,
@@ -666,12 +744,69 @@ class BuildStepJsonResource(JsonResource):
         # buildbot.status.buildstep.BuildStepStatus
         JsonResource.__init__(self, status)
         self.build_step_status = build_step_status
-        # TODO self.putChild('logs', LogsJsonResource())
+        self.putChild('logs', LogsJsonResource(status, build_step_status))
 
     def asDict(self, request):
         return self.build_step_status.asDict()
 
 
+class LogJsonResource(JsonResource):
+    help = """A slice of the lines of a log of a build step.
+
+Without arguments, returns the last lines of the log.
+- Takes a 'first' and optionally a 'last' argument, to return the lines
+  numbered from first up to, but excluding, last.
+- Takes a 'tail' argument, to return that many lines from the end of the log.
+"""
+    pageTitle = 'Log'
+    defaultTailLines = 1000
+
+    def __init__(self, status, log_status):
+        JsonResource.__init__(self, status)
+        self.log_status = log_status
+
+    @defer.inlineCallbacks
+    def asDict(self, request):
+        total = yield self.log_status.getLineCountAsync()
+        if 'first' in request.args:
+            first = int(RequestArg(request, 'first', 0))
+            last = RequestArg(request, 'last', None)
+            if last is not None:
+                last = int(last)
+        else:
+            first = max(0, total - int(RequestArg(request, 'tail', self.defaultTailLines)))
+            last = None
+        lines = yield self.log_status.getTextLinesAsync(first, last)
+        defer.returnValue({
+            'name': self.log_status.getName(),
+            'finished': self.log_status.isFinished(),
+            'total': total,
+            'first': first,
+            'last': first + len(lines),
+            'lines': lines,
+        })
+
+
+class LogsJsonResource(JsonResource):
+    help = """The logs of a build step.
+"""
+    pageTitle = 'Logs'
+
+    def __init__(self, status, build_step_status):
+        JsonResource.__init__(self, status)
+        self.build_step_status = build_step_status
+
+    def getChild(self, path, request):
+        for log_status in self.build_step_status.getLogs():
+            if log_status.getName() == path:
+                return LogJsonResource(self.status, log_status)
+        return JsonResource.getChild(self, path, request)
+
+    def asDict(self, request):
+        return dict((l.getName(), {'name': l.getName(), 'finished': l.isFinished()})
+                    for l in self.build_step_status.getLogs())
+
+
 class BuildStepsJsonResource(JsonResource):
     help = """A list of build steps that occurred during a build.
 """
@@ -837,9 +972,19 @@ class SingleProjectJsonResource(LatestRevisionResource):
             builder = self.status.getBuilder(b)
             self.putChild(b, SingleProjectBuilderJsonResource(status, builder))
 
+    def cacheBuilders(self, request):
+        return self.children.keys()
+
     @defer.inlineCallbacks
     def asDict(self, request):
-        result = {'builders': []}
+        result = yield self.asLazyDict(request)
+        result['builders'] = yield defer.gatherResults([builder() for builder in result['builders']],
+                                                       consumeErrors=True)
+        defer.returnValue(result)
+
+    @defer.inlineCallbacks
+    def asLazyDict(self, request):
+        result = {}
 
         #Get codebases
         codebases = {}
@@ -851,15 +996,13 @@ class SingleProjectJsonResource(LatestRevisionResource):
 
         result['comparisonURL'] = path_to_comparison(request, self.project_status.name, codebases)
 
-        defers = []
+        # each builder is only rendered when it is written, so none is left
+        # running when the client disconnects or an earlier builder fails
+        builders = []
         for name in self.children:
             child = self.getChildWithDefault(name, request)
-            d = child.asDict(request, codebases, branches, True)
-            defers.append(d)
-
-        for d in defers:
-            r = yield d
-            result['builders'].append(r)
+            builders.append(lambda child=child: child.asDict(request, codebases, branches, True))
+        result['builders'] = builders
 
         defer.returnValue(result)
 
@@ -877,6 +1020,8 @@ class SingleProjectBuilderJsonResource(LatestRevisionResource):
         self.latest_rev = latest_rev
         LatestRevisionResource.__init__(self, status, project)
 
+    def cacheBuilders(self, request):
+        return [self.builder.getName()]
 
     @defer.inlineCallbacks
     def builder_dict(self, builder, codebases, request, branches, base_build_dict, include_build_steps,
@@ -887,10 +1032,10 @@ class SingleProjectBuilderJsonResource(LatestRevisionResource):
                                        include_pending_builds)
 
         #Get latest build
-        builds = yield builder.generateFinishedBuildsAsync(branches=map_branches(branches),
-                                                           codebases=codebases,
-                                                           num_builds=1,
-                                                           useCache=True)
+        builds = yield builder.generateFinishedBuildSummariesAsync(branches=map_branches(branches),
+                                                                   codebases=codebases,
+                                                                   num_builds=1,
+                                                                   useCache=True)
 
         if len(builds) > 0:
             d['latestBuild'] = builds[0].asBaseDict(request, include_artifacts=True, include_failure_url=True)
@@ -971,12 +1116,18 @@ class PendingBuildsJsonResource(JsonResource):
 class SinglePendingBuildsJsonResource(JsonResource):
     help = """List the pending builds for a specific builder."""
     pageTitle = 'Queue'
+    # like BuilderPendingBuildsJsonResource, the requests claimed by other
+    # masters are only seen through the master events
+    cache_lifetime = 5
 
     def __init__(self, status, builder):
         JsonResource.__init__(self, status)
         self.status = status
         self.builder = builder
 
+    def cacheBuilders(self, request):
+        return [self.builder.getName()]
+
     @defer.inlineCallbacks
     def asDict(self, request):
         #Get codebases
@@ -1207,8 +1358,8 @@ For help on any sub directory, use url /child/help
         # This needs to be called before the first HelpResource().body call.
         self.hackExamples()
 
-    def content(self, request):
-        result = JsonResource.content(self, request)
+    def content(self, request, consumer=None):
+        result = JsonResource.content(self, request, consumer)
         # This is done to hook the downloaded filename.
         request.path = 'buildbot'
         return result
@@ -94,8 +94,8 @@ class BuildRequest(Row):
         triggeredbybrid = None,
         mergebrid = None,
         startbrid = None,
-        slavepool = None
-
+        slavepool = None,
+        selected_slave = None
     )
 
     id_column = 'id'
@@ -333,6 +333,36 @@ class Build(Row):
 
     id_column = 'id'
 
+class LastBuild(Row):
+    table = "last_builds"
+
+    defaults = dict(
+        id = None,
+        buildername = 'bldr',
+        codebases_key = '',
+        key_hash = None,
+        results = 0,
+        number = 1,
+        finish_time = None)
+
+    id_column = 'id'
+
+class MasterEvent(Row):
+    table = "master_events"
+
+    defaults = dict(
+        id = None,
+        event = 'change_added',
+        objectid = None,
+        buildsetid = None,
+        buildername = None,
+        masterid = None,
+        created_at = 1304262222)
+
+    required_columns = ( 'objectid', )
+
+    id_column = 'id'
+
 # Fake DB Components
 
 # TODO: test these using the same test methods as are used against the real
@@ -410,7 +440,18 @@ class FakeChangesComponent(FakeDBComponent):
         except KeyError:
             return defer.succeed(None)
 
-        chdict = dict(
+        return defer.succeed(self._chdict(row))
+
+    def getChangesSince(self, changeid, limit=None):
+        changeids = sorted(id for id in self.changes if id > changeid)[:limit]
+        return defer.succeed([self._chdict(self.changes[id]) for id in changeids])
+
+    def getRecentChanges(self, count):
+        changeids = sorted(self.changes)[-count:]
+        return defer.succeed([self._chdict(self.changes[id]) for id in changeids])
+
+    def _chdict(self, row):
+        return dict(
                 changeid=row.changeid,
                 author=row.author,
                 files=row.files,
@@ -426,8 +467,6 @@ class FakeChangesComponent(FakeDBComponent):
                 codebase=row.codebase,
                 project=row.project)
 
-        return defer.succeed(chdict)
-
     def getChangeUids(self, changeid):
         try:
             ch_uids = [self.changes[changeid].uid]
@@ -435,8 +474,6 @@ class FakeChangesComponent(FakeDBComponent):
             ch_uids = []
         return defer.succeed(ch_uids)
 
-    # TODO: getRecentChanges
-
     # fake methods
 
     def fakeAddChangeInstance(self, change):
@@ -674,10 +711,14 @@ class FakeBuildsetsComponent(FakeDBComponent):
     def addBuildset(self, sourcestampsetid, reason, properties, triggeredbybrid=None,
                     builderNames=None, external_idstring=None, _reactor=reactor):
         bsid = self._newBsid()
+        selected_slave = None
+        if properties and 'selected_slave' in properties:
+            selected_slave = properties['selected_slave'][0]
         br_rows = []
         for buildername in builderNames:
             br_rows.append(
-                    BuildRequest(buildsetid=bsid, buildername=buildername))
+                    BuildRequest(buildsetid=bsid, buildername=buildername,
+                                 selected_slave=selected_slave))
         self.db.buildrequests.insertTestData(br_rows)
 
         # make up a row and keep its dictionary, with the properties tacked on
@@ -974,8 +1015,34 @@ class FakeBuildRequestsComponent(FakeDBComponent):
 
         return defer.succeed(rv)
 
-    def getBuildRequestsInQueue(self, queue=None):
-        return self.getBuildRequests(complete=False, claimed=False)
+    def getBuildRequestsInQueue(self, queue=None, brids=None, limit=None, after=None):
+        d = self.getBuildRequests(complete=False, claimed=False)
+        if brids:
+            d.addCallback(lambda brdicts: [brdict for brdict in brdicts if brdict['brid'] in brids])
+
+        def sortKey(brdict):
+            return -brdict['priority'], brdict['submitted_at'], brdict['brid']
+
+        if after:
+            d.addCallback(lambda brdicts: [brdict for brdict in brdicts if sortKey(brdict) > sortKey(after)])
+        if limit or after:
+            d.addCallback(lambda brdicts: sorted(brdicts, key=sortKey)[:limit])
+        return d
+
+    def getBuildRequestsSourceStamps(self, brids):
+        rv = {}
+        for brid in brids:
+            rv[brid] = []
+            if brid not in self.reqs:
+                continue
+            bs = self.db.buildsets.buildsets.get(self.reqs[brid].buildsetid)
+            if bs is None:
+                continue
+            for ss in self.db.sourcestamps.sourcestamps.itervalues():
+                if ss['sourcestampsetid'] == bs['sourcestampsetid']:
+                    rv[brid].append(dict(sourcestampsetid=ss['sourcestampsetid'], codebase=ss['codebase'],
+                                         branch=ss['branch'], revision=ss['revision']))
+        return defer.succeed(rv)
 
     def getBuildRequestInQueue(self, buildername=None, sourcestamps=None, sorted=True, limit=None):
         return self.getBuildRequests(buildername=buildername, complete=False, claimed=False)
@@ -996,6 +1063,10 @@ class FakeBuildRequestsComponent(FakeDBComponent):
                 objectid=self.MASTER_ID, claimed_at=claimed_at)
         return defer.succeed(None)
 
+    def claimBuildRequestGroups(self, brids_groups, claimed_at=None):
+        return self.claimBuildRequests([brid for brids in brids_groups for brid in brids],
+                                       claimed_at=claimed_at)
+
     def unclaimBuildRequests(self, brids, results=None, _master_objectid=None):
         for brid in brids:
             try:
@@ -1150,11 +1221,15 @@ class FakeBuildsComponent(FakeDBComponent):
 
     def setUp(self):
         self.builds = {}
+        # (buildername, codebases_key, results) -> number
+        self.last_builds = {}
 
     def insertTestData(self, rows):
         for row in rows:
             if isinstance(row, Build):
                 self.builds[row.id] = row
+            if isinstance(row, LastBuild):
+                self.last_builds[(row.buildername, row.codebases_key, row.results)] = row.number
 
     # component methods
 
@@ -1178,6 +1253,9 @@ class FakeBuildsComponent(FakeDBComponent):
 
     def getLastBuildsNumbers(self, buildername=None, slavename=None, results=None, sourcestamps=None, num_builds=1):
         return defer.succeed([])
+
+    def getLastBuildNumbersByResults(self, buildername, sourcestamps=None):
+        return defer.succeed({})
     
     def getBuildsForRequest(self, brid):
         ret = []
@@ -1225,6 +1303,18 @@ class FakeBuildsComponent(FakeDBComponent):
     def finishedMergedBuilds(self, brids, number):
         return defer.succeed(None)
 
+    def updateLastBuild(self, buildername, codebases_key, results, number, finish_time=None):
+        key = (buildername, codebases_key, results)
+        if self.last_builds.get(key) < number:
+            self.last_builds[key] = number
+        return defer.succeed(None)
+
+    def getLastBuildNumber(self, buildername, codebases_key, results=None):
+        numbers = [number for (name, cb_key, res), number in self.last_builds.iteritems()
+                   if name == buildername and cb_key == codebases_key
+                   and (not results or res in results)]
+        return defer.succeed(max(numbers) if numbers else None)
+
 class FakeMastersConfigComponent(FakeDBComponent):
 
     def setUp(self):
@@ -1250,6 +1340,61 @@ class FakeMastersConfigComponent(FakeDBComponent):
         return defer.succeed(dict(id=row.id, buildbotURL=row.buildbotURL, objectid=row.objectid))
 
 
+class FakeEventsComponent(FakeDBComponent):
+
+    def setUp(self):
+        self.events = {}
+        self.enabled = False
+        self.masterid = None
+
+    def insertTestData(self, rows):
+        for row in rows:
+            if isinstance(row, MasterEvent):
+                self.events[row.id] = row.values.copy()
+
+    def enable(self, masterid):
+        self.enabled = True
+        self.masterid = masterid
+
+    def disable(self):
+        self.enabled = False
+
+    def addEvents(self, events, _reactor=reactor):
+        if self.enabled:
+            for ev in events:
+                id = max(self.events.keys() or [0]) + 1
+                self.events[id] = dict(id=id, event=ev['event'], objectid=ev['objectid'],
+                                       buildsetid=ev.get('buildsetid'),
+                                       buildername=ev.get('buildername'),
+                                       masterid=self.masterid,
+                                       created_at=_reactor.seconds())
+        return defer.succeed(None)
+
+    def getEventsSince(self, eventid, limit=500, missing=()):
+        ids = sorted(id for id in self.events if id > eventid or id in missing)
+        return defer.succeed([self._eventdict(self.events[id]) for id in ids[:limit]])
+
+    def getLatestEventId(self):
+        return defer.succeed(max(self.events.keys() or [0]))
+
+    def getFirstEventId(self, event, objectid):
+        ids = [id for id, ev in self.events.iteritems()
+               if ev['event'] == event and ev['objectid'] > objectid]
+        return defer.succeed(min(ids) if ids else None)
+
+    def pruneEvents(self, age, _reactor=reactor):
+        old = [id for id, ev in self.events.iteritems()
+               if ev['created_at'] < _reactor.seconds() - age]
+        for id in old:
+            del self.events[id]
+        return defer.succeed(len(old))
+
+    def _eventdict(self, row):
+        return dict(eventid=row['id'], event=row['event'], objectid=row['objectid'],
+                    buildsetid=row['buildsetid'], buildername=row['buildername'],
+                    masterid=row['masterid'], created_at=row['created_at'])
+
+
 class FakeUsersComponent(FakeDBComponent):
 
     def setUp(self):
@@ -1396,6 +1541,8 @@ class FakeDBConnector(object):
         self._components.append(comp)
         self.mastersconfig = comp = FakeMastersConfigComponent(self, testcase)
         self._components.append(comp)
+        self.events = comp = FakeEventsComponent(self, testcase)
+        self._components.append(comp)
 
     def setup(self):
         self.is_setup = True
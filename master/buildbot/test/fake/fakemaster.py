@@ -27,6 +27,8 @@ import mock
 class FakeCache(object):
     """Emulate an L{AsyncLRUCache}, but without any real caching.  This
     I{does} do the weakref part, to catch un-weakref-able objects."""
+    hits = refhits = misses = 0
+
     def __init__(self, name, miss_fn):
         self.name = name
         self.miss_fn = miss_fn
@@ -40,6 +42,12 @@ class FakeCache(object):
         d.addCallback(mkref)
         return d
 
+    def remove(self, key):
+        pass
+
+    def keys(self):
+        return []
+
 
 class FakeCaches(object):
 
@@ -136,6 +144,12 @@ class FakeMaster(object):
     def subscribeToBuildRequests(self, callback):
         pass
 
+    def subscribeToCancelledBuildRequests(self, callback):
+        pass
+
+    def subscribeToMasterEvents(self, callback):
+        pass
+
     # work around http://code.google.com/p/mock/issues/detail?id=105
     def _get_child_mock(self, **kw):
         return mock.Mock(**kw)
@@ -143,6 +157,9 @@ class FakeMaster(object):
     def maybeBuildsetComplete(self, bsid):
         pass
 
+    def buildRequestAdded(self, bsid, brid, buildername):
+        pass
+
     def buildRequestRemoved(self, bsid, brid, buildername):
         pass
 
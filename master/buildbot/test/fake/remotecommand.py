@@ -127,6 +127,15 @@ class FakeLogFile(object):
             for obs in self.step.logobservers[self.name]:
                 obs.errReceived(text)
 
+    def addEntries(self, entries):
+        for channel, text in entries:
+            if channel == STDOUT:
+                self.addStdout(text)
+            elif channel == STDERR:
+                self.addStderr(text)
+            else:
+                self.addHeader(text)
+
     def readlines(self):
         io = StringIO(self.stdout)
         return io.readlines()
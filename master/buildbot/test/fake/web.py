@@ -37,6 +37,7 @@ class FakeRequest(Mock):
         self.site = Mock()
         self.site.buildbot_service = Mock()
         master = self.site.buildbot_service.master = Mock()
+        self.site.buildbot_service.jsonCache = None
 
         self.addedChanges = []
         def addChange(**kwargs):
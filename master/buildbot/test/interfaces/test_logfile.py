@@ -63,6 +63,12 @@ class Tests(interfaces.InterfaceTests):
         def addStderr(self, text):
             pass
 
+    def test_signature_addEntries(self):
+        log = self.makeLogFile()
+        @self.assertArgSpecMatches(log.addEntries)
+        def addEntries(self, entries):
+            pass
+
     def test_signature_readlines(self):
         log = self.makeLogFile()
         @self.assertArgSpecMatches(log.readlines)
@@ -98,6 +104,13 @@ class Tests(interfaces.InterfaceTests):
         self.assertIn(textwrap.dedent("""\
             some text with"""), log.getText())
 
+    def test_addEntries(self):
+        log = self.makeLogFile()
+        log.addEntries([(logfile.STDOUT, 'out '), (logfile.STDERR, 'err '),
+                        (logfile.HEADER, "won't see this\n"),
+                        (logfile.STDOUT, 'more '), (logfile.STDOUT, 'out\n')])
+        self.assertEqual(log.getText(), 'out err more out\n')
+
 
 class RealTests(Tests):
 
@@ -31,90 +31,89 @@ class GitOutputParsing(gpo.GetProcessOutputMixin, unittest.TestCase):
         self.poller = gitpoller.GitPoller('git@example.com:foo/baz.git')
         self.setUpGetProcessOutput()
         
-    dummyRevStr = '12345abcde'
-    def _perform_git_output_test(self, methodToTest, args,
-                                 desiredGoodOutput, desiredGoodResult,
-                                 emptyRaisesException=True):
+    # _get_changes is tested in TestGitPoller, below
 
-        # make this call to self.patch here so that we raise a SkipTest if it
-        # is not supported
+    def test_get_commits(self):
         self.expectCommands(
-                gpo.Expect('git', *args)
-                    .path('gitpoller-work'),
-                )
+                gpo.Expect('git', 'log', '--no-walk=unsorted', '--name-only',
+                    gitpoller.GitPoller._commitFormat, 'aaa', 'bbb', '--')
+                    .path('gitpoller-work')
+                    .stdout('\x1ebbb\x1f1273258009\x1fby bbb <b@example.com>\x1f'
+                            'second\nbody\n\x1f\n\ndir/a file\nb\n'
+                            '\x1eaaa\x1f1273258000\x1fby \xc3\xa5aa <a@example.com>\x1f'
+                            'first\n\x1f\n'))
 
-        d = defer.succeed(None)
-        def call_empty(_):
-            # we should get an Exception with empty output from git
-            return methodToTest(self.dummyRevStr)
-        d.addCallback(call_empty)
-    
-        def cb_empty(_):
-            if emptyRaisesException:
-                self.fail("getProcessOutput should have failed on empty output")
-        def eb_empty(f):
-            if not emptyRaisesException:
-                self.fail("getProcessOutput should NOT have failed on empty output")
-        d.addCallbacks(cb_empty, eb_empty)
-        d.addCallback(lambda _: self.assertAllCommandsRan())
-
-        # and the method shouldn't supress any exceptions
+        d = self.poller._get_commits(['aaa', 'bbb'])
+        @d.addCallback
+        def check(commits):
+            self.assertAllCommandsRan()
+            self.assertEqual(commits, [
+                (1273258000.0, u'by \xe5aa <a@example.com>', [], u'first'),
+                (1273258009.0, u'by bbb <b@example.com>', ['dir/a file', 'b'],
+                 u'second\nbody')])
+        return d
+
+    def test_get_commits_missing(self):
         self.expectCommands(
-                gpo.Expect('git', *args)
+                gpo.Expect('git', 'log', '--no-walk=unsorted', '--name-only',
+                    gitpoller.GitPoller._commitFormat, 'aaa', 'bbb', '--')
                     .path('gitpoller-work')
-                    .exit(1),
-                )
-        def call_exception(_):
-            return methodToTest(self.dummyRevStr)
-        d.addCallback(call_exception)
-    
-        def cb_exception(_):
-            self.fail("getProcessOutput should have failed on stderr output")
-        def eb_exception(f):
-            pass
-        d.addCallbacks(cb_exception, eb_exception)
-        d.addCallback(lambda _: self.assertAllCommandsRan())
-
-        # finally we should get what's expected from good output
+                    .stdout('\x1eaaa\x1f1273258000\x1fby aaa <a@example.com>\x1f'
+                            'first\n\x1f\n'))
+
+        d = self.poller._get_commits(['aaa', 'bbb'])
+        return self.assertFailure(d, EnvironmentError)
+
+    def expectLog(self, stdout='', exit=0):
         self.expectCommands(
-                gpo.Expect('git', *args)
+                gpo.Expect('git', 'log', '--no-walk=unsorted', '--name-only',
+                    gitpoller.GitPoller._commitFormat, 'aaa', '--')
                     .path('gitpoller-work')
-                    .stdout(desiredGoodOutput)
-                )
-        def call_desired(_):
-            return methodToTest(self.dummyRevStr)
-        d.addCallback(call_desired)
-    
-        def cb_desired(r):
-            self.assertEquals(r, desiredGoodResult)
-        d.addCallback(cb_desired)
-        d.addCallback(lambda _: self.assertAllCommandsRan())
-        
-    def test_get_commit_author(self):
-        authorStr = 'Sammy Jankis <email@example.com>'
-        return self._perform_git_output_test(self.poller._get_commit_author,
-                ['log', '--no-walk', '--format=%aN <%aE>', self.dummyRevStr, '--'],
-                authorStr, authorStr)
-        
-    def test_get_commit_comments(self):
-        commentStr = 'this is a commit message\n\nthat is multiline'
-        return self._perform_git_output_test(self.poller._get_commit_comments,
-                ['log', '--no-walk', '--format=%s%n%b', self.dummyRevStr, '--'],
-                commentStr, commentStr)
-        
-    def test_get_commit_files(self):
-        filesStr = 'file1\nfile2'
-        return self._perform_git_output_test(self.poller._get_commit_files,
-                ['log', '--name-only', '--no-walk', '--format=%n', self.dummyRevStr, '--'],
-                filesStr, filesStr.split(), emptyRaisesException=False)
-        
-    def test_get_commit_timestamp(self):
-        stampStr = '1273258009'
-        return self._perform_git_output_test(self.poller._get_commit_timestamp,
-                ['log', '--no-walk', '--format=%ct', self.dummyRevStr, '--'],
-                stampStr, float(stampStr))
+                    .stdout(stdout)
+                    .exit(exit))
 
-    # _get_changes is tested in TestGitPoller, below
+    def test_get_commits_mergeWithoutFiles(self):
+        # a merge commit lists no files, and the body may be empty
+        self.expectLog('\x1eaaa\x1f1273258000\x1fby aaa <a@example.com>\x1f'
+                       'Merge branch \'b\'\n\n\x1f\n')
+
+        d = self.poller._get_commits(['aaa'])
+        @d.addCallback
+        def check(commits):
+            self.assertAllCommandsRan()
+            self.assertEqual(commits, [
+                (1273258000.0, u'by aaa <a@example.com>', [], u"Merge branch 'b'")])
+        return d
+
+    def test_get_commits_noTimestamps(self):
+        self.poller.usetimestamps = False
+        self.expectLog('\x1eaaa\x1f1273258000\x1fby aaa <a@example.com>\x1f'
+                       'first\n\x1f\nfile\n')
+
+        d = self.poller._get_commits(['aaa'])
+        @d.addCallback
+        def check(commits):
+            self.assertEqual(commits, [(None, u'by aaa <a@example.com>', ['file'], u'first')])
+        return d
+
+    def test_get_commits_badTimestamp(self):
+        self.expectLog('\x1eaaa\x1fnot a time\x1fby aaa <a@example.com>\x1f'
+                       'first\n\x1f\n')
+
+        d = self.poller._get_commits(['aaa'])
+        return self.assertFailure(d, ValueError)
+
+    def test_get_commits_emptyOutput(self):
+        self.expectLog('')
+
+        d = self.poller._get_commits(['aaa'])
+        return self.assertFailure(d, EnvironmentError)
+
+    def test_get_commits_gitFails(self):
+        self.expectLog(exit=1)
+
+        d = self.poller._get_commits(['aaa'])
+        return self.assertFailure(d, EnvironmentError)
 
 class TestGitPoller(gpo.GetProcessOutputMixin,
                     changesource.ChangeSourceMixin,
@@ -342,20 +341,13 @@ class TestGitPoller(gpo.GetProcessOutputMixin,
                         ])),
                 )
 
-        # and patch out the _get_commit_foo methods which were already tested
+        # and patch out the _get_commits method which was already tested
         # above
-        def timestamp(rev):
-            return defer.succeed(1273258009.0)
-        self.patch(self.poller, '_get_commit_timestamp', timestamp)
-        def author(rev):
-            return defer.succeed('by:' + rev[:8])
-        self.patch(self.poller, '_get_commit_author', author)
-        def files(rev):
-            return defer.succeed(['/etc/' + rev[:3]])
-        self.patch(self.poller, '_get_commit_files', files)
-        def comments(rev):
-            return defer.succeed('hello!')
-        self.patch(self.poller, '_get_commit_comments', comments)
+        def commits(revs):
+            return defer.succeed([(1273258009.0, 'by:' + rev[:8],
+                                   ['/etc/' + rev[:3]], 'hello!')
+                                  for rev in revs])
+        self.patch(self.poller, '_get_commits', commits)
 
         # do the poll
         self.poller.branches = ['master', 'release']
@@ -465,20 +457,13 @@ class TestGitPoller(gpo.GetProcessOutputMixin,
                         ])),
                 )
 
-        # and patch out the _get_commit_foo methods which were already tested
+        # and patch out the _get_commits method which was already tested
         # above
-        def timestamp(rev):
-            return defer.succeed(1273258009.0)
-        self.patch(self.poller, '_get_commit_timestamp', timestamp)
-        def author(rev):
-            return defer.succeed('by:' + rev[:8])
-        self.patch(self.poller, '_get_commit_author', author)
-        def files(rev):
-            return defer.succeed(['/etc/' + rev[:3]])
-        self.patch(self.poller, '_get_commit_files', files)
-        def comments(rev):
-            return defer.succeed('hello!')
-        self.patch(self.poller, '_get_commit_comments', comments)
+        def commits(revs):
+            return defer.succeed([(1273258009.0, 'by:' + rev[:8],
+                                   ['/etc/' + rev[:3]], 'hello!')
+                                  for rev in revs])
+        self.patch(self.poller, '_get_commits', commits)
 
         # do the poll
         self.poller.lastRev = {
@@ -579,3 +564,7 @@ class TestGitPollerConstructor(unittest.TestCase, config.ConfigErrorsMixin):
     def test_gitbin_default(self):
         poller = gitpoller.GitPoller("/tmp/git.git")
         self.assertEqual(poller.gitbin, "git")
+
+    def test_maxProcesses(self):
+        poller = gitpoller.GitPoller("/tmp/git.git", maxProcesses=2)
+        self.assertEqual(poller.processes.limit, 2)
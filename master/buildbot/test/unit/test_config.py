@@ -37,6 +37,7 @@ global_defaults = dict(
     titleURL='http://buildbot.net',
     buildbotURL='http://localhost:8080/',
     changeHorizon=None,
+    buildStartBatchSize=1,
     eventHorizon=50,
     logHorizon=None,
     buildHorizon=None,
@@ -190,7 +191,7 @@ class MasterConfig(ConfigErrorsMixin, dirs.DirsMixin, unittest.TestCase):
                 db_url='sqlite:///state.sqlite',
                 db_poll_interval=None),
             metrics = None,
-            caches = dict(Changes=10, Builds=15),
+            caches = dict(Changes=10, Builds=15, BuildRequests=6000, BuildSummaries=500),
             schedulers = {},
             builders = [],
             slaves = [],
@@ -407,6 +408,9 @@ class MasterConfig_loaders(ConfigErrorsMixin, unittest.TestCase):
     def test_load_global_changeHorizon_none(self):
         self.do_test_load_global(dict(changeHorizon=None), changeHorizon=None)
 
+    def test_load_global_buildStartBatchSize(self):
+        self.do_test_load_global(dict(buildStartBatchSize=50), buildStartBatchSize=50)
+
     def test_load_global_eventHorizon(self):
         self.do_test_load_global(dict(eventHorizon=10), eventHorizon=10)
 
@@ -424,10 +428,31 @@ class MasterConfig_loaders(ConfigErrorsMixin, unittest.TestCase):
         self.do_test_load_global(dict(logCompressionMethod='gz'),
                                  logCompressionMethod='gz')
 
+    def test_load_global_logCompressionMethod_blockgz(self):
+        self.do_test_load_global(dict(logCompressionMethod='blockgz'),
+                                 logCompressionMethod='blockgz')
+
     def test_load_global_logCompressionMethod_invalid(self):
         self.cfg.load_global(self.filename,
                 dict(logCompressionMethod='foo'))
-        self.assertConfigError(self.errors, "must be 'bz2' or 'gz'")
+        self.assertConfigError(self.errors, "must be 'bz2', 'gz' or 'blockgz'")
+
+    def test_load_global_buildStatusStorage(self):
+        self.do_test_load_global(dict(buildStatusStorage='sqlite'),
+                                 buildStatusStorage='sqlite')
+
+    def test_load_global_buildStatusStorage_invalid(self):
+        self.cfg.load_global(self.filename,
+                dict(buildStatusStorage='foo'))
+        self.assertConfigError(self.errors, "must be 'pickle' or 'sqlite'")
+
+    def test_load_global_buildLoaderThreads(self):
+        self.do_test_load_global(dict(buildLoaderThreads=8),
+                                 buildLoaderThreads=8)
+
+    def test_load_global_buildLoaderThreads_invalid(self):
+        self.cfg.load_global(self.filename, dict(buildLoaderThreads=0))
+        self.assertConfigError(self.errors, "c['buildLoaderThreads'] must be at least 1")
 
     def test_load_global_codebaseGenerator(self):
         func = lambda _: "dummy"
@@ -582,7 +607,7 @@ class MasterConfig_loaders(ConfigErrorsMixin, unittest.TestCase):
 
     def test_load_caches_defaults(self):
         self.cfg.load_caches(self.filename, {})
-        self.assertResults(caches=dict(Changes=10, Builds=15))
+        self.assertResults(caches=dict(Changes=10, Builds=15, BuildRequests=6000, BuildSummaries=500))
 
     def test_load_caches_invalid(self):
         self.cfg.load_caches(self.filename, dict(caches=13))
@@ -591,7 +616,7 @@ class MasterConfig_loaders(ConfigErrorsMixin, unittest.TestCase):
     def test_load_caches_buildCacheSize(self):
         self.cfg.load_caches(self.filename,
                 dict(buildCacheSize=13))
-        self.assertResults(caches=dict(Builds=13, Changes=10))
+        self.assertResults(caches=dict(Builds=13, Changes=10, BuildRequests=6000, BuildSummaries=500))
 
     def test_load_caches_buildCacheSize_and_caches(self):
         self.cfg.load_caches(self.filename,
@@ -601,7 +626,7 @@ class MasterConfig_loaders(ConfigErrorsMixin, unittest.TestCase):
     def test_load_caches_changeCacheSize(self):
         self.cfg.load_caches(self.filename,
                 dict(changeCacheSize=13))
-        self.assertResults(caches=dict(Changes=13, Builds=15))
+        self.assertResults(caches=dict(Changes=13, Builds=15, BuildRequests=6000, BuildSummaries=500))
 
     def test_load_caches_changeCacheSize_and_caches(self):
         self.cfg.load_caches(self.filename,
@@ -611,7 +636,7 @@ class MasterConfig_loaders(ConfigErrorsMixin, unittest.TestCase):
     def test_load_caches(self):
         self.cfg.load_caches(self.filename,
                 dict(caches=dict(foo=1)))
-        self.assertResults(caches=dict(Changes=10, Builds=15, foo=1))
+        self.assertResults(caches=dict(Changes=10, Builds=15, BuildRequests=6000, BuildSummaries=500, foo=1))
 
     def test_load_caches_entries_test(self):
         self.cfg.load_caches(self.filename,
@@ -14,6 +14,7 @@
 # Copyright Buildbot Team Members
 
 import datetime
+import time
 import sqlalchemy as sa
 from twisted.trial import unittest
 from twisted.internet import task, defer
@@ -51,7 +52,8 @@ class TestBuildsetsConnectorComponent(
         d = self.setUpConnectorComponent(
             table_names=[ 'patches', 'changes', 'sourcestamp_changes',
                 'buildsets', 'buildset_properties', 'buildrequests',
-                'objects', 'buildrequest_claims', 'sourcestamps', 'sourcestampsets', 'builds' ])
+                'objects', 'buildrequest_claims', 'sourcestamps', 'sourcestampsets', 'builds',
+                'master_events' ])
 
         def finish_setup(_):
             self.db.buildrequests = \
@@ -98,7 +100,7 @@ class TestBuildsetsConnectorComponent(
                         priority=7, claimed=True, mergebrid=None, mine=True, complete=True,
                         results=75, startbrid=None, claimed_at=self.CLAIMED_AT,
                         submitted_at=self.SUBMITTED_AT, triggeredbybrid = None,
-                        complete_at=self.COMPLETE_AT))
+                        complete_at=self.COMPLETE_AT, selected_slave=None))
         d.addCallback(check)
         return d
 
@@ -716,6 +718,38 @@ class TestBuildsetsConnectorComponent(
             lambda : meth(100, _reactor=clock),
             [47, 49])
 
+    @defer.inlineCallbacks
+    def test_unclaimExpiredRequests_addsEvents(self):
+        clock = task.Clock()
+        clock.advance(self.CLAIMED_AT_EPOCH)
+        self.db.events.enable(self.MASTER_ID)
+
+        meth = self.db.buildrequests.unclaimExpiredRequests
+        yield self.do_test_unclaimMethod(
+            lambda : meth(100, _reactor=clock),
+            [47, 49])
+
+        evdicts = yield self.db.events.getEventsSince(0)
+        self.assertEqual([(ev['event'], ev['objectid'], ev['buildsetid'], ev['masterid'])
+                          for ev in evdicts],
+                         [('buildrequest_unclaimed', 49, self.BSID, self.MASTER_ID)])
+
+    @defer.inlineCallbacks
+    def test_claimAndCompleteBuildRequests_addEvents(self):
+        yield self.insertTestData([
+            fakedb.BuildRequest(id=44, buildsetid=self.BSID, buildername='bbb'),
+        ])
+        self.db.events.enable(self.MASTER_ID)
+
+        yield self.db.buildrequests.claimBuildRequests(brids=[44])
+        yield self.db.buildrequests.completeBuildRequests([44], 7)
+
+        evdicts = yield self.db.events.getEventsSince(0)
+        self.assertEqual([(ev['event'], ev['objectid'], ev['buildsetid'], ev['buildername'])
+                          for ev in evdicts],
+                         [('buildrequest_claimed', 44, self.BSID, 'bbb'),
+                          ('buildrequest_completed', 44, self.BSID, 'bbb')])
+
     def test_unclaimBuildRequests(self):
         to_unclaim = [
             44, # completed -> unclaimed anyway
@@ -953,6 +987,34 @@ class TestBuildsetsConnectorComponent(
         d.addCallback(checkBuildRequests, 1)
         return d
 
+    @defer.inlineCallbacks
+    def test_claimBuildRequestGroups(self):
+        clock = task.Clock()
+        clock.advance(1300305712)
+        breqs = [fakedb.BuildRequest(id=id, buildsetid=id, buildername="builder") for id in range(1, 6)]
+        yield self.insertTestData(breqs)
+
+        yield self.db.buildrequests.claimBuildRequestGroups([[1, 2, 3], [4]], _reactor=clock)
+
+        brlist = yield self.db.buildrequests.getBuildRequests(brids=[1, 2, 3, 4, 5])
+        self.assertEqual(sorted([(br['brid'], br['mergebrid'], br['claimed'], br['mine']) for br in brlist]),
+                         [(1, None, True, True), (2, 1, True, True), (3, 1, True, True),
+                          (4, None, True, True), (5, None, False, False)])
+
+    @defer.inlineCallbacks
+    def test_claimBuildRequestGroups_other_master_claim(self):
+        breqs = [fakedb.BuildRequest(id=id, buildsetid=id, buildername="builder") for id in range(1, 5)]
+        breqs += [fakedb.BuildRequestClaim(brid=4, objectid=self.OTHER_MASTER_ID, claimed_at=1300103810)]
+        yield self.insertTestData(breqs)
+
+        yield self.assertFailure(self.db.buildrequests.claimBuildRequestGroups([[1, 2], [3], [4]]),
+                                 buildrequests.AlreadyClaimedError)
+
+        brlist = yield self.db.buildrequests.getBuildRequests(brids=[1, 2, 3, 4])
+        self.assertEqual(sorted([(br['brid'], br['mergebrid'], br['claimed'], br['mine']) for br in brlist]),
+                         [(1, None, False, False), (2, None, False, False), (3, None, False, False),
+                          (4, None, True, False)])
+
     def test_findCompatibleFinishedBuildRequest(self):
         breqs = [fakedb.BuildRequest(id=1, buildsetid=1, buildername="B", complete=1, results=0,
                                      submitted_at=1418823086, complete_at=1418823086),
@@ -1165,7 +1227,8 @@ class TestBuildsetsConnectorComponent(
                 'priority': priority,
                 'mergebrid': None,
                 'brid': brid,
-                'startbrid': None}
+                'startbrid': None,
+                'selected_slave': None}
 
     def test_getBuildRequestInQueue(self):
         breqs = [fakedb.BuildRequest(id=1, buildsetid=1, buildername="bldr1"),
@@ -1261,7 +1324,8 @@ class TestBuildsetsConnectorComponent(
         breqs = [fakedb.BuildRequest(id=1, buildsetid=1, buildername="bldr1",
                                      priority=20, submitted_at=1450171024),
                  fakedb.BuildRequest(id=2, buildsetid=2, buildername="bldr1",
-                                     priority=50, submitted_at=1450171039),
+                                     priority=50, submitted_at=1450171039,
+                                     selected_slave="build-slave-03"),
                  fakedb.BuildRequest(id=3, buildsetid=3, buildername="bldr2",
                                      priority=100, submitted_at=1449668061,
                                      startbrid=1),
@@ -1273,7 +1337,7 @@ class TestBuildsetsConnectorComponent(
                                      results=RESUME, complete=0),
                  fakedb.BuildRequest(id=6, buildsetid=6, buildername="bldr3",
                                      priority=100, submitted_at=1446632022,
-                                     results=RESUME, complete=0),
+                                     results=RESUME, complete=0, selected_slave="build-slave-02"),
                  fakedb.BuildRequest(id=7, buildsetid=7, buildername="bldr3",
                                      priority=100, submitted_at=1446632022,
                                      results=RESUME, complete=0, mergebrid=7),
@@ -1362,6 +1426,70 @@ class TestBuildsetsConnectorComponent(
         d.addCallback(lambda queue: self.assertEqual(queue, expectedBreqs))
         return d
 
+    @defer.inlineCallbacks
+    def test_getBuildRequestsInUnclaimedQueuePages(self):
+        yield self.insertPrioritizedBreqs()
+
+        page = yield self.db.buildrequests.getBuildRequestsInQueue(queue=Queue.unclaimed, limit=3)
+        self.assertEqual([br['brid'] for br in page], [9, 3, 2])
+
+        page = yield self.db.buildrequests.getBuildRequestsInQueue(queue=Queue.unclaimed, limit=3,
+                                                                   after=page[-1])
+        self.assertEqual([br['brid'] for br in page], [1])
+
+        page = yield self.db.buildrequests.getBuildRequestsInQueue(queue=Queue.unclaimed, limit=3,
+                                                                   after=page[-1])
+        self.assertEqual(page, [])
+
+    @defer.inlineCallbacks
+    def test_getBuildRequestsInUnclaimedQueuePagesSamePriorityAndSubmittedTime(self):
+        yield self.insertTestData([fakedb.BuildRequest(id=id, buildsetid=id, buildername="bldr1",
+                                                       priority=50, submitted_at=1450171024)
+                                   for id in range(1, 6)])
+
+        first = yield self.db.buildrequests.getBuildRequestsInQueue(queue=Queue.unclaimed, limit=2)
+        second = yield self.db.buildrequests.getBuildRequestsInQueue(queue=Queue.unclaimed, limit=10,
+                                                                     after=first[-1])
+        self.assertEqual([br['brid'] for br in first + second], [1, 2, 3, 4, 5])
+
+    def test_getBuildRequestsInUnclaimedQueueFilterByBrids(self):
+        expectedBreqs = [self.fakePrioritzedRequest(brid=3, results=-1,
+                                                    buildername='bldr2', priority=100,
+                                                    submitted_at=1449668061,
+                                                    selected_slave=None,
+                                                    slavepool=None, startbrid=1),
+                         self.fakePrioritzedRequest(brid=1, results=-1,
+                                                    buildername='bldr1', priority=20,
+                                                    submitted_at=1450171024,
+                                                    selected_slave=None, slavepool=None)]
+
+        d = self.insertPrioritizedBreqs()
+        d.addCallback(lambda _: self.db.buildrequests.getBuildRequestsInQueue(queue=Queue.unclaimed,
+                                                                              brids=[1, 3, 4]))
+        d.addCallback(lambda queue: self.assertEqual(queue, expectedBreqs))
+        return d
+
+    @defer.inlineCallbacks
+    def test_getBuildRequestsSourceStamps(self):
+        yield self.insertTestData([fakedb.SourceStampSet(id=1),
+                                   fakedb.SourceStamp(id=1, sourcestampsetid=1, codebase='cb1',
+                                                      branch='master', revision='asz3113'),
+                                   fakedb.SourceStamp(id=2, sourcestampsetid=1, codebase='cb2',
+                                                      branch='develop', revision='asz3114'),
+                                   fakedb.Buildset(id=1, sourcestampsetid=1),
+                                   fakedb.Buildset(id=2, sourcestampsetid=1),
+                                   fakedb.BuildRequest(id=1, buildsetid=1, buildername="bldr1"),
+                                   fakedb.BuildRequest(id=2, buildsetid=2, buildername="bldr2")])
+
+        sourcestamps = yield self.db.buildrequests.getBuildRequestsSourceStamps([1, 2, 3])
+
+        expected = [dict(sourcestampsetid=1, codebase='cb1', branch='master', revision='asz3113'),
+                    dict(sourcestampsetid=1, codebase='cb2', branch='develop', revision='asz3114')]
+        key = lambda ss: ss['codebase']
+        self.assertEqual(sorted(sourcestamps[1], key=key), expected)
+        self.assertEqual(sorted(sourcestamps[2], key=key), expected)
+        self.assertEqual(sourcestamps[3], [])
+
     @defer.inlineCallbacks
     def test_getPrioritizedBuildRequestsInUnclaimedQueueUsesFilters(self):
         sources = [{'repository': 'repo1', 'codebase': 'cb1', 'branch': 'master', 'revision': 'asz3113'},
@@ -1461,3 +1589,104 @@ class TestBuildsetsConnectorComponent(
         d.addCallback(lambda _: self.db.buildrequests.getBuildRequests(buildername='bldr1', brids=[4]))
         d.addCallback(self.checkCanceledBuildRequests, complete=False, results=RESUME)
         return d
+
+    def insertPruneTestData(self):
+        recent = int(time.time())
+        return self.insertTestData([
+            fakedb.Change(changeid=1),
+            fakedb.Patch(id=1, patch_author='me', patch_comment='fix'),
+            fakedb.SourceStampSet(id=1),
+            fakedb.SourceStamp(id=1, sourcestampsetid=1, patchid=1),
+            fakedb.SourceStampChange(sourcestampid=1, changeid=1),
+            fakedb.SourceStampSet(id=2),
+            fakedb.SourceStamp(id=2, sourcestampsetid=2),
+            fakedb.Buildset(id=1, sourcestampsetid=1, submitted_at=1000, complete=1),
+            fakedb.BuildsetProperty(buildsetid=1),
+            fakedb.BuildRequest(id=1, buildsetid=1, buildername="bldr1"),
+            fakedb.BuildRequestClaim(brid=1, objectid=self.MASTER_ID, claimed_at=1000),
+            fakedb.Build(id=1, brid=1),
+            fakedb.Buildset(id=2, sourcestampsetid=2, submitted_at=2000, complete=1),
+            fakedb.BuildRequest(id=2, buildsetid=2, buildername="bldr1"),
+            # triggered by the old request, shares its sourcestampset
+            fakedb.Buildset(id=3, sourcestampsetid=2, submitted_at=recent),
+            fakedb.BuildRequest(id=3, buildsetid=3, buildername="bldr2",
+                                triggeredbybrid=2, startbrid=2, submitted_at=recent),
+        ])
+
+    def getIds(self, table, column='id'):
+        def thd(conn):
+            tbl = self.db.model.metadata.tables[table]
+            return sorted(r[0] for r in conn.execute(sa.select([tbl.c[column]])))
+        return self.db.pool.do(thd)
+
+    @defer.inlineCallbacks
+    def test_pruneBuildRequests(self):
+        yield self.insertPruneTestData()
+
+        pruned = yield self.db.buildrequests.pruneBuildRequests(10)
+
+        # buildset BSID from setUp is old but not complete
+        self.assertEqual(pruned, 2)
+        buildsets = yield self.getIds('buildsets')
+        self.assertEqual(buildsets, [3, self.BSID])
+        buildset_properties = yield self.getIds('buildset_properties', 'buildsetid')
+        self.assertEqual(buildset_properties, [])
+        claims = yield self.getIds('buildrequest_claims', 'brid')
+        self.assertEqual(claims, [])
+        builds = yield self.getIds('builds')
+        self.assertEqual(builds, [])
+        sourcestampsets = yield self.getIds('sourcestampsets')
+        self.assertEqual(sourcestampsets, [2, 234])
+        sourcestamps = yield self.getIds('sourcestamps')
+        self.assertEqual(sourcestamps, [2, 234])
+        sourcestamp_changes = yield self.getIds('sourcestamp_changes', 'sourcestampid')
+        self.assertEqual(sourcestamp_changes, [])
+        patches = yield self.getIds('patches')
+        self.assertEqual(patches, [])
+
+        breqs = yield self.db.buildrequests.getBuildRequests()
+        self.assertEqual([br['brid'] for br in breqs], [3])
+        self.assertEqual((breqs[0]['triggeredbybrid'], breqs[0]['startbrid']), (None, None))
+
+    @defer.inlineCallbacks
+    def test_pruneBuildRequestsKeepsIncompleteBuildsets(self):
+        yield self.insertPruneTestData()
+        # an old buildset still waiting for its request
+        yield self.insertTestData([
+            fakedb.Buildset(id=4, sourcestampsetid=1, submitted_at=500, complete=0),
+            fakedb.BuildRequest(id=4, buildsetid=4, buildername="bldr1", submitted_at=500),
+        ])
+
+        pruned = yield self.db.buildrequests.pruneBuildRequests(10)
+
+        self.assertEqual(pruned, 2)
+        buildsets = yield self.getIds('buildsets')
+        self.assertEqual(buildsets, [3, 4, self.BSID])
+        sourcestampsets = yield self.getIds('sourcestampsets')
+        self.assertEqual(sourcestampsets, [1, 2, 234])
+        breqs = yield self.db.buildrequests.getBuildRequests()
+        self.assertEqual(sorted(br['brid'] for br in breqs), [3, 4])
+
+    @defer.inlineCallbacks
+    def test_pruneBuildRequestsInBatches(self):
+        yield self.insertPruneTestData()
+
+        results = []
+        while True:
+            pruned = yield self.db.buildrequests.pruneBuildRequests(10, limit=1)
+            if not pruned:
+                break
+            buildsets = yield self.getIds('buildsets')
+            results.append(buildsets)
+
+        self.assertEqual(results, [[2, 3, self.BSID], [3, self.BSID]])
+
+    @defer.inlineCallbacks
+    def test_pruneBuildRequestsUnconfigured(self):
+        yield self.insertPruneTestData()
+
+        pruned = yield self.db.buildrequests.pruneBuildRequests(None)
+
+        self.assertEqual(pruned, 0)
+        buildsets = yield self.getIds('buildsets')
+        self.assertEqual(buildsets, [1, 2, 3, self.BSID])
@@ -13,6 +13,7 @@
 #
 # Copyright Buildbot Team Members
 
+import sqlalchemy as sa
 from twisted.trial import unittest
 from twisted.internet import defer, task
 from buildbot.db import builds
@@ -31,7 +32,7 @@ class TestBuildsConnectorComponent(
     def setUp(self):
         d = self.setUpConnectorComponent(
             table_names=['builds', 'buildrequests', 'buildsets',
-                'sourcestamps', 'sourcestampsets', 'patches' ])
+                'sourcestamps', 'sourcestampsets', 'patches', 'last_builds' ])
 
         def finish_setup(_):
             self.db.builds = builds.BuildsConnectorComponent(self.db)
@@ -265,6 +266,37 @@ class TestBuildsConnectorComponent(
 
         self.assertEqual(lastBuildNumber, [4, 3])
 
+    @defer.inlineCallbacks
+    def test_getLastBuildNumbersByResults(self):
+        builds = [fakedb.BuildRequest(id=2, buildsetid=1, buildername="builder",
+                                      complete=1, results=2,
+                                      submitted_at=self.SUBMITTED_AT_EPOCH,
+                                      complete_at=self.COMPLETE_AT_EPOCH),
+                  fakedb.Build(id=2, number=3, brid=2, start_time=self.SUBMITTED_AT_EPOCH,
+                               finish_time=self.COMPLETE_AT_EPOCH),
+                  fakedb.BuildRequest(id=3, buildsetid=1, buildername="builder",
+                                      complete=1, results=0,
+                                      submitted_at=self.SUBMITTED_AT_EPOCH,
+                                      complete_at=self.COMPLETE_AT_EPOCH),
+                  fakedb.Build(id=3, number=2, brid=3, start_time=self.SUBMITTED_AT_EPOCH,
+                               finish_time=self.COMPLETE_AT_EPOCH),
+                  # resumed builds are left out
+                  fakedb.BuildRequest(id=4, buildsetid=1, buildername="builder",
+                                      complete=1, results=9,
+                                      submitted_at=self.SUBMITTED_AT_EPOCH,
+                                      complete_at=self.COMPLETE_AT_EPOCH),
+                  fakedb.Build(id=4, number=5, brid=4, start_time=self.SUBMITTED_AT_EPOCH,
+                               finish_time=self.COMPLETE_AT_EPOCH)]
+        yield self.insertTestData(self.last_builds + builds)
+
+        numbers = yield self.db.builds.getLastBuildNumbersByResults(
+            "builder", [{'b_codebase': '1', 'b_branch': 'master'}])
+        self.assertEqual(numbers, {0: 4, 2: 3})
+
+        numbers = yield self.db.builds.getLastBuildNumbersByResults(
+            "builder", [{'b_codebase': '1', 'b_branch': 'qa'}])
+        self.assertEqual(numbers, {})
+
     @defer.inlineCallbacks
     def insertRecentBuilds(self):
         builds = [{'buildername': "builder",
@@ -376,3 +408,39 @@ class TestBuildsConnectorComponent(
 
         builds = yield self.db.builds.getLastsBuildsNumbersBySlave(slavename="slave-01")
         self.assertEquals(builds, {'builder-01': [3], 'builder': [2, 4]})
+
+    @defer.inlineCallbacks
+    def test_updateLastBuild(self):
+        key = 'cb=master;'
+        yield self.db.builds.updateLastBuild('bldr', key, SUCCESS, 5, finish_time=100)
+        yield self.db.builds.updateLastBuild('bldr', key, 2, 7, finish_time=200)
+        # an earlier build does not replace the recorded one
+        yield self.db.builds.updateLastBuild('bldr', key, SUCCESS, 3)
+        yield self.db.builds.updateLastBuild('bldr', key, SUCCESS, 5)
+        yield self.db.builds.updateLastBuild('other', key, SUCCESS, 9)
+
+        number = yield self.db.builds.getLastBuildNumber('bldr', key)
+        self.assertEqual(number, 7)
+        number = yield self.db.builds.getLastBuildNumber('bldr', key, results=[SUCCESS])
+        self.assertEqual(number, 5)
+
+        yield self.db.builds.updateLastBuild('bldr', key, SUCCESS, 8)
+        number = yield self.db.builds.getLastBuildNumber('bldr', key, results=[SUCCESS, 2])
+        self.assertEqual(number, 8)
+
+        def thd(conn):
+            tbl = self.db.model.last_builds
+            return [tuple(row) for row in conn.execute(
+                sa.select([tbl.c.buildername, tbl.c.results, tbl.c.number])
+                .order_by(tbl.c.buildername, tbl.c.results)).fetchall()]
+        rows = yield self.db.pool.do(thd)
+        self.assertEqual(rows, [('bldr', 0, 8), ('bldr', 2, 7), ('other', 0, 9)])
+
+    @defer.inlineCallbacks
+    def test_getLastBuildNumberUnknownKey(self):
+        yield self.db.builds.updateLastBuild('bldr', 'cb=master;', SUCCESS, 5)
+
+        number = yield self.db.builds.getLastBuildNumber('bldr', 'cb=staging;')
+        self.assertEqual(number, None)
+        number = yield self.db.builds.getLastBuildNumber('bldr', 'cb=master;', results=[2])
+        self.assertEqual(number, None)
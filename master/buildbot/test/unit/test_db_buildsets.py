@@ -88,7 +88,8 @@ class TestBuildsetsConnectorComponent(
         d.addCallback(check)
         return d
 
-    def checkBuildRequest(self, triggeredbybrid=None, startbrid=None, priority=Priority.Default):
+    def checkBuildRequest(self, triggeredbybrid=None, startbrid=None, priority=Priority.Default,
+                          selected_slave=None):
         def check((bsid, brids)):
             def thd(conn):
                 reqs_tbl = self.db.model.buildrequests
@@ -99,6 +100,7 @@ class TestBuildsetsConnectorComponent(
                 self.assertEqual(row.triggeredbybrid, triggeredbybrid)
                 self.assertEqual(row.startbrid, startbrid)
                 self.assertEqual(row.priority, priority)
+                self.assertEqual(row.selected_slave, selected_slave)
             return self.db.pool.do(thd)
 
         return check
@@ -136,6 +138,14 @@ class TestBuildsetsConnectorComponent(
         d.addCallback(self.checkBuildRequest(priority=Priority.Medium))
         return d
 
+    def test_addBuildset_selected_slave(self):
+        d = self.db.buildsets.addBuildset(sourcestampsetid=234, reason='because',
+                                properties={'selected_slave': ('slave-01', 'Force Build Form')},
+                                builderNames=['a'])
+
+        d.addCallback(self.checkBuildRequest(selected_slave='slave-01'))
+        return d
+
     def test_addBuildset_bigger(self):
         props = dict(prop=(['list'], 'test'))
         d = defer.succeed(None)
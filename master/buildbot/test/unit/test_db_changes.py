@@ -479,6 +479,30 @@ class TestChangesConnectorComponent(
         d.addCallback(check)
         return d
 
+    def test_getChangesSince(self):
+        d = self.insertTestData([
+            fakedb.Change(changeid=10),
+            fakedb.Change(changeid=12),
+        ] + self.change13_rows + self.change14_rows)
+        d.addCallback(lambda _ :
+                self.db.changes.getChangesSince(10))
+        def check(changes):
+            self.assertEqual([ c['changeid'] for c in changes ], [12, 13, 14])
+            self.assertEqual(sorted(changes[1]['files']),
+                        sorted(['master/README.txt', 'slave/README.txt']))
+            self.assertEqual(changes[1]['properties'],
+                        { 'notest' : ('no', 'Change') })
+            self.assertEqual(changes[2], self.change14_dict)
+        d.addCallback(check)
+        d.addCallback(lambda _ :
+                self.db.changes.getChangesSince(10, limit=2))
+        d.addCallback(lambda changes :
+                self.assertEqual([ c['changeid'] for c in changes ], [12, 13]))
+        d.addCallback(lambda _ :
+                self.db.changes.getChangesSince(14))
+        d.addCallback(lambda changes : self.assertEqual(changes, []))
+        return d
+
     def test_getRecentChanges_subset(self):
         d = self.insertTestData([
             fakedb.Change(changeid=8),
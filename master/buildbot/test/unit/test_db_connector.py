@@ -15,7 +15,7 @@
 
 import os
 import mock
-from twisted.internet import defer
+from twisted.internet import defer, task
 from twisted.trial import unittest
 from buildbot.db import connector
 from buildbot import config
@@ -62,32 +62,72 @@ class DBConnector(db.RealDatabaseMixin, unittest.TestCase):
         @d.addCallback
         def check(_):
             self.assertTrue(self.db.cleanup_timer.running)
+            self.assertTrue(self.db.pruner.running)
 
     def test_doCleanup_unconfigured_cleanUpPeriod(self):
         d = self.startService()
         @d.addCallback
         def check(_):
             self.assertTrue(self.db.cleanup_timer is None)
+            self.assertTrue(self.db.pruner is None)
 
     def test_doCleanup_unconfigured(self):
         self.db.changes.pruneChanges = mock.Mock(
                         return_value=defer.succeed(None))
-        self.db._doCleanup(pruneBuildRequests=False)
+        self.db._doCleanup()
         self.assertFalse(self.db.changes.pruneChanges.called)
 
     def test_doCleanup_configured(self):
         self.db.changes.pruneChanges = mock.Mock(
                         return_value=defer.succeed(None))
         self.db.buildrequests.pruneBuildRequests = mock.Mock(
-                        return_value=defer.succeed(None))
+                        return_value=defer.succeed(0))
         d = self.startService()
         @d.addCallback
         def check(_):
-            self.db._doCleanup(pruneBuildRequests=True)
+            self.db._doCleanup()
             self.assertTrue(self.db.changes.pruneChanges.called)
-            self.assertTrue(self.db.buildrequests.pruneBuildRequests.called)
+            self.assertFalse(self.db.buildrequests.pruneBuildRequests.called)
         return d
 
+    def makePruner(self, pruned):
+        self.master.config.buildRequestsDays = 10
+        self.clock = task.Clock()
+        pruner = connector.BuildRequestsPruner(self.db)
+        pruner._reactor = self.clock
+        results = list(pruned)
+
+        def pruneBuildRequests(buildRequestsDays, limit):
+            self.assertEqual((buildRequestsDays, limit), (10, pruner.BATCH_SIZE))
+            self.clock.advance(1)
+            return defer.succeed(results.pop(0))
+        self.db.buildrequests.pruneBuildRequests = mock.Mock(side_effect=pruneBuildRequests)
+        return pruner
+
+    @defer.inlineCallbacks
+    def test_pruner_prunesUntilDone(self):
+        pruner = self.makePruner([100, 100, 20, 0])
+        yield self.startService()
+        yield pruner.prune()
+        self.assertEqual(self.db.buildrequests.pruneBuildRequests.call_count, 4)
+        self.assertFalse(pruner.pruning)
+
+    @defer.inlineCallbacks
+    def test_pruner_stopsAfterTimeBudget(self):
+        pruner = self.makePruner([100] * 10)
+        pruner.TIME_BUDGET = 3
+        yield self.startService()
+        yield pruner.prune()
+        self.assertEqual(self.db.buildrequests.pruneBuildRequests.call_count, 3)
+
+    @defer.inlineCallbacks
+    def test_pruner_unconfigured(self):
+        pruner = self.makePruner([100])
+        self.master.config.buildRequestsDays = None
+        yield self.startService()
+        yield pruner.prune()
+        self.assertFalse(self.db.buildrequests.pruneBuildRequests.called)
+
     def test_setup_check_version_bad(self):
         d = self.startService(check_version=True)
         return self.assertFailure(d, connector.DatabaseNotReadyError)
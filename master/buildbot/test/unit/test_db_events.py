@@ -0,0 +1,118 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Unity Technologies
+
+from twisted.trial import unittest
+from twisted.internet import defer, task
+from buildbot.db import events
+from buildbot.test.util import connector_component
+from buildbot.test.fake import fakedb
+
+
+class TestEventsConnectorComponent(
+            connector_component.ConnectorComponentMixin,
+            unittest.TestCase):
+
+    def setUp(self):
+        d = self.setUpConnectorComponent(table_names=['master_events'])
+
+        def finish_setup(_):
+            self.db.events = events.EventsConnectorComponent(self.db)
+        d.addCallback(finish_setup)
+
+        return d
+
+    def tearDown(self):
+        return self.tearDownConnectorComponent()
+
+    background_data = [
+        fakedb.MasterEvent(id=1, event='change_added', objectid=13, created_at=100),
+        fakedb.MasterEvent(id=2, event='buildrequest_added', objectid=44,
+                           buildsetid=8, buildername='bldr', masterid=3, created_at=200),
+        fakedb.MasterEvent(id=4, event='buildrequest_claimed', objectid=44, masterid=4,
+                           created_at=300),
+    ]
+
+    @defer.inlineCallbacks
+    def test_addEvents_disabled(self):
+        yield self.db.events.addEvents([dict(event='change_added', objectid=13)])
+        latest = yield self.db.events.getLatestEventId()
+        self.assertEqual(latest, 0)
+
+    @defer.inlineCallbacks
+    def test_addEvents(self):
+        clock = task.Clock()
+        clock.advance(500)
+        self.db.events.enable(7)
+        yield self.insertTestData(self.background_data)
+
+        yield self.db.events.addEvents([
+            dict(event='buildrequest_cancelled', objectid=44, buildsetid=8, buildername='bldr'),
+            dict(event='change_added', objectid=14),
+        ], _reactor=clock)
+
+        evdicts = yield self.db.events.getEventsSince(4)
+        self.assertEqual(evdicts, [
+            dict(eventid=5, event='buildrequest_cancelled', objectid=44, buildsetid=8,
+                 buildername='bldr', masterid=7, created_at=500),
+            dict(eventid=6, event='change_added', objectid=14, buildsetid=None,
+                 buildername=None, masterid=7, created_at=500),
+        ])
+
+    @defer.inlineCallbacks
+    def test_getEventsSince(self):
+        yield self.insertTestData(self.background_data)
+
+        evdicts = yield self.db.events.getEventsSince(1)
+        self.assertEqual([ev['eventid'] for ev in evdicts], [2, 4])
+        self.assertEqual(evdicts[0], dict(eventid=2, event='buildrequest_added', objectid=44,
+                                          buildsetid=8, buildername='bldr', masterid=3,
+                                          created_at=200))
+
+        evdicts = yield self.db.events.getEventsSince(2, missing=[1])
+        self.assertEqual([ev['eventid'] for ev in evdicts], [1, 4])
+
+        evdicts = yield self.db.events.getEventsSince(0, limit=2)
+        self.assertEqual([ev['eventid'] for ev in evdicts], [1, 2])
+
+    @defer.inlineCallbacks
+    def test_getLatestEventId(self):
+        latest = yield self.db.events.getLatestEventId()
+        self.assertEqual(latest, 0)
+
+        yield self.insertTestData(self.background_data)
+        latest = yield self.db.events.getLatestEventId()
+        self.assertEqual(latest, 4)
+
+    @defer.inlineCallbacks
+    def test_getFirstEventId(self):
+        yield self.insertTestData(self.background_data + [
+            fakedb.MasterEvent(id=5, event='change_added', objectid=15, created_at=400)])
+        first = yield self.db.events.getFirstEventId('change_added', 12)
+        self.assertEqual(first, 1)
+        first = yield self.db.events.getFirstEventId('change_added', 13)
+        self.assertEqual(first, 5)
+        first = yield self.db.events.getFirstEventId('change_added', 15)
+        self.assertEqual(first, None)
+
+    @defer.inlineCallbacks
+    def test_pruneEvents(self):
+        clock = task.Clock()
+        clock.advance(350)
+        yield self.insertTestData(self.background_data)
+
+        pruned = yield self.db.events.pruneEvents(100, _reactor=clock)
+        self.assertEqual(pruned, 2)
+        evdicts = yield self.db.events.getEventsSince(0)
+        self.assertEqual([ev['eventid'] for ev in evdicts], [4])
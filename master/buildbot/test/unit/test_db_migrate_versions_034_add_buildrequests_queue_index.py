@@ -0,0 +1,58 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Unity Technologies
+
+import sqlalchemy as sa
+from sqlalchemy.engine import reflection
+from twisted.trial import unittest
+from buildbot.test.util import migration
+
+class Migration(migration.MigrateTestMixin, unittest.TestCase):
+
+    def setUp(self):
+        return self.setUpMigrateTest()
+
+    def tearDown(self):
+        return self.tearDownMigrateTest()
+
+    def create_tables_thd(self, conn):
+        metadata = sa.MetaData()
+        metadata.bind = conn
+
+        buildrequests = sa.Table('buildrequests', metadata,
+                                 sa.Column('id', sa.Integer,  primary_key=True),
+                                 sa.Column('buildsetid', sa.Integer, nullable=False),
+                                 sa.Column('buildername', sa.String(length=255), nullable=False),
+                                 sa.Column('priority', sa.Integer, nullable=False,
+                                           server_default=sa.DefaultClause("0")),
+                                 sa.Column('complete', sa.Integer, server_default=sa.DefaultClause("0")),
+                                 sa.Column('results', sa.SmallInteger),
+                                 sa.Column('submitted_at', sa.Integer, nullable=False),
+                                 sa.Column('complete_at', sa.Integer),
+                                 sa.Column('mergebrid', sa.Integer, nullable=True))
+        buildrequests.create()
+
+    # tests
+
+    def test_migrate(self):
+        def setup_thd(conn):
+            self.create_tables_thd(conn)
+
+        def verify_thd(conn):
+            insp = reflection.Inspector.from_engine(conn)
+            indexes = dict((idx['name'], idx['column_names']) for idx in insp.get_indexes('buildrequests'))
+            self.assertEqual(indexes.get('buildrequests_queue'),
+                             ['complete', 'mergebrid', 'priority', 'submitted_at'])
+
+        return self.do_test_migration(33, 34, setup_thd, verify_thd)
@@ -0,0 +1,81 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Unity Technologies
+
+import sqlalchemy as sa
+from sqlalchemy.engine import reflection
+from twisted.trial import unittest
+from buildbot.test.util import migration
+
+class Migration(migration.MigrateTestMixin, unittest.TestCase):
+
+    def setUp(self):
+        return self.setUpMigrateTest()
+
+    def tearDown(self):
+        return self.tearDownMigrateTest()
+
+    def create_tables_thd(self, conn):
+        metadata = sa.MetaData()
+        metadata.bind = conn
+
+        buildrequests = sa.Table('buildrequests', metadata,
+                                 sa.Column('id', sa.Integer,  primary_key=True),
+                                 sa.Column('buildsetid', sa.Integer, nullable=False),
+                                 sa.Column('buildername', sa.String(length=255), nullable=False),
+                                 sa.Column('complete', sa.Integer, server_default=sa.DefaultClause("0")),
+                                 sa.Column('submitted_at', sa.Integer, nullable=False))
+        buildrequests.create()
+
+        buildset_properties = sa.Table('buildset_properties', metadata,
+                                       sa.Column('buildsetid', sa.Integer, nullable=False),
+                                       sa.Column('property_name', sa.String(256), nullable=False),
+                                       sa.Column('property_value', sa.Text, nullable=False))
+        buildset_properties.create()
+
+        conn.execute(buildrequests.insert(), [
+            dict(id=1, buildsetid=1, buildername='bldr', complete=0, submitted_at=0),
+            dict(id=2, buildsetid=2, buildername='bldr', complete=0, submitted_at=0),
+            dict(id=3, buildsetid=3, buildername='bldr', complete=1, submitted_at=0)])
+
+        conn.execute(buildset_properties.insert(), [
+            dict(buildsetid=1, property_name='selected_slave',
+                 property_value='["slave-01", "Force Build Form"]'),
+            dict(buildsetid=2, property_name='reason',
+                 property_value='["because", "Force Build Form"]'),
+            dict(buildsetid=3, property_name='selected_slave',
+                 property_value='["slave-02", "Force Build Form"]')])
+
+    # tests
+
+    def test_migrate(self):
+        def setup_thd(conn):
+            self.create_tables_thd(conn)
+
+        def verify_thd(conn):
+            metadata = sa.MetaData()
+            metadata.bind = conn
+
+            buildrequests = sa.Table('buildrequests', metadata, autoload=True)
+            res = conn.execute(sa.select([buildrequests.c.id, buildrequests.c.selected_slave])
+                               .order_by(buildrequests.c.id))
+            # only the pending requests are copied
+            self.assertEqual(map(tuple, res.fetchall()),
+                             [(1, 'slave-01'), (2, None), (3, None)])
+
+            insp = reflection.Inspector.from_engine(conn)
+            indexes = dict((idx['name'], idx['column_names']) for idx in insp.get_indexes('buildrequests'))
+            self.assertEqual(indexes.get('buildrequests_selected_slave'), ['selected_slave'])
+
+        return self.do_test_migration(34, 35, setup_thd, verify_thd)
@@ -0,0 +1,53 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Unity Technologies
+
+import sqlalchemy as sa
+from sqlalchemy.engine import reflection
+from twisted.trial import unittest
+from buildbot.test.util import migration
+
+class Migration(migration.MigrateTestMixin, unittest.TestCase):
+
+    def setUp(self):
+        return self.setUpMigrateTest()
+
+    def tearDown(self):
+        return self.tearDownMigrateTest()
+
+    # tests
+
+    def test_migrate(self):
+        def setup_thd(conn):
+            pass
+
+        def verify_thd(conn):
+            metadata = sa.MetaData()
+            metadata.bind = conn
+
+            master_events = sa.Table('master_events', metadata, autoload=True)
+            conn.execute(master_events.insert(), [
+                dict(event='change_added', objectid=13, created_at=100),
+                dict(event='buildrequest_added', objectid=44, buildsetid=8,
+                     buildername='bldr', masterid=3, created_at=100)])
+            res = conn.execute(sa.select([master_events.c.id, master_events.c.event])
+                               .order_by(master_events.c.id))
+            self.assertEqual(map(tuple, res.fetchall()),
+                             [(1, 'change_added'), (2, 'buildrequest_added')])
+
+            insp = reflection.Inspector.from_engine(conn)
+            indexes = dict((idx['name'], idx['column_names']) for idx in insp.get_indexes('master_events'))
+            self.assertEqual(indexes.get('master_events_created_at'), ['created_at'])
+
+        return self.do_test_migration(35, 36, setup_thd, verify_thd)
@@ -0,0 +1,54 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Unity Technologies
+
+import sqlalchemy as sa
+from sqlalchemy.engine import reflection
+from twisted.trial import unittest
+from buildbot.test.util import migration
+
+class Migration(migration.MigrateTestMixin, unittest.TestCase):
+
+    def setUp(self):
+        return self.setUpMigrateTest()
+
+    def tearDown(self):
+        return self.tearDownMigrateTest()
+
+    # tests
+
+    def test_migrate(self):
+        def setup_thd(conn):
+            pass
+
+        def verify_thd(conn):
+            metadata = sa.MetaData()
+            metadata.bind = conn
+
+            last_builds = sa.Table('last_builds', metadata, autoload=True)
+            conn.execute(last_builds.insert(), [
+                dict(buildername='bldr', codebases_key='cb=master;', key_hash='a' * 40,
+                     results=0, number=5, finish_time=100),
+                dict(buildername='bldr', codebases_key='cb=master;', key_hash='a' * 40,
+                     results=2, number=7, finish_time=200)])
+            self.assertRaises(sa.exc.IntegrityError, conn.execute, last_builds.insert(),
+                              dict(buildername='bldr', codebases_key='cb=master;',
+                                   key_hash='a' * 40, results=0, number=8))
+
+            insp = reflection.Inspector.from_engine(conn)
+            indexes = dict((idx['name'], idx) for idx in insp.get_indexes('last_builds'))
+            self.assertEqual(indexes['last_builds_key']['column_names'], ['key_hash', 'results'])
+            self.assertTrue(indexes['last_builds_key']['unique'])
+
+        return self.do_test_migration(36, 37, setup_thd, verify_thd)
@@ -0,0 +1,129 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Unity Technologies
+
+import mock
+from twisted.trial import unittest
+from twisted.internet import defer, task
+from twisted.python import log
+from buildbot import locks
+from buildbot.process import metrics
+from buildbot.util.eventual import flushEventualQueue
+
+class TestBaseLock(unittest.TestCase):
+
+    def setUp(self):
+        self.lockid = locks.MasterLock('lck', maxCount=2)
+        self.lock = locks.RealMasterLock(self.lockid)
+        self.counting = self.lockid.access('counting')
+        self.exclusive = self.lockid.access('exclusive')
+
+    def claimed(self, owner, access):
+        self.assertTrue(self.lock.isAvailable(owner, access))
+        self.lock.claim(owner, access)
+
+    @defer.inlineCallbacks
+    def test_exclusiveWaiterIsNotStarved(self):
+        self.claimed('a', self.counting)
+        self.claimed('b', self.counting)
+
+        d_excl = self.lock.waitUntilMaybeAvailable('x', self.exclusive)
+        d_count = self.lock.waitUntilMaybeAvailable('c', self.counting)
+        self.assertFalse(self.lock.isAvailable('d', self.counting))
+        self.assertEqual(self.lock._numExclusiveWaiting, 1)
+
+        self.lock.release('a', self.counting)
+        self.assertFalse(self.lock.isAvailable('x', self.exclusive))
+        self.assertFalse(self.lock.isAvailable('c', self.counting))
+        self.lock.release('b', self.counting)
+        yield flushEventualQueue()
+        self.assertTrue(d_excl.called)
+        self.assertFalse(d_count.called)
+
+        self.claimed('x', self.exclusive)
+        self.assertEqual(self.lock._getOwnersCount(), (1, 0))
+        self.assertEqual(self.lock._numExclusiveWaiting, 0)
+        self.assertFalse(self.lock.isAvailable('c', self.counting))
+
+        self.lock.release('x', self.exclusive)
+        yield flushEventualQueue()
+        self.assertTrue(d_count.called)
+        self.claimed('c', self.counting)
+        self.assertEqual(self.lock._getOwnersCount(), (0, 1))
+        self.assertEqual(self.lock.waiting.keys(), [])
+
+    def test_countingWaitersAheadUseTheFreeSlots(self):
+        self.claimed('a', self.counting)
+        self.lock.waitUntilMaybeAvailable('x', self.exclusive)
+        self.lock.waitUntilMaybeAvailable('c', self.counting)
+        self.lock.release('a', self.counting)
+
+        # the exclusive waiter was woken, and is still ahead
+        self.assertTrue(self.lock.isAvailable('x', self.exclusive))
+        self.assertFalse(self.lock.isAvailable('c', self.counting))
+        self.assertFalse(self.lock.isAvailable(None, self.counting))
+
+        d = self.lock.waiting['x'][1]
+        self.assertEqual(d, None)
+        self.lock.claim('x', self.exclusive)
+        self.lock.release('x', self.exclusive)
+
+        # one slot for the waiter, one for a newcomer
+        self.claimed('d', self.counting)
+        self.assertTrue(self.lock.isAvailable('c', self.counting))
+        self.assertFalse(self.lock.isAvailable('e', self.counting))
+        self.assertFalse(self.lock.isAvailable('c', self.exclusive))
+
+    def test_waitingAgainKeepsThePlaceInTheQueue(self):
+        self.claimed('a', self.exclusive)
+        d1 = self.lock.waitUntilMaybeAvailable('b', self.counting)
+        self.lock.waitUntilMaybeAvailable('c', self.exclusive)
+        d2 = self.lock.waitUntilMaybeAvailable('b', self.exclusive)
+        self.assertEqual(self.lock.waiting.keys(), ['b', 'c'])
+        self.assertEqual(self.lock._numExclusiveWaiting, 2)
+
+        self.assertRaises(AssertionError, self.lock.stopWaitingUntilAvailable,
+                          'b', self.counting, d1)
+        self.lock.stopWaitingUntilAvailable('b', self.exclusive, d2)
+        self.assertEqual(self.lock.waiting.keys(), ['c'])
+        self.assertEqual(self.lock._numExclusiveWaiting, 1)
+
+    def test_metrics(self):
+        clock = task.Clock()
+        self.patch(locks.BaseLock, '_reactor', clock)
+        events = []
+        observer = lambda ev: events.append(ev['metric']) if 'metric' in ev else None
+        log.addObserver(observer)
+        self.addCleanup(log.removeObserver, observer)
+
+        self.claimed('a', self.exclusive)
+        self.lock.waitUntilMaybeAvailable('b', self.counting)
+        self.lock.waitUntilMaybeAvailable('c', self.counting)
+        clock.advance(5)
+        self.lock.release('a', self.exclusive)
+        self.lock.claim('b', self.counting)
+
+        self.assertEqual([(ev.counter, ev.count, ev.absolute) for ev in events
+                          if isinstance(ev, metrics.MetricCountEvent)],
+                         [('Lock(lck).waiting', 1, True), ('Lock(lck).waiting', 2, True),
+                          ('Lock(lck).waiting', 1, True)])
+        self.assertEqual([(ev.timer, ev.elapsed) for ev in events
+                          if isinstance(ev, metrics.MetricTimeEvent)],
+                         [('Lock(lck).wait', 5)])
+
+    def test_slaveLockMetricName(self):
+        lockid = locks.SlaveLock('lck', maxCountForSlave={'s1': 3})
+        lock = locks.RealSlaveLock(lockid).getLock(mock.Mock(slavename='s1'))
+        self.assertEqual(lock.maxCount, 3)
+        self.assertEqual(lock.metricName, 'lck[s1]')
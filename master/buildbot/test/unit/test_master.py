@@ -413,6 +413,8 @@ class Polling(dirs.DirsMixin, misc.PatcherMixin, unittest.TestCase):
         self.gotten_buildset_additions = []
         self.gotten_buildset_completions = []
         self.gotten_buildrequest_additions = []
+        self.gotten_buildrequest_cancels = []
+        self.gotten_master_events = []
 
 
         basedir = os.path.abspath('basedir')
@@ -438,6 +440,10 @@ class Polling(dirs.DirsMixin, misc.PatcherMixin, unittest.TestCase):
             sub.deliver = self.deliverBuildsetCompletion
             self.master._new_buildrequest_subs = sub = mock.Mock()
             sub.deliver = self.deliverBuildRequestAddition
+            self.master._cancelled_buildrequest_subs = sub = mock.Mock()
+            sub.deliver = self.gotten_buildrequest_cancels.append
+            self.master._master_event_subs = sub = mock.Mock()
+            sub.deliver = self.gotten_master_events.append
 
         d.addCallback(set_master)
         return d
@@ -511,6 +517,45 @@ class Polling(dirs.DirsMixin, misc.PatcherMixin, unittest.TestCase):
         d.addCallback(check)
         return d
 
+    def test_pollDatabaseChanges_batches(self):
+        self.patch(self.master, 'CHANGES_BATCH_SIZE', 2)
+        self.db.insertTestData([
+            fakedb.Object(id=53, name=self.master_name,
+                          class_name='buildbot.master.BuildMaster'),
+            fakedb.ObjectState(objectid=53, name='last_processed_change',
+                               value_json='10'),
+            fakedb.Change(changeid=10),
+            fakedb.Change(changeid=11),
+            fakedb.Change(changeid=12),
+            fakedb.Change(changeid=13),
+            fakedb.Change(changeid=14),
+        ])
+        d = self.master.pollDatabaseChanges()
+        def check(_):
+            self.assertEqual([ ch.number for ch in self.gotten_changes],
+                             [ 11, 12, 13, 14 ])
+            self.db.state.assertState(53, last_processed_change=14)
+        d.addCallback(check)
+        return d
+
+    def test_pollDatabaseChanges_stopsAtGap(self):
+        # change 12 is not committed yet; 13 waits for it
+        self.db.insertTestData([
+            fakedb.Object(id=53, name=self.master_name,
+                          class_name='buildbot.master.BuildMaster'),
+            fakedb.ObjectState(objectid=53, name='last_processed_change',
+                               value_json='10'),
+            fakedb.Change(changeid=10),
+            fakedb.Change(changeid=11),
+            fakedb.Change(changeid=13),
+        ])
+        d = self.master.pollDatabaseChanges()
+        def check(_):
+            self.assertEqual([ ch.number for ch in self.gotten_changes], [ 11 ])
+            self.db.state.assertState(53, last_processed_change=11)
+        d.addCallback(check)
+        return d
+
     def test_pollDatabaseChanges_nothing_new(self):
         self.db.insertTestData([
             fakedb.Object(id=53, name='master',
@@ -589,3 +634,100 @@ class Polling(dirs.DirsMixin, misc.PatcherMixin, unittest.TestCase):
         d.addCallback(check)
         return d
 
+
+    @defer.inlineCallbacks
+    def test_pollDatabase_readsEventsAfterCatchingUp(self):
+        clock = task.Clock()
+        self.db.insertTestData([
+            fakedb.Object(id=22, name=self.master_name,
+                          class_name='buildbot.master.BuildMaster'),
+            fakedb.Change(changeid=10),
+            fakedb.MasterEvent(id=3, event='change_added', objectid=10),
+        ])
+        self.db.events.enable(22)
+        yield self.master.pollDatabase(_reactor=clock)
+        self.assertEqual(self.gotten_changes, [])
+        self.assertEqual(self.master._last_event_id, 3)
+
+        self.db.insertTestData([
+            fakedb.SourceStampSet(id=127),
+            fakedb.SourceStamp(id=127, sourcestampsetid=127),
+            fakedb.Buildset(id=99, sourcestampsetid=127),
+            fakedb.BuildRequest(id=19, buildsetid=99, buildername='9teen'),
+            fakedb.Change(changeid=11),
+            fakedb.MasterEvent(id=4, event='change_added', objectid=11),
+            fakedb.MasterEvent(id=5, event='buildrequest_added', objectid=19,
+                               buildsetid=99, buildername='9teen'),
+            fakedb.MasterEvent(id=6, event='buildrequest_cancelled', objectid=19,
+                               buildsetid=99, buildername='9teen', masterid=22),
+            fakedb.MasterEvent(id=7, event='buildrequest_cancelled', objectid=20,
+                               buildsetid=99, buildername='twenty', masterid=23),
+        ])
+        yield self.master.pollDatabase(_reactor=clock)
+        self.assertEqual([ch.number for ch in self.gotten_changes], [11])
+        self.assertEqual(self.gotten_buildrequest_additions,
+                         [dict(bsid=99, brid=19, buildername='9teen')])
+        # the cancels of this master were already delivered
+        self.assertEqual(self.gotten_buildrequest_cancels,
+                         [dict(bsid=99, brid=20, buildername='twenty')])
+        self.assertEqual([ev['eventid'] for ev in self.gotten_master_events],
+                         [4, 5, 6, 7])
+        self.db.state.assertState(22, last_processed_change=11)
+
+    @defer.inlineCallbacks
+    def test_pollDatabase_changesAfterGapAreReadFromEvents(self):
+        clock = task.Clock()
+        # change 12 is not committed when the master catches up
+        self.db.insertTestData([
+            fakedb.Object(id=22, name=self.master_name,
+                          class_name='buildbot.master.BuildMaster'),
+            fakedb.ObjectState(objectid=22, name='last_processed_change',
+                               value_json='10'),
+            fakedb.Change(changeid=10),
+            fakedb.Change(changeid=11),
+            fakedb.Change(changeid=13),
+            fakedb.MasterEvent(id=4, event='change_added', objectid=11),
+            fakedb.MasterEvent(id=5, event='change_added', objectid=13),
+        ])
+        self.db.events.enable(22)
+        yield self.master.pollDatabase(_reactor=clock)
+        self.assertEqual([ch.number for ch in self.gotten_changes], [11])
+        self.assertEqual(self.master._last_event_id, 4)
+
+        self.db.insertTestData([
+            fakedb.Change(changeid=12),
+            fakedb.MasterEvent(id=6, event='change_added', objectid=12),
+        ])
+        yield self.master.pollDatabase(_reactor=clock)
+        self.assertEqual([ch.number for ch in self.gotten_changes], [11, 13, 12])
+        self.db.state.assertState(22, last_processed_change=13)
+
+    @defer.inlineCallbacks
+    def test_pollDatabaseEvents_missingEvents(self):
+        clock = task.Clock()
+        self.master._last_event_id = 1
+        self.db.insertTestData([
+            fakedb.MasterEvent(id=4, event='buildrequest_claimed', objectid=19),
+        ])
+        yield self.master.pollDatabaseEvents(_reactor=clock)
+        self.assertEqual(self.master._missing_event_ids, {2: 0, 3: 0})
+
+        # event 2 is committed later, event 3 never is
+        self.db.insertTestData([
+            fakedb.MasterEvent(id=2, event='buildrequest_claimed', objectid=20),
+        ])
+        yield self.master.pollDatabaseEvents(_reactor=clock)
+        self.assertEqual([ev['eventid'] for ev in self.gotten_master_events], [4, 2])
+        self.assertEqual(self.master._missing_event_ids, {3: 0})
+
+        clock.advance(self.master.EVENT_GAP_TIMEOUT)
+        yield self.master.pollDatabaseEvents(_reactor=clock)
+        self.assertEqual(self.master._missing_event_ids, {})
+        self.assertEqual(self.master._last_event_id, 4)
+
+    def test_buildRequestRemoved_addsEvent(self):
+        self.db.events.enable(22)
+        self.master.buildRequestRemoved(99, 19, '9teen')
+        self.assertEqual(self.gotten_buildrequest_cancels,
+                         [dict(bsid=99, brid=19, buildername='9teen')])
+        self.assertEqual(self.db.events.events.values()[0]['event'], 'buildrequest_cancelled')
@@ -14,8 +14,10 @@
 # Copyright Buildbot Team Members
 
 from twisted.trial import unittest
+from twisted.internet import defer
 from buildbot.test.fake import fakedb, fakemaster
 from buildbot.process import buildrequest
+from buildbot.util import lru
 from buildbot.status.results import CANCELED, BEGINNING
 import mock
 
@@ -94,6 +96,36 @@ class TestBuildRequest(unittest.TestCase):
         d.addCallback(check)
         return d
 
+    @defer.inlineCallbacks
+    def test_fromBrdict_cached_request_is_updated(self):
+        master = fakemaster.make_master()
+        master.db = fakedb.FakeDBConnector(self)
+        master.db.insertTestData([
+            fakedb.SourceStampSet(id=234),
+            fakedb.SourceStamp(id=234, sourcestampsetid=234, branch='trunk',
+                        revision='9284', repository='svn://...',
+                        project='world-domination'),
+            fakedb.Buildset(id=539, reason='triggered', sourcestampsetid=234),
+            fakedb.BuildRequest(id=288, buildsetid=539, buildername='bldr',
+                        priority=13, submitted_at=1200000000),
+        ])
+        # only the build requests are cached
+        cache = lru.AsyncLRUCache(buildrequest.BuildRequest._make_br)
+        get_cache = master.caches.get_cache
+        master.caches.get_cache = lambda name, miss_fn: \
+            cache if name == "BuildRequests" else get_cache(name, miss_fn)
+
+        brdict = yield master.db.buildrequests.getBuildRequest(288)
+        br = yield buildrequest.BuildRequest.fromBrdict(master, brdict)
+        self.assertEqual(br.priority, 13)
+
+        # the cached request picks up the fields changed since
+        brdict = dict(brdict, priority=50, slavepool='startSlavenames')
+        br2 = yield buildrequest.BuildRequest.fromBrdict(master, brdict)
+        self.assertIdentical(br2, br)
+        self.assertEqual(br2.priority, 50)
+        self.assertEqual(br2.slavepool, 'startSlavenames')
+
     def test_fromBrdict_no_sourcestamps(self):
         master = fakemaster.make_master()
         master.db = fakedb.FakeDBConnector(self)
@@ -1,3 +1,4 @@
+import random
 from twisted.trial import unittest
 from twisted.internet import defer
 from twisted.python import log
@@ -13,6 +14,7 @@ from buildbot.test.util.katanabuildrequestdistributor import KatanaBuildRequestD
 from buildbot.test.util import compat
 from buildbot.db.buildrequests import AlreadyClaimedError
 from buildbot.process.buildrequest import Priority
+from buildbot.db import events
 
 class TestKatanaBuildRequestDistributorGetNextPriorityBuilder(unittest.TestCase,
                                         KatanaBuildRequestDistributorTestSetup):
@@ -175,12 +177,78 @@ class TestKatanaBuildRequestDistributorGetNextPriorityBuilder(unittest.TestCase,
         breq = yield self.brd.katanaBuildChooser.getNextPriorityBuilder(queue=Queue.resume)
         self.assertEquals(breq, None)
 
+    @defer.inlineCallbacks
+    def test_getNextPriorityBuilderSkipsBuildersWithNoIdleSlaves(self):
+        testdata = [fakedb.BuildRequest(id=1, buildsetid=1, buildername="bldr1",
+                                        priority=100, submitted_at=1449578391),
+                    fakedb.BuildRequest(id=2, buildsetid=2, buildername="bldr2",
+                                        priority=50, submitted_at=1450171039)]
+
+        testdata += self.getBuildSetTestData(xrange(1, 3))
+
+        bldr1 = self.setupBuilderInMaster(name='bldr1', slavenames={'slave-01': False},
+                                          startSlavenames={'slave-02': False})
+        self.setupBuilderInMaster(name='bldr2', slavenames={'slave-01': False}, startSlavenames={'slave-03': True})
+
+        yield self.insertTestData(testdata)
+
+        breq = yield self.brd.katanaBuildChooser.getNextPriorityBuilder(queue=Queue.unclaimed)
+        self.assertEquals((breq.buildername, breq.id), ('bldr2', 2))
+
+        getAvailableSlaves = mock.Mock(wraps=bldr1.getAvailableSlavesToProcessBuildRequests)
+        self.patch(bldr1, 'getAvailableSlavesToProcessBuildRequests', getAvailableSlaves)
+
+        breq = yield self.brd.katanaBuildChooser.getNextPriorityBuilder(queue=Queue.unclaimed)
+        self.assertEquals((breq.buildername, breq.id), ('bldr2', 2))
+        self.assertFalse(getAvailableSlaves.called)
+
+        # a slave finished a build on bldr1
+        self.brd.katanaBuildChooser.slavesAvailabilityChanged(['bldr1'])
+        breq = yield self.brd.katanaBuildChooser.getNextPriorityBuilder(queue=Queue.unclaimed)
+        self.assertEquals((breq.buildername, breq.id), ('bldr2', 2))
+        getAvailableSlaves.assert_called_once_with(slavepool=Slavepool.startSlavenames)
+
+    @defer.inlineCallbacks
+    def test_getNextPriorityBuilderKeepsBuildRequestsCached(self):
+        testdata = [fakedb.BuildRequest(id=1, buildsetid=1, buildername="bldr1",
+                                        priority=100, submitted_at=1449578391),
+                    fakedb.BuildRequest(id=2, buildsetid=2, buildername="bldr1",
+                                        priority=50, submitted_at=1450171039)]
+
+        testdata += self.getBuildSetTestData(xrange(1, 3))
+
+        self.setupBuilderInMaster(name='bldr1', slavenames={'slave-01': True}, startSlavenames={'slave-02': True})
+
+        yield self.insertTestData(testdata)
+
+        chooser = self.brd.katanaBuildChooser
+        chooser.breqCache.set_max_size(10)
+
+        breq = yield chooser.getNextPriorityBuilder(queue=Queue.unclaimed)
+        self.assertEquals(breq.id, 1)
+        self.assertFalse(breq.checkMerges)
+
+        # the activity loop finished
+        chooser.resetMergeChecks()
+        self.assertTrue(breq.checkMerges)
+
+        misses = chooser.breqCache.misses
+        cachedBreq = yield chooser.getNextPriorityBuilder(queue=Queue.unclaimed)
+        self.assertIdentical(cachedBreq, breq)
+        self.assertEquals(chooser.breqCache.misses, misses)
+
+        # the request was claimed
+        chooser.buildRequestRemoved(1)
+        self.assertEquals(chooser.breqCache.keys(), [])
+        breq = yield chooser.getNextPriorityBuilder(queue=Queue.unclaimed)
+        self.assertEquals(breq.id, 2)
+
     @defer.inlineCallbacks
     def test_getNextPriorityBuilderSelectedSlaveUnclaimQueue(self):
         testdata = [fakedb.BuildRequest(id=1, buildsetid=1, buildername="bldr2",
                                         priority=2, submitted_at=1450171024),
                  fakedb.BuildRequest(id=2, buildsetid=2, buildername="bldr1",
-                                     priority=50, submitted_at=1450171039)]
+                                     priority=50, submitted_at=1450171039, selected_slave='slave-01')]
 
         testdata += [fakedb.BuildsetProperty(buildsetid=2,
                                              property_name='selected_slave',
@@ -217,7 +285,7 @@ class TestKatanaBuildRequestDistributorGetNextPriorityBuilder(unittest.TestCase,
                                         priority=20, submitted_at=1449578391),
                     fakedb.BuildRequest(id=2, buildsetid=2, buildername="bldr1",
                                         priority=50, submitted_at=1450171039,
-                                        results=RESUME, complete=0)]
+                                        results=RESUME, complete=0, selected_slave='slave-01')]
 
         testdata += [fakedb.BuildRequestClaim(brid=1, objectid=self.MASTER_ID, claimed_at=1449578391),
                        fakedb.BuildRequestClaim(brid=2, objectid=self.MASTER_ID, claimed_at=1450171039)]
@@ -248,7 +316,8 @@ class TestKatanaBuildRequestDistributorGetNextPriorityBuilder(unittest.TestCase,
                                         priority=20, submitted_at=1449578391),
                     fakedb.BuildRequest(id=2, buildsetid=2, buildername="bldr1",
                                         priority=50, submitted_at=1450171039,
-                                        results=RESUME, complete=0, slavepool=Slavepool.startSlavenames)]
+                                        results=RESUME, complete=0, slavepool=Slavepool.startSlavenames,
+                                        selected_slave='slave-01')]
 
         testdata += [fakedb.BuildRequestClaim(brid=1, objectid=self.MASTER_ID, claimed_at=1449578391),
                      fakedb.BuildRequestClaim(brid=2, objectid=self.MASTER_ID, claimed_at=1450171039)]
@@ -270,6 +339,258 @@ class TestKatanaBuildRequestDistributorGetNextPriorityBuilder(unittest.TestCase,
         self.assertEquals((breq.buildername, breq.id), ("bldr1", 2))
 
 
+    @defer.inlineCallbacks
+    def test_getNextPriorityBuilderLoadsQueueInPages(self):
+        testdata = [fakedb.BuildRequest(id=id, buildsetid=id, buildername="bldr1",
+                                        priority=id, submitted_at=1449578391) for id in range(1, 6)]
+        testdata += self.getBuildSetTestData(xrange=xrange(1, 6))
+        yield self.insertTestData(testdata)
+
+        self.setupBuilderInMaster(name='bldr1', slavenames={'slave-01': True}, startSlavenames={'slave-02': True})
+
+        self.patch(self.brd.katanaBuildChooser, 'QUEUE_PAGE_SIZE', 2)
+        getBuildRequestsInQueue = mock.Mock(wraps=self.master.db.buildrequests.getBuildRequestsInQueue)
+        self.patch(self.master.db.buildrequests, 'getBuildRequestsInQueue', getBuildRequestsInQueue)
+
+        breq = yield self.brd.katanaBuildChooser.getNextPriorityBuilder(queue=Queue.unclaimed)
+        self.assertEquals(breq.id, 5)
+        self.assertEquals(len(self.brd.katanaBuildChooser.buildRequestQueues[Queue.unclaimed]), 5)
+        self.assertEquals(getBuildRequestsInQueue.call_count, 3)
+
+    @defer.inlineCallbacks
+    def test_getNextPriorityBuilderFetchesOnlyAddedBuildRequests(self):
+        testdata = [fakedb.BuildRequest(id=1, buildsetid=1, buildername="bldr1",
+                                        priority=20, submitted_at=1449578391)]
+        testdata += self.getBuildSetTestData(xrange=xrange(1, 3))
+        yield self.insertTestData(testdata)
+
+        self.setupBuilderInMaster(name='bldr1', slavenames={'slave-01': True}, startSlavenames={'slave-02': True})
+
+        breq = yield self.brd.katanaBuildChooser.getNextPriorityBuilder(queue=Queue.unclaimed)
+        self.assertEquals(breq.id, 1)
+
+        yield self.insertTestData([fakedb.BuildRequest(id=2, buildsetid=2, buildername="bldr1",
+                                                       priority=50, submitted_at=1450171039)])
+
+        getBuildRequestsInQueue = mock.Mock(wraps=self.master.db.buildrequests.getBuildRequestsInQueue)
+        self.patch(self.master.db.buildrequests, 'getBuildRequestsInQueue', getBuildRequestsInQueue)
+
+        breq = yield self.brd.katanaBuildChooser.getNextPriorityBuilder(queue=Queue.unclaimed)
+        self.assertEquals(breq.id, 2)
+        getBuildRequestsInQueue.assert_called_once_with(queue=Queue.unclaimed, brids=[2], order=False)
+
+    @defer.inlineCallbacks
+    def test_getNextPriorityBuilderReconcilesQueue(self):
+        testdata = [fakedb.BuildRequest(id=1, buildsetid=1, buildername="bldr1",
+                                        priority=20, submitted_at=1449578391)]
+        testdata += self.getBuildSetTestData(xrange=xrange(1, 3))
+        yield self.insertTestData(testdata)
+
+        self.setupBuilderInMaster(name='bldr1', slavenames={'slave-01': True}, startSlavenames={'slave-02': True})
+
+        breq = yield self.brd.katanaBuildChooser.getNextPriorityBuilder(queue=Queue.unclaimed)
+        self.assertEquals(breq.id, 1)
+
+        # a request added by another master, no notification is received
+        self.brd.katanaBuildChooser.buildRequestRemoved(2)
+        yield self.insertTestData([fakedb.BuildRequest(id=2, buildsetid=2, buildername="bldr1",
+                                                       priority=50, submitted_at=1450171039)])
+        self.brd.katanaBuildChooser.addedBrids[Queue.unclaimed].clear()
+
+        breq = yield self.brd.katanaBuildChooser.getNextPriorityBuilder(queue=Queue.unclaimed)
+        self.assertEquals(breq.id, 1)
+
+        self.brd.katanaBuildChooser.reconciledAt[Queue.unclaimed] -= \
+            self.brd.katanaBuildChooser.RECONCILE_QUEUE_INTERVAL
+        breq = yield self.brd.katanaBuildChooser.getNextPriorityBuilder(queue=Queue.unclaimed)
+        self.assertEquals(breq.id, 2)
+
+    @defer.inlineCallbacks
+    def test_getNextPriorityBuilderSkipsRemovedBuildRequests(self):
+        testdata = [fakedb.BuildRequest(id=1, buildsetid=1, buildername="bldr1",
+                                        priority=20, submitted_at=1449578391),
+                    fakedb.BuildRequest(id=2, buildsetid=2, buildername="bldr1",
+                                        priority=50, submitted_at=1450171039)]
+        testdata += self.getBuildSetTestData(xrange=xrange(1, 3))
+        yield self.insertTestData(testdata)
+
+        self.setupBuilderInMaster(name='bldr1', slavenames={'slave-01': True}, startSlavenames={'slave-02': True})
+
+        breq = yield self.brd.katanaBuildChooser.getNextPriorityBuilder(queue=Queue.unclaimed)
+        self.assertEquals(breq.id, 2)
+
+        # the request stays in the queue until it is claimed or cancelled
+        self.brd._buildRequestRemoved(dict(bsid=2, brid=2, buildername="bldr1"))
+        breq = yield self.brd.katanaBuildChooser.getNextPriorityBuilder(queue=Queue.unclaimed)
+        self.assertEquals(breq.id, 1)
+
+        breq = yield self.brd.katanaBuildChooser.getNextPriorityBuilder(queue=Queue.unclaimed)
+        self.assertEquals(breq.id, 1)
+
+        self.brd._buildRequestRemoved(dict(bsid=1, brid=1, buildername="bldr1"))
+        breq = yield self.brd.katanaBuildChooser.getNextPriorityBuilder(queue=Queue.unclaimed)
+        self.assertEquals(breq, None)
+
+    @defer.inlineCallbacks
+    def test_getNextPriorityBuilderSkipsRequestsClaimedByOtherMasters(self):
+        testdata = [fakedb.BuildRequest(id=brid, buildsetid=brid, buildername="bldr1",
+                                        priority=100 - brid, submitted_at=1449578391)
+                    for brid in range(1, 4)]
+        testdata += self.getBuildSetTestData(xrange=xrange(1, 4))
+        yield self.insertTestData(testdata)
+        self.master.db.events.masterid = 1
+
+        self.setupBuilderInMaster(name='bldr1', slavenames={'slave-01': True}, startSlavenames={'slave-02': True})
+
+        breq = yield self.brd.katanaBuildChooser.getNextPriorityBuilder(queue=Queue.unclaimed)
+        self.assertEquals(breq.id, 1)
+
+        def event(event, brid, masterid):
+            self.brd._masterEvent(dict(eventid=brid, event=event, objectid=brid, buildsetid=brid,
+                                       buildername="bldr1", masterid=masterid, created_at=0))
+
+        # the claims of this master are handled when they are made
+        event(events.BUILDREQUEST_CLAIMED, 1, 1)
+        breq = yield self.brd.katanaBuildChooser.getNextPriorityBuilder(queue=Queue.unclaimed)
+        self.assertEquals(breq.id, 1)
+
+        event(events.BUILDREQUEST_CLAIMED, 1, 2)
+        breq = yield self.brd.katanaBuildChooser.getNextPriorityBuilder(queue=Queue.unclaimed)
+        self.assertEquals(breq.id, 2)
+
+        event(events.BUILDREQUEST_COMPLETED, 2, 1)
+        breq = yield self.brd.katanaBuildChooser.getNextPriorityBuilder(queue=Queue.unclaimed)
+        self.assertEquals(breq.id, 3)
+
+
+class TestBuildRequestQueue(unittest.TestCase):
+
+    def makeBrdict(self, brid, priority=50, submitted_at=1449578391, buildername='bldr1', startbrid=None,
+                   sourcestamps=None):
+        brdict = dict(brid=brid, priority=priority, submitted_at=submitted_at,
+                      buildername=buildername, startbrid=startbrid)
+        if sourcestamps is not None:
+            brdict['sourcestamps'] = sourcestamps
+        return brdict
+
+    def makeSourceStamps(self, sourcestampsetid, revision='abcd', branch='default'):
+        return [dict(sourcestampsetid=sourcestampsetid, codebase='c', branch=branch, revision=revision)]
+
+    def walk(self, queue, skipBuilder=None):
+        return [brdict['brid'] for brdict in queue.walk(skipBuilder=skipBuilder)]
+
+    def test_walkByPriorityAndSubmittedTime(self):
+        queue = buildrequestdistributor.BuildRequestQueue(
+            [self.makeBrdict(1, priority=20),
+             self.makeBrdict(2, priority=50, submitted_at=1450171039, buildername='bldr2'),
+             self.makeBrdict(3, priority=50),
+             self.makeBrdict(4, priority=100, submitted_at=1450171039, buildername='bldr2')])
+
+        self.assertEquals(len(queue), 4)
+        self.assertEquals(self.walk(queue), [4, 3, 2, 1])
+        # the requests stay in the queue until they are removed
+        self.assertEquals(self.walk(queue), [4, 3, 2, 1])
+
+    def test_remove(self):
+        queue = buildrequestdistributor.BuildRequestQueue([self.makeBrdict(1), self.makeBrdict(2)])
+        queue.remove(1)
+        queue.remove(3)
+
+        self.assertFalse(1 in queue)
+        self.assertEquals(len(queue), 1)
+        self.assertEquals(self.walk(queue), [2])
+
+    def test_removeWhileWalking(self):
+        queue = buildrequestdistributor.BuildRequestQueue(
+            [self.makeBrdict(1, priority=100), self.makeBrdict(2), self.makeBrdict(3, priority=20)])
+        brids = []
+        for brdict in queue.walk():
+            brids.append(brdict['brid'])
+            queue.remove(2)
+
+        self.assertEquals(brids, [1, 3])
+
+    def test_walkManyBuildRequests(self):
+        brdicts = [self.makeBrdict(brid, priority=random.randint(1, 5), submitted_at=random.randint(1, 5))
+                   for brid in range(1, 200)]
+        queue = buildrequestdistributor.BuildRequestQueue(brdicts)
+
+        expected = sorted(brdicts, key=lambda br: (-br['priority'], br['submitted_at'], br['brid']))
+        self.assertEquals(self.walk(queue), [br['brid'] for br in expected])
+
+    def test_addWhileWalking(self):
+        queue = buildrequestdistributor.BuildRequestQueue(
+            [self.makeBrdict(brid, priority=100 - brid) for brid in range(1, 8)])
+        brids = []
+        for brdict in queue.walk():
+            brids.append(brdict['brid'])
+            if brdict['brid'] == 3:
+                # one ahead of the walk, which is not visited, and one after
+                queue.add(self.makeBrdict(10, priority=100))
+                queue.add(self.makeBrdict(11, priority=90))
+
+        self.assertEquals(brids, [1, 2, 3, 4, 5, 6, 7, 11])
+        self.assertEquals(self.walk(queue), [10, 1, 2, 3, 4, 5, 6, 7, 11])
+
+    def test_staleEntriesAreDiscarded(self):
+        queue = buildrequestdistributor.BuildRequestQueue(
+            [self.makeBrdict(brid, buildername='bldr%d' % (brid % 2)) for brid in range(1, 7)])
+        for brid in (1, 3, 5):
+            queue.remove(brid)
+        self.assertEquals(queue._stale, 3)
+        self.assertEquals(len(queue._builders['bldr1']), 3)
+
+        queue.remove(2)
+        self.assertEquals(queue._stale, 0)
+        self.assertEquals(queue._builders.keys(), ['bldr0'])
+        self.assertEquals(self.walk(queue), [4, 6])
+
+    def test_addReplacesBuildRequest(self):
+        queue = buildrequestdistributor.BuildRequestQueue([self.makeBrdict(1, priority=20), self.makeBrdict(2)])
+        queue.add(self.makeBrdict(1, priority=100))
+
+        self.assertEquals(len(queue), 2)
+        self.assertEquals(queue.get(1)['priority'], 100)
+        self.assertEquals(self.walk(queue), [1, 2])
+
+    def test_walkSkipsBuilders(self):
+        queue = buildrequestdistributor.BuildRequestQueue(
+            [self.makeBrdict(1, priority=100),
+             self.makeBrdict(2, priority=50, buildername='bldr2'),
+             self.makeBrdict(3, priority=20),
+             self.makeBrdict(4, priority=20, submitted_at=1450171039, startbrid=3)])
+
+        skippedBuilders = set()
+        brids = []
+        for brdict in queue.walk(skipBuilder=lambda buildername: buildername in skippedBuilders):
+            brids.append(brdict['brid'])
+            skippedBuilders.add(brdict['buildername'])
+
+        # requests that are part of a chain are always visited
+        self.assertEquals(brids, [1, 2, 4])
+
+    def test_getMergeCandidates(self):
+        queue = buildrequestdistributor.BuildRequestQueue(
+            [self.makeBrdict(1, sourcestamps=self.makeSourceStamps(1)),
+             self.makeBrdict(2, priority=100, sourcestamps=self.makeSourceStamps(2)),
+             self.makeBrdict(3, sourcestamps=self.makeSourceStamps(3, revision='efgh')),
+             self.makeBrdict(4, buildername='bldr2', sourcestamps=self.makeSourceStamps(4)),
+             self.makeBrdict(5, startbrid=1, sourcestamps=self.makeSourceStamps(5)),
+             self.makeBrdict(6)])
+
+        def getMergeCandidates(sourcestamps, startbrid=None):
+            return [brdict['brid'] for brdict in queue.getMergeCandidates('bldr1', sourcestamps, startbrid=startbrid)]
+
+        # requests sharing the sourcestampset are not merge candidates
+        self.assertEquals(getMergeCandidates(self.makeSourceStamps(1)), [2, 5])
+        self.assertEquals(getMergeCandidates(self.makeSourceStamps(7)), [2, 1, 5])
+        self.assertEquals(getMergeCandidates(self.makeSourceStamps(7), startbrid=1), [5])
+        self.assertEquals(getMergeCandidates(self.makeSourceStamps(7, branch='other')), [])
+
+        queue.remove(2)
+        self.assertEquals(getMergeCandidates(self.makeSourceStamps(1)), [5])
+
+
 class TestKatanaBuildRequestDistributorMaybeStartBuildsOn(KatanaBuildRequestDistributorTestSetup, unittest.TestCase):
 
     @defer.inlineCallbacks
@@ -278,7 +599,8 @@ class TestKatanaBuildRequestDistributorMaybeStartBuildsOn(KatanaBuildRequestDist
                                         priority=20, submitted_at=1449578391),
                     fakedb.BuildRequest(id=2, buildsetid=2, buildername="bldr1",
                                         priority=50, submitted_at=1450171039,
-                                        results=RESUME, complete=0, slavepool=Slavepool.startSlavenames)]
+                                        results=RESUME, complete=0, slavepool=Slavepool.startSlavenames,
+                                        selected_slave='slave-01')]
 
         testdata += [fakedb.BuildRequestClaim(brid=1, objectid=self.MASTER_ID, claimed_at=1449578391),
                      fakedb.BuildRequestClaim(brid=2, objectid=self.MASTER_ID, claimed_at=1450171039)]
@@ -393,6 +715,71 @@ class TestKatanaBuildRequestDistributorMaybeStartBuildsOn(KatanaBuildRequestDist
         self.quiet_deferred.addCallback(check)
         return self.quiet_deferred
 
+    @defer.inlineCallbacks
+    def generateBatchBuilds(self):
+        testdata = [fakedb.BuildRequest(id=1, buildsetid=1, buildername="bldr1",
+                                        priority=100, submitted_at=1449578391),
+                    fakedb.BuildRequest(id=2, buildsetid=2, buildername="bldr1",
+                                        priority=50, submitted_at=1449578391),
+                    fakedb.BuildRequest(id=3, buildsetid=3, buildername="bldr1",
+                                        priority=20, submitted_at=1449578391),
+                    fakedb.BuildRequest(id=4, buildsetid=4, buildername="bldr2",
+                                        priority=20, submitted_at=1450171039)]
+
+        testdata += self.getBuildSetTestData(xrange=xrange(1, 5))
+
+        self.setupBuilderInMaster(name='bldr1', slavenames={'slave-01': True},
+                                  startSlavenames={'slave-02': True, 'slave-03': True})
+        self.setupBuilderInMaster(name='bldr2', slavenames={'slave-01': True},
+                                  startSlavenames={'slave-04': True})
+
+        yield self.insertTestData(testdata)
+
+        self.master.config.buildStartBatchSize = 10
+
+    def checkBatchBuilds(self, _, expectedBrids):
+        self.checkBRDCleanedUp()
+        self.assertEquals(sorted(brids for _, brids in self.processedBuilds), expectedBrids)
+        # each build runs on a different slave
+        slavenames = [slavename for slavename, _ in self.processedBuilds]
+        self.assertEquals(len(slavenames), len(set(slavenames)))
+
+    @defer.inlineCallbacks
+    def test_maybeStartBuildsOnBatchClaimsBuildsAtOnce(self):
+        yield self.generateBatchBuilds()
+
+        claimBuildRequestGroups = mock.Mock(wraps=self.master.db.buildrequests.claimBuildRequestGroups)
+        self.patch(self.master.db.buildrequests, 'claimBuildRequestGroups', claimBuildRequestGroups)
+
+        self.brd.maybeStartBuildsOn(['bldr1', 'bldr2'])
+        yield self.quiet_deferred
+
+        self.checkBatchBuilds(None, [[1], [2], [4]])
+        claimBuildRequestGroups.assert_called_once_with([[1], [2], [4]])
+
+    @defer.inlineCallbacks
+    def test_maybeStartBuildsOnBatchClaimsBuildsOneByOne(self):
+        yield self.generateBatchBuilds()
+
+        def claimBuildRequestGroups(brids_groups):
+            return defer.fail(AlreadyClaimedError())
+        self.patch(self.master.db.buildrequests, 'claimBuildRequestGroups', claimBuildRequestGroups)
+
+        funct = self.brd.katanaBuildChooser.claimBuildRequests
+
+        @defer.inlineCallbacks
+        def claimBuildRequests(breqs):
+            yield funct(breqs)
+            if breqs[0].id == 2:
+                yield funct(breqs) # generate AlreadyClaimedError
+
+        self.brd.katanaBuildChooser.claimBuildRequests = claimBuildRequests
+
+        self.brd.maybeStartBuildsOn(['bldr1', 'bldr2'])
+        yield self.quiet_deferred
+
+        self.checkBatchBuilds(None, [[1], [3], [4]])
+
     @defer.inlineCallbacks
     def generateMergableBuilds(self, results=BEGINNING):
         self.initialized()
@@ -575,6 +962,29 @@ class TestKatanaBuildRequestDistributorMaybeStartBuildsOn(KatanaBuildRequestDist
         yield self.brd._maybeStartOrResumeBuildsOn(['bldr1'])
         self.assertEquals(self.mergedBuilds, [(2, [3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13])])
 
+    @defer.inlineCallbacks
+    def test_findCompatibleFinishedBuildRequestIsCached(self):
+        self.initialized()
+        chooser = self.brd.katanaBuildChooser
+        chooser.bldr = mock.Mock()
+        chooser.bldr.name = 'bldr1'
+        findCompatibleFinishedBuildRequest = mock.Mock(return_value=defer.succeed(None))
+        self.patch(self.master.db.buildrequests, 'findCompatibleFinishedBuildRequest',
+                   findCompatibleFinishedBuildRequest)
+
+        finished_br = yield chooser.findCompatibleFinishedBuildRequest(1)
+        finished_br = yield chooser.findCompatibleFinishedBuildRequest(1)
+        self.assertEquals(finished_br, None)
+        self.assertEquals(findCompatibleFinishedBuildRequest.call_count, 1)
+
+        # the builder may have finished a build in the chain
+        findCompatibleFinishedBuildRequest.return_value = defer.succeed({'brid': 2})
+        chooser.slavesAvailabilityChanged(['bldr1'])
+        finished_br = yield chooser.findCompatibleFinishedBuildRequest(1)
+        finished_br = yield chooser.findCompatibleFinishedBuildRequest(1)
+        self.assertEquals(finished_br, {'brid': 2})
+        self.assertEquals(findCompatibleFinishedBuildRequest.call_count, 2)
+
     @defer.inlineCallbacks
     @compat.usesFlushLoggedErrors
     def test_maybeStartOrResumeBuildsOnHandleDBFailuresWhenMergingFinishedBuilds(self):
@@ -700,7 +1110,8 @@ class TestKatanaBuildChooser(KatanaBuildRequestDistributorTestSetup, unittest.Te
                                      priority=20, submitted_at=1449578391),
                  fakedb.BuildRequest(id=2, buildsetid=2, buildername="bldr1",
                                      priority=50, submitted_at=1450171039,
-                                     results=RESUME, complete=0, slavepool=slavepool)]
+                                     results=RESUME, complete=0, slavepool=slavepool,
+                                     selected_slave='slave-01')]
 
         breqsclaims = [fakedb.BuildRequestClaim(brid=1, objectid=self.MASTER_ID, claimed_at=1449578391),
                        fakedb.BuildRequestClaim(brid=2, objectid=self.MASTER_ID, claimed_at=1450171039)]
@@ -724,7 +1135,7 @@ class TestKatanaBuildChooser(KatanaBuildRequestDistributorTestSetup, unittest.Te
                  fakedb.BuildRequest(id=2, buildsetid=2, buildername="bldr1",
                                      priority=50, submitted_at=1449668061),
                 fakedb.BuildRequest(id=3, buildsetid=3, buildername="bldr1",
-                                    priority=100, submitted_at=1450171039)]
+                                    priority=100, submitted_at=1450171039, selected_slave='slave-01')]
 
         bset = [fakedb.Buildset(id=1, sourcestampsetid=1),
                 fakedb.Buildset(id=2, sourcestampsetid=2),
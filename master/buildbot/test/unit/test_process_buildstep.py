@@ -396,6 +396,26 @@ class TestCustomStepExecution(steps.BuildStepMixin, unittest.TestCase):
         return d
 
 
+class TestRemoteCommandSegments(unittest.TestCase):
+
+    def test_segments(self):
+        step = mock.Mock(name='fake step')
+        step.logobservers = {}
+        cmd = buildstep.RemoteCommand('shell', {}, collectStdout=True)
+        cmd.updates = {}
+        cmd.logs['stdio'] = remotecommand.FakeLogFile('stdio', step)
+        cmd.logs['out.log'] = remotecommand.FakeLogFile('out.log', step)
+        cmd.remoteUpdate({'segments': [['stdout', 'hello '], ['stderr', 'oops\n'],
+                                       [('log', 'out.log'), 'logged'],
+                                       ['stdout', 'world\n']]})
+
+        self.assertEqual(cmd.logs['stdio'].chunks,
+                         [(0, 'hello '), (1, 'oops\n'), (0, 'world\n')])
+        self.assertEqual(cmd.logs['out.log'].stdout, 'logged')
+        self.assertEqual(cmd.stdout, 'hello world\n')
+        self.assertEqual(cmd.updates, {})
+
+
 class RemoteShellCommandTests(object):
 
     def test_user_argument(self):
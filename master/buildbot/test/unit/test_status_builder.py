@@ -5,12 +5,11 @@ from buildbot.status import buildrequest
 from buildbot.config import ProjectConfig
 from mock import Mock
 from buildbot.status.build import BuildStatus
-from buildbot.status.results import SUCCESS
+from buildbot.status.results import SUCCESS, FAILURE, RESUME
 from buildbot.sourcestamp import SourceStamp
 from twisted.internet import defer
 from buildbot.status.master import Status
 from buildbot.test.fake import fakedb
-import datetime
 
 class TestBuilderStatus(unittest.TestCase):
 
@@ -58,12 +57,13 @@ class TestBuilderStatus(unittest.TestCase):
         self.builder_status.saveYourself = lambda skipBuilds: True
 
     @defer.inlineCallbacks
-    def test_generateFinishedBuildsUseLatestBuildCache(self):
+    def test_generateFinishedBuildsUseLastBuilds(self):
 
         codebases = {'katana-buildbot': 'katana'}
 
-        self.builder_status.latestBuildCache['katana-buildbot=katana;'] = {'date': datetime.datetime.now(),
-                                                                           'build': 38}
+        yield self.master.db.insertTestData([
+            fakedb.LastBuild(buildername='builder-01', codebases_key='katana-buildbot=katana;',
+                             results=SUCCESS, number=37)])
 
         builds = yield self.builder_status.generateFinishedBuildsAsync(branches=[],
                                                                        codebases=codebases,
@@ -72,57 +72,63 @@ class TestBuilderStatus(unittest.TestCase):
 
         self.assertTrue(len(builds) > 0)
         self.assertTrue(isinstance(builds[0], BuildStatus))
-        self.assertEqual(builds[0].number, 38)
+        self.assertEqual(builds[0].number, 37)
 
     @defer.inlineCallbacks
-    def test_generateFinishedBuildsUseBuildCache(self):
+    def test_generateFinishedBuildsSavesLastBuilds(self):
 
         codebases = {'katana-buildbot': 'katana'}
 
-        self.assertEqual(self.builder_status.latestBuildCache, {})
+        self.assertEqual(self.master.db.builds.last_builds, {})
+        self.master.db.builds.getLastBuildNumbersByResults = lambda buildername, sourcestamps: \
+            defer.succeed({SUCCESS: 36, FAILURE: 38})
 
         builds = yield self.builder_status.generateFinishedBuildsAsync(branches=[],
                                                                        codebases=codebases,
                                                                        num_builds=1,
+                                                                       results=[SUCCESS],
                                                                        useCache=True)
 
-        self.assertTrue('katana-buildbot=katana;' in self.builder_status.latestBuildCache.keys())
-        self.assertEqual(self.builder_status.latestBuildCache['katana-buildbot=katana;']['build'], 38)
-        self.assertTrue(len(builds) > 0)
-        self.assertTrue(isinstance(builds[0], BuildStatus))
-        self.assertEqual(builds[0].number, 38)
+        # the latest build of each results is recorded, not only the one found
+        self.assertEqual(self.master.db.builds.last_builds,
+                         {('builder-01', 'katana-buildbot=katana;', SUCCESS): 36,
+                          ('builder-01', 'katana-buildbot=katana;', FAILURE): 38})
+        self.assertEqual([b.number for b in builds], [36])
+
+        builds = yield self.builder_status.generateFinishedBuildsAsync(branches=[],
+                                                                       codebases=codebases,
+                                                                       num_builds=1,
+                                                                       useCache=True)
+        self.assertEqual([b.number for b in builds], [38])
 
 
     @defer.inlineCallbacks
-    def test_emptyCodebaseSelectionShouldSkipLatestBuildCache(self):
+    def test_emptyCodebaseSelectionShouldSkipLastBuilds(self):
         codebases = {}
 
-        self.assertEqual(self.builder_status.latestBuildCache, {})
-
         builds = yield self.builder_status.generateFinishedBuildsAsync(branches=[],
                                                      codebases=codebases,
                                                      num_builds=1, useCache=True)
 
-        self.assertEqual(self.builder_status.latestBuildCache, {})
+        self.assertEqual(self.master.db.builds.last_builds, {})
         self.assertTrue(len(builds) > 0)
         self.assertTrue(isinstance(builds[0], BuildStatus))
         self.assertEqual(builds[0].number, 38)
 
     @defer.inlineCallbacks
-    def test_generateFinishedBuildsUpdateToProjectCodebases(self):
+    def test_generateFinishedBuildsNoBuildIsNotSaved(self):
 
         codebases = {'codebase1': 'branch1', 'codebase2': 'branch2'}
 
         self.master.db.builds.getLastBuildsNumbers = lambda buildername, sourcestamps, results, num_builds: \
             defer.succeed([])
 
-        self.assertEqual(self.builder_status.latestBuildCache, {})
-
         builds = yield self.builder_status.generateFinishedBuildsAsync(branches=[],
                                                      codebases=codebases,
                                                      num_builds=1, useCache=True)
 
-        self.assertEqual(self.builder_status.latestBuildCache['katana-buildbot=katana;']['build'], None)
+        self.assertEqual(builds, [])
+        self.assertEqual(self.master.db.builds.last_builds, {})
 
 
     def multipleCodebasesProject(self):
@@ -137,33 +143,61 @@ class TestBuilderStatus(unittest.TestCase):
         self.getProjects = lambda: {'Katana': self.project}
 
     @defer.inlineCallbacks
-    def test_generateFinishedBuildsMultipleCodebasesSkipCache(self):
+    def test_generateFinishedBuildsMultipleCodebasesSaveLastBuild(self):
         self.multipleCodebasesProject()
-        codebases = {'codebase1': 'branch1', 'codebase2': 'branch2'}
-
-        self.master.db.builds.getLastBuildsNumbers = lambda buildername, sourcestamps, results, num_builds: \
-            defer.succeed([])
+        codebases = {'codebase1': 'branch1'}
 
-        self.assertEqual(self.builder_status.latestBuildCache, {})
+        self.master.db.builds.getLastBuildNumbersByResults = lambda buildername, sourcestamps: \
+            defer.succeed({SUCCESS: 38})
 
         yield self.builder_status.generateFinishedBuildsAsync(branches=[],
                                                      codebases=codebases,
                                                      num_builds=1, useCache=True)
 
-        self.assertEqual(self.builder_status.latestBuildCache, {})
+        self.assertEqual(self.master.db.builds.last_builds,
+                         {('builder-01', 'codebase1=branch1;codebase2=branch2;', SUCCESS): 38})
 
     @defer.inlineCallbacks
-    def test_generateFinishedBuildsMultipleCodebasesSaveCache(self):
-        self.multipleCodebasesProject()
-        codebases = {'codebase1': 'branch1'}
+    def test_generateFinishedBuildsRemembersMisses(self):
+        codebases = {'katana-buildbot': 'katana'}
+        searches = []
+
+        def getLastBuildNumbersByResults(buildername, sourcestamps):
+            searches.append(buildername)
+            return defer.succeed({FAILURE: 36})
+        self.master.db.builds.getLastBuildNumbersByResults = getLastBuildNumbersByResults
+
+        for _ in range(2):
+            builds = yield self.builder_status.generateFinishedBuildsAsync(branches=[],
+                                                                           codebases=codebases,
+                                                                           num_builds=1,
+                                                                           results=[SUCCESS],
+                                                                           useCache=True)
+            self.assertEqual(builds, [])
+        self.assertEqual(searches, ['builder-01'])
+
+        # a build recorded on the key is found by the next lookup
+        yield self.builder_status.saveLatestBuild(self.builder_status.buildCache.get(38))
+        self.assertEqual(self.builder_status.latestBuildMisses, {})
+        builds = yield self.builder_status.generateFinishedBuildsAsync(branches=[],
+                                                                       codebases=codebases,
+                                                                       num_builds=1,
+                                                                       results=[SUCCESS],
+                                                                       useCache=True)
+        self.assertEqual([b.number for b in builds], [38])
+        self.assertEqual(searches, ['builder-01'])
 
-        self.assertEqual(self.builder_status.latestBuildCache, {})
+    @defer.inlineCallbacks
+    def test_saveLatestBuild(self):
+        build = self.builder_status.buildCache.get(40)
+        yield self.builder_status.saveLatestBuild(build)
 
-        yield self.builder_status.generateFinishedBuildsAsync(branches=[],
-                                                     codebases=codebases,
-                                                     num_builds=1, useCache=True)
+        build = self.builder_status.buildCache.get(41)
+        build.results = RESUME
+        yield self.builder_status.saveLatestBuild(build)
 
-        self.assertEqual(self.builder_status.latestBuildCache['codebase1=branch1;codebase2=branch2;']['build'], 38)
+        self.assertEqual(self.master.db.builds.last_builds,
+                         {('builder-01', 'katana-buildbot=katana;', SUCCESS): 40})
 
     @defer.inlineCallbacks
     def setupPendingBuildCache(
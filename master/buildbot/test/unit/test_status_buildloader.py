@@ -0,0 +1,126 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Unity Technologies
+
+import mock
+from twisted.internet import defer, task
+from twisted.trial import unittest
+from buildbot.process import metrics
+from buildbot.status.buildloader import BuildLoader, INTERACTIVE, BACKGROUND
+
+
+class FakePool(object):
+    """Runs the calls given to the loader when the test asks for it."""
+
+    def __init__(self):
+        self.calls = []
+
+    def callInThreadWithCallback(self, onResult, f, *args):
+        self.calls.append((onResult, f, args))
+
+    def runNext(self):
+        onResult, f, args = self.calls.pop(0)
+        onResult(True, f(*args))
+
+
+class TestBuildLoader(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.clock.callFromThread = lambda f, *args: f(*args)
+        self.pool = FakePool()
+        self.loader = BuildLoader(size=2, batchSize=3, pool=self.pool, _reactor=self.clock)
+        self.loaded = []
+
+    def load(self, key, priority=INTERACTIVE, batch=None):
+        def fn():
+            self.loaded.append(key)
+            return key
+        return self.loader.load(key, fn, priority=priority, batch=batch)
+
+    def test_concurrentLoadsOfAKeyAreCoalesced(self):
+        d1 = self.load('a')
+        d2 = self.load('a')
+        self.pool.runNext()
+
+        self.assertEqual(self.loaded, ['a'])
+        self.assertEqual((d1.result, d2.result), ('a', 'a'))
+        self.assertEqual(self.pool.calls, [])
+
+        # the key is loaded again once the load is done
+        self.load('a')
+        self.pool.runNext()
+        self.assertEqual(self.loaded, ['a', 'a'])
+
+    def test_sizeBoundsRunningLoads(self):
+        for key in 'abc':
+            self.load(key)
+        self.assertEqual(len(self.pool.calls), 2)
+
+        self.pool.runNext()
+        self.assertEqual(len(self.pool.calls), 2)
+
+    def test_interactiveLoadsRunFirst(self):
+        for key in 'ab':
+            self.load(key)
+        self.load('background', priority=BACKGROUND)
+        self.load('interactive')
+        # a queued background load is moved up when it is requested again
+        self.load('urgent', priority=BACKGROUND)
+        self.load('urgent', priority=INTERACTIVE)
+
+        for _ in range(5):
+            self.pool.runNext()
+        self.assertEqual(self.loaded, ['a', 'b', 'interactive', 'urgent', 'background'])
+
+    def test_consecutiveLoadsOfABatchShareACall(self):
+        self.loader.size = 1
+        ds = [self.load(n, batch='builder') for n in range(5)]
+        self.load('other')
+
+        self.pool.runNext()
+        self.assertEqual(self.loaded, [0])
+        self.pool.runNext()
+        self.assertEqual(self.loaded, [0, 1, 2, 3])
+        self.pool.runNext()
+        self.assertEqual(self.loaded, [0, 1, 2, 3, 4])
+        self.assertEqual([d.result for d in ds], range(5))
+
+    def test_failedLoadErrbacks(self):
+        d = self.loader.load('a', lambda: 1 / 0)
+        self.pool.runNext()
+        return self.assertFailure(d, ZeroDivisionError)
+
+    def test_metrics(self):
+        self.patch(metrics.MetricCountEvent, 'log', mock.Mock())
+        self.patch(metrics.MetricTimeEvent, 'log', mock.Mock())
+        for key in 'abc':
+            self.load(key)
+        self.clock.advance(2)
+        self.pool.runNext()
+
+        metrics.MetricCountEvent.log.assert_called_with('BuildLoader.queued', 0, absolute=True)
+        # 'a' finished loading, then 'c' started after waiting 2 seconds
+        self.assertEqual([c[0][0] for c in metrics.MetricTimeEvent.log.call_args_list],
+                         ['BuildLoader.wait', 'BuildLoader.wait', 'BuildLoader.load', 'BuildLoader.wait'])
+        metrics.MetricTimeEvent.log.assert_called_with('BuildLoader.wait', 2)
+
+    @defer.inlineCallbacks
+    def test_ownThreadPool(self):
+        loader = BuildLoader(size=1)
+        self.addCleanup(loader.stop)
+        result = yield loader.load('a', lambda: 'loaded')
+        self.assertEqual(result, 'loaded')
+        self.assertTrue(loader.pool.started)
+        self.assertEqual(loader.pool.max, 1)
@@ -0,0 +1,250 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Unity Technologies
+
+import os
+import sqlite3
+import zlib
+from cPickle import loads
+from twisted.internet import defer
+from twisted.persisted import styles
+from twisted.trial import unittest
+from buildbot.status import builder, buildstore
+from buildbot.status.build import BuildSummary
+from buildbot.status.buildstep import BuildStepStatus
+from buildbot.status.results import SUCCESS
+from buildbot.test.fake import fakemaster
+
+
+class TestBuildStores(unittest.TestCase):
+
+    def setupBuilder(self, store=None):
+        m = fakemaster.make_master()
+        b = builder.BuilderStatus(buildername='builder_1', category=None, master=m)
+        b.basedir = os.path.abspath(self.mktemp())
+        os.mkdir(b.basedir)
+        if store:
+            b.setBuildStore(store(b.basedir))
+            self.addCleanup(b.getBuildStore().close)
+        b.determineNextBuildNumber()
+        b.currentBigState = 'idle'
+        b.status = 'idle'
+        return b
+
+    def finishBuilds(self, b, count):
+        for i in range(count):
+            build = b.newBuild()
+            build.setSlavename('slave-01')
+            build.addStepWithName('compile', 'ShellCommand')
+            build.buildStarted(build)
+            build.setResults(SUCCESS)
+            build.buildFinished()
+
+    def reloadBuilder(self, b, store):
+        b2 = self.setupBuilder()
+        b2.basedir = b.basedir
+        b2.setBuildStore(store(b.basedir))
+        self.addCleanup(b2.getBuildStore().close)
+        b2.determineNextBuildNumber()
+        return b2
+
+    def test_pickleStore(self):
+        b = self.setupBuilder(buildstore.PickleBuildStore)
+        self.finishBuilds(b, 3)
+        self.assertTrue(os.path.isfile(os.path.join(b.basedir, '2')))
+
+        b2 = self.reloadBuilder(b, buildstore.PickleBuildStore)
+        self.assertEqual(b2.nextBuildNumber, 3)
+        self.assertEqual(b2.getBuildStore().buildNumbers(), [0, 1, 2])
+        build = b2.getBuild(1)
+        self.assertEqual(build.getSlavename(), 'slave-01')
+        self.assertEqual([s.getName() for s in build.getSteps()], ['compile'])
+
+    def test_sqliteStore(self):
+        b = self.setupBuilder(buildstore.SQLiteBuildStore)
+        self.finishBuilds(b, 3)
+        self.assertFalse(os.path.exists(os.path.join(b.basedir, '2')))
+
+        b2 = self.reloadBuilder(b, buildstore.SQLiteBuildStore)
+        self.assertEqual(b2.nextBuildNumber, 3)
+        build = b2.getBuild(1)
+        self.assertEqual((build.getNumber(), build.getResults(), build.getSlavename()),
+                         (1, SUCCESS, 'slave-01'))
+        # the steps are loaded along with the build
+        self.assertIn('steps', build.__dict__)
+        self.assertEqual([s.getName() for s in build.steps], ['compile'])
+        self.assertIdentical(build.steps[0].getBuild(), build)
+
+    def test_sqliteStoreLoadsStepsLazily(self):
+        b = self.setupBuilder(buildstore.SQLiteBuildStore)
+        self.finishBuilds(b, 3)
+
+        b2 = self.reloadBuilder(b, buildstore.SQLiteBuildStore)
+        build = b2.loadBuildFromFile(1, withSteps=False)
+        self.assertEqual((build.getNumber(), build.getResults(), build.getSlavename()),
+                         (1, SUCCESS, 'slave-01'))
+        self.assertNotIn('steps', build.__dict__)
+
+        steps = build.getSteps()
+        self.assertEqual([s.getName() for s in steps], ['compile'])
+        self.assertIdentical(steps[0].getBuild(), build)
+        self.assertIdentical(build.getSteps(), steps)
+
+    def test_sqliteStoreRewritesUpgradedSteps(self):
+        b = self.setupBuilder(buildstore.SQLiteBuildStore)
+        self.finishBuilds(b, 1)
+
+        def upgradeToVersion5(step):
+            step.upgradedTo5 = True
+            step.wasUpgraded = True
+        self.patch(BuildStepStatus, 'persistenceVersion', 5)
+        BuildStepStatus.upgradeToVersion5 = upgradeToVersion5
+        self.addCleanup(delattr, BuildStepStatus, 'upgradeToVersion5')
+
+        b2 = self.reloadBuilder(b, buildstore.SQLiteBuildStore)
+        build = b2.loadBuildFromFile(0, withSteps=False)
+        self.assertTrue(build.getSteps()[0].upgradedTo5)
+
+        steps = b2.getBuildStore()._execute("SELECT steps FROM builds WHERE number = 0")[0][0]
+        steps = loads(zlib.decompress(str(steps)))
+        upgraded = getattr(steps[0], 'upgradedTo5', False)
+        # clear the unpickled steps from the upgrade queue
+        styles.doUpgrade()
+        self.assertTrue(upgraded)
+
+    def test_sqliteStoreResavesLazyBuild(self):
+        b = self.setupBuilder(buildstore.SQLiteBuildStore)
+        self.finishBuilds(b, 1)
+        b2 = self.reloadBuilder(b, buildstore.SQLiteBuildStore)
+        build = b2.loadBuildFromFile(0, withSteps=False)
+        build.setText(['resaved'])
+        build.saveYourself()
+
+        b3 = self.reloadBuilder(b, buildstore.SQLiteBuildStore)
+        build = b3.getBuild(0)
+        self.assertEqual(build.getText(), ['resaved'])
+        self.assertEqual([s.getName() for s in build.getSteps()], ['compile'])
+
+    def test_migrate(self):
+        b = self.setupBuilder(buildstore.PickleBuildStore)
+        self.finishBuilds(b, 3)
+
+        b2 = self.reloadBuilder(b, buildstore.SQLiteBuildStore)
+        store = b2.getBuildStore()
+        # not migrated yet, read from the pickles
+        self.assertEqual(b2.getBuild(0).getSlavename(), 'slave-01')
+
+        self.assertEqual(store.migrate(b2, batchSize=2), 3)
+        self.assertEqual(store.pickles.buildNumbers(), [])
+        self.assertEqual(store.buildNumbers(), [0, 1, 2])
+        self.assertEqual(store.migrate(b2), 0)
+
+        b3 = self.reloadBuilder(b, buildstore.SQLiteBuildStore)
+        self.assertEqual(b3.nextBuildNumber, 3)
+        build = b3.getBuild(2)
+        self.assertEqual([s.getName() for s in build.getSteps()], ['compile'])
+
+    def test_sqliteStorePrune(self):
+        b = self.setupBuilder(buildstore.SQLiteBuildStore)
+        self.finishBuilds(b, 5)
+        store = b.getBuildStore()
+
+        store.pruneBuilds(3, keep=[1])
+
+        self.assertEqual(store.buildNumbers(), [1, 3, 4])
+        self.assertEqual(store.loadBuild(0), None)
+
+    def test_sqliteStoreAddsSummaryColumn(self):
+        basedir = os.path.abspath(self.mktemp())
+        os.mkdir(basedir)
+        conn = sqlite3.connect(os.path.join(basedir, buildstore.SQLiteBuildStore.filename))
+        conn.execute("CREATE TABLE builds (number INTEGER PRIMARY KEY, results INTEGER, started REAL, "
+                     "finished REAL, slavename TEXT, body BLOB NOT NULL, steps BLOB NOT NULL)")
+        conn.close()
+
+        b = self.setupBuilder()
+        b.basedir = basedir
+        b.setBuildStore(buildstore.SQLiteBuildStore(basedir))
+        self.addCleanup(b.getBuildStore().close)
+        self.finishBuilds(b, 1)
+
+        self.assertEqual(b.getBuildStore().loadSummary(0).getSlavename(), 'slave-01')
+
+
+    def assertSummaryWithoutBuild(self, b, number):
+        summary = b.getBuildSummary(number)
+        self.assertIsInstance(summary, BuildSummary)
+        self.assertEqual((summary.getNumber(), summary.getResults(), summary.getSlavename()),
+                         (number, SUCCESS, 'slave-01'))
+        self.assertIdentical(summary.getBuilder(), b)
+        self.assertNotIn(number, b.buildCache.cache)
+
+    def test_pickleStoreSummary(self):
+        b = self.setupBuilder(buildstore.PickleBuildStore)
+        self.finishBuilds(b, 2)
+        self.assertTrue(os.path.isfile(os.path.join(b.basedir, '1.summary')))
+
+        b2 = self.reloadBuilder(b, buildstore.PickleBuildStore)
+        self.assertSummaryWithoutBuild(b2, 1)
+
+    def test_sqliteStoreSummary(self):
+        b = self.setupBuilder(buildstore.SQLiteBuildStore)
+        self.finishBuilds(b, 2)
+
+        b2 = self.reloadBuilder(b, buildstore.SQLiteBuildStore)
+        self.assertSummaryWithoutBuild(b2, 1)
+
+    def test_missingSummaryIsSaved(self):
+        b = self.setupBuilder(buildstore.PickleBuildStore)
+        self.finishBuilds(b, 1)
+        os.unlink(os.path.join(b.basedir, '0.summary'))
+
+        b2 = self.reloadBuilder(b, buildstore.PickleBuildStore)
+        self.assertEqual(b2.getBuildSummary(0).getSlavename(), 'slave-01')
+        self.assertTrue(os.path.isfile(os.path.join(b.basedir, '0.summary')))
+
+    def test_summaryWithoutLogsIsSavedAgain(self):
+        b = self.setupBuilder(buildstore.PickleBuildStore)
+        self.finishBuilds(b, 1)
+        summary = b.getBuildStore().loadSummary(0)
+        summary.logs = None
+        b.getBuildStore().saveSummary(summary)
+
+        b2 = self.reloadBuilder(b, buildstore.PickleBuildStore)
+        self.assertEqual(b2.getBuildSummary(0).logs, [])
+        self.assertEqual(b2.getBuildStore().loadSummary(0).logs, [])
+        self.assertNotIn(0, b2.buildCache.cache)
+
+    def test_resavedBuildUpdatesCachedSummary(self):
+        b = self.setupBuilder(buildstore.PickleBuildStore)
+        self.finishBuilds(b, 1)
+        self.assertEqual(b.getBuildSummary(0).getText(), [])
+
+        build = b.getBuild(0)
+        build.setText(['resaved'])
+        build.saveYourself()
+
+        self.assertEqual(b.getBuildSummary(0).getText(), ['resaved'])
+
+    @defer.inlineCallbacks
+    def test_generateFinishedBuildSummariesAsync(self):
+        b = self.setupBuilder(buildstore.SQLiteBuildStore)
+        self.finishBuilds(b, 3)
+
+        b2 = self.reloadBuilder(b, buildstore.SQLiteBuildStore)
+        b2.generateBuildNumbers = lambda codebases, branches, results, num_builds: defer.succeed([2, 1, 0])
+        summaries = yield b2.generateFinishedBuildSummariesAsync(num_builds=3)
+
+        self.assertEqual([s.getNumber() for s in summaries], [2, 1, 0])
+        self.assertEqual(b2.buildCache.cache, {})
@@ -22,6 +22,7 @@ import time
 from twisted.trial import unittest
 from twisted.internet import defer
 from buildbot.status import logfile
+from buildbot.util import blockgz
 from buildbot.test.util import dirs
 from buildbot import config
 
@@ -339,3 +340,89 @@ class TestLogFile(unittest.TestCase, dirs.DirsMixin):
         self.config.logCompressionMethod = None
         return self.do_test_compressLog('', expect_comp=False)
 
+
+    def write_lines(self, count):
+        self.logfile.INDEX_INTERVAL = 100
+        self.logfile.chunkSize = 30
+        for i in range(count):
+            self.logfile.addEntry(i % 3 == 0 and 1 or 0, 'line %d\nline' % i)
+            self.logfile.addEntry(0, ' %d continued\n' % i)
+            if i % 10 == 0:
+                self.logfile.addHeader('header %d\n' % i)
+
+    def test_getTextLines(self):
+        self.write_lines(50)
+        self.logfile.finish()
+        lines = self.logfile.getText().splitlines(True)
+
+        self.assertTrue(os.path.exists(self.logfile.getIndexFilename()))
+        self.assertNotEqual(self.logfile._findLine(40), (0, 0))
+        self.assertEqual(self.logfile.getLineCount(), 100)
+        self.assertEqual(self.logfile.getTextLines(37, 45), lines[37:45])
+        self.assertEqual(self.logfile.getTextLines(0, 3), lines[0:3])
+        self.assertEqual(self.logfile.getTextLines(95), lines[95:])
+        self.assertEqual(self.logfile.getTextLines(200), [])
+        self.assertEqual(self.logfile.getTailLines(3), lines[-3:])
+
+    def test_getTextLines_pickled(self):
+        self.write_lines(50)
+        self.logfile.finish()
+        lines = self.logfile.getText().splitlines(True)
+        self.pickle_and_restore()
+
+        self.assertEqual(self.logfile.getLineCount(), 100)
+        self.assertEqual(self.logfile.getTextLines(61, 72), lines[61:72])
+
+    def test_getTextLines_unfinished(self):
+        self.write_lines(20)
+        self.logfile.addStdout('partial')
+        lines = self.logfile.getText().splitlines(True)
+
+        self.assertTrue(self.logfile.runEntries)
+        self.assertEqual(self.logfile.getLineCount(), 41)
+        self.assertEqual(self.logfile.getTailLines(2), lines[-2:])
+        self.assertEqual(self.logfile.getTextLines(33, 36), lines[33:36])
+
+    def test_getTextLines_unindexed(self):
+        self.write_lines(20)
+        self.logfile.finish()
+        lines = self.logfile.getText().splitlines(True)
+        # logs written before the index was introduced
+        os.unlink(self.logfile.getIndexFilename())
+        del self.logfile.__dict__['indexed']
+        self.pickle_and_restore()
+
+        self.assertEqual(self.logfile.getLineCount(), 40)
+        self.assertEqual(self.logfile.getTextLines(25, 30), lines[25:30])
+
+    @defer.inlineCallbacks
+    def test_getTextLinesAsync_compressed(self):
+        self.write_lines(50)
+        self.logfile.finish()
+        lines = self.logfile.getText().splitlines(True)
+        self.config.logCompressionMethod = 'gz'
+        yield self.logfile.compressLog()
+
+        result = yield self.logfile.getTextLinesAsync(70, 80)
+        self.assertEqual(result, lines[70:80])
+        result = yield self.logfile.getTailLinesAsync(5)
+        self.assertEqual(result, lines[-5:])
+
+    def test_compressLog_blockgz(self):
+        self.config.logCompressionMethod = 'blockgz'
+        self.config.logCompressionLimit = 1000
+        for i in range(20000):
+            self.logfile.addStdout('line %d\n' % i)
+        # the complete blocks are compressed while the log is written
+        self.assertTrue(self.logfile._blocksQueued > 0)
+        self.logfile.finish()
+        text = self.logfile.getText()
+
+        d = self.logfile.compressLog()
+        def check(_):
+            self.assertFalse(os.path.exists(self.logfile.getFilename()))
+            self.assertIsInstance(self.logfile.getFile(), blockgz.BlockGzipFile)
+            self.assertEqual(self.logfile.getText(), text)
+            self.assertEqual(self.logfile.getTailLines(2), ['line 19998\n', 'line 19999\n'])
+        d.addCallback(check)
+        return d
@@ -0,0 +1,212 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Unity Technologies
+
+import json
+
+from twisted.trial import unittest
+from twisted.internet import defer, error, protocol, reactor
+from twisted.protocols import basic
+from twisted.python import failure
+from twisted.test import proto_helpers
+
+from buildbot.status.natsprotocol import NatsClientFactory
+from buildbot.status.status_nats import NatsStatusPush
+
+
+class FakeNatsServer(basic.LineReceiver):
+    delimiter = '\r\n'
+
+    def connectionMade(self):
+        self.factory.connections.append(self)
+        self.buf = ''
+        self.sendLine('INFO {"server_id":"fake"}')
+
+    def connectionLost(self, reason):
+        self.factory.connections.remove(self)
+        if not self.factory.connections:
+            self.factory.lost.callback(None)
+
+    def lineReceived(self, line):
+        if line.startswith('CONNECT '):
+            self.factory.options.append(json.loads(line[len('CONNECT '):]))
+        elif line.startswith('PUB '):
+            _, self.subject, size = line.split()
+            self.size = int(size)
+            self.setRawMode()
+        elif line == 'PING':
+            self.sendLine('PONG')
+
+    def rawDataReceived(self, data):
+        self.buf += data
+        if len(self.buf) >= self.size + 2:
+            self.factory.messages.append((self.subject, self.buf[:self.size]))
+            rest, self.buf = self.buf[self.size + 2:], ''
+            self.setLineMode(rest)
+
+
+class FakeNatsServerFactory(protocol.ServerFactory):
+    protocol = FakeNatsServer
+
+    def __init__(self):
+        self.connections = []
+        self.options = []
+        self.messages = []
+        self.lost = defer.Deferred()
+
+
+class NotifyingNatsClientFactory(NatsClientFactory):
+
+    def __init__(self):
+        NatsClientFactory.__init__(self)
+        self.connected = defer.Deferred()
+        self.disconnected = defer.Deferred()
+
+    def clientConnected(self, client):
+        NatsClientFactory.clientConnected(self, client)
+        self.connected.callback(client)
+
+    def clientDisconnected(self, client):
+        NatsClientFactory.clientDisconnected(self, client)
+        self.disconnected.callback(None)
+
+
+class TestNatsProtocol(unittest.TestCase):
+
+    def setUp(self):
+        self.factory = NatsClientFactory()
+        self.client = self.factory.buildProtocol(None)
+        self.transport = proto_helpers.StringTransport()
+        self.client.makeConnection(self.transport)
+
+    def test_connect(self):
+        self.assertEqual(self.transport.value(),
+                         'CONNECT {"name":"katana","pedantic":false,"verbose":false}\r\n')
+        self.assertIdentical(self.factory.client, self.client)
+
+    def test_publishIsPipelined(self):
+        self.transport.clear()
+        self.client.publish('katana.buildStarted', '{}')
+        first = self.client.flush()
+        self.client.publish('katana.buildFinished', '[1]')
+        second = self.client.flush()
+
+        self.assertEqual(self.transport.value(),
+                         'PUB katana.buildStarted 2\r\n{}\r\nPING\r\n'
+                         'PUB katana.buildFinished 3\r\n[1]\r\nPING\r\n')
+        self.assertEqual(self.client.inflightBytes, 64)
+
+        self.client.dataReceived('PONG\r\n')
+        self.assertTrue(first.called)
+        self.assertFalse(second.called)
+        self.assertEqual(self.client.inflightBytes, 33)
+
+    def test_answersPing(self):
+        self.transport.clear()
+        self.client.dataReceived('PING\r\n')
+        self.assertEqual(self.transport.value(), 'PONG\r\n')
+
+    def test_connectionLostFailsNewestFirst(self):
+        failed = []
+        for i in range(2):
+            self.client.publish('katana.event', str(i))
+            d = self.client.flush()
+            d.addErrback(lambda f, i=i: failed.append(i))
+
+        self.client.connectionLost(failure.Failure(error.ConnectionLost()))
+
+        self.assertEqual(failed, [1, 0])
+        self.assertEqual(self.client.inflightBytes, 0)
+        self.assertIdentical(self.factory.client, None)
+
+
+class TestNatsStatusPush(unittest.TestCase):
+
+    def setUp(self):
+        self.push = NatsStatusPush('nats://127.0.0.1:4333', maxDiskItems=0, maxInflightBytes=100)
+        self.addCleanup(self.cancelTask)
+
+    def cancelTask(self):
+        if self.push.task and self.push.task.active():
+            self.push.task.cancel()
+
+    def connect(self):
+        client = self.push.factory.buildProtocol(None)
+        transport = proto_helpers.StringTransport()
+        client.makeConnection(transport)
+        transport.clear()
+        return client, transport
+
+    def test_serverUrl(self):
+        self.assertEqual((self.push.host, self.push.port), ('127.0.0.1', 4333))
+
+    def test_pushDataNotConnected(self):
+        self.assertEqual(self.push.pushData(None, [{'event': 'buildStarted'}]),
+                         (False, 'not connected'))
+
+    def test_pushDataTooManyBytesInFlight(self):
+        client, transport = self.connect()
+        self.assertEqual(self.push.pushData(None, [{'event': 'e', 'payload': 'x' * 100}]),
+                         (True, None))
+        result, _ = self.push.pushData(None, [{'event': 'e'}])
+        self.assertFalse(result)
+
+        client.dataReceived('PONG\r\n')
+        self.assertEqual(self.push.pushData(None, [{'event': 'e'}]), (True, None))
+
+    def test_batchEvents(self):
+        self.push.batchEvents = True
+        items = [{'event': 'a', 'id': 1}, {'event': 'b', 'id': 2}, {'event': 'a', 'id': 3}]
+        self.assertEqual(self.push.formatMessages(items),
+                         [('katana.a', json.dumps([items[0], items[2]], separators=(',', ':'))),
+                          ('katana.b', json.dumps([items[1]], separators=(',', ':')))])
+
+    def test_unacknowledgedItemsAreQueuedBack(self):
+        client, transport = self.connect()
+        self.push.pushData(None, [{'event': 'a', 'id': 1}])
+        self.push.pushData(None, [{'event': 'a', 'id': 2}])
+        self.push.queue.pushItem({'event': 'a', 'id': 3})
+
+        client.connectionLost(failure.Failure(error.ConnectionLost()))
+
+        self.assertEqual([item['id'] for item in self.push.queue.items()], [1, 2, 3])
+        self.assertFalse(self.push.wasLastPushSuccessful())
+
+    @defer.inlineCallbacks
+    def test_publishToServer(self):
+        server = FakeNatsServerFactory()
+        port = reactor.listenTCP(0, server, interface='127.0.0.1')
+        self.addCleanup(port.stopListening)
+        self.push.factory = NotifyingNatsClientFactory()
+        self.push.connector = reactor.connectTCP('127.0.0.1', port.getHost().port, self.push.factory)
+
+        @defer.inlineCallbacks
+        def disconnect():
+            self.push.factory.stopTrying()
+            self.push.connector.disconnect()
+            yield self.push.factory.disconnected
+            yield server.lost
+        self.addCleanup(disconnect)
+
+        client = yield self.push.factory.connected
+        self.assertEqual(self.push.pushData(None, [{'event': 'buildStarted', 'id': 1},
+                                                   {'event': 'buildFinished', 'id': 2}]),
+                         (True, None))
+        yield client.flush()
+
+        self.assertEqual(server.options[0]['verbose'], False)
+        self.assertEqual([(subject, json.loads(payload)) for subject, payload in server.messages],
+                         [('katana.buildStarted', {'event': 'buildStarted', 'id': 1}),
+                          ('katana.buildFinished', {'event': 'buildFinished', 'id': 2})])
+        self.assertEqual(client.inflightBytes, 0)
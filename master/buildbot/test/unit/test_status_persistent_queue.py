@@ -19,7 +19,7 @@ from twisted.trial import unittest
 from buildbot.test.util import dirs
 
 from buildbot.status.persistent_queue import MemoryQueue, DiskQueue, \
-    IQueue, PersistentQueue, WriteFile
+    IQueue, PersistentQueue, SegmentDiskQueue, WriteFile
 
 class test_Queues(dirs.DirsMixin, unittest.TestCase):
 
@@ -144,4 +144,53 @@ class test_Queues(dirs.DirsMixin, unittest.TestCase):
         self._test_helper(PersistentQueue(MemoryQueue(3),
                                           DiskQueue('fake_dir', 5)))
 
+    def testSegmentDiskQueue(self):
+        self._test_helper(SegmentDiskQueue('fake_dir', maxItems=8,
+                                           segmentItems=3, flushItems=2))
+
+    def testPersistentSegmentQueue(self):
+        self._test_helper(PersistentQueue(MemoryQueue(3),
+                                          SegmentDiskQueue('fake_dir', 5, segmentItems=2)))
+
+    def testSegmentDiskQueueRotates(self):
+        q = SegmentDiskQueue('fake_dir', segmentItems=2, flushItems=1)
+        for i in range(5):
+            q.pushItem(i)
+        self.assertEqual(['1.segment', '2.segment', '3.segment'],
+                         sorted(os.listdir('fake_dir')))
+        self.assertEqual([0, 1, 2], q.popChunk(3))
+        self.assertEqual(['2.segment', '3.segment', 'consumed'], sorted(os.listdir('fake_dir')))
+        self.assertEqual([3, 4], q.popChunk())
+
+    def testSegmentDiskQueueReload(self):
+        q = SegmentDiskQueue('fake_dir', segmentItems=3, flushItems=10)
+        for i in range(7):
+            q.pushItem(i)
+        self.assertEqual([0, 1], q.popChunk(2))
+        q.insertBackChunk(['a', 'b'])
+        q.pushItem(7)
+        q.save()
+
+        q = SegmentDiskQueue('fake_dir', segmentItems=3, flushItems=10)
+        self.assertEqual(8, q.nbItems())
+        self.assertEqual(['a', 'b', 2, 3, 4, 5, 6, 7], q.items())
+        self.assertEqual(['a', 'b', 2, 3, 4], q.popChunk(5))
+
+        q = SegmentDiskQueue('fake_dir', segmentItems=3, flushItems=10)
+        self.assertEqual([5, 6, 7], q.popChunk())
+        self.assertEqual([], q.popChunk())
+
+    def testSegmentDiskQueueTruncatedRecord(self):
+        q = SegmentDiskQueue('fake_dir', pickleFn=str, unpickleFn=str, flushItems=1)
+        q.pushItem('foo')
+        q.pushItem('bar')
+        path = os.path.join('fake_dir', '1.segment')
+        with open(path, 'r+b') as f:
+            f.truncate(os.path.getsize(path) - 1)
+
+        q = SegmentDiskQueue('fake_dir', pickleFn=str, unpickleFn=str)
+        self.assertEqual(1, q.nbItems())
+        q.pushItem('baz')
+        self.assertEqual(['foo', 'baz'], q.popChunk())
+
 # vim: set ts=4 sts=4 sw=4 et:
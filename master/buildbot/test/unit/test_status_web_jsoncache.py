@@ -0,0 +1,178 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Unity Technologies
+
+import json
+import mock
+from twisted.internet import defer, task
+from twisted.trial import unittest
+from twisted.web import http
+from buildbot.db import events
+from buildbot.status.web.jsoncache import JsonResponseCache
+from buildbot.status.web.status_json import JsonResource
+from buildbot.test.fake.web import FakeRequest
+
+
+class CountingJsonResource(JsonResource):
+
+    def __init__(self):
+        JsonResource.__init__(self, mock.Mock())
+        self.rendered = 0
+
+    def cacheBuilders(self, request):
+        return ['b1']
+
+    def asDict(self, request):
+        self.rendered += 1
+        return {'rendered': self.rendered}
+
+
+class TestJsonResponseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.cache = JsonResponseCache(maxSize=2, _reactor=self.clock)
+
+    def put(self, key, builderNames, lifetime=60):
+        token = self.cache.begin()
+        self.cache.put(key, token, 'body ' + key, self.cache.makeETag(token),
+                       builderNames, lifetime)
+
+    def test_makeKeyIgnoresCacheBusterAndArgumentOrder(self):
+        req1 = FakeRequest(args={'branch': ['trunk'], 'codebase': ['a'], '_': ['123']})
+        req2 = FakeRequest(args={'codebase': ['a'], 'branch': ['trunk'], 'build_steps': []})
+        req1.path = req2.path = '/json/projects/p'
+        self.assertEqual(self.cache.makeKey(req1), self.cache.makeKey(req2))
+
+        req2.args['build_steps'] = ['0']
+        self.assertNotEqual(self.cache.makeKey(req1), self.cache.makeKey(req2))
+
+    def test_builderEventsInvalidateTheirResponses(self):
+        self.put('k1', ['b1'])
+        self.put('k2', ['b2'])
+
+        self.cache.buildStarted('b1', mock.Mock())
+        self.assertEqual(self.cache.get('k1'), None)
+        self.assertEqual(self.cache.get('k2').body, 'body k2')
+
+        request = mock.Mock()
+        request.getBuilderName.return_value = 'b2'
+        self.cache.requestSubmitted(request)
+        self.assertEqual(self.cache.get('k2'), None)
+        self.assertEqual(self.cache.byBuilder, {})
+
+    def test_runningBuildsInvalidateTheirResponses(self):
+        build = mock.Mock()
+        build.getBuilder.return_value.getName.return_value = 'b1'
+        self.assertEqual(self.cache.buildStarted('b1', build), (self.cache, self.cache.updateInterval))
+
+        for event in (lambda: self.cache.stepStarted(build, mock.Mock()),
+                      lambda: self.cache.stepFinished(build, mock.Mock(), 0),
+                      lambda: self.cache.buildETAUpdate(build, 10)):
+            self.put('k1', ['b1'])
+            self.put('k2', ['b2'])
+            event()
+            self.assertEqual(self.cache.get('k1'), None)
+            self.assertEqual(self.cache.get('k2').body, 'body k2')
+
+    def test_responseComputedDuringAnInvalidationIsNotStored(self):
+        token = self.cache.begin()
+        self.cache.buildFinished('b1', mock.Mock(), 0)
+        self.cache.put('k1', token, 'stale', self.cache.makeETag(token), ['b1'], 60)
+        self.assertEqual(self.cache.get('k1'), None)
+
+    def test_responsesExpireAndAreBounded(self):
+        self.put('k1', ['b1'], lifetime=10)
+        self.clock.advance(10)
+        self.assertEqual(self.cache.get('k1'), None)
+
+        for key in ('k1', 'k2', 'k3'):
+            self.put(key, ['b1'])
+        self.assertEqual(self.cache.responses.keys(), ['k2', 'k3'])
+        self.assertEqual(self.cache.byBuilder, {'b1': set(['k2', 'k3'])})
+
+    def test_watchesTheBuilders(self):
+        status = mock.Mock()
+        builder_status = mock.Mock()
+        self.cache.startWatching(status)
+        status.subscribe.assert_called_with(self.cache)
+        self.assertEqual(self.cache.builderAdded('b1', builder_status), self.cache)
+
+        self.put('k1', ['b1'])
+        self.cache.stopWatching()
+        status.unsubscribe.assert_called_with(self.cache)
+        builder_status.unsubscribe.assert_called_with(self.cache)
+        self.assertEqual(self.cache.get('k1'), None)
+
+    def test_watchesTheMasterEvents(self):
+        status = mock.Mock()
+        self.cache.startWatching(status)
+        status.master.subscribeToMasterEvents.assert_called_with(self.cache.masterEvent)
+
+        self.put('k1', ['b1'])
+        self.put('k2', ['b2'])
+        self.cache.masterEvent(dict(event=events.BUILDSET_ADDED, objectid=1, buildername=None))
+        self.cache.masterEvent(dict(event=events.BUILDREQUEST_CLAIMED, objectid=1, buildername='b1'))
+        self.assertEqual(self.cache.get('k1'), None)
+        self.assertEqual(self.cache.get('k2').body, 'body k2')
+
+        self.cache.stopWatching()
+        status.master.subscribeToMasterEvents.return_value.unsubscribe.assert_called_with()
+
+
+class TestJsonResourceResponseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = JsonResponseCache()
+        self.resource = CountingJsonResource()
+
+    @defer.inlineCallbacks
+    def render(self, args=None):
+        req = FakeRequest(args=args or {})
+        req.method = "GET"
+        req.path = '/json/counting'
+        req.site.buildbot_service.jsonCache = self.cache
+        yield req.test_render(self.resource)
+        defer.returnValue(req)
+
+    @defer.inlineCallbacks
+    def test_responseIsServedFromTheCache(self):
+        req = yield self.render()
+        self.assertEqual(json.loads(req.written), {'rendered': 1})
+        etag = req.setETag.call_args[0][0]
+
+        req = yield self.render({'_': ['1']})
+        self.assertEqual(json.loads(req.written), {'rendered': 1})
+        req.setETag.assert_called_with(etag)
+
+        req = yield self.render({'codebase': ['a']})
+        self.assertEqual(json.loads(req.written), {'rendered': 2})
+
+    @defer.inlineCallbacks
+    def test_matchingETagIsNotModified(self):
+        yield self.render()
+        req = FakeRequest()
+        req.method = "GET"
+        req.path = '/json/counting'
+        req.site.buildbot_service.jsonCache = self.cache
+        req.setETag.return_value = http.CACHED
+        yield req.test_render(self.resource)
+        self.assertEqual(req.written, '')
+
+    @defer.inlineCallbacks
+    def test_buildFinishedInvalidatesTheResponse(self):
+        yield self.render()
+        self.cache.buildFinished('b1', mock.Mock(), 0)
+        req = yield self.render()
+        self.assertEqual(json.loads(req.written), {'rendered': 2})
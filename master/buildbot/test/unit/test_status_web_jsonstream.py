@@ -0,0 +1,113 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Unity Technologies
+
+import json
+from twisted.internet import defer, task
+from twisted.trial import unittest
+from buildbot.status.web.jsonstream import JsonStreamEncoder
+from buildbot.status.web.status_json import FilterOut
+
+
+class FakeConsumer(object):
+
+    def __init__(self):
+        self.written = []
+        self.producer = None
+        self.full = False
+
+    def registerProducer(self, producer, streaming):
+        self.producer = producer
+
+    def unregisterProducer(self):
+        self.producer = None
+
+    def write(self, data):
+        self.written.append(data)
+        if self.full:
+            self.producer.pauseProducing()
+
+    def value(self):
+        return "".join(self.written)
+
+
+DATA = {
+    'name': 'builder',
+    'empty': {'a': '', 'b': [], 'c': {'d': None}},
+    'builds': [{'number': 1, 'results': 0, 'steps': []}, None, {'number': 2, 'text': [u'\xe9', 3.5]}],
+    'nothing': [None, '', {}],
+    0: True,
+    None: False,
+}
+
+
+class TestJsonStreamEncoder(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.consumer = FakeConsumer()
+
+    def encode(self, data, **kwargs):
+        encoder = JsonStreamEncoder(self.consumer, _reactor=self.clock, **kwargs)
+        d = encoder.encode(data)
+        self.clock.advance(0)
+        return encoder, d
+
+    def test_compact(self):
+        encoder, d = self.encode(DATA)
+        self.assertTrue(d.called)
+        self.assertEqual(self.consumer.value(), json.dumps(DATA, separators=(',', ':')))
+        self.assertIdentical(self.consumer.producer, None)
+
+    def test_indented(self):
+        self.encode(DATA, compact=False)
+        self.assertEqual(self.consumer.value(), json.dumps(DATA, sort_keys=True, indent=2))
+
+    def test_filterOut(self):
+        for data in (DATA, [None, {}], {}, 0, ''):
+            self.consumer.written = []
+            self.encode(data, filterOut=True)
+            self.assertEqual(self.consumer.value(), json.dumps(FilterOut(data), separators=(',', ':')))
+
+    def test_deferredsAndCallables(self):
+        d1 = defer.Deferred()
+        encoder, d = self.encode({'builders': [lambda: {'name': 'a'}, d1, (i for i in [1, 2])]})
+        self.assertFalse(d.called)
+        self.assertEqual(self.consumer.value(), '')
+
+        d1.callback({'name': 'b'})
+        self.clock.advance(0)
+        self.assertEqual(self.consumer.value(), '{"builders":[{"name":"a"},{"name":"b"},[1,2]]}')
+
+    def test_pausedWhileConsumerIsFull(self):
+        JsonStreamEncoder.bufferSize = 10
+        self.addCleanup(setattr, JsonStreamEncoder, 'bufferSize', 64*1024)
+        self.consumer.full = True
+        encoder, d = self.encode(["x" * 10] * 3)
+        self.assertEqual(self.consumer.value(), '["xxxxxxxxxx"')
+
+        self.consumer.full = False
+        encoder.resumeProducing()
+        for _ in range(3):
+            self.clock.advance(0)
+        self.assertTrue(d.called)
+        self.assertEqual(json.loads(self.consumer.value()), ["x" * 10] * 3)
+
+    def test_stopProducing(self):
+        d1 = defer.Deferred()
+        encoder, d = self.encode([d1, 1])
+        encoder.stopProducing()
+        d1.callback(0)
+        self.assertTrue(d.called)
+        self.assertEqual(self.consumer.value(), '')
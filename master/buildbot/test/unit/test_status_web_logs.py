@@ -20,7 +20,10 @@ from buildbot.status.logfile import HTMLLogFile, LogFile
 from buildbot.status.web.logs import LogsResource, HTMLLog, TextLog
 
 import mock
+from buildbot.status.web.status_json import LogsJsonResource
+from buildbot.test.fake.web import FakeRequest
 from buildbot.status.web.xmltestresults import XMLTestResource
+from twisted.internet import defer
 from twisted.trial import unittest
 from twisted.web.resource import NoResource
 
@@ -114,3 +117,50 @@ class TestLogsResource(unittest.TestCase):
         htmllog = HTMLLogFile(step, "example", "test file", "test html")
 
         self.assertEquals(htmllog.content_type, "")
+
+
+class TestLogLines(unittest.TestCase):
+    def setUp(self):
+        self.log = mock.Mock(LogFile)
+        self.log.getName.return_value = "stdio"
+        self.log.isFinished.return_value = True
+        self.log.getLineCountAsync.return_value = defer.succeed(5)
+        lines = ["%d\n" % i for i in range(5)]
+        self.log.getTextLinesAsync.side_effect = lambda first, last: defer.succeed(lines[first:last])
+        self.log.getTailLinesAsync.side_effect = lambda count: defer.succeed(lines[-count:])
+
+    def render(self, path, args):
+        req = FakeRequest(args)
+        req.method = "GET"
+        d = req.test_render(TextLog(self.log).getChild(path, req))
+        d.addCallback(lambda _: req)
+        return d
+
+    @defer.inlineCallbacks
+    def test_text_log_lines(self):
+        req = yield self.render("lines", {'first': ['1'], 'last': ['3']})
+
+        self.assertEqual(req.written, "1\n2\n")
+        req.setHeader.assert_any_call("content-type", "text/plain; charset=utf-8")
+
+    @defer.inlineCallbacks
+    def test_text_log_tail(self):
+        req = yield self.render("tail", {'lines': ['2']})
+
+        self.assertEqual(req.written, "3\n4\n")
+
+    @defer.inlineCallbacks
+    def test_text_log_invalid_lines(self):
+        req = yield self.render("lines", {'first': ['x']})
+
+        req.setResponseCode.assert_called_with(400)
+
+    @defer.inlineCallbacks
+    def test_json_log_tail(self):
+        step = mock.Mock(BuildStepStatus)
+        step.getLogs.return_value = [self.log]
+        resource = LogsJsonResource(mock.Mock(), step).getChild("stdio", None)
+
+        data = yield resource.asDict(FakeRequest({'tail': ['2']}))
+        self.assertEqual(data, {'name': 'stdio', 'finished': True, 'total': 5,
+                                'first': 3, 'last': 5, 'lines': ['3\n', '4\n']})
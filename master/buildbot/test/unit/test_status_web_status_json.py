@@ -13,6 +13,7 @@
 #
 # Copyright Buildbot Team Members
 
+import json
 import mock
 from buildbot.status.web import status_json
 from twisted.trial import unittest
@@ -286,6 +287,33 @@ class TestPastBuildsJsonResource(unittest.TestCase):
         for b in builds_dict:
             self.assertEqual(b, expectedDict(builds_dict.index(b)))
 
+    @defer.inlineCallbacks
+    def test_getPastBuildsJsonResourceWithoutStepsAndProperties(self):
+        builder = mockBuilder(self.master, self.master_status, "builder-01", "Katana")
+        builds = [fakeBuildStatus(self.master, builder, n) for n in range(3)]
+
+        builder.builder_status.generateFinishedBuildsAsync = mock.Mock(return_value=defer.succeed(builds))
+        builder.builder_status.generateFinishedBuildSummariesAsync = \
+            mock.Mock(return_value=defer.succeed([b.getSummary() for b in builds]))
+
+        builds_json = status_json.PastBuildsJsonResource(self.master_status, 3, builder_status=builder.builder_status)
+        full_dicts = yield builds_json.asDict(self.request)
+        self.request.args.update({"steps": ["0"], "props": ["0"]})
+        summary_dicts = yield builds_json.asDict(self.request)
+
+        self.assertEqual(builder.builder_status.generateFinishedBuildsAsync.call_count, 1)
+        self.assertEqual(builder.builder_status.generateFinishedBuildSummariesAsync.call_count, 1)
+        for d in full_dicts:
+            del d['steps']
+            del d['properties']
+        self.assertEqual(summary_dicts, full_dicts)
+
+        summary = builds[0].getSummary()
+        summary.logs = [('compile', 'stdio')]
+        self.assertEqual(summary.asDict(self.request)['logs'],
+                         [['stdio', 'http://localhost:8080/projects/Katana/builders/builder-01'
+                                    '/builds/0/steps/compile/logs/stdio?katana-buildbot_branch=katana']])
+
 
 class TestSingleProjectJsonResource(unittest.TestCase):
     def setUp(self):
@@ -382,6 +410,40 @@ class TestSingleProjectJsonResource(unittest.TestCase):
 
         self.assertEqual(project_dict, expected_project_dict)
 
+    @defer.inlineCallbacks
+    def test_getBuildersByProjectWritesJson(self):
+        yield self.setupProject(builders={'builder-02': 'Katana', 'builder-03': 'Katana'})
+        project_json = status_json.SingleProjectJsonResource(self.master_status, self.project)
+        project_json.status.master.db.state.getObjectStateByKey = lambda objects, filteredKey, storedKey: {}
+        written = []
+        self.request.write = written.append
+
+        yield project_json.content(self.request)
+
+        self.assertEqual(json.loads("".join(written)), self.expectedProjectDict(
+            builders=[self.jsonBuilders('builder-02', pendingBuilds=1), self.jsonBuilders('builder-03')]))
+        self.assertEqual(self.request.registerProducer.call_count, 1)
+
+    @defer.inlineCallbacks
+    def test_getBuildersByProjectRendersBuildersWhenWritten(self):
+        yield self.setupProject(builders={'builder-02': 'Katana', 'builder-03': 'Katana'})
+        project_json = status_json.SingleProjectJsonResource(self.master_status, self.project)
+        project_json.status.master.db.state.getObjectStateByKey = lambda objects, filteredKey, storedKey: {}
+        rendered = []
+
+        def asDict(self, request, codebases, branches, base_build_dict):
+            rendered.append(self.builder.name)
+            return defer.fail(RuntimeError("builder failed"))
+        self.patch(status_json.SingleProjectBuilderJsonResource, 'asDict', asDict)
+
+        result = yield project_json.asLazyDict(self.request)
+        self.assertEqual(rendered, [])
+        self.assertEqual(len(result['builders']), 2)
+
+        # the encoder stops at the first failure, the other builder is never rendered
+        yield self.assertFailure(project_json.content(self.request), RuntimeError)
+        self.assertEqual(len(rendered), 1)
+
     @defer.inlineCallbacks
     def test_getBuildersWithPendingBuildsByProject(self):
         yield self.setupProject(builders={'builder-02': 'Katana'})
@@ -444,9 +506,9 @@ class TestSingleProjectJsonResource(unittest.TestCase):
                                results=None,
                                max_search=2000,
                                useCache=False):
-            return defer.succeed([fakeBuildStatus(self.master, builder, 1)])
+            return defer.succeed([fakeBuildStatus(self.master, builder, 1).getSummary()])
 
-        builder.builder_status.generateFinishedBuildsAsync = mockFinishedBuildsAsync
+        builder.builder_status.generateFinishedBuildSummariesAsync = mockFinishedBuildsAsync
 
         project_json = status_json.SingleProjectJsonResource(self.master_status, self.project)
 
@@ -0,0 +1,74 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Unity Technologies
+
+import os
+import zlib
+from gzip import GzipFile
+from twisted.trial import unittest
+from buildbot.util import blockgz
+
+
+class TestBlockGzip(unittest.TestCase):
+
+    def setUp(self):
+        self.filename = os.path.abspath(self.mktemp())
+        self.indexfilename = self.filename + ".blocks"
+        self.data = "".join("line %d\n" % i for i in range(30000))
+        w = blockgz.BlockGzipWriter(self.filename, self.indexfilename)
+        for i in range(0, len(self.data), blockgz.BLOCK_SIZE):
+            w.writeBlock(self.data[i:i + blockgz.BLOCK_SIZE])
+        w.close()
+
+    def test_readAll(self):
+        f = blockgz.BlockGzipFile(self.filename, self.indexfilename)
+        self.assertTrue(len(f.offsets) > 3)
+        self.assertEqual(f.read(), self.data)
+        self.assertEqual(f.read(), "")
+
+    def test_seekAcrossBlocks(self):
+        f = blockgz.BlockGzipFile(self.filename, self.indexfilename)
+        offset = blockgz.BLOCK_SIZE * 2 - 10
+        f.seek(offset)
+        self.assertEqual(f.read(100), self.data[offset:offset + 100])
+        self.assertEqual(f.tell(), offset + 100)
+
+        f.seek(-5, 2)
+        self.assertEqual(f.read(100), self.data[-5:])
+        self.assertEqual(f.tell(), len(self.data))
+
+    def test_seekDecompressesOneBlock(self):
+        f = blockgz.BlockGzipFile(self.filename, self.indexfilename)
+        decompressed = []
+        self.patch(blockgz, 'zlib', FakeZlib(decompressed))
+        f.seek(len(self.data) - 10)
+        f.read(10)
+        self.assertEqual(len(decompressed), 1)
+
+    def test_readableAsGzip(self):
+        self.assertEqual(GzipFile(self.filename, "r").read(), self.data)
+
+    def test_missingIndex(self):
+        os.unlink(self.indexfilename)
+        self.assertRaises(IOError, blockgz.BlockGzipFile, self.filename, self.indexfilename)
+
+
+class FakeZlib(object):
+
+    def __init__(self, decompressed):
+        self.decompressed = decompressed
+
+    def decompress(self, data, wbits):
+        self.decompressed.append(data)
+        return zlib.decompress(data, wbits)
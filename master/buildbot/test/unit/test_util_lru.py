@@ -577,3 +577,34 @@ class AsyncLRUCacheTest(unittest.TestCase):
         self.assertEqual((yield self.lru.get('p')), short('p'))
         self.lru.put('p', set(['P2P2']))
         self.assertEqual((yield self.lru.get('p')), set(['P2P2']))
+
+    @defer.inlineCallbacks
+    def test_remove(self):
+        for c in 'abc':
+            res = yield self.lru.get(c)
+            self.check_result(res, short(c))
+
+        self.lru.remove('b')
+        gc.collect()
+
+        # the removed key is skipped when the cache is purged
+        for c in 'def':
+            res = yield self.lru.get(c)
+            self.check_result(res, short(c))
+        self.assertEqual(sorted(self.lru.keys()), ['d', 'e', 'f'])
+
+        self.lru.miss_fn = self.long_miss_fn
+        res = yield self.lru.get('b')
+        self.check_result(res, long('b'))
+
+    @defer.inlineCallbacks
+    def test_remove_referenced(self):
+        res = yield self.lru.get('a')
+        self.check_result(res, short('a'))
+
+        # a removed value still referenced elsewhere is fetched again
+        self.lru.remove('a')
+        self.lru.miss_fn = self.long_miss_fn
+        res2 = yield self.lru.get('a')
+        self.check_result(res2, long('a'), exp_refhits=0, exp_misses=2)
+        self.assertEqual(res, short('a'))
@@ -13,7 +13,7 @@
 #
 # Copyright Buildbot Team Members
 
-from buildbot.db import model
+from buildbot.db import model, events
 from buildbot.test.util import db
 from buildbot.test.fake import fakemaster
 
@@ -38,6 +38,7 @@ class ConnectorComponentMixin(db.RealDatabaseMixin):
             self.db = FakeDBConnector()
             self.db.pool = self.db_pool
             self.db.model = model.Model(self.db)
+            self.db.events = events.EventsConnectorComponent(self.db)
             self.db.master = fakemaster.make_master()
         d.addCallback(finish_setup)
         return d
@@ -33,11 +33,22 @@ class KatanaBuildRequestDistributorTestSetup(connector_component.ConnectorCompon
         self.master.db = self.db
         self.master.caches = cache.CacheManager()
         self.master.config.mergeRequests = None
+        self.master.config.buildStartBatchSize = 1
         self.processedBuilds = []
         self.mergedBuilds = []
         self.addRunningBuilds = False
         self.slaves = {}
 
+    @defer.inlineCallbacks
+    def insertTestData(self, rows):
+        yield connector_component.ConnectorComponentMixin.insertTestData(self, rows)
+        # the master announces the new buildrequests to the distributor
+        brd = getattr(self, 'brd', None)
+        if brd:
+            for row in rows:
+                if isinstance(row, fakedb.BuildRequest) and not row.complete:
+                    brd._buildRequestAdded(dict(bsid=row.buildsetid, brid=row.id, buildername=row.buildername))
+
     def setUpQuietDeferred(self):
         # Detects the "end" of the test
         self.quiet_deferred = defer.Deferred()
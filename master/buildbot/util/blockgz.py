@@ -0,0 +1,121 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Unity Technologies
+
+"""
+Block-compressed gzip files.
+
+The file is a sequence of independently compressed gzip members of at most
+BLOCK_SIZE uncompressed bytes, so it is still a valid gzip file that GzipFile
+can read sequentially. An index file holds the uncompressed and compressed
+offsets of the start of each member, followed by the uncompressed and
+compressed sizes of the file, so that BlockGzipFile can seek to any offset by
+decompressing a single block.
+"""
+
+import struct
+import zlib
+from bisect import bisect_right
+
+BLOCK_SIZE = 64*1024
+INDEX_RECORD = struct.Struct(">QQ")
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+class BlockGzipWriter(object):
+
+    def __init__(self, filename, indexfilename, level=6):
+        self.level = level
+        self.file = open(filename, "wb")
+        self.index = open(indexfilename, "wb")
+        # uncompressed and compressed sizes written so far
+        self.offset = 0
+        self.coffset = 0
+
+    def writeBlock(self, data):
+        assert len(data) <= BLOCK_SIZE, "blocks are at most BLOCK_SIZE bytes"
+        c = zlib.compressobj(self.level, zlib.DEFLATED, GZIP_WBITS)
+        member = c.compress(data) + c.flush()
+        self.index.write(INDEX_RECORD.pack(self.offset, self.coffset))
+        self.file.write(member)
+        self.offset += len(data)
+        self.coffset += len(member)
+
+    def close(self):
+        self.index.write(INDEX_RECORD.pack(self.offset, self.coffset))
+        self.file.close()
+        self.index.close()
+
+    def abort(self):
+        self.file.close()
+        self.index.close()
+
+
+class BlockGzipFile(object):
+    """A read-only file object for a block-compressed file, raising IOError
+    when the file or its index can not be opened."""
+
+    def __init__(self, filename, indexfilename):
+        with open(indexfilename, "rb") as f:
+            data = f.read()
+        size = INDEX_RECORD.size
+        if not data or len(data) % size:
+            raise IOError("invalid block index %s" % indexfilename)
+        self.offsets = []
+        self.coffsets = []
+        for i in range(0, len(data), size):
+            offset, coffset = INDEX_RECORD.unpack_from(data, i)
+            self.offsets.append(offset)
+            self.coffsets.append(coffset)
+        self.size = self.offsets[-1]
+        self.file = open(filename, "rb")
+        self.pos = 0
+        self.block = None
+        self.blockData = ""
+
+    def _readBlock(self, block):
+        if block != self.block:
+            self.file.seek(self.coffsets[block])
+            member = self.file.read(self.coffsets[block + 1] - self.coffsets[block])
+            self.blockData = zlib.decompress(member, GZIP_WBITS)
+            self.block = block
+        return self.blockData
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.pos
+        elif whence == 2:
+            offset += self.size
+        self.pos = max(0, offset)
+
+    def tell(self):
+        return self.pos
+
+    def read(self, size=-1):
+        end = self.size if size < 0 else min(self.size, self.pos + size)
+        pieces = []
+        while self.pos < end:
+            block = bisect_right(self.offsets, self.pos) - 1
+            data = self._readBlock(block)
+            start = self.pos - self.offsets[block]
+            piece = data[start:start + end - self.pos]
+            if not piece:
+                break
+            pieces.append(piece)
+            self.pos += len(piece)
+        return "".join(pieces)
+
+    def close(self):
+        self.file.close()
+        self.blockData = ""
@@ -159,7 +159,8 @@ class LRUCache(object):
             while refc:
                 k = queue.popleft()
                 refc = refcount[k] = refcount[k] - 1
-            del cache[k]
+            # removed keys stay in the queue until they are purged
+            cache.pop(k, None)
             del refcount[k]
 
 
@@ -232,8 +233,9 @@ class AsyncLRUCache(LRUCache):
         return d
 
     def remove(self, key):
-        if key in self.cache:
-            del self.cache[key]
+        # the weak reference would bring the removed value back as a refhit
+        self.cache.pop(key, None)
+        self.weakrefs.pop(key, None)
 
 # for tests
 inv_failed = False
@@ -32,7 +32,7 @@ from buildslave import util
 # this used to be a CVS $-style "Revision" auto-updated keyword, but since I
 # moved to Darcs as the primary repository, this is updated manually each
 # time this file is changed. The last cvs_ver that was here was 1.51 .
-command_version = "2.16"
+command_version = "2.17"
 
 # version history:
 #  >=1.17: commands are interruptable
@@ -65,6 +65,8 @@ command_version = "2.16"
 #  >= 2.14: RemoveDirectory can delete multiple directories
 #  >= 2.15: 'interruptSignal' option is added to SlaveShellCommand
 #  >= 2.16: 'user' option is added to SlaveShellCommand
+#  >= 2.17: 'log_segments' option is added to SlaveShellCommand, to send the
+#           output as a single ordered 'segments' update per flush
 
 class Command:
     implements(ISlaveCommand)
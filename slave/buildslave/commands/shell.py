@@ -40,6 +40,7 @@ class SlaveShellCommand(base.Command):
                          usePTY=args.get('usePTY', "slave-config"),
                          logEnviron=args.get('logEnviron', True),
                          user=args.get('user'),
+                         sendSegments=args.get('log_segments', False),
                          )
         if args.get('interruptSignal'):
             c.interruptSignal = args['interruptSignal']
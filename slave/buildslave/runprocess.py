@@ -28,8 +28,13 @@ import stat
 from collections import deque
 from tempfile import NamedTemporaryFile
 
-from twisted.python import runtime, log
+from twisted.python import runtime, log, filepath
 from twisted.internet import reactor, defer, protocol, task, error
+try:
+    from twisted.internet import inotify
+except ImportError:
+    # only available on Linux
+    inotify = None
 
 from buildslave import util
 from buildslave.exceptions import AbandonChain
@@ -80,13 +85,103 @@ def quoteArguments(arguments):
     return ' '.join([cmdLineQuote(a) for a in arguments])
 
 
+class LogFileNotifier:
+    """
+    Calls the LogFileWatchers of a reactor when their logfiles change,
+    using a single inotify instance: the instances a user can create are
+    limited (fs.inotify.max_user_instances, 128 by default), the watches
+    are not. A directory is watched while a logfile in it is watched.
+    """
+    def __init__(self, reactor):
+        self._reactor = reactor
+        self.notifier = None
+        # path of the directory -> number of logfiles watched in it
+        self.directories = {}
+        # path of the logfile -> callbacks
+        self.callbacks = {}
+
+    def add(self, logfile, callback):
+        """Calls callback when logfile is changed, created, replaced or
+        removed. Raises an exception if inotify can not be used."""
+        logfile = os.path.abspath(logfile)
+        directory = os.path.dirname(logfile)
+        if self.notifier is None:
+            notifier = inotify.INotify(reactor=self._reactor)
+            notifier.startReading()
+            self.notifier = notifier
+        try:
+            # watch the directory, the logfile may not exist yet or be
+            # replaced by the command; this is also done when the directory
+            # is already watched, in case it was removed and created again
+            self.notifier.watch(filepath.FilePath(directory),
+                                mask=inotify.IN_MODIFY | inotify.IN_CREATE | inotify.IN_MOVED_TO |
+                                     inotify.IN_CLOSE_WRITE | inotify.IN_DELETE,
+                                callbacks=[self._notified])
+        except:
+            if not self.directories:
+                self._close()
+            raise
+        self.directories[directory] = self.directories.get(directory, 0) + 1
+        self.callbacks.setdefault(logfile, []).append(callback)
+
+    def remove(self, logfile, callback):
+        logfile = os.path.abspath(logfile)
+        directory = os.path.dirname(logfile)
+        callbacks = self.callbacks[logfile]
+        callbacks.remove(callback)
+        if not callbacks:
+            del self.callbacks[logfile]
+        self.directories[directory] -= 1
+        if self.directories[directory]:
+            return
+        del self.directories[directory]
+        try:
+            self.notifier.ignore(filepath.FilePath(directory))
+        except KeyError:
+            # the watch went away with the directory
+            pass
+        if not self.directories:
+            self._close()
+
+    def _close(self):
+        self.notifier.loseConnection()
+        self.notifier = None
+
+    def _notified(self, ignored, path, mask):
+        for callback in self.callbacks.get(path.path, [])[:]:
+            callback()
+
+_notifiers = {}
+def getLogFileNotifier(reactor):
+    """Returns the LogFileNotifier of the reactor."""
+    if reactor not in _notifiers:
+        _notifiers[reactor] = LogFileNotifier(reactor)
+    return _notifiers[reactor]
+
+
 class LogFileWatcher:
+    """
+    Sends the data added to a logfile by the command. Where inotify is
+    available, the logfile is read as soon as it changes, and only polled
+    every NOTIFY_POLL_INTERVAL seconds in case a change was missed,
+    otherwise it is polled every POLL_INTERVAL seconds.
+    """
     POLL_INTERVAL = 2
+    NOTIFY_POLL_INTERVAL = 10
+
+    # the reads start at MIN_READ_SIZE bytes, and double while the file has
+    # more data, up to the size of the chunks RunProcess sends
+    MIN_READ_SIZE = 16*1024
+    MAX_READ_SIZE = 128*1024
+
+    _reactor = reactor
 
     def __init__(self, command, name, logfile, follow=False):
         self.command = command
         self.name = name
         self.logfile = logfile
+        self.notifier = None
+        self.pendingRead = None
 
         log.msg("LogFileWatcher created to watch %s" % logfile)
         # we are created before the ShellCommand starts. If the logfile we're
@@ -103,15 +198,49 @@ class LogFileWatcher:
         self.poller = task.LoopingCall(self.poll)
 
     def start(self):
-        self.poller.start(self.POLL_INTERVAL).addErrback(self._cleanupPoll)
+        if self._startNotifier():
+            interval = self.NOTIFY_POLL_INTERVAL
+        else:
+            interval = self.POLL_INTERVAL
+        self.poller.start(interval).addErrback(self._cleanupPoll)
+
+    def _startNotifier(self):
+        if inotify is None:
+            return False
+        notifier = getLogFileNotifier(self._reactor)
+        try:
+            notifier.add(self.logfile, self._notified)
+        except Exception, e:
+            log.msg("LogFileWatcher polling %s, can not use inotify: %s" % (self.logfile, e))
+            return False
+        self.notifier = notifier
+        return True
+
+    def _notified(self):
+        # a single read for the events of a reactor iteration
+        if self.pendingRead is None:
+            self.pendingRead = self._reactor.callLater(0, self._notifiedRead)
+
+    def _notifiedRead(self):
+        self.pendingRead = None
+        try:
+            self.poll()
+        except:
+            log.err(None, "while reading %s" % self.logfile)
 
     def _cleanupPoll(self, err):
         log.err(err, msg="Polling error")
         self.poller = None
 
     def stop(self):
+        if self.notifier is not None:
+            self.notifier.remove(self.logfile, self._notified)
+            self.notifier = None
+        if self.pendingRead is not None:
+            self.pendingRead.cancel()
+            self.pendingRead = None
         self.poll()
-        if self.poller is not None:
+        if self.poller is not None and self.poller.running:
             self.poller.stop()
         if self.started:
             self.f.close()
@@ -141,11 +270,13 @@ class LogFileWatcher:
                 self.f.seek(s[2], 0)
             self.started = True
         self.f.seek(self.f.tell(), 0)
+        size = self.MIN_READ_SIZE
         while True:
-            data = self.f.read(10000)
+            data = self.f.read(size)
             if not data:
                 return
             self.command.addLogfile(self.name, data)
+            size = min(size * 2, self.MAX_READ_SIZE)
 
 
 if runtime.platformType == 'posix':
@@ -257,7 +388,7 @@ class RunProcess:
                  timeout=None, maxTime=None, initialStdin=None,
                  keepStdout=False, keepStderr=False,
                  logEnviron=True, logfiles={}, usePTY="slave-config",
-                 useProcGroup=True, user=None):
+                 useProcGroup=True, user=None, sendSegments=False):
         """
 
         @param keepStdout: if True, we keep a copy of all the stdout text
@@ -271,6 +402,10 @@ class RunProcess:
 
         @param useProcGroup: (default True) use a process group for non-PTY
             process invocations
+
+        @param sendSegments: if True, send the buffered output as a single
+            'segments' update, a list of (logname, data) in output order,
+            which the master must support
         """
 
         self.builder = builder
@@ -299,6 +434,7 @@ class RunProcess:
 
         self.sendStdout = sendStdout
         self.sendStderr = sendStderr
+        self.sendSegments = sendSegments
         self.sendRC = sendRC
         self.logfiles = logfiles
         self.workdir = workdir
@@ -636,10 +772,28 @@ class RunProcess:
         self.buftimer = None
         self._sendBuffers()
 
+    def _sendSegments(self):
+        """
+        Send all the content in our buffers as one ordered list of segments
+        """
+        segments = []
+        while self.buffered:
+            logname, data = self.buffered.popleft()
+            if len(data) > self.CHUNK_LIMIT:
+                segments.extend([logname, chunk] for chunk in self._chunkForSend(data))
+            elif data:
+                segments.append([logname, data])
+        if segments:
+            self.sendStatus({'segments': segments})
+
     def _sendBuffers(self):
         """
         Send all the content in our buffers.
         """
+        if self.sendSegments:
+            # this empties the buffers, leaving nothing to the loop below
+            self._sendSegments()
+
         msg = {}
         msg_size = 0
         lastlog = None
@@ -652,9 +806,8 @@ class RunProcess:
             # out the message so far.  This is because the message is
             # transferred as a dictionary, which makes the ordering of keys
             # unspecified, and makes it impossible to interleave data from
-            # different logs.  A future enhancement could be to change the
-            # master to support a list of (logname, data) tuples instead of a
-            # dictionary.
+            # different logs.  Masters supporting it get a list of (logname,
+            # data) segments instead, see _sendSegments.
             # On our first pass through this loop lastlog is None
             if lastlog is None:
                 lastlog = logname
@@ -104,7 +104,7 @@ class FakeRunProcess:
                  timeout=None, maxTime=None, initialStdin=None,
                  keepStdout=False, keepStderr=False,
                  logEnviron=True, logfiles={}, usePTY="slave-config",
-                 user=None)
+                 user=None, sendSegments=False)
 
         if not self._expectations:
             raise AssertionError("unexpected instantiation: %s" % (kwargs,))
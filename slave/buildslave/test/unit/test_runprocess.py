@@ -688,6 +688,32 @@ class TestLogging(BasedirMixin, unittest.TestCase):
         s._sendBuffers()
         self.failUnlessEqual(len(b.updates), 2)
 
+    def testSendSegmentsInterleaved(self):
+        b = FakeSlaveBuilder(False, self.basedir)
+        s = runprocess.RunProcess(b, stdoutCommand('hello'), self.basedir,
+                                  sendSegments=True)
+        s._addToBuffers('stdout', 'hello ')
+        s._addToBuffers('stderr', 'DIEEEEEEE')
+        s._addToBuffers(('log', 'out.log'), 'logged')
+        s._addToBuffers('stdout', 'world')
+        s._sendBuffers()
+        self.failUnlessEqual(b.updates, [
+            {'segments': [['stdout', 'hello '], ['stderr', 'DIEEEEEEE'],
+                          [('log', 'out.log'), 'logged'], ['stdout', 'world']]},
+            ])
+
+    def testSendSegmentsChunked(self):
+        b = FakeSlaveBuilder(False, self.basedir)
+        s = runprocess.RunProcess(b, stdoutCommand('hello'), self.basedir,
+                                  sendSegments=True)
+        data = "x" * (runprocess.RunProcess.CHUNK_LIMIT * 3 / 2)
+        s._addToBuffers('stdout', data)
+        s._sendBuffers()
+        self.failUnlessEqual(len(b.updates), 1)
+        self.failUnlessEqual([len(d) for l, d in b.updates[0]['segments']],
+                             [runprocess.RunProcess.CHUNK_LIMIT,
+                              runprocess.RunProcess.CHUNK_LIMIT / 2])
+
     def testSendNotimeout(self):
         b = FakeSlaveBuilder(False, self.basedir)
         s = runprocess.RunProcess(b, stdoutCommand('hello'), self.basedir)
@@ -721,3 +747,72 @@ class TestLogFileWatcher(BasedirMixin, unittest.TestCase):
         st = lf.statFile()
         self.assertEqual(st and st[2], 2, "statfile.log exists and size is correct")
         os.remove('statfile.log')
+
+    def test_readsGrowWhileFileHasData(self):
+        rp = self.makeRP()
+        read = []
+        rp.addLogfile = lambda name, data: read.append(data)
+        logfile = os.path.join(self.basedir, 'big.log')
+        lf = runprocess.LogFileWatcher(rp, 'test', logfile, False)
+        open(logfile, 'w').write('x' * 300000)
+        lf.poll()
+        lf.stop()
+        self.assertEqual([len(data) for data in read],
+                         [16*1024, 32*1024, 64*1024, 128*1024, 300000 - 240*1024])
+
+    def test_pollsWithoutInotify(self):
+        self.patch(runprocess, 'inotify', None)
+        rp = self.makeRP()
+        lf = runprocess.LogFileWatcher(rp, 'test', os.path.join(self.basedir, 'p.log'), False)
+        lf.start()
+        self.assertEqual(lf.notifier, None)
+        self.assertEqual(lf.poller.interval, lf.POLL_INTERVAL)
+        lf.stop()
+
+    def test_readsWhenNotified(self):
+        if runprocess.inotify is None:
+            raise unittest.SkipTest("inotify is not available")
+        rp = self.makeRP()
+        read = []
+        rp.addLogfile = lambda name, data: read.append((name, data))
+        logfile = os.path.join(self.basedir, 'notified.log')
+        lf = runprocess.LogFileWatcher(rp, 'test', logfile, False)
+        lf.start()
+        self.assertNotEqual(lf.notifier, None)
+        self.assertEqual(lf.poller.interval, lf.NOTIFY_POLL_INTERVAL)
+        open(logfile, 'w').write('hello\n')
+
+        d = task.deferLater(reactor, 0.5, lambda: None)
+        def check(_):
+            self.assertEqual(read, [('test', 'hello\n')])
+            lf.stop()
+        d.addCallback(check)
+        return d
+
+    def test_watchersShareTheNotifier(self):
+        if runprocess.inotify is None:
+            raise unittest.SkipTest("inotify is not available")
+        rp = self.makeRP()
+        read = []
+        rp.addLogfile = lambda name, data: read.append((name, data))
+        lf1 = runprocess.LogFileWatcher(rp, 'one', os.path.join(self.basedir, 'one.log'), False)
+        lf2 = runprocess.LogFileWatcher(rp, 'two', os.path.join(self.basedir, 'two.log'), False)
+        lf1.start()
+        lf2.start()
+        notifier = lf1.notifier
+        self.assertIdentical(lf2.notifier, notifier)
+        self.assertEqual(notifier.directories, {os.path.abspath(self.basedir): 2})
+        inotify = notifier.notifier
+        open(os.path.join(self.basedir, 'two.log'), 'w').write('hello\n')
+
+        d = task.deferLater(reactor, 0.5, lambda: None)
+        def check(_):
+            self.assertEqual(read, [('two', 'hello\n')])
+            lf1.stop()
+            self.assertIdentical(notifier.notifier, inotify)
+            lf2.stop()
+            self.assertEqual(notifier.notifier, None)
+            self.assertEqual(notifier.directories, {})
+            self.assertEqual(notifier.callbacks, {})
+        d.addCallback(check)
+        return d